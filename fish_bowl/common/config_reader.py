@@ -1,7 +1,7 @@
 import json
 import logging
 import os
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 _logger = logging.getLogger(__name__)
 
@@ -9,13 +9,18 @@ _logger = logging.getLogger(__name__)
 CONFIG_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../configuration'))
 
 
-def read_simulation_config(config_name: str) -> Dict:
+def read_simulation_config(config_name: str, config_path: Optional[str] = None) -> Dict:
     """
     Read a simulation .json configuration
     :param config_name:
+    :param config_path: configuration folder (CONFIG_DIR by default), or path of the configuration file itself in
+    which case config_name is ignored
     :return:
     """
-    config_file = os.path.join(CONFIG_DIR, '{}.json'.format(config_name))
+    if config_path is not None and os.path.isfile(config_path):
+        config_file = config_path
+    else:
+        config_file = os.path.join(config_path or CONFIG_DIR, '{}.json'.format(config_name))
     with open(config_file, 'r') as fp:
         _logger.info('Reading simulation config from: {}'.format(config_file))
         return json.load(fp)
@@ -0,0 +1,216 @@
+"""
+Storage backends of the simulation engine
+
+StorageBackend lists the persistence operations SimulationGrid relies on. Five implementations are available:
+- memory: StoreSimulationClient, numpy arrays only, nothing outlives the process
+- sql: SimulationClient, SQLAlchemy database (sqlite by default)
+- parquet: ParquetSimulationClient, in-memory state with every turn appended to a columnar Parquet history
+- sharded: ShardedSimulationClient, one sqlite file per simulation and a catalog mapping sids to files
+- pipelined: PipelinedSimulationClient, in-memory state with every turn written to a database by a writer thread
+
+Backends are looked up by name so that a run can pick one without importing the others (and their dependencies).
+"""
+import abc
+import importlib
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from fish_bowl.process.utils import Animal
+from fish_bowl.process.topology import SquareGridCoordinate
+
+# simulation parameters a clone can change, the others describe the initial state it shares with its parent
+CLONE_PARAMETERS = ('fish_breed_maturity', 'fish_breed_probability', 'fish_speed', 'shark_breed_maturity',
+                    'shark_breed_probability', 'shark_speed', 'shark_starving')
+
+# backend name -> (module, class name), imported on first use
+BACKENDS = {
+    'memory': ('fish_bowl.dataio.store', 'StoreSimulationClient'),
+    'sql': ('fish_bowl.dataio.persistence', 'SimulationClient'),
+    'parquet': ('fish_bowl.dataio.parquet', 'ParquetSimulationClient'),
+    'sharded': ('fish_bowl.dataio.sharding', 'ShardedSimulationClient'),
+    'pipelined': ('fish_bowl.dataio.pipeline', 'PipelinedSimulationClient'),
+}
+
+
+class StorageBackend(abc.ABC):
+    """
+    Persistence operations used by SimulationGrid. Simulations are identified by the sid returned by
+    init_simulation, animals by the oid returned by init_animal.
+    """
+
+    @abc.abstractmethod
+    def init_simulation(self, grid_size, init_nb_fish, init_nb_shark, fish_breed_maturity, fish_breed_probability,
+                        fish_speed, shark_breed_maturity, shark_breed_probability, shark_speed,
+                        shark_starving) -> int:
+        """
+        Record a new simulation and return its sid
+        """
+
+    @abc.abstractmethod
+    def get_simulation(self, sim_id: int):
+        """
+        Simulation parameters, as an object with one attribute per parameter
+        """
+
+    @abc.abstractmethod
+    def init_animal(self, sim_id: int, current_turn: int, animal_type: Animal, coordinate: SquareGridCoordinate,
+                    last_fed: Optional[int] = 0, last_breed: Optional[int] = 0) -> int:
+        """
+        Create an animal on a free square and return its oid
+        """
+
+    @abc.abstractmethod
+    def coordinate_is_occupied(self, sim_id: int, coordinate: SquareGridCoordinate) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def has_fish_in_square(self, sim_id: int, coordinates: List[SquareGridCoordinate]) -> List[SquareGridCoordinate]:
+        """
+        Coordinates holding a live fish, in the order they were given
+        """
+
+    @abc.abstractmethod
+    def eat_animal_in_square(self, sim_id: int, coordinate: SquareGridCoordinate) -> bool:
+        pass
+
+    @abc.abstractmethod
+    def move_animal(self, sim_id: int, animal_id: int, new_position: SquareGridCoordinate):
+        pass
+
+    @abc.abstractmethod
+    def kill_animal(self, sim_id: int, animal_ids: List[int]):
+        pass
+
+    @abc.abstractmethod
+    def update_animals(self, sim_id: int, update_dict: Dict):
+        """
+        Update breed_count, last_breed and last_fed of live animals, update_dict maps oid -> {column: value}
+        """
+
+    @abc.abstractmethod
+    def get_animal_tuples(self, sim_id: int, columns: Sequence[str], animal_type: Optional[Animal] = None,
+                          live_only: bool = True) -> List[Tuple]:
+        """
+        Rows of the requested columns as named tuples, ordered by oid
+        """
+
+    @abc.abstractmethod
+    def get_animal_arrays(self, sim_id: int, columns: Sequence[str], animal_type: Optional[Animal] = None,
+                          live_only: bool = True) -> Dict:
+        """
+        Requested columns as numpy arrays, ordered by oid
+        """
+
+    @abc.abstractmethod
+    def iter_animal_tuples(self, sim_id: int, columns: Sequence[str], animal_type: Optional[Animal] = None,
+                           live_only: bool = True, batch_size: int = 10000) -> Iterator[List[Tuple]]:
+        pass
+
+    @abc.abstractmethod
+    def get_animals_df(self, sim_id: int):
+        """
+        All animals of a simulation as a pandas DataFrame
+        """
+
+    @abc.abstractmethod
+    def count_animals(self, sim_id: int) -> Dict[Animal, int]:
+        """
+        Number of live animals by type
+        """
+
+    @abc.abstractmethod
+    def log_turn(self, sim_id: int, turn: int, population: Dict[Animal, int]):
+        """
+        Called by the engine once a turn is complete
+        """
+
+    @abc.abstractmethod
+    def get_last_turn(self, sim_id: int) -> Optional[int]:
+        pass
+
+    @abc.abstractmethod
+    def get_turn_log(self, sim_id: int, until_turn: Optional[int] = None) -> List[Tuple[int, int, int]]:
+        """
+        (turn, nb_fish, nb_shark) of the logged turns
+        """
+
+    def get_turn_snapshot(self, sim_id: int, columns: Sequence[str]) -> Tuple[Optional[int], Dict]:
+        """
+        Last logged turn and the requested columns of the live animals (see get_animal_arrays), read together. Reads
+        one after the other by default, which is enough for backends not written while they are read; database
+        backends read both in a single transaction
+        """
+        return self.get_last_turn(sim_id), self.get_animal_arrays(sim_id, columns)
+
+    @abc.abstractmethod
+    def clone_simulation(self, sim_id: int, **parameters) -> int:
+        """
+        Copy a simulation (parameters, animals, turn log) to a new one and return its sid
+        :param sim_id:
+        :param parameters: new values of some CLONE_PARAMETERS
+        :return:
+        """
+
+    def record_summary(self, sim_id: int, end_reason: Optional[str] = None, runtime_seconds: Optional[float] = None):
+        """
+        Called once the run of a simulation ended, to add it to the catalog of the backend (see catalog). Backends
+        without catalog ignore it
+        """
+        return
+
+    def get_simulation_summary(self, sim_id: int) -> Optional[Dict]:
+        """
+        Catalog row written by record_summary, None while the simulation is running or if the backend has no
+        catalog
+        """
+        return None
+
+    def close(self):
+        """
+        Release the resources held by the backend, nothing to do by default
+        """
+        return
+
+
+def check_clone_parameters(parameters: Dict):
+    """
+    Raise a ValueError if parameters can't be given to a clone
+    :param parameters: CLONE_PARAMETERS values
+    :return:
+    """
+    unknown = sorted(set(parameters) - set(CLONE_PARAMETERS))
+    if unknown:
+        raise ValueError('A clone can only change {}, not {}'.format(', '.join(CLONE_PARAMETERS), ', '.join(unknown)))
+    for key, value in parameters.items():
+        if key.endswith('_probability'):
+            if value < 0 or value > 100:
+                raise ValueError('{} must be between 0 and 100, not {}'.format(key, value))
+        elif value <= 0:
+            raise ValueError('{} must be positive, not {}'.format(key, value))
+
+
+def get_backend_class(name: str) -> type:
+    """
+    Import and return the class of a named backend
+    :param name: one of BACKENDS
+    :return:
+    """
+    try:
+        module_name, class_name = BACKENDS[name]
+    except KeyError:
+        raise ValueError('Unknown storage backend {!r}, expected one of {}'.format(name, sorted(BACKENDS)))
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def create_backend(name: str, **kwargs) -> StorageBackend:
+    """
+    Instantiate a named backend
+    :param name: one of BACKENDS
+    :param kwargs: arguments of the backend class:
+    - memory: release_dead, occupancy and its dense_above / sparse_below thresholds
+    - sql: database_url, profile, read_pool_size
+    - parquet: directory, row_group_rows, compression, release_dead
+    - sharded: directory, profile, read_pool_size, max_open_shards
+    - pipelined: database_url (sharded:///<directory> for a sharded sink), max_pending_turns, profile
+    :return:
+    """
+    return get_backend_class(name)(**kwargs)
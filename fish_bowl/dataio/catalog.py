@@ -0,0 +1,138 @@
+"""
+Catalog of finished simulations
+
+One SIMULATION_SUMMARY row per simulation, written when its run ends (record_summary of the SQL and sharded
+clients): the simulation parameters, the final turn and populations, the peak populations, the end reason and the
+runtime. Rows are self-contained, so listing simulations never reads the TURNS or ANIMALS tables, and the sharded
+client keeps them in its catalog database instead of the shards.
+
+list_summaries pages through the catalog with a keyset on sid: a page is the `limit` rows following the last sid
+of the previous page, found through the primary key (or one of the indexes when filtering), so every page costs
+the same whatever its position in the catalog.
+"""
+import datetime as dt
+import operator
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import Column, DateTime, Float, Index, Integer, String, select
+
+# simulation parameters copied to the summary rows, filters matching their value
+SUMMARY_PARAMETERS = ('grid_size', 'init_nb_fish', 'fish_breed_maturity', 'fish_breed_probability', 'fish_speed',
+                      'init_nb_shark', 'shark_breed_maturity', 'shark_breed_probability', 'shark_speed',
+                      'shark_starving')
+# filter name -> (column, comparison)
+SUMMARY_FILTERS = dict(
+    [(p, (p, operator.eq)) for p in SUMMARY_PARAMETERS],
+    end_reason=('end_reason', operator.eq),
+    min_turn=('final_turn', operator.ge),
+    max_turn=('final_turn', operator.le),
+    min_peak_fish=('peak_nb_fish', operator.ge),
+    min_peak_shark=('peak_nb_shark', operator.ge),
+)
+MAX_PAGE_SIZE = 1000
+
+
+class SummaryColumns:
+    """
+    Columns of the SIMULATION_SUMMARY table, mixed into the declarative base of each database holding it
+    """
+    __tablename__ = 'SIMULATION_SUMMARY'
+    sid = Column(Integer, primary_key=True, autoincrement=False)
+    ended_at = Column(DateTime)
+    grid_size = Column(Integer)
+    init_nb_fish = Column(Integer)
+    fish_breed_maturity = Column(Integer)
+    fish_breed_probability = Column(Integer)
+    fish_speed = Column(Integer)
+    init_nb_shark = Column(Integer)
+    shark_breed_maturity = Column(Integer)
+    shark_breed_probability = Column(Integer)
+    shark_speed = Column(Integer)
+    shark_starving = Column(Integer)
+    final_turn = Column(Integer)
+    final_nb_fish = Column(Integer)
+    final_nb_shark = Column(Integer)
+    peak_nb_fish = Column(Integer)
+    peak_nb_shark = Column(Integer)
+    end_reason = Column(String)
+    runtime_seconds = Column(Float)
+
+
+# in table order
+SUMMARY_COLUMNS = tuple(c for c in SummaryColumns.__dict__ if isinstance(SummaryColumns.__dict__[c], Column))
+
+
+def summary_indexes() -> Tuple[Index, ...]:
+    """
+    Indexes of the common filters, sid last so that a filtered page is a range of the index
+    """
+    return (Index('ix_summary_end_reason', 'end_reason', 'sid'),
+            Index('ix_summary_final_turn', 'final_turn', 'sid'),
+            Index('ix_summary_grid_size', 'grid_size', 'sid'))
+
+
+def summary_values(simulation, turn_stats: Tuple, end_reason: Optional[str],
+                   runtime_seconds: Optional[float]) -> Dict:
+    """
+    Column values of a summary row
+    :param simulation: simulation parameters, as an object with one attribute per parameter
+    :param turn_stats: (final turn, final nb_fish, final nb_shark, peak nb_fish, peak nb_shark)
+    :param end_reason:
+    :param runtime_seconds:
+    :return:
+    """
+    values = {p: getattr(simulation, p) for p in SUMMARY_PARAMETERS}
+    values.update(zip(('final_turn', 'final_nb_fish', 'final_nb_shark', 'peak_nb_fish', 'peak_nb_shark'),
+                      turn_stats))
+    values.update(ended_at=dt.datetime.now(), end_reason=end_reason, runtime_seconds=runtime_seconds)
+    return values
+
+
+def summary_to_dict(row) -> Dict:
+    values = {c: getattr(row, c) for c in SUMMARY_COLUMNS}
+    if values['ended_at'] is not None:
+        values['ended_at'] = values['ended_at'].isoformat()
+    return values
+
+
+def get_summary(queries, table, sim_id: int) -> Optional[Dict]:
+    """
+    Summary row of a simulation, None if its run has not ended (or was not recorded)
+    :param queries: SQLAlchemyQueries of the database holding the table
+    :param table: SIMULATION_SUMMARY table
+    :param sim_id:
+    :return:
+    """
+    query = select(*[table.c[c] for c in SUMMARY_COLUMNS]).where(table.c.sid == sim_id)
+    with queries.reader_engine.connect() as conn:
+        row = conn.execute(query).first()
+    return None if row is None else summary_to_dict(row)
+
+
+def list_summaries(queries, table, filters: Optional[Dict] = None, after: Optional[int] = None, limit: int = 50,
+                   descending: bool = False) -> List[Dict]:
+    """
+    Page of summary rows, ordered by sid
+    :param queries: SQLAlchemyQueries of the database holding the table
+    :param table: SIMULATION_SUMMARY table
+    :param filters: SUMMARY_FILTERS name -> value
+    :param after: last sid of the previous page, None for the first page
+    :param limit: number of rows, at most MAX_PAGE_SIZE
+    :param descending: newest simulations first
+    :return:
+    """
+    filters = filters or {}
+    unknown = sorted(set(filters) - set(SUMMARY_FILTERS))
+    if unknown:
+        raise ValueError('Unknown filters {}, expected some of {}'.format(', '.join(unknown), sorted(SUMMARY_FILTERS)))
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError('limit must be between 1 and {}, not {}'.format(MAX_PAGE_SIZE, limit))
+    query = select(*[table.c[c] for c in SUMMARY_COLUMNS])
+    for name, value in sorted(filters.items()):
+        column, comparison = SUMMARY_FILTERS[name]
+        query = query.where(comparison(table.c[column], value))
+    if after is not None:
+        query = query.where(table.c.sid < after if descending else table.c.sid > after)
+    query = query.order_by(table.c.sid.desc() if descending else table.c.sid).limit(limit)
+    with queries.reader_engine.connect() as conn:
+        return [summary_to_dict(row) for row in conn.execute(query)]
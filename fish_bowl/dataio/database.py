@@ -5,25 +5,70 @@ import re
 import os
 
 from sqlalchemy import event, exc
-from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.engine import Engine, create_engine, make_url
 from sqlite3 import Connection as SQLite3Connection
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import Pool
+from sqlalchemy.pool import Pool, QueuePool, StaticPool
 
 _logger = logging.getLogger(__name__)
 
 POOL_RECYCLE = 100
 POOL_SIZE = 1  # 1 for monothreaded, otherwise should be number of threads
 
+# SQLite pragmas issued on every new connection, by persistence profile
+# - default: SQLite defaults (rollback journal, full synchronous writes)
+# - production: WAL journal so that readers and the writer don't block each other, synchronous NORMAL (durable
+#   at checkpoints, safe against corruption in WAL mode), memory mapped reads and a bigger page cache
+SQLITE_PROFILES = {
+    'default': (),
+    'production': (
+        ('journal_mode', 'WAL'),
+        ('synchronous', 'NORMAL'),
+        ('mmap_size', 268435456),
+        ('cache_size', -65536),
+        ('temp_store', 'MEMORY'),
+        ('busy_timeout', 5000),
+    ),
+}
+
 
 @event.listens_for(Engine, "connect")
 def _set_sqlite_pragma(dbapi_connection, connection_record):
     if isinstance(dbapi_connection, SQLite3Connection):
-        cursor =dbapi_connection.cursor()
-        cursor.execute("PRAGMA foreign_key=OM;")
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON;")
         cursor.close()
 
 
+def _sqlite_pragma_listener(pragmas):
+    """
+    Connect listener issuing a list of (pragma, value)
+    """
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas:
+            cursor.execute("PRAGMA {}={};".format(pragma, value))
+        cursor.close()
+    return set_pragmas
+
+
+def is_sqlite_file(database_url) -> bool:
+    """
+    True for sqlite database stored in a file (not in memory)
+    """
+    url = make_url(database_url)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def read_only_url(database_url) -> str:
+    """
+    Url opening a sqlite database file in read only mode
+    """
+    url = make_url(database_url)
+    path = os.path.abspath(url.database)
+    return 'sqlite:///file:{}?mode=ro&uri=true'.format(path)
+
+
 @event.listens_for(Engine, "connect")
 def connect(dbapi_connection, connection_record):
     """
@@ -73,17 +118,70 @@ def session_scope(session_builder):
 
 
 class SQLAlchemyQueries:
-    def __init__(self, database_url, declarative_base=None, expire_on_commit=True):
+    def __init__(self, database_url, declarative_base=None, expire_on_commit=True, profile: str = 'default',
+                 read_pool_size: int = 0):
+        """
+        :param database_url:
+        :param declarative_base: tables of this base are created if missing
+        :param expire_on_commit:
+        :param profile: sqlite persistence profile, one of SQLITE_PROFILES
+        :param read_pool_size: if > 0 and the database is a sqlite file, reads go through a pool of read only
+        connections, separated from the single writer connection
+        """
         _logger.info('Using <{}>'.format(blank_password(database_url)))
+        if profile not in SQLITE_PROFILES:
+            raise ValueError('Unknown persistence profile {}, use one of {}'.format(profile, sorted(SQLITE_PROFILES)))
+        self._profile = profile
+        self._read_engine = None
         if 'sqlite' in database_url:
-            # no pool recycling for in-memory sqlite, disable it
-            self._engine = create_engine(database_url, pool_recycle=-1)
+            pragmas = SQLITE_PROFILES[profile]
+            if profile != 'default' and is_sqlite_file(database_url):
+                # a single writer connection, sqlite serialises writes anyway
+                self._engine = create_engine(database_url, pool_recycle=-1, poolclass=QueuePool, pool_size=1,
+                                             max_overflow=0, connect_args={'check_same_thread': False})
+            elif is_sqlite_file(database_url):
+                self._engine = create_engine(database_url, pool_recycle=-1)
+            else:
+                # an in-memory database lives in its connection: share that one connection between threads (the
+                # writer thread of a pipelined client for instance), no pool recycling
+                self._engine = create_engine(database_url, pool_recycle=-1, poolclass=StaticPool,
+                                             connect_args={'check_same_thread': False})
+            event.listen(self._engine, 'connect', _sqlite_pragma_listener(pragmas))
+            if read_pool_size > 0 and is_sqlite_file(database_url):
+                read_pragmas = [(k, v) for k, v in pragmas if k != 'journal_mode'] + [('query_only', 'ON')]
+                self._read_engine = create_engine(read_only_url(database_url), pool_recycle=-1, poolclass=QueuePool,
+                                                  pool_size=read_pool_size, max_overflow=0,
+                                                  connect_args={'check_same_thread': False})
+                event.listen(self._read_engine, 'connect', _sqlite_pragma_listener(read_pragmas))
+            elif read_pool_size > 0:
+                _logger.info('No read only pool for in-memory database, reads use the writer connection')
         else:
             kwargs = {'pool_recycle': POOL_RECYCLE, 'pool_size': POOL_SIZE}
-            self.engine = create_engine(database_url, **kwargs)
+            self._engine = create_engine(database_url, **kwargs)
         self._session_maker = sessionmaker(bind=self._engine, expire_on_commit=expire_on_commit)
         if declarative_base:
             declarative_base.metadata.create_all(bind=self._engine, checkfirst=True)
+        if self._read_engine is not None:
+            self._read_session_maker = sessionmaker(bind=self._read_engine, expire_on_commit=expire_on_commit)
+        else:
+            self._read_session_maker = self._session_maker
+
+    @property
+    def profile(self) -> str:
+        return self._profile
+
+    @property
+    def reader_engine(self) -> Engine:
+        """
+        Engine used for reads: the read only pool if any, the writer engine otherwise
+        """
+        return self._engine if self._read_engine is None else self._read_engine
 
     def session_scope(self):
-        return session_scope(self._session_maker)
\ No newline at end of file
+        return session_scope(self._session_maker)
+
+    def read_scope(self):
+        """
+        Transactional scope for reads, through the read only pool if configured
+        """
+        return session_scope(self._read_session_maker)
\ No newline at end of file
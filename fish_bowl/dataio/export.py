@@ -0,0 +1,200 @@
+"""
+Streaming export of database simulations to Parquet
+
+ParquetExporter moves the SIMULATIONS, TURNS and ANIMALS rows of a SimulationClient database into Parquet files
+without ever holding a whole table: rows are read through server side cursors in batches of batch_size, and every
+batch is written as a row group of the partition file it belongs to. Memory is bounded by one batch whatever the
+size of the simulation.
+
+Files are partitioned by simulation and by turn range (turns_per_partition turns per file; animals by spawn turn):
+
+    <directory>/manifest.json
+    <directory>/sim_id=<sid>/simulation.json
+    <directory>/sim_id=<sid>/turns/turns_<first>_<last>.parquet
+    <directory>/sim_id=<sid>/animals/spawn_turn_<first>_<last>.parquet
+
+A partition file is written under a temporary name and renamed once complete, then recorded in the manifest. An
+interrupted export started again with the same directory skips the partitions recorded, so it resumes where it
+stopped. Turn partitions are only recorded once all their turns are logged, and animal partitions are exported
+again if the simulation played turns since they were written (the database keeps the current state of the animals,
+not their history).
+
+Requires pyarrow.
+"""
+import json
+import logging
+import os
+from typing import Callable, Dict, Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+from fish_bowl.dataio.parquet import pa, pq, _require_pyarrow
+from fish_bowl.dataio.store import ANIMAL_COLUMNS
+
+_logger = logging.getLogger(__name__)
+
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 1
+EXPORT_ANIMAL_COLUMNS = tuple(c for c in ANIMAL_COLUMNS if c != 'sim_id')
+TURN_COLUMNS = ('turn', 'nb_fish', 'nb_shark')
+
+
+def _write_json(path: str, content: Dict):
+    """
+    Write a json file atomically
+    """
+    with open(path + '.tmp', 'w') as fp:
+        json.dump(content, fp, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+class ParquetExporter:
+
+    def __init__(self, client, directory: str, turns_per_partition: int = 1000, batch_size: int = 1 << 16,
+                 compression: str = 'zstd'):
+        """
+        :param client: SimulationClient of the database to export
+        :param directory: export folder, created if needed. An existing export is resumed
+        :param turns_per_partition: number of turns (or spawn turns) per file
+        :param batch_size: rows read at once, and size of the row groups
+        :param compression: parquet compression codec
+        """
+        _require_pyarrow()
+        if turns_per_partition < 1 or batch_size < 1:
+            raise ValueError('turns_per_partition and batch_size must be positive')
+        self._client = client
+        self._directory = directory
+        self._turns_per_partition = turns_per_partition
+        self._batch_size = batch_size
+        self._compression = compression
+        os.makedirs(directory, exist_ok=True)
+        self._manifest = self._load_manifest()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    @property
+    def manifest(self) -> Dict:
+        return self._manifest
+
+    def _load_manifest(self) -> Dict:
+        path = os.path.join(self._directory, MANIFEST)
+        if not os.path.exists(path):
+            return {'version': MANIFEST_VERSION, 'turns_per_partition': self._turns_per_partition,
+                    'simulations': {}}
+        with open(path) as fp:
+            manifest = json.load(fp)
+        if manifest['turns_per_partition'] != self._turns_per_partition:
+            raise ValueError('{} was exported with {} turns per partition, not {}'.format(
+                self._directory, manifest['turns_per_partition'], self._turns_per_partition))
+        return manifest
+
+    def _save_manifest(self):
+        _write_json(os.path.join(self._directory, MANIFEST), self._manifest)
+
+    def simulation_path(self, sim_id: int) -> str:
+        return os.path.join(self._directory, 'sim_id={}'.format(sim_id))
+
+    def _partition_path(self, sim_id: int, kind: str, prefix: str, partition: int) -> str:
+        first = partition * self._turns_per_partition
+        return os.path.join(self.simulation_path(sim_id), kind,
+                            '{}_{}_{}.parquet'.format(prefix, first, first + self._turns_per_partition - 1))
+
+    def export(self, sim_ids: Optional[Iterable[int]] = None) -> Dict:
+        """
+        Export simulations
+        :param sim_ids: simulations to export, all of them if None
+        :return: the manifest
+        """
+        if sim_ids is None:
+            sim_ids = self._client.get_simulation_ids()
+        for sim_id in sim_ids:
+            self.export_simulation(sim_id)
+        return self._manifest
+
+    def export_simulation(self, sim_id: int) -> Dict:
+        """
+        Export (or resume the export of) a simulation
+        :param sim_id:
+        :return: manifest entry of the simulation
+        """
+        simulation = self._client.get_simulation(sim_id)
+        last_turn = self._client.get_last_turn(sim_id)
+        entry = self._manifest['simulations'].setdefault(str(sim_id), {'turns': {}, 'animals': {}})
+        os.makedirs(os.path.join(self.simulation_path(sim_id), 'turns'), exist_ok=True)
+        os.makedirs(os.path.join(self.simulation_path(sim_id), 'animals'), exist_ok=True)
+        parameters = {c.name: getattr(simulation, c.name) for c in simulation.__table__.columns}
+        parameters['timestamp'] = parameters['timestamp'].isoformat() if parameters['timestamp'] else None
+        _write_json(os.path.join(self.simulation_path(sim_id), 'simulation.json'), parameters)
+
+        # turns: a partition is final once its last turn is logged
+        def turn_is_final(partition: int) -> bool:
+            return last_turn is not None and (partition + 1) * self._turns_per_partition - 1 <= last_turn
+
+        batches = ({c: np.array([r[i] for r in rows], dtype=np.int64) for i, c in enumerate(TURN_COLUMNS)}
+                   for rows in self._client.iter_turn_log(sim_id, from_turn=self._resume_from(entry['turns']),
+                                                          batch_size=self._batch_size))
+        self._write_partitions(sim_id, entry['turns'], 'turns', 'turns', 'turn', TURN_COLUMNS, batches,
+                               turn_is_final)
+
+        # animals: the current state, exported again when the simulation moved on
+        if entry.get('animals_turn') != last_turn:
+            entry['animals'] = {}
+            entry['animals_turn'] = last_turn
+        batches = self._client.iter_animals_by_spawn_turn(sim_id, EXPORT_ANIMAL_COLUMNS,
+                                                          from_spawn_turn=self._resume_from(entry['animals']),
+                                                          batch_size=self._batch_size)
+        self._write_partitions(sim_id, entry['animals'], 'animals', 'spawn_turn', 'spawn_turn',
+                               EXPORT_ANIMAL_COLUMNS, batches, lambda partition: True)
+        self._save_manifest()
+        _logger.info('Simulation {} exported to {}: {} turn and {} animal partitions'.format(
+            sim_id, self.simulation_path(sim_id), len(entry['turns']), len(entry['animals'])))
+        return entry
+
+    def _resume_from(self, done: Dict[str, int]) -> Optional[int]:
+        """
+        First turn of the partition following the ones recorded (partitions are written in order)
+        """
+        if not done:
+            return None
+        return (max(int(p) for p in done) + 1) * self._turns_per_partition
+
+    def _write_partitions(self, sim_id: int, done: Dict[str, int], kind: str, prefix: str, key: str,
+                          columns: Sequence[str], batches: Iterator[Dict[str, np.ndarray]],
+                          is_final: Callable[[int], bool]):
+        """
+        Write batches sorted by key into one file per partition of key, recording the final ones in done
+        """
+        writer = None
+        partition = None
+        rows = 0
+        path = None
+
+        def close():
+            writer.close()
+            os.replace(path + '.tmp', path)
+            if is_final(partition):
+                done[str(partition)] = rows
+                self._save_manifest()
+            _logger.debug('Simulation {}: {} rows written to {}'.format(sim_id, rows, path))
+
+        for arrays in batches:
+            partitions = np.floor_divide(arrays[key], self._turns_per_partition)
+            # batches are sorted by key, split them where the partition changes
+            bounds = [0] + (np.flatnonzero(np.diff(partitions)) + 1).tolist() + [len(partitions)]
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if partitions[start] != partition:
+                    if writer is not None:
+                        close()
+                    partition = int(partitions[start])
+                    path = self._partition_path(sim_id, kind, prefix, partition)
+                    table = pa.table({c: arrays[c][start:end] for c in columns})
+                    writer = pq.ParquetWriter(path + '.tmp', table.schema, compression=self._compression)
+                    rows = 0
+                else:
+                    table = pa.table({c: arrays[c][start:end] for c in columns})
+                writer.write_table(table)
+                rows += end - start
+        if writer is not None:
+            close()
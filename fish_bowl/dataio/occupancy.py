@@ -0,0 +1,205 @@
+"""
+Square -> animal occupancy of a grid
+
+- DenseOccupancy: (grid_size, grid_size) oid array, O(1) lookups, memory in grid_size ** 2
+- SparseOccupancy: coordinate hash, memory in the number of animals
+- AdaptiveOccupancy: switches between both representations with the occupancy density. The dense threshold is
+  above the sparse one (hysteresis) so that a population hovering around a threshold doesn't convert back and
+  forth every turn.
+
+Free squares are reported as -1.
+"""
+import logging
+import sys
+from typing import Iterator, Tuple, Union
+
+import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+FREE = -1
+
+
+class DenseOccupancy:
+    mode = 'dense'
+
+    def __init__(self, grid_size: int):
+        self._grid = np.full((grid_size, grid_size), FREE, dtype=np.int32)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return self._grid.nbytes
+
+    def get(self, x: int, y: int) -> int:
+        return int(self._grid[x, y])
+
+    def set(self, x: int, y: int, oid: int):
+        if self._grid[x, y] == FREE:
+            self._count += 1
+        self._grid[x, y] = oid
+
+    def clear(self, x: int, y: int):
+        if self._grid[x, y] != FREE:
+            self._count -= 1
+            self._grid[x, y] = FREE
+
+    def fill(self, xs: np.ndarray, ys: np.ndarray, oids: np.ndarray):
+        """
+        Replace the whole occupancy
+        """
+        self._grid.fill(FREE)
+        self._grid[xs, ys] = oids
+        self._count = len(oids)
+
+    def items(self) -> Iterator[Tuple[Tuple[int, int], int]]:
+        xs, ys = np.nonzero(self._grid != FREE)
+        for x, y in zip(xs.tolist(), ys.tolist()):
+            yield (x, y), int(self._grid[x, y])
+
+    def to_array(self) -> np.ndarray:
+        return self._grid.copy()
+
+
+class SparseOccupancy:
+    mode = 'sparse'
+
+    def __init__(self, grid_size: int):
+        self._grid_size = grid_size
+        self._cells = {}
+        self._peak = 0
+
+    def __len__(self):
+        return len(self._cells)
+
+    @property
+    def nbytes(self) -> int:
+        # hash table plus the key tuples (coordinates and oids are mostly cached small ints)
+        return sys.getsizeof(self._cells) + 64 * len(self._cells)
+
+    def get(self, x: int, y: int) -> int:
+        return self._cells.get((x, y), FREE)
+
+    def set(self, x: int, y: int, oid: int):
+        self._cells[(x, y)] = oid
+        self._peak = max(self._peak, len(self._cells))
+
+    def clear(self, x: int, y: int):
+        self._cells.pop((x, y), None)
+        if 8 * len(self._cells) < self._peak:
+            # dictionaries never shrink their table on deletion, rebuild it
+            self._cells = dict(self._cells)
+            self._peak = len(self._cells)
+
+    def fill(self, xs: np.ndarray, ys: np.ndarray, oids: np.ndarray):
+        self._cells = dict(zip(zip(xs.tolist(), ys.tolist()), oids.tolist()))
+        self._peak = len(self._cells)
+
+    def items(self) -> Iterator[Tuple[Tuple[int, int], int]]:
+        return iter(list(self._cells.items()))
+
+    def to_array(self) -> np.ndarray:
+        grid = np.full((self._grid_size, self._grid_size), FREE, dtype=np.int32)
+        for (x, y), oid in self._cells.items():
+            grid[x, y] = oid
+        return grid
+
+
+class AdaptiveOccupancy:
+    """
+    Dense once more than dense_above of the squares are occupied, sparse again below sparse_below
+    """
+
+    def __init__(self, grid_size: int, dense_above: float = 0.1, sparse_below: float = 0.02):
+        """
+        :param grid_size:
+        :param dense_above: density switching to the dense representation
+        :param sparse_below: density switching back to the sparse representation, lower than dense_above
+        """
+        if not 0 <= sparse_below < dense_above <= 1:
+            raise ValueError('Expected 0 <= sparse_below < dense_above <= 1, got {} and {}'.format(sparse_below,
+                                                                                                  dense_above))
+        self._grid_size = grid_size
+        cells = grid_size ** 2
+        self._dense_above = int(dense_above * cells)
+        self._sparse_below = int(sparse_below * cells)
+        self._occupancy = SparseOccupancy(grid_size)
+        self.switches = 0
+
+    def __len__(self):
+        return len(self._occupancy)
+
+    @property
+    def mode(self) -> str:
+        return self._occupancy.mode
+
+    @property
+    def nbytes(self) -> int:
+        return self._occupancy.nbytes
+
+    def _convert(self, target):
+        new = target(self._grid_size)
+        for (x, y), oid in self._occupancy.items():
+            new.set(x, y, oid)
+        _logger.debug('Occupancy {} -> {} with {} animals'.format(self._occupancy.mode, new.mode, len(new)))
+        self._occupancy = new
+        self.switches += 1
+
+    def get(self, x: int, y: int) -> int:
+        return self._occupancy.get(x, y)
+
+    def set(self, x: int, y: int, oid: int):
+        self._occupancy.set(x, y, oid)
+        if self._occupancy.mode == 'sparse' and len(self._occupancy) > self._dense_above:
+            self._convert(DenseOccupancy)
+
+    def clear(self, x: int, y: int):
+        self._occupancy.clear(x, y)
+        if self._occupancy.mode == 'dense' and len(self._occupancy) < self._sparse_below:
+            self._convert(SparseOccupancy)
+
+    def fill(self, xs: np.ndarray, ys: np.ndarray, oids: np.ndarray):
+        """
+        Replace the whole occupancy, in the representation matching its new density
+        """
+        mode = self._occupancy.mode
+        if len(oids) > self._dense_above:
+            mode = 'dense'
+        elif len(oids) < self._sparse_below:
+            mode = 'sparse'
+        if mode != self._occupancy.mode:
+            self._occupancy = OCCUPANCY_TYPES[mode](self._grid_size)
+            self.switches += 1
+        self._occupancy.fill(xs, ys, oids)
+
+    def items(self) -> Iterator[Tuple[Tuple[int, int], int]]:
+        return self._occupancy.items()
+
+    def to_array(self) -> np.ndarray:
+        return self._occupancy.to_array()
+
+
+Occupancy = Union[DenseOccupancy, SparseOccupancy, AdaptiveOccupancy]
+
+OCCUPANCY_TYPES = {
+    'dense': DenseOccupancy,
+    'sparse': SparseOccupancy,
+    'adaptive': AdaptiveOccupancy,
+}
+
+
+def create_occupancy(mode: str, grid_size: int, **kwargs) -> Occupancy:
+    """
+    :param mode: dense, sparse or adaptive
+    :param grid_size:
+    :param kwargs: thresholds of the adaptive occupancy
+    :return:
+    """
+    try:
+        occupancy_type = OCCUPANCY_TYPES[mode]
+    except KeyError:
+        raise ValueError('Unknown occupancy mode {!r}, expected one of {}'.format(mode, sorted(OCCUPANCY_TYPES)))
+    return occupancy_type(grid_size, **kwargs)
@@ -0,0 +1,173 @@
+"""
+Columnar history of simulations in Parquet files
+
+ParquetSimulationClient plays simulations in memory (it is a StoreSimulationClient) and appends a snapshot of the
+live animals to a Parquet dataset each time a turn is logged. Snapshots are buffered and written as one part file
+per row group, so the history can be read back while the simulation is still running:
+
+    <directory>/simulation_<sid>/simulation.json        simulation parameters
+    <directory>/simulation_<sid>/animals/part-00000.parquet
+    <directory>/simulation_<sid>/turns.parquet          population by turn, written on close
+
+A directory can be reused by later clients: sids are numbered after the simulation folders it already holds, so a
+new run never writes into the history of a previous one.
+
+Requires pyarrow.
+"""
+import json
+import logging
+import os
+import re
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from fish_bowl.dataio.store import StoreSimulationClient, ARRAY_DTYPES
+from fish_bowl.process.utils import Animal
+
+_logger = logging.getLogger(__name__)
+
+# columns of the animal snapshots, 'turn' is added in front
+HISTORY_COLUMNS = ('oid', 'animal_type', 'coord_x', 'coord_y', 'spawn_turn', 'last_breed', 'breed_count',
+                   'last_fed')
+TURN_COLUMNS = ('turn', 'nb_fish', 'nb_shark')
+SIMULATION_FOLDER = re.compile(r'^simulation_(\d+)$')
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('The parquet storage backend requires pyarrow, install it with: pip install pyarrow')
+
+
+class ParquetSimulationClient(StoreSimulationClient):
+    """
+    In-memory simulations with their turn by turn history appended to Parquet files
+    """
+
+    def __init__(self, directory: str, row_group_rows: int = 1 << 16, compression: str = 'snappy',
+                 release_dead: bool = True):
+        """
+        :param directory: root folder of the datasets, created if needed
+        :param row_group_rows: number of buffered snapshot rows that triggers the write of a part file
+        :param compression: parquet compression codec
+        :param release_dead: see StoreSimulationClient
+        """
+        _require_pyarrow()
+        super().__init__(release_dead=release_dead)
+        self._directory = directory
+        self._row_group_rows = row_group_rows
+        self._compression = compression
+        self._buffers = {}
+        self._buffered_rows = {}
+        self._parts = {}
+        os.makedirs(directory, exist_ok=True)
+        # simulations of previous clients of the directory keep their sids
+        existing = [int(m.group(1)) for m in map(SIMULATION_FOLDER.match, os.listdir(directory)) if m is not None]
+        self._next_sid = max(existing, default=0) + 1
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def simulation_path(self, sim_id: int) -> str:
+        return os.path.join(self._directory, 'simulation_{}'.format(sim_id))
+
+    def init_simulation(self, **kwargs):
+        sid = super().init_simulation(**kwargs)
+        self._start_history(sid)
+        return sid
+
+    def clone_simulation(self, sim_id: int, **parameters) -> int:
+        """
+        Copy a simulation in memory, the history of the clone starts with the next logged turn
+        """
+        sid = super().clone_simulation(sim_id, **parameters)
+        self._start_history(sid)
+        return sid
+
+    def _start_history(self, sid: int):
+        path = self.simulation_path(sid)
+        # fails rather than mixing two runs, if another client of the directory took the sid meanwhile
+        os.makedirs(os.path.join(path, 'animals'))
+        parameters = self.get_simulation(sid)._asdict()
+        parameters['timestamp'] = parameters['timestamp'].isoformat()
+        with open(os.path.join(path, 'simulation.json'), 'w') as fp:
+            json.dump(parameters, fp)
+        self._buffers[sid] = []
+        self._buffered_rows[sid] = 0
+        self._parts[sid] = 0
+
+    def log_turn(self, sim_id: int, turn: int, population: Dict[Animal, int]):
+        super().log_turn(sim_id=sim_id, turn=turn, population=population)
+        arrays = self.get_animal_arrays(sim_id, HISTORY_COLUMNS)
+        arrays['turn'] = np.full(len(arrays['oid']), turn, dtype=np.int32)
+        self._buffers[sim_id].append(arrays)
+        self._buffered_rows[sim_id] += len(arrays['oid'])
+        if self._buffered_rows[sim_id] >= self._row_group_rows:
+            self.flush(sim_id)
+
+    def flush(self, sim_id: Optional[int] = None):
+        """
+        Write the buffered snapshots as a new part file
+        :param sim_id: simulation to flush, all of them if None
+        :return:
+        """
+        sim_ids = list(self._buffers) if sim_id is None else [sim_id]
+        for sid in sim_ids:
+            snapshots = self._buffers[sid]
+            if not snapshots:
+                continue
+            columns = ('turn',) + HISTORY_COLUMNS
+            table = pa.table({c: pa.array(np.concatenate([s[c] for s in snapshots])) for c in columns})
+            part = os.path.join(self.simulation_path(sid), 'animals', 'part-{:05d}.parquet'.format(self._parts[sid]))
+            pq.write_table(table, part, compression=self._compression)
+            _logger.debug('Simulation {}: {} rows written to {}'.format(sid, table.num_rows, part))
+            self._parts[sid] += 1
+            self._buffers[sid] = []
+            self._buffered_rows[sid] = 0
+
+    def read_history(self, sim_id: int, turns: Optional[Sequence[int]] = None,
+                     columns: Optional[Sequence[str]] = None):
+        """
+        Read back the written snapshots, buffered ones are flushed first
+        :param sim_id:
+        :param turns: restrict to these turns
+        :param columns: restrict to these columns
+        :return: pyarrow Table ordered by turn then oid
+        """
+        self._get(sim_id)
+        self.flush(sim_id)
+        path = os.path.join(self.simulation_path(sim_id), 'animals')
+        if self._parts[sim_id] == 0:
+            schema_columns = ('turn',) + HISTORY_COLUMNS if columns is None else tuple(columns)
+            return pa.table({c: pa.array([], type=pa.from_numpy_dtype(np.dtype(ARRAY_DTYPES.get(c, np.int32))))
+                             for c in schema_columns})
+        filters = None if turns is None else [('turn', 'in', list(turns))]
+        return pq.read_table(path, columns=None if columns is None else list(columns), filters=filters)
+
+    def write_turn_log(self, sim_id: int) -> str:
+        """
+        Write the population by turn of a simulation
+        :param sim_id:
+        :return: file path
+        """
+        log = self.get_turn_log(sim_id)
+        table = pa.table({c: pa.array([t[i] for t in log], type=pa.int64()) for i, c in enumerate(TURN_COLUMNS)})
+        path = os.path.join(self.simulation_path(sim_id), 'turns.parquet')
+        pq.write_table(table, path, compression=self._compression)
+        return path
+
+    def close(self):
+        """
+        Flush every simulation and write their turn logs
+        """
+        self.flush()
+        for sid in self._buffers:
+            self.write_turn_log(sid)
@@ -1,19 +1,25 @@
 import datetime as dt
 import logging
 import os
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple, Sequence, Iterator, TYPE_CHECKING
 
-import pandas as pd
+import numpy as np
 
+from fish_bowl.dataio.backends import StorageBackend, check_clone_parameters
+from fish_bowl.dataio.catalog import SummaryColumns, get_summary, list_summaries, summary_indexes, summary_values
 from fish_bowl.dataio.database import SQLAlchemyQueries
-from sqlalchemy import Column, DateTime, Float, ForeignKey, Enum, Boolean, Integer
-from sqlalchemy.orm import validates
+from fish_bowl.dataio.store import animal_row_type, rows_to_arrays
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Enum, Boolean, Integer, select, and_, or_, insert, \
+    update, bindparam, literal
+from sqlalchemy.orm import declarative_base, validates
 from sqlalchemy.sql import func
-from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm.exc import NoResultFound
 
 from fish_bowl.process.utils import ImpossibleAction, Animal
-from fish_bowl.process.topology import SquareGridCoordinate, square_grid_valid, NonEmptyCoordinate
+from fish_bowl.process.topology import SquareGridCoordinate
+
+if TYPE_CHECKING:
+    import pandas as pd
 
 _logger = logging.getLogger(__name__)
 
@@ -79,13 +85,42 @@ class Animals(Base):
                                                                y=self.coord_y)
 
 
-class SimulationClient(SQLAlchemyQueries):
-    def __init__(self, database_url):
-        super().__init__(database_url=database_url, declarative_base=Base, expire_on_commit=False)
+class SimulationTurn(Base):
+    """
+    Population at the end of each completed turn, turn 0 being the initial spawn
+    """
+    __tablename__ = 'TURNS'
+    sim_id = Column(ForeignKey("{}.{}.sid".format(schema, Simulation.__tablename__)), primary_key=True)
+    turn = Column(Integer, primary_key=True)
+    nb_fish = Column(Integer)
+    nb_shark = Column(Integer)
+
+    __table_args__ = ({'schema': schema})
+
+
+class SimulationSummary(SummaryColumns, Base):
+    """
+    Summary of a finished simulation, see catalog
+    """
+    __table_args__ = summary_indexes() + ({'schema': schema},)
+
+
+class SimulationClient(SQLAlchemyQueries, StorageBackend):
+    def __init__(self, database_url, profile: str = 'default', read_pool_size: int = 0):
+        super().__init__(database_url=database_url, declarative_base=Base, expire_on_commit=False, profile=profile,
+                         read_pool_size=read_pool_size)
+
+    def close(self):
+        """
+        Close the pooled connections
+        """
+        if self.reader_engine is not self._engine:
+            self.reader_engine.dispose()
+        self._engine.dispose()
 
     def init_simulation(self, grid_size, init_nb_fish, init_nb_shark, fish_breed_maturity, fish_breed_probability,
                         fish_speed, shark_breed_maturity, shark_breed_probability, shark_speed,
-                        shark_starving):
+                        shark_starving, sid: Optional[int] = None):
         """
         Initialize a simulation and return the sid
         :param grid_size:
@@ -98,6 +133,7 @@ class SimulationClient(SQLAlchemyQueries):
         :param shark_breed_probability:
         :param shark_speed:
         :param shark_starving:
+        :param sid: id given to the simulation, the next free one if None
         :return:
         """
         # first check some inputs
@@ -110,14 +146,15 @@ class SimulationClient(SQLAlchemyQueries):
         assert shark_starving > 0, "shark_starving must be positive"
 
         with self.session_scope() as s:
-            s.add(Simulation(timestamp=dt.datetime.now(), grid_size=grid_size, init_nb_fish=init_nb_fish,
+            s.add(Simulation(sid=sid, timestamp=dt.datetime.now(), grid_size=grid_size, init_nb_fish=init_nb_fish,
                              init_nb_shark=init_nb_shark, fish_breed_maturity=fish_breed_maturity,
                              fish_breed_probability=fish_breed_probability,
                              fish_speed=fish_speed, shark_breed_maturity=shark_breed_maturity,
                              shark_breed_probability=shark_breed_probability, shark_speed=shark_speed,
                              shark_starving=shark_starving))
             s.flush()
-            sid = s.query(func.max(Simulation.sid)).one()[0]
+            if sid is None:
+                sid = s.query(func.max(Simulation.sid)).one()[0]
         return sid
 
     def get_simulation(self, sim_id: int) -> Simulation:
@@ -126,38 +163,63 @@ class SimulationClient(SQLAlchemyQueries):
         :param sim_id:
         :return:
         """
-        with self.session_scope() as s:
+        with self.read_scope() as s:
             return s.query(Simulation).filter(Simulation.sid == sim_id).one()
 
+    def clone_simulation(self, sim_id: int, **parameters) -> int:
+        """
+        Copy a simulation, its animals (dead ones included) and its turn log to a new sid, inside the database.
+        Animals get new oids, in the order of the original ones
+        :param sim_id:
+        :param parameters: new values of some CLONE_PARAMETERS
+        :return: sid of the clone
+        """
+        check_clone_parameters(parameters)
+        with self.session_scope() as s:
+            try:
+                simulation = s.query(Simulation).filter(Simulation.sid == sim_id).one()
+            except NoResultFound:
+                raise ValueError("Simulation {} doesn't exist!".format(sim_id))
+            values = {c.name: getattr(simulation, c.name) for c in Simulation.__table__.columns if c.name != 'sid'}
+            values.update(parameters, timestamp=dt.datetime.now())
+            clone = Simulation(**values)
+            s.add(clone)
+            s.flush()
+            sid = clone.sid
+            conn = s.connection()
+            for table, key in ((Animals.__table__, 'oid'), (SimulationTurn.__table__, 'turn')):
+                columns = [c.name for c in table.columns if c.name not in ('oid', 'sim_id')]
+                source = select(literal(sid), *[table.c[c] for c in columns]).where(table.c.sim_id == sim_id)
+                conn.execute(insert(table).from_select(['sim_id'] + columns, source.order_by(table.c[key])))
+        return sid
+
     def get_all_simulations(self):
         """
         Retrieve all simulations in a panda DataFrame
         :return: DataFrame
         """
-        with self.session_scope() as s:
+        with self.read_scope() as s:
             query = s.query(Simulation)
+            import pandas as pd
             return pd.read_sql(query.statement, query.session.bind)
 
+    def get_simulation_ids(self) -> List[int]:
+        """
+        Ids of all simulations, in creation order
+        :return:
+        """
+        with self.reader_engine.connect() as conn:
+            return [r[0] for r in conn.execute(select(Simulation.__table__.c.sid).order_by(Simulation.__table__.c.sid))]
+
     def init_animal(self, sim_id: int, current_turn: int, animal_type: Animal, coordinate: SquareGridCoordinate,
                     last_fed: Optional[int] = 0, last_breed: Optional[int] = 0):
         """
-        use for single animal init
+        use for single animal init. The square is not checked: SimulationGrid checks the whole grid at the end of
+        the turn, see fish_bowl.process.invariants
         :return:
         """
-
         with self.session_scope() as s:
-            try:
-                simulation = s.query(Simulation).filter(Simulation.sid == sim_id).one()
-                s.flush()
-            except NoResultFound:
-                _logger.debug("Simulation {} doesn't exist!".format(sim_id))
-                raise ValueError("Simulation {} doesn't exist!".format(sim_id))
-            # Check coordinate match with the grid
-            square_grid_valid(grid_size=simulation.grid_size, coordinates=coordinate)
-            # check if coordinate is free
-            if self.coordinate_is_occupied(sim_id=sim_id, coordinate=coordinate):
-                raise NonEmptyCoordinate('Coordinate {} is occupied'.format(coordinate))
-            new_animal = Animals(sim_id=simulation.sid, animal_type=animal_type, spawn_turn=current_turn,
+            new_animal = Animals(sim_id=sim_id, animal_type=animal_type, spawn_turn=current_turn,
                                  breed_count=0, last_breed=last_breed, alive=True, last_fed=last_fed,
                                  coord_x=coordinate.x, coord_y=coordinate.y)
             s.add(new_animal)
@@ -170,7 +232,7 @@ class SimulationClient(SQLAlchemyQueries):
         :param coordinate:
         :return:
         """
-        with self.session_scope() as s:
+        with self.read_scope() as s:
             query = s.query(Animals).filter(Animals.sim_id == sim_id, Animals.coord_x == coordinate.x,
                                             Animals.coord_y == coordinate.y, Animals.alive)
             return s.query(query.exists()).scalar()
@@ -182,7 +244,7 @@ class SimulationClient(SQLAlchemyQueries):
         :param animal_id:
         :return:
         """
-        with self.session_scope() as s:
+        with self.read_scope() as s:
             q = s.query(Animals).filter(Animals.sim_id == sim_id, Animals.oid == animal_id)
             return q.one()
 
@@ -194,22 +256,23 @@ class SimulationClient(SQLAlchemyQueries):
         :param live_only:
         :return:
         """
-        with self.session_scope() as s:
+        with self.read_scope() as s:
             query = s.query(Animals).filter(Animals.sim_id == sim_id, Animals.coord_x == coordinate.x,
                                             Animals.coord_y == coordinate.y)
             if live_only:
                 query = query.filter(Animals.alive)
             return query.all()
 
-    def get_animals_by_type(self, sim_id: int, animal_type: Animal) -> pd.DataFrame:
+    def get_animals_by_type(self, sim_id: int, animal_type: Animal) -> 'pd.DataFrame':
         """
 
         :param sim_id:
         :param animal_type:
         :return:
         """
-        with self.session_scope() as s:
+        with self.read_scope() as s:
             q = s.query(Animals).filter(Animals.sim_id == sim_id, Animals.alive, Animals.animal_type == animal_type)
+            import pandas as pd
             return pd.read_sql(q.statement, q.session.bind)
 
     def get_animals_df(self, sim_id: int):
@@ -218,10 +281,290 @@ class SimulationClient(SQLAlchemyQueries):
         :param sim_id:
         :return:
         """
-        with self.session_scope() as s:
+        with self.read_scope() as s:
             q = s.query(Animals).filter(Animals.sim_id == sim_id, Animals.alive)
+            import pandas as pd
             return pd.read_sql(q.statement, q.session.bind)
 
+    def count_animals(self, sim_id: int) -> Dict[Animal, int]:
+        """
+        Count live animals per type
+        :param sim_id:
+        :return:
+        """
+        with self.read_scope() as s:
+            q = s.query(Animals.animal_type, func.count(Animals.oid)).filter(Animals.sim_id == sim_id, Animals.alive)
+            counts = dict(q.group_by(Animals.animal_type).all())
+        return {a: counts.get(a, 0) for a in Animal}
+
+    def log_turn(self, sim_id: int, turn: int, population: Dict[Animal, int]):
+        """
+        Record the population at the end of a completed turn
+        :param sim_id:
+        :param turn:
+        :param population:
+        :return:
+        """
+        with self.session_scope() as s:
+            s.add(SimulationTurn(sim_id=sim_id, turn=turn, nb_fish=population.get(Animal.Fish, 0),
+                                 nb_shark=population.get(Animal.Shark, 0)))
+        return
+
+    def apply_turn_changes(self, sim_id: int, turn: int, population: Dict[Animal, int],
+                           spawned: Dict[str, np.ndarray], changed: Dict[str, np.ndarray],
+                           dead: np.ndarray) -> np.ndarray:
+        """
+        Write everything that changed in a turn in a single transaction: readers see the turn and its animals at
+        once, or not at all
+        :param sim_id:
+        :param turn: completed turn, logged with population
+        :param population:
+        :param spawned: columns of the new animals, without oid, animal_type as the Animal value
+        :param changed: oid and the new values of the coord_x, coord_y, breed_count, last_breed, last_fed columns of
+        existing animals
+        :param dead: oids of the animals that died
+        :return: oids given to the spawned animals, in the order they were given
+        """
+        oids = np.zeros(0, dtype=np.int64)
+        table = Animals.__table__
+        with self.session_scope() as s:
+            # core executemany statements, on the connection of the session transaction
+            conn = s.connection()
+            n = len(spawned['animal_type'])
+            if n > 0:
+                # only this writer adds animals to the simulation: the new ones are the oids above its last one
+                last = s.query(func.max(Animals.oid)).filter(Animals.sim_id == sim_id).scalar() or 0
+                columns = [c for c in spawned if c != 'animal_type']
+                values = [spawned[c].tolist() for c in columns]
+                types = [Animal(v) for v in spawned['animal_type'].tolist()]
+                rows = [dict(zip(columns, r), sim_id=sim_id, animal_type=t, alive=True)
+                        for r, t in zip(zip(*values), types)]
+                conn.execute(insert(table), rows)
+                oids = np.array(conn.execute(select(table.c.oid).where(table.c.sim_id == sim_id, table.c.oid > last)
+                                             .order_by(table.c.oid)).scalars().all(), dtype=np.int64)
+            if len(changed['oid']) > 0:
+                columns = [c for c in changed if c != 'oid']
+                stmt = update(table).where(table.c.oid == bindparam('_oid')).values(
+                    **{c: bindparam('_' + c) for c in columns})
+                keys = ['_oid'] + ['_' + c for c in columns]
+                values = [changed['oid'].tolist()] + [changed[c].tolist() for c in columns]
+                conn.execute(stmt, [dict(zip(keys, r)) for r in zip(*values)])
+            if len(dead) > 0:
+                stmt = update(table).where(table.c.oid == bindparam('_oid')).values(alive=False)
+                conn.execute(stmt, [{'_oid': oid} for oid in dead.tolist()])
+            s.add(SimulationTurn(sim_id=sim_id, turn=turn, nb_fish=population.get(Animal.Fish, 0),
+                                 nb_shark=population.get(Animal.Shark, 0)))
+        return oids
+
+    def get_last_turn(self, sim_id: int) -> Optional[int]:
+        """
+        Last completed turn of a simulation, None if no turn was recorded
+        :param sim_id:
+        :return:
+        """
+        with self.read_scope() as s:
+            return s.query(func.max(SimulationTurn.turn)).filter(SimulationTurn.sim_id == sim_id).scalar()
+
+    def get_turn_log(self, sim_id: int, until_turn: Optional[int] = None) -> List[Tuple[int, int, int]]:
+        """
+        Population history as a list of (turn, nb_fish, nb_shark)
+        :param sim_id:
+        :param until_turn: last turn included, all turns if None
+        :return:
+        """
+        with self.read_scope() as s:
+            q = s.query(SimulationTurn.turn, SimulationTurn.nb_fish, SimulationTurn.nb_shark)\
+                .filter(SimulationTurn.sim_id == sim_id)
+            if until_turn is not None:
+                q = q.filter(SimulationTurn.turn <= until_turn)
+            return [tuple(r) for r in q.order_by(SimulationTurn.turn).all()]
+
+    def summarise(self, sim_id: int, end_reason: Optional[str] = None,
+                  runtime_seconds: Optional[float] = None) -> Dict:
+        """
+        Values of the summary row of a simulation, from its parameters and turn log
+        :param sim_id:
+        :param end_reason:
+        :param runtime_seconds:
+        :return:
+        """
+        simulation = self.get_simulation(sim_id)
+        turns = SimulationTurn.__table__
+        with self.reader_engine.connect() as conn:
+            last_turn, peak_fish, peak_shark = conn.execute(
+                select(func.max(turns.c.turn), func.max(turns.c.nb_fish), func.max(turns.c.nb_shark))
+                .where(turns.c.sim_id == sim_id)).one()
+            if last_turn is None:
+                raise ValueError('Simulation {} has no logged turn'.format(sim_id))
+            final = conn.execute(select(turns.c.nb_fish, turns.c.nb_shark)
+                                 .where(turns.c.sim_id == sim_id, turns.c.turn == last_turn)).one()
+        return summary_values(simulation, (last_turn, final[0], final[1], peak_fish, peak_shark), end_reason,
+                              runtime_seconds)
+
+    def record_summary(self, sim_id: int, end_reason: Optional[str] = None, runtime_seconds: Optional[float] = None):
+        """
+        Write (or replace) the catalog row of a simulation whose run ended
+        """
+        values = self.summarise(sim_id, end_reason=end_reason, runtime_seconds=runtime_seconds)
+        with self.session_scope() as s:
+            s.merge(SimulationSummary(sid=sim_id, **values))
+
+    def backfill_summaries(self) -> int:
+        """
+        Record the summary of the simulations with logged turns but no catalog row, played before the catalog
+        existed. Their end reason and runtime are unknown
+        :return: number of rows written
+        """
+        with self.read_scope() as s:
+            q = s.query(SimulationTurn.sim_id).distinct()\
+                .filter(~SimulationTurn.sim_id.in_(select(SimulationSummary.sid)))
+            missing = [r[0] for r in q.order_by(SimulationTurn.sim_id)]
+        for sim_id in missing:
+            self.record_summary(sim_id)
+        return len(missing)
+
+    def get_simulation_summary(self, sim_id: int) -> Optional[Dict]:
+        """
+        Catalog row of a simulation, None while it is running
+        """
+        return get_summary(self, SimulationSummary.__table__, sim_id)
+
+    def list_simulation_summaries(self, filters: Optional[Dict] = None, after: Optional[int] = None,
+                                  limit: int = 50, descending: bool = False) -> List[Dict]:
+        """
+        Page of the catalog, see catalog.list_summaries
+        """
+        return list_summaries(self, SimulationSummary.__table__, filters=filters, after=after, limit=limit,
+                              descending=descending)
+
+    @staticmethod
+    def _projection(sim_id: int, columns: Sequence[str], animal_type: Optional[Animal], live_only: bool):
+        """
+        Core select statement of some animal columns, ordered by oid
+        """
+        animal_row_type(tuple(columns))
+        table = Animals.__table__
+        stmt = select(*[table.c[c] for c in columns]).where(table.c.sim_id == sim_id)
+        if live_only:
+            stmt = stmt.where(table.c.alive)
+        if animal_type is not None:
+            stmt = stmt.where(table.c.animal_type == animal_type)
+        return stmt.order_by(table.c.oid)
+
+    def get_animal_tuples(self, sim_id: int, columns: Sequence[str], animal_type: Optional[Animal] = None,
+                          live_only: bool = True) -> List[Tuple]:
+        """
+        Load only some columns of the animals, as named tuples sorted by oid
+        :param sim_id:
+        :param columns: ANIMALS column names
+        :param animal_type: restrict to an animal type if specified
+        :param live_only:
+        :return:
+        """
+        row_type = animal_row_type(tuple(columns))
+        with self.reader_engine.connect() as conn:
+            return [row_type(*r) for r in conn.execute(self._projection(sim_id, columns, animal_type, live_only))]
+
+    def get_animal_arrays(self, sim_id: int, columns: Sequence[str], animal_type: Optional[Animal] = None,
+                          live_only: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Load only some columns of the animals, as one numpy array per column sorted by oid.
+        animal_type is returned as the Animal value
+        :param sim_id:
+        :param columns: ANIMALS column names
+        :param animal_type: restrict to an animal type if specified
+        :param live_only:
+        :return:
+        """
+        with self.reader_engine.connect() as conn:
+            rows = conn.execute(self._projection(sim_id, columns, animal_type, live_only)).fetchall()
+        return rows_to_arrays(columns, rows)
+
+    def get_turn_snapshot(self, sim_id: int, columns: Sequence[str]) -> Tuple[Optional[int], Dict[str, np.ndarray]]:
+        """
+        Last logged turn and the requested columns of the live animals, read in one transaction so that the animals
+        are the ones of that turn when the writer commits whole turns (see apply_turn_changes)
+        :param sim_id:
+        :param columns: ANIMALS column names
+        :return: (last turn, one numpy array per column sorted by oid)
+        """
+        turns = SimulationTurn.__table__
+        with self.reader_engine.connect() as conn:
+            if conn.dialect.name == 'sqlite':
+                # pysqlite only opens a transaction before a write, without it both selects could see different
+                # commits
+                conn.exec_driver_sql('BEGIN')
+            last_turn = conn.execute(select(func.max(turns.c.turn)).where(turns.c.sim_id == sim_id)).scalar()
+            rows = conn.execute(self._projection(sim_id, columns, None, True)).fetchall()
+        return last_turn, rows_to_arrays(columns, rows)
+
+    def iter_animal_tuples(self, sim_id: int, columns: Sequence[str], animal_type: Optional[Animal] = None,
+                           live_only: bool = True, batch_size: int = 10000) -> Iterator[List[Tuple]]:
+        """
+        Stream animals in batches of named tuples through a server side cursor, memory only holds one batch
+        :param sim_id:
+        :param columns: ANIMALS column names
+        :param animal_type: restrict to an animal type if specified
+        :param live_only:
+        :param batch_size:
+        :return:
+        """
+        row_type = animal_row_type(tuple(columns))
+        with self.reader_engine.connect() as conn:
+            result = conn.execution_options(stream_results=True)\
+                .execute(self._projection(sim_id, columns, animal_type, live_only))
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [row_type(*r) for r in rows]
+
+    def iter_animals_by_spawn_turn(self, sim_id: int, columns: Sequence[str], from_spawn_turn: Optional[int] = None,
+                                   batch_size: int = 1 << 16) -> Iterator[Dict[str, np.ndarray]]:
+        """
+        Stream all animals, dead or alive, ordered by spawn turn then oid, as batches of column arrays through a
+        server side cursor
+        :param sim_id:
+        :param columns: ANIMALS column names, must include spawn_turn
+        :param from_spawn_turn: skip the animals spawned before this turn
+        :param batch_size:
+        :return:
+        """
+        animal_row_type(tuple(columns))
+        table = Animals.__table__
+        stmt = select(*[table.c[c] for c in columns]).where(table.c.sim_id == sim_id)
+        if from_spawn_turn is not None:
+            stmt = stmt.where(table.c.spawn_turn >= from_spawn_turn)
+        stmt = stmt.order_by(table.c.spawn_turn, table.c.oid)
+        with self.reader_engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(stmt)
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows_to_arrays(columns, rows)
+
+    def iter_turn_log(self, sim_id: int, from_turn: Optional[int] = None,
+                      batch_size: int = 1 << 16) -> Iterator[List[Tuple[int, int, int]]]:
+        """
+        Stream the population history in batches of (turn, nb_fish, nb_shark)
+        :param sim_id:
+        :param from_turn: first turn streamed, all turns if None
+        :param batch_size:
+        :return:
+        """
+        table = SimulationTurn.__table__
+        stmt = select(table.c.turn, table.c.nb_fish, table.c.nb_shark).where(table.c.sim_id == sim_id)
+        if from_turn is not None:
+            stmt = stmt.where(table.c.turn >= from_turn)
+        with self.reader_engine.connect() as conn:
+            result = conn.execution_options(stream_results=True).execute(stmt.order_by(table.c.turn))
+            while True:
+                rows = result.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield [tuple(r) for r in rows]
+
     def has_fish_in_square(self, sim_id: int, coordinates: List[SquareGridCoordinate]) -> List[SquareGridCoordinate]:
         """
         Return a list of coordinate where fish are present
@@ -229,13 +572,15 @@ class SimulationClient(SQLAlchemyQueries):
         :param coordinates:
         :return:
         """
-        fish_df = self.get_animals_by_type(sim_id=sim_id, animal_type=Animal.Fish)
-        has_fish = []
-        for coord in coordinates:
-            fta = fish_df[(fish_df.coord_x == coord.x) & (fish_df.coord_y == coord.y)]
-            if len(fta) > 0:
-                has_fish.append(SquareGridCoordinate(int(fta.iloc[0].coord_x), int(fta.iloc[0].coord_y)))
-        return has_fish
+        if len(coordinates) == 0:
+            return []
+        table = Animals.__table__
+        stmt = select(table.c.coord_x, table.c.coord_y).where(
+            table.c.sim_id == sim_id, table.c.alive, table.c.animal_type == Animal.Fish,
+            or_(*[and_(table.c.coord_x == c.x, table.c.coord_y == c.y) for c in coordinates]))
+        with self.reader_engine.connect() as conn:
+            fish = set(tuple(r) for r in conn.execute(stmt))
+        return [SquareGridCoordinate(int(c.x), int(c.y)) for c in coordinates if (c.x, c.y) in fish]
 
     def update_animals(self, sim_id: int, update_dict: Dict):
         """
@@ -296,22 +641,17 @@ class SimulationClient(SQLAlchemyQueries):
 
     def move_animal(self, sim_id: int, animal_id: int, new_position: SquareGridCoordinate):
         """
-
+        Move a live animal. The new square is not checked: SimulationGrid checks the whole grid at the end of the
+        turn, see fish_bowl.process.invariants
         :param sim_id:
         :param animal_id:
         :param new_position:
         :return:
         """
-        if self.coordinate_is_occupied(sim_id=sim_id, coordinate=new_position):
-            raise NonEmptyCoordinate('Cannot move, coordinate {} is occupied'.format(new_position))
-
+        table = Animals.__table__
         with self.session_scope() as s:
-            simulation = s.query(Simulation).filter(Simulation.sid == sim_id).one()
-            # Check coordinate match with the grid
-            square_grid_valid(grid_size=simulation.grid_size, coordinates=new_position)
-            a_ = s.query(Animals).filter(Animals.sim_id == sim_id, Animals.oid == animal_id).one()
-            if a_.alive:
-                a_.coord_x = new_position.x
-                a_.coord_y = new_position.y
-            else:
-                raise ImpossibleAction('Attempting to move a dead animal: {}'.format(a_))
+            moved = s.connection().execute(update(table)
+                                           .where(table.c.sim_id == sim_id, table.c.oid == animal_id, table.c.alive)
+                                           .values(coord_x=new_position.x, coord_y=new_position.y)).rowcount
+        if moved == 0:
+            raise ImpossibleAction('Attempting to move a dead or unknown animal: {}'.format(animal_id))
@@ -0,0 +1,237 @@
+"""
+Pipelined persistence: the engine plays turn N+1 while turn N is written to the database
+
+PipelinedSimulationClient plays simulations in memory (it is a StoreSimulationClient) and hands the database
+writes to a writer thread. Each time a turn is logged, the live animals are compared with the ones of the previous
+logged turn and the differences become an immutable TurnChanges:
+
+- spawned: animals that appeared, with all their columns
+- changed: animals whose position, breed or feeding columns changed
+- dead: animals that disappeared
+
+The writer thread applies the change sets in turn order, one transaction per turn (SimulationClient.
+apply_turn_changes), so readers of the database only ever see complete turns.
+
+- backpressure: at most max_pending_turns change sets wait in the queue, log_turn blocks beyond that
+- flush: flush() waits until every logged turn is written, close() flushes and is also called at interpreter exit
+- failures: the first write error stops the writes, the next log_turn, flush or close raises PersistenceError, which
+  SimulationGrid.play_turn lets through
+
+The database gives its own oids to the animals, they match the in-memory ones only when the simulation is alone in
+an empty database.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+from typing import Dict, Optional
+
+import numpy as np
+
+from fish_bowl.dataio.sharding import open_client
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.utils import Animal
+
+_logger = logging.getLogger(__name__)
+
+SNAPSHOT_COLUMNS = ('oid', 'animal_type', 'coord_x', 'coord_y', 'spawn_turn', 'breed_count', 'last_breed',
+                    'last_fed')
+# columns an animal can change during its life
+MUTABLE_COLUMNS = ('coord_x', 'coord_y', 'breed_count', 'last_breed', 'last_fed')
+
+TurnChanges = namedtuple('TurnChanges', ['sim_id', 'turn', 'population', 'spawned', 'changed', 'dead'])
+
+
+class PersistenceError(Exception):
+    # the writer thread failed to write a turn
+    pass
+
+
+def _frozen(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    for array in arrays.values():
+        array.flags.writeable = False
+    return arrays
+
+
+def diff_snapshots(previous: Dict[str, np.ndarray], current: Dict[str, np.ndarray]):
+    """
+    Differences between two snapshots of the live animals, both sorted by oid
+    :param previous:
+    :param current:
+    :return: spawned columns, changed columns (oid and MUTABLE_COLUMNS), dead oids
+    """
+    pos = np.searchsorted(previous['oid'], current['oid'])
+    known = pos < len(previous['oid'])
+    known[known] = previous['oid'][pos[known]] == current['oid'][known]
+    spawned = {c: current[c][~known] for c in SNAPSHOT_COLUMNS}
+    matched = pos[known]
+    differs = np.zeros(len(matched), dtype=bool)
+    for c in MUTABLE_COLUMNS:
+        differs |= current[c][known] != previous[c][matched]
+    changed = {c: current[c][known][differs] for c in ('oid',) + MUTABLE_COLUMNS}
+    dead = previous['oid'][~np.isin(previous['oid'], current['oid'], assume_unique=True)]
+    return spawned, changed, dead
+
+
+class PipelinedSimulationClient(StoreSimulationClient):
+    """
+    In-memory simulations written to a database by a background thread
+    """
+
+    def __init__(self, database_url: str, max_pending_turns: int = 4, profile: str = 'default'):
+        """
+        :param database_url: database receiving the simulations, see sharding.open_client
+        :param max_pending_turns: number of logged turns waiting to be written before log_turn blocks
+        :param profile: sqlite persistence profile of the database
+        """
+        super().__init__(release_dead=True)
+        self._sink = open_client(database_url, profile=profile)
+        self._queue = queue.Queue(maxsize=max_pending_turns)
+        self._snapshots = {}
+        # in-memory oid -> database oid, by simulation, maintained by the writer thread
+        self._database_oids = {}
+        self._error = None
+        self._closed = False
+        self._turns_written = 0
+        self._write_seconds = 0.
+        self._blocked_seconds = 0.
+        self._writer = threading.Thread(target=self._write_loop, name='fish_bowl-writer', daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    @property
+    def sink(self):
+        """
+        Client of the database the turns are written to
+        """
+        return self._sink
+
+    @property
+    def stats(self) -> Dict:
+        """
+        turns_written, pending turns, seconds spent writing and seconds log_turn was blocked by a full queue
+        """
+        return {'turns_written': self._turns_written, 'pending': self._queue.qsize(),
+                'write_seconds': self._write_seconds, 'blocked_seconds': self._blocked_seconds}
+
+    def _raise_if_failed(self):
+        if self._error is not None:
+            raise PersistenceError('Writing to the database failed: {}'.format(self._error)) from self._error
+
+    def init_simulation(self, **kwargs) -> int:
+        """
+        Create the simulation in the database, with the sid the database gives it, then in memory
+        """
+        self._raise_if_failed()
+        if self._closed:
+            raise PersistenceError('The client is closed')
+        sid = self._sink.init_simulation(**kwargs)
+        self._next_sid = sid
+        super().init_simulation(**kwargs)
+        self._snapshots[sid] = {c: np.zeros(0, dtype=np.int64) for c in SNAPSHOT_COLUMNS}
+        return sid
+
+    def clone_simulation(self, sim_id: int, **parameters) -> int:
+        """
+        Clone the simulation in the database, once every logged turn is written, then in memory
+        """
+        self.flush()
+        sid = self._sink.clone_simulation(sim_id, **parameters)
+        self._next_sid = sid
+        super().clone_simulation(sim_id, **parameters)
+        self._snapshots[sid] = self._snapshots[sim_id]
+        # the database copied the animals in oid order: the k-th oid of the parent became the k-th oid of the clone
+        parent = np.sort(self._sink.get_animal_arrays(sim_id, ('oid',), live_only=False)['oid'])
+        clone = np.sort(self._sink.get_animal_arrays(sid, ('oid',), live_only=False)['oid'])
+        database_oids = self._database_oids.get(sim_id, np.zeros(0, dtype=np.int64)).copy()
+        known = database_oids >= 0
+        database_oids[known] = clone[np.searchsorted(parent, database_oids[known])]
+        # the writer is idle after the flush
+        self._database_oids[sid] = database_oids
+        return sid
+
+    def record_summary(self, sim_id: int, end_reason: Optional[str] = None, runtime_seconds: Optional[float] = None):
+        """
+        Add the simulation to the catalog of the database once every logged turn is written
+        """
+        self.flush()
+        self._sink.record_summary(sim_id, end_reason=end_reason, runtime_seconds=runtime_seconds)
+
+    def get_simulation_summary(self, sim_id: int) -> Optional[Dict]:
+        return self._sink.get_simulation_summary(sim_id)
+
+    def log_turn(self, sim_id: int, turn: int, population: Dict[Animal, int]):
+        super().log_turn(sim_id=sim_id, turn=turn, population=population)
+        current = self.get_animal_arrays(sim_id, SNAPSHOT_COLUMNS)
+        order = np.argsort(current['oid'])
+        current = {c: v[order] for c, v in current.items()}
+        spawned, changed, dead = diff_snapshots(self._snapshots[sim_id], current)
+        self._snapshots[sim_id] = current
+        changes = TurnChanges(sim_id=sim_id, turn=turn, population=dict(population), spawned=_frozen(spawned),
+                              changed=_frozen(changed), dead=_frozen({'oid': dead})['oid'])
+        self._raise_if_failed()
+        start = time.time()
+        # blocks while max_pending_turns are waiting: the engine can't run away from the database
+        self._queue.put(changes)
+        self._blocked_seconds += time.time() - start
+
+    def _write(self, changes: TurnChanges):
+        sid = changes.sim_id
+        database_oids = self._database_oids.get(sid, np.zeros(0, dtype=np.int64))
+        changed = dict(changes.changed, oid=database_oids[changes.changed['oid']])
+        spawned = {c: v for c, v in changes.spawned.items() if c != 'oid'}
+        oids = self._sink.apply_turn_changes(sid, changes.turn, changes.population, spawned=spawned,
+                                             changed=changed, dead=database_oids[changes.dead])
+        if len(oids) != len(changes.spawned['oid']):
+            raise PersistenceError('Turn {} of simulation {}: {} animals spawned, {} written'.format(
+                changes.turn, sid, len(changes.spawned['oid']), len(oids)))
+        if len(oids) > 0:
+            size = int(changes.spawned['oid'].max()) + 1
+            if size > len(database_oids):
+                grown = np.full(max(size, 2 * len(database_oids)), -1, dtype=np.int64)
+                grown[:len(database_oids)] = database_oids
+                database_oids = grown
+            database_oids[changes.spawned['oid']] = oids
+        self._database_oids[sid] = database_oids
+
+    def _write_loop(self):
+        while True:
+            changes = self._queue.get()
+            try:
+                if changes is None:
+                    return
+                # after a failure the queue is still drained, so that log_turn never blocks forever
+                if self._error is None:
+                    start = time.time()
+                    self._write(changes)
+                    self._write_seconds += time.time() - start
+                    self._turns_written += 1
+            except Exception as err:
+                _logger.exception('Writing turn {} of simulation {} failed'.format(changes.turn, changes.sim_id))
+                self._error = err
+            finally:
+                self._queue.task_done()
+
+    def flush(self, sim_id: Optional[int] = None):
+        """
+        Wait until every logged turn is written
+        :param sim_id: ignored, turns are written in order whatever their simulation
+        :return:
+        """
+        self._queue.join()
+        self._raise_if_failed()
+
+    def close(self):
+        """
+        Write the pending turns, stop the writer thread and close the database client
+        """
+        if self._closed:
+            return
+        self._closed = True
+        atexit.unregister(self.close)
+        self._queue.put(None)
+        self._writer.join()
+        self._sink.close()
+        self._raise_if_failed()
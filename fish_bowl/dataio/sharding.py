@@ -0,0 +1,341 @@
+"""
+Per-simulation database sharding
+
+ShardedSimulationClient gives every simulation its own sqlite file, so that simulations played in parallel never
+wait on each other's write lock. A small catalog database allocates the simulation ids and maps them to their
+shard:
+
+    <directory>/catalog.db                  SHARDS: sid -> shard file name, SIMULATION_SUMMARY of finished runs
+    <directory>/simulation_<sid>.db         SIMULATIONS, ANIMALS and TURNS of that simulation only
+
+Every operation takes a sim_id and is routed to the SimulationClient of its shard. Shard clients are opened on
+first use and the least recently used ones are closed beyond max_open_shards, once no caller holds them. Sids are
+never reused, even the one of a simulation whose creation failed.
+
+clone_simulation copies the shard file of the parent with the sqlite backup API, then moves its rows to the sid
+allocated for the clone. Animals keep their oids, which are only unique within a shard.
+
+open_client picks the sharded client for database urls of the form sharded:///<directory>, so the job scheduler
+and the Flask app only need a different DATABASE_URL.
+"""
+import datetime as dt
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import Column, DateTime, Integer, String, delete, insert, select, update
+from sqlalchemy.orm import declarative_base
+
+from fish_bowl.dataio.backends import StorageBackend, check_clone_parameters
+from fish_bowl.dataio.catalog import SummaryColumns, get_summary, list_summaries, summary_indexes
+from fish_bowl.dataio.database import SQLAlchemyQueries
+from fish_bowl.dataio.persistence import Animals, Simulation, SimulationClient, SimulationSummary, SimulationTurn
+
+_logger = logging.getLogger(__name__)
+
+SHARDED_SCHEME = 'sharded://'
+CATALOG_FILE = 'catalog.db'
+
+CatalogBase = declarative_base()
+
+
+class Shard(CatalogBase):
+    __tablename__ = 'SHARDS'
+    # sids of deleted rows are not handed out again
+    __table_args__ = {'sqlite_autoincrement': True}
+    sid = Column(Integer, primary_key=True, autoincrement=True)
+    timestamp = Column(DateTime)
+    path = Column(String)
+
+
+class CatalogSummary(SummaryColumns, CatalogBase):
+    __table_args__ = summary_indexes()
+
+
+def sharded_url(directory: str) -> str:
+    return '{}{}'.format(SHARDED_SCHEME, os.path.abspath(directory))
+
+
+def open_client(database_url: str, profile: str = 'default', read_pool_size: int = 0) -> StorageBackend:
+    """
+    SQL client of a database url, sharded if the url is sharded:///<directory>
+    :param database_url:
+    :param profile: sqlite persistence profile
+    :param read_pool_size: see SimulationClient
+    :return:
+    """
+    if database_url.startswith(SHARDED_SCHEME):
+        return ShardedSimulationClient(database_url[len(SHARDED_SCHEME):], profile=profile,
+                                       read_pool_size=read_pool_size)
+    return SimulationClient(database_url, profile=profile, read_pool_size=read_pool_size)
+
+
+def _routed(name: str):
+    """
+    Method forwarding the call to the shard of its sim_id
+    """
+    def method(self, sim_id: int, *args, **kwargs):
+        with self.shard(sim_id) as client:
+            return getattr(client, name)(sim_id, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = 'SimulationClient.{} on the shard of sim_id'.format(name)
+    return method
+
+
+def _routed_iterator(name: str):
+    """
+    Generator method forwarding the call to the shard of its sim_id, the shard is held until the iteration ends
+    """
+    def method(self, sim_id: int, *args, **kwargs):
+        with self.shard(sim_id) as client:
+            yield from getattr(client, name)(sim_id, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = 'SimulationClient.{} on the shard of sim_id'.format(name)
+    return method
+
+
+class ShardedSimulationClient(StorageBackend):
+
+    def __init__(self, directory: str, profile: str = 'default', read_pool_size: int = 0, max_open_shards: int = 64):
+        """
+        :param directory: folder of the catalog and shard files, created if needed
+        :param profile: sqlite persistence profile of the shards
+        :param read_pool_size: read only connections per shard, see SimulationClient
+        :param max_open_shards: number of shard clients kept open, more stay open while callers hold them
+        """
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._profile = profile
+        self._read_pool_size = read_pool_size
+        self._max_open_shards = max_open_shards
+        self._catalog = SQLAlchemyQueries('sqlite:///{}'.format(os.path.join(directory, CATALOG_FILE)),
+                                          declarative_base=CatalogBase, expire_on_commit=False, profile=profile)
+        # sid -> [client, number of callers holding it], least recently used first
+        self._shards = OrderedDict()
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        return self._directory
+
+    def _shard_path(self, sim_id: int) -> Optional[str]:
+        path = self._paths.get(sim_id)
+        if path is None:
+            with self._catalog.read_scope() as s:
+                path = s.execute(select(Shard.path).where(Shard.sid == sim_id)).scalar()
+            if path is None:
+                return None
+            self._paths[sim_id] = path
+        return os.path.join(self._directory, path)
+
+    @contextmanager
+    def shard(self, sim_id: int) -> Iterator[SimulationClient]:
+        """
+        Client of the shard of a simulation, not closed by the eviction of the least recently used shards while the
+        with block holds it
+        :param sim_id:
+        :return:
+        """
+        with self._lock:
+            entry = self._shards.pop(sim_id, None)
+            if entry is None:
+                path = self._shard_path(sim_id)
+                if path is None:
+                    raise KeyError('Unknown simulation {}'.format(sim_id))
+                entry = [SimulationClient('sqlite:///{}'.format(path), profile=self._profile,
+                                          read_pool_size=self._read_pool_size), 0]
+            entry[1] += 1
+            self._shards[sim_id] = entry
+            self._evict()
+        try:
+            yield entry[0]
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                self._evict()
+
+    def _evict(self):
+        """
+        Close the least recently used shard clients beyond max_open_shards that no caller holds, with the lock held
+        """
+        idle = [sid for sid, (_, users) in self._shards.items() if users == 0]
+        for sid in idle[:max(0, len(self._shards) - self._max_open_shards)]:
+            self._shards.pop(sid)[0].close()
+
+    def _allocate_sid(self) -> int:
+        """
+        New sid in the catalog, with the name of its shard file
+        """
+        with self._catalog.session_scope() as s:
+            shard = Shard(timestamp=dt.datetime.now())
+            s.add(shard)
+            s.flush()
+            sid = shard.sid
+            shard.path = 'simulation_{}.db'.format(sid)
+        return sid
+
+    def _release_sid(self, sim_id: int):
+        """
+        Forget a sid whose shard could not be created
+        """
+        with self._lock:
+            entry = self._shards.pop(sim_id, None)
+        if entry is not None:
+            entry[0].close()
+        path = self._shard_path(sim_id)
+        with self._catalog.session_scope() as s:
+            s.query(Shard).filter(Shard.sid == sim_id).delete()
+        self._paths.pop(sim_id, None)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def init_simulation(self, **kwargs) -> int:
+        """
+        Allocate a sid in the catalog and create the shard of the simulation, see SimulationClient.init_simulation
+        """
+        sid = self._allocate_sid()
+        try:
+            with self.shard(sid) as client:
+                client.init_simulation(sid=sid, **kwargs)
+        except Exception:
+            self._release_sid(sid)
+            raise
+        _logger.debug('Simulation {} created in shard {}'.format(sid, self._shard_path(sid)))
+        return sid
+
+    def clone_simulation(self, sim_id: int, **parameters) -> int:
+        """
+        Copy the shard of a simulation, its animals (dead ones included) and its turn log to a new sid. Animals keep
+        their oids
+        :param sim_id:
+        :param parameters: new values of some CLONE_PARAMETERS
+        :return: sid of the clone
+        """
+        check_clone_parameters(parameters)
+        source_path = self._shard_path(sim_id)
+        if source_path is None:
+            raise ValueError("Simulation {} doesn't exist!".format(sim_id))
+        sid = self._allocate_sid()
+        try:
+            # consistent copy of the parent, even while its shard is opened in WAL mode
+            source, target = sqlite3.connect(source_path), sqlite3.connect(self._shard_path(sid))
+            try:
+                source.backup(target)
+            finally:
+                source.close()
+                target.close()
+            simulations = Simulation.__table__
+            with self.shard(sid) as client, client.session_scope() as s:
+                conn = s.connection()
+                values = dict(conn.execute(select(simulations).where(simulations.c.sid == sim_id)).mappings().one())
+                values.update(parameters, sid=sid, timestamp=dt.datetime.now())
+                conn.execute(insert(simulations).values(**values))
+                for table in (Animals.__table__, SimulationTurn.__table__):
+                    conn.execute(update(table).where(table.c.sim_id == sim_id).values(sim_id=sid))
+                conn.execute(delete(SimulationSummary.__table__))
+                conn.execute(delete(simulations).where(simulations.c.sid == sim_id))
+        except Exception:
+            self._release_sid(sid)
+            raise
+        _logger.debug('Simulation {} cloned into shard {}'.format(sim_id, self._shard_path(sid)))
+        return sid
+
+    def get_simulation_ids(self) -> List[int]:
+        with self._catalog.read_scope() as s:
+            return [r[0] for r in s.execute(select(Shard.sid).where(Shard.path.isnot(None)).order_by(Shard.sid))]
+
+    def get_all_simulations(self):
+        """
+        Retrieve all simulations in a panda DataFrame
+        """
+        import pandas as pd
+        frames = []
+        for sid in self.get_simulation_ids():
+            with self.shard(sid) as client:
+                frames.append(client.get_all_simulations())
+        return pd.concat(frames, ignore_index=True)
+
+    def get_last_turn(self, sim_id: int) -> Optional[int]:
+        """
+        Last completed turn of a simulation, None if no turn was recorded or the simulation doesn't exist
+        """
+        if self._shard_path(sim_id) is None:
+            return None
+        with self.shard(sim_id) as client:
+            return client.get_last_turn(sim_id)
+
+    def record_summary(self, sim_id: int, end_reason: Optional[str] = None, runtime_seconds: Optional[float] = None):
+        """
+        Write the summary of a simulation computed by its shard to the catalog
+        """
+        with self.shard(sim_id) as client:
+            values = client.summarise(sim_id, end_reason=end_reason, runtime_seconds=runtime_seconds)
+        with self._catalog.session_scope() as s:
+            s.merge(CatalogSummary(sid=sim_id, **values))
+
+    def backfill_summaries(self) -> int:
+        """
+        Record the summary of the simulations without catalog row, see SimulationClient.backfill_summaries
+        """
+        with self._catalog.read_scope() as s:
+            missing = [r[0] for r in s.execute(select(Shard.sid).where(
+                Shard.path.isnot(None), ~Shard.sid.in_(select(CatalogSummary.sid))).order_by(Shard.sid))]
+        recorded = 0
+        for sim_id in missing:
+            if self.get_last_turn(sim_id) is not None:
+                self.record_summary(sim_id)
+                recorded += 1
+        return recorded
+
+    def get_simulation_summary(self, sim_id: int) -> Optional[Dict]:
+        """
+        Catalog row of a simulation, None while it is running
+        """
+        return get_summary(self._catalog, CatalogSummary.__table__, sim_id)
+
+    def list_simulation_summaries(self, filters: Optional[Dict] = None, after: Optional[int] = None,
+                                  limit: int = 50, descending: bool = False) -> List[Dict]:
+        """
+        Page of the catalog, see catalog.list_summaries
+        """
+        return list_summaries(self._catalog, CatalogSummary.__table__, filters=filters, after=after, limit=limit,
+                              descending=descending)
+
+    get_simulation = _routed('get_simulation')
+    init_animal = _routed('init_animal')
+    coordinate_is_occupied = _routed('coordinate_is_occupied')
+    has_fish_in_square = _routed('has_fish_in_square')
+    eat_animal_in_square = _routed('eat_animal_in_square')
+    move_animal = _routed('move_animal')
+    kill_animal = _routed('kill_animal')
+    update_animals = _routed('update_animals')
+    get_animal = _routed('get_animal')
+    get_animal_in_position = _routed('get_animal_in_position')
+    get_animals_by_type = _routed('get_animals_by_type')
+    get_animals_df = _routed('get_animals_df')
+    get_animal_tuples = _routed('get_animal_tuples')
+    get_animal_arrays = _routed('get_animal_arrays')
+    iter_animal_tuples = _routed_iterator('iter_animal_tuples')
+    iter_animals_by_spawn_turn = _routed_iterator('iter_animals_by_spawn_turn')
+    count_animals = _routed('count_animals')
+    log_turn = _routed('log_turn')
+    apply_turn_changes = _routed('apply_turn_changes')
+    get_turn_log = _routed('get_turn_log')
+    get_turn_snapshot = _routed('get_turn_snapshot')
+    summarise = _routed('summarise')
+    iter_turn_log = _routed_iterator('iter_turn_log')
+
+    def close(self):
+        """
+        Close the shard clients and the catalog connections
+        """
+        with self._lock:
+            for client, _ in self._shards.values():
+                client.close()
+            self._shards.clear()
+        self._catalog.reader_engine.dispose()
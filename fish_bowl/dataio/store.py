@@ -0,0 +1,679 @@
+"""
+Compact in-memory storage of animals
+
+AnimalStore keeps the ANIMALS table columns as narrow numpy arrays (structure of arrays) instead of pandas rows or
+ORM objects. Slots of released animals are recycled through a free list threaded through their oid column, and oids
+map to slots in O(1): an array indexed by oid covers a window of the most recent oids, and the few stored animals
+older than the window (long lived fish) are kept in a dictionary. The window start is chosen to minimise the memory
+of the two, so the index follows the number of stored animals, not the number of oids ever spawned.
+StoreSimulationClient exposes the SimulationClient methods used by SimulationGrid on top of it, so a simulation can
+be played without any database.
+"""
+import datetime as dt
+import functools
+import logging
+import sys
+from collections import namedtuple
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fish_bowl.dataio.backends import StorageBackend, check_clone_parameters
+from fish_bowl.dataio.occupancy import Occupancy, create_occupancy
+from fish_bowl.process.utils import Animal, ImpossibleAction
+from fish_bowl.process.topology import SquareGridCoordinate, square_grid_valid, NonEmptyCoordinate
+
+_logger = logging.getLogger(__name__)
+
+ANIMAL_COLUMNS = ('oid', 'sim_id', 'animal_type', 'spawn_turn', 'breed_count', 'last_breed', 'last_fed', 'alive',
+                  'coord_x', 'coord_y')
+UPDATABLE_COLUMNS = ('breed_count', 'last_breed', 'last_fed')
+SIMULATION_COLUMNS = ('sid', 'timestamp', 'grid_size', 'init_nb_fish', 'fish_breed_maturity',
+                      'fish_breed_probability', 'fish_speed', 'init_nb_shark', 'shark_breed_maturity',
+                      'shark_breed_probability', 'shark_speed', 'shark_starving')
+# dtypes of the arrays returned by projection queries, animal_type is returned as the Animal value
+ARRAY_DTYPES = {
+    'oid': np.int64,
+    'sim_id': np.int64,
+    'animal_type': np.uint8,
+    'spawn_turn': np.int32,
+    'breed_count': np.int32,
+    'last_breed': np.int32,
+    'last_fed': np.int32,
+    'alive': bool,
+    'coord_x': np.int32,
+    'coord_y': np.int32,
+}
+_ANIMAL_BY_VALUE = {a.value: a for a in Animal}
+
+AnimalRecord = namedtuple('AnimalRecord', ANIMAL_COLUMNS)
+SimulationRecord = namedtuple('SimulationRecord', SIMULATION_COLUMNS)
+
+
+@functools.lru_cache(maxsize=None)
+def animal_row_type(columns: Tuple[str, ...]):
+    """
+    Named tuple type of a projection of the ANIMALS columns
+    """
+    unknown = [c for c in columns if c not in ANIMAL_COLUMNS]
+    if unknown:
+        raise ValueError('Unknown animal columns: {}'.format(unknown))
+    return namedtuple('AnimalRow', columns)
+
+
+def rows_to_arrays(columns: Sequence[str], rows: Sequence[Tuple]) -> Dict[str, np.ndarray]:
+    """
+    Convert projection rows to one numpy array per column
+    """
+    arrays = {}
+    for i, name in enumerate(columns):
+        values = [r[i] for r in rows]
+        if name == 'animal_type':
+            values = [v.value for v in values]
+        arrays[name] = np.array(values, dtype=ARRAY_DTYPES[name])
+    return arrays
+
+
+class AnimalStore:
+    """
+    Structure of arrays storage of animals: uint8 type, int16 (or int32 for big grids) coordinates, int32 turn fields,
+    uint16 breed count and a bool alive mask. Bytes per animal, the oid index included, are reported by
+    bytes_per_animal.
+    """
+    _TURN_DTYPE = np.int32
+    # smallest oid window of the index
+    _MIN_WINDOW = 64
+    # approximate memory of an oid outside of the window: dictionary entry and two int objects
+    _OLD_SLOT_BYTES = 100
+
+    def __init__(self, grid_size: int = 0, capacity: int = 64):
+        self._coord_dtype = np.int16 if grid_size < np.iinfo(np.int16).max else np.int32
+        self._size = 0
+        self._capacity = 0
+        self._nb_live = 0
+        self._nb_stored = 0
+        self._next_oid = 1
+        # released slots store -2 - <next free slot> as oid, -1 ends the list
+        self._free_head = -1
+        # oid -> slot: _slot_of[oid - _oid_base] in the window, _old_slots below it
+        self._oid_base = 1
+        self._slot_of = np.full(0, -1, dtype=np.int32)
+        self._old_slots = {}
+        self._arrays = {}
+        self._grow(max(capacity, 1))
+
+    # ---------------------------------------------------------------- storage management
+    def _grow(self, capacity: int):
+        dtypes = {
+            'oid': np.int32,
+            'animal_type': np.uint8,
+            'coord_x': self._coord_dtype,
+            'coord_y': self._coord_dtype,
+            'spawn_turn': self._TURN_DTYPE,
+            'last_breed': self._TURN_DTYPE,
+            'last_fed': self._TURN_DTYPE,
+            'breed_count': np.uint16,
+            'alive': bool,
+        }
+        for name, dtype in dtypes.items():
+            new = np.zeros(capacity, dtype=dtype)
+            if name in self._arrays:
+                new[:self._capacity] = self._arrays[name]
+            self._arrays[name] = new
+        self._capacity = capacity
+        for name, array in self._arrays.items():
+            setattr(self, '_' + name, array)
+
+    def _lookup(self, oid: int) -> int:
+        """
+        Slot of an oid, -1 if it is not stored
+        """
+        i = oid - self._oid_base
+        if 0 <= i < len(self._slot_of):
+            return int(self._slot_of[i])
+        return self._old_slots.get(oid, -1)
+
+    def _index(self, oid: int, slot: int):
+        """
+        Point an oid to a slot, or forget it if slot is -1. oid must be below the end of the window
+        """
+        if oid >= self._oid_base:
+            self._slot_of[oid - self._oid_base] = slot
+        elif slot >= 0:
+            self._old_slots[oid] = slot
+        else:
+            self._old_slots.pop(oid, None)
+
+    def _ensure_oid(self, oid: int):
+        if oid - self._oid_base >= len(self._slot_of):
+            self._reindex(oid + 1)
+
+    def _reindex(self, end: int):
+        """
+        Rebuild the oid index for oids up to end (excluded): the window starts at the stored oid minimising the memory
+        of the window and of the oids left below it, with some room for the next oids
+        """
+        slots = self.slots(live_only=False)
+        oids = self._oid[slots].astype(np.int64)
+        # window starting at the k-th newest stored oid: 1.5 * (end - oid) int32 entries, the n - k older oids in
+        # the dictionary
+        newest = oids[::-1]
+        cost = 6 * (end - newest) + self._OLD_SLOT_BYTES * np.arange(len(newest) - 1, -1, -1)
+        base = int(newest[np.argmin(cost)]) if len(newest) else end - 1
+        span = end - base
+        self._oid_base = base
+        self._slot_of = np.full(span + max(span // 2, self._MIN_WINDOW), -1, dtype=np.int32)
+        window = oids >= base
+        self._slot_of[oids[window] - base] = slots[window]
+        self._old_slots = dict(zip(oids[~window].tolist(), slots[~window].tolist()))
+
+    def _allocate_slot(self) -> int:
+        if self._free_head >= 0:
+            slot = self._free_head
+            self._free_head = -2 - int(self._oid[slot])
+            return slot
+        if self._size == self._capacity:
+            self._grow(2 * self._capacity)
+        self._size += 1
+        return self._size - 1
+
+    def compact(self, capacity: Optional[int] = None):
+        """
+        Move the animals to the first slots and release the spare capacity and the unused part of the oid index,
+        after the population dropped
+        :param capacity: new capacity, by default twice the number of stored animals
+        """
+        used = self.slots(live_only=False)
+        capacity = max(capacity or 2 * len(used), len(used), 1)
+        arrays = {name: array[used] for name, array in self._arrays.items()}
+        self._arrays = {}
+        self._capacity = 0
+        self._free_head = -1
+        self._grow(capacity)
+        for name, array in arrays.items():
+            self._arrays[name][:len(used)] = array
+        self._size = len(used)
+        self._reindex(self._next_oid)
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    def _index_nbytes(self) -> int:
+        old = self._old_slots
+        return self._slot_of.nbytes + sys.getsizeof(old) + sum(sys.getsizeof(k) + sys.getsizeof(v)
+                                                               for k, v in old.items())
+
+    @property
+    def nbytes(self) -> int:
+        """
+        Memory used by the arrays (including free capacity) and the oid index
+        """
+        return sum(a.nbytes for a in self._arrays.values()) + self._index_nbytes()
+
+    @property
+    def bytes_per_animal(self) -> float:
+        """
+        Bytes needed to store one animal: one slot in every column and its share of the oid index. Spare capacity
+        is not counted, see nbytes
+        """
+        return sum(a.itemsize for a in self._arrays.values()) + self._index_nbytes() / max(self._nb_stored, 1)
+
+    @property
+    def next_oid(self) -> int:
+        return self._next_oid
+
+    def __len__(self):
+        """
+        Number of live animals
+        """
+        return self._nb_live
+
+    def __contains__(self, oid: int) -> bool:
+        return self._lookup(oid) >= 0
+
+    def slot(self, oid: int) -> int:
+        """
+        O(1) oid to slot lookup
+        """
+        slot = self._lookup(oid)
+        if slot < 0:
+            raise KeyError('No animal with oid {}'.format(oid))
+        return slot
+
+    # ---------------------------------------------------------------- animal operations
+    def add(self, animal_type: Animal, x: int, y: int, spawn_turn: int, last_breed: int = 0, last_fed: int = 0,
+            breed_count: int = 0, alive: bool = True, oid: Optional[int] = None) -> int:
+        """
+        Store a new animal, reusing a released slot if any
+        :return: animal oid
+        """
+        if oid is None:
+            oid = self._next_oid
+        elif oid in self:
+            raise ValueError('Animal {} already exists'.format(oid))
+        self._next_oid = max(self._next_oid, oid + 1)
+        self._ensure_oid(oid)
+        slot = self._allocate_slot()
+        self._oid[slot] = oid
+        self._animal_type[slot] = animal_type.value
+        self._coord_x[slot] = x
+        self._coord_y[slot] = y
+        self._spawn_turn[slot] = spawn_turn
+        self._last_breed[slot] = last_breed
+        self._last_fed[slot] = last_fed
+        self._breed_count[slot] = breed_count
+        self._alive[slot] = alive
+        self._index(oid, slot)
+        self._nb_live += int(alive)
+        self._nb_stored += 1
+        return oid
+
+    def kill(self, oid: int):
+        """
+        Mark an animal dead, its record is kept until released
+        """
+        slot = self.slot(oid)
+        if self._alive[slot]:
+            self._alive[slot] = False
+            self._nb_live -= 1
+
+    def release(self, oid: int):
+        """
+        Forget an animal, its slot goes to the free list
+        """
+        slot = self.slot(oid)
+        if self._alive[slot]:
+            self._nb_live -= 1
+        self._alive[slot] = False
+        self._animal_type[slot] = 0
+        self._index(oid, -1)
+        self._oid[slot] = -2 - self._free_head
+        self._free_head = slot
+        self._nb_stored -= 1
+
+    def move(self, oid: int, x: int, y: int):
+        slot = self.slot(oid)
+        self._coord_x[slot] = x
+        self._coord_y[slot] = y
+
+    def update(self, oid: int, **values):
+        """
+        Update breed_count, last_breed or last_fed of an animal
+        """
+        slot = self.slot(oid)
+        for k, v in values.items():
+            if k not in UPDATABLE_COLUMNS:
+                raise ValueError('Cannot update {} property with this method'.format(k))
+            self._arrays[k][slot] = v
+
+    def is_alive(self, oid: int) -> bool:
+        return bool(self._alive[self.slot(oid)])
+
+    def animal_type(self, oid: int) -> Animal:
+        return _ANIMAL_BY_VALUE[int(self._animal_type[self.slot(oid)])]
+
+    def position(self, oid: int) -> Tuple[int, int]:
+        slot = self.slot(oid)
+        return int(self._coord_x[slot]), int(self._coord_y[slot])
+
+    def record(self, oid: int, sim_id: Optional[int] = None) -> AnimalRecord:
+        slot = self.slot(oid)
+        return AnimalRecord(oid=oid, sim_id=sim_id, animal_type=_ANIMAL_BY_VALUE[int(self._animal_type[slot])],
+                            spawn_turn=int(self._spawn_turn[slot]), breed_count=int(self._breed_count[slot]),
+                            last_breed=int(self._last_breed[slot]), last_fed=int(self._last_fed[slot]),
+                            alive=bool(self._alive[slot]), coord_x=int(self._coord_x[slot]),
+                            coord_y=int(self._coord_y[slot]))
+
+    # ---------------------------------------------------------------- bulk access
+    def slots(self, animal_type: Optional[Animal] = None, live_only: bool = True) -> np.ndarray:
+        """
+        Used slots sorted by oid, optionally restricted to live animals of a type
+        """
+        oid = self._oid[:self._size]
+        # released slots hold negative oids
+        used = oid >= 0
+        if live_only:
+            used &= self._alive[:self._size]
+        if animal_type is not None:
+            used &= self._animal_type[:self._size] == animal_type.value
+        slots = np.flatnonzero(used)
+        return slots[np.argsort(oid[slots], kind='stable')]
+
+    def columns(self, names: Sequence[str], animal_type: Optional[Animal] = None,
+                live_only: bool = True) -> Dict[str, np.ndarray]:
+        """
+        Copy of some columns for the selected animals, sorted by oid
+        """
+        slots = self.slots(animal_type=animal_type, live_only=live_only)
+        return {name: self._arrays[name][slots] for name in names}
+
+    def records(self, sim_id: Optional[int] = None, animal_type: Optional[Animal] = None,
+                live_only: bool = True) -> List[AnimalRecord]:
+        return [self.record(int(oid), sim_id=sim_id)
+                for oid in self._oid[self.slots(animal_type=animal_type, live_only=live_only)]]
+
+    def copy(self) -> 'AnimalStore':
+        clone = AnimalStore.__new__(AnimalStore)
+        clone.__dict__.update(self.__dict__)
+        clone._arrays = {k: v.copy() for k, v in self._arrays.items()}
+        for name, array in clone._arrays.items():
+            setattr(clone, '_' + name, array)
+        clone._slot_of = self._slot_of.copy()
+        clone._old_slots = dict(self._old_slots)
+        return clone
+
+    # ---------------------------------------------------------------- ANIMALS table round trip
+    @classmethod
+    def from_animals(cls, animals: Iterable, grid_size: int = 0) -> 'AnimalStore':
+        """
+        Build a store from Animals rows (or any object with the ANIMALS columns as attributes)
+        """
+        store = cls(grid_size=grid_size)
+        for a in animals:
+            store.add(animal_type=a.animal_type, x=a.coord_x, y=a.coord_y, spawn_turn=a.spawn_turn,
+                      last_breed=a.last_breed, last_fed=a.last_fed, breed_count=a.breed_count, alive=a.alive,
+                      oid=a.oid)
+        return store
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, np.ndarray], grid_size: int = 0,
+                     next_oid: Optional[int] = None) -> 'AnimalStore':
+        """
+        Build a store from one array per column (all the columns of the store, animal_type as Animal values)
+        :param columns:
+        :param grid_size:
+        :param next_oid: oid of the next animal, after the biggest stored oid by default
+        :return:
+        """
+        size = len(columns['oid'])
+        store = cls(grid_size=grid_size, capacity=max(2 * size, 64))
+        for name, array in store._arrays.items():
+            array[:size] = columns[name]
+        store._size = size
+        store._nb_stored = size
+        store._nb_live = int(np.count_nonzero(columns['alive']))
+        max_oid = int(columns['oid'].max()) if size else 0
+        store._next_oid = max(next_oid or 0, max_oid + 1)
+        store._reindex(store._next_oid)
+        return store
+
+    def to_animals(self, sim_id: int, live_only: bool = False) -> List:
+        """
+        Convert stored animals to Animals rows of a simulation, oids are kept
+        """
+        from fish_bowl.dataio.persistence import Animals
+        return [Animals(**r._asdict()) for r in self.records(sim_id=sim_id, live_only=live_only)]
+
+    @classmethod
+    def load(cls, client, sim_id: int, live_only: bool = False) -> 'AnimalStore':
+        """
+        Load the animals of a simulation from a SimulationClient database
+        """
+        from fish_bowl.dataio.persistence import Animals
+        grid_size = client.get_simulation(sim_id).grid_size
+        with client.session_scope() as s:
+            q = s.query(Animals).filter(Animals.sim_id == sim_id)
+            if live_only:
+                q = q.filter(Animals.alive)
+            return cls.from_animals(q.order_by(Animals.oid).all(), grid_size=grid_size)
+
+    def save(self, client, sim_id: int):
+        """
+        Replace the animals of a simulation in a SimulationClient database with the stored ones
+        """
+        from fish_bowl.dataio.persistence import Animals
+        with client.session_scope() as s:
+            s.query(Animals).filter(Animals.sim_id == sim_id).delete()
+            s.add_all(self.to_animals(sim_id))
+
+
+class StoreSimulationClient(StorageBackend):
+    """
+    In-memory persistence with the SimulationClient interface, backed by one AnimalStore per simulation and a
+    square -> oid occupancy, adaptive by default: a coordinate hash while the grid is nearly empty, a dense array
+    once it fills up. The animal store is compacted whenever most of its capacity is unused.
+    """
+
+    def __init__(self, release_dead: bool = True, occupancy: str = 'adaptive', **occupancy_options):
+        """
+        :param release_dead: if True, dead animals are forgotten and their slots reused, as in-memory simulations
+        never read them back. Set to False to keep them as the database does
+        :param occupancy: dense, sparse or adaptive, see fish_bowl.dataio.occupancy
+        :param occupancy_options: dense_above and sparse_below thresholds of the adaptive occupancy
+        """
+        self._release_dead = release_dead
+        self._occupancy_mode = occupancy
+        self._occupancy_options = occupancy_options
+        self._simulations = {}
+        self._stores = {}
+        self._occupancy = {}
+        self._turns = {}
+        self._next_sid = 1
+
+    def _get(self, sim_id: int) -> Tuple[SimulationRecord, AnimalStore, Occupancy]:
+        try:
+            return self._simulations[sim_id], self._stores[sim_id], self._occupancy[sim_id]
+        except KeyError:
+            _logger.debug("Simulation {} doesn't exist!".format(sim_id))
+            raise ValueError("Simulation {} doesn't exist!".format(sim_id))
+
+    def init_simulation(self, grid_size, init_nb_fish, init_nb_shark, fish_breed_maturity, fish_breed_probability,
+                        fish_speed, shark_breed_maturity, shark_breed_probability, shark_speed,
+                        shark_starving):
+        """
+        Initialize a simulation and return the sid, same checks as SimulationClient.init_simulation
+        """
+        if grid_size ** 2 < (init_nb_fish + init_nb_shark):
+            raise ValueError('initial number of animals bigger than grid size....')
+        assert fish_breed_maturity > 0, "fish_breed_maturity must be positive"
+        assert fish_speed > 0, "fish_speed must be positive"
+        assert shark_breed_maturity > 0, "shark_breed_maturity must be positive"
+        assert shark_speed > 0, "shark_speed must be positive"
+        assert shark_starving > 0, "shark_starving must be positive"
+        for key, value in (('fish_breed_probability', fish_breed_probability),
+                           ('shark_breed_probability', shark_breed_probability)):
+            if value < 0 or value > 100:
+                raise ValueError('{} must be between 0 and 100, not {}'.format(key, value))
+        sid = self._next_sid
+        self._next_sid += 1
+        self._simulations[sid] = SimulationRecord(
+            sid=sid, timestamp=dt.datetime.now(), grid_size=grid_size, init_nb_fish=init_nb_fish,
+            fish_breed_maturity=fish_breed_maturity, fish_breed_probability=fish_breed_probability,
+            fish_speed=fish_speed, init_nb_shark=init_nb_shark, shark_breed_maturity=shark_breed_maturity,
+            shark_breed_probability=shark_breed_probability, shark_speed=shark_speed, shark_starving=shark_starving)
+        self._stores[sid] = AnimalStore(grid_size=grid_size)
+        self._occupancy[sid] = create_occupancy(self._occupancy_mode, grid_size, **self._occupancy_options)
+        self._turns[sid] = []
+        return sid
+
+    def get_simulation(self, sim_id: int) -> SimulationRecord:
+        return self._get(sim_id)[0]
+
+    def clone_simulation(self, sim_id: int, **parameters) -> int:
+        """
+        Copy a simulation to a new sid, see StorageBackend.clone_simulation. The animal columns are copied once: every
+        turn rewrites most of them, sharing them until the first write would not save anything
+        """
+        check_clone_parameters(parameters)
+        simulation, store, _ = self._get(sim_id)
+        sid = self._next_sid
+        self._next_sid += 1
+        self._simulations[sid] = simulation._replace(sid=sid, timestamp=dt.datetime.now(), **parameters)
+        clone = store.copy()
+        self._stores[sid] = clone
+        occupancy = create_occupancy(self._occupancy_mode, simulation.grid_size, **self._occupancy_options)
+        live = clone.columns(('coord_x', 'coord_y', 'oid'))
+        occupancy.fill(live['coord_x'], live['coord_y'], live['oid'])
+        self._occupancy[sid] = occupancy
+        self._turns[sid] = list(self._turns[sim_id])
+        return sid
+
+    def get_all_simulations(self):
+        """
+        Retrieve all simulations in a panda DataFrame
+        """
+        import pandas as pd
+        return pd.DataFrame(list(self._simulations.values()), columns=SIMULATION_COLUMNS)
+
+    def get_store(self, sim_id: int) -> AnimalStore:
+        return self._get(sim_id)[1]
+
+    def get_occupancy(self, sim_id: int) -> Occupancy:
+        return self._get(sim_id)[2]
+
+    def replace_animals(self, sim_id: int, columns: Dict[str, np.ndarray], next_oid: int):
+        """
+        Replace all the animals of a simulation at once, used by engines working on their own arrays
+        :param sim_id:
+        :param columns: one array per AnimalStore column
+        :param next_oid: oid the next spawned animal gets
+        :return:
+        """
+        simulation, _, occupancy = self._get(sim_id)
+        if self._release_dead:
+            columns = {k: v[columns['alive']] for k, v in columns.items()}
+        self._stores[sim_id] = AnimalStore.from_columns(columns, grid_size=simulation.grid_size, next_oid=next_oid)
+        live = columns['alive']
+        occupancy.fill(columns['coord_x'][live], columns['coord_y'][live], columns['oid'][live])
+
+    def init_animal(self, sim_id: int, current_turn: int, animal_type: Animal, coordinate: SquareGridCoordinate,
+                    last_fed: Optional[int] = 0, last_breed: Optional[int] = 0):
+        simulation, store, occupancy = self._get(sim_id)
+        square_grid_valid(grid_size=simulation.grid_size, coordinates=coordinate)
+        if occupancy.get(coordinate.x, coordinate.y) >= 0:
+            raise NonEmptyCoordinate('Coordinate {} is occupied'.format(coordinate))
+        oid = store.add(animal_type=animal_type, x=coordinate.x, y=coordinate.y, spawn_turn=current_turn,
+                        last_breed=last_breed, last_fed=last_fed)
+        occupancy.set(coordinate.x, coordinate.y, oid)
+        return oid
+
+    def coordinate_is_occupied(self, sim_id: int, coordinate: SquareGridCoordinate) -> bool:
+        simulation, _, occupancy = self._get(sim_id)
+        if not square_grid_valid(grid_size=simulation.grid_size, coordinates=coordinate, raise_err=False):
+            return False
+        return occupancy.get(coordinate.x, coordinate.y) >= 0
+
+    def get_animal(self, sim_id: int, animal_id: int) -> AnimalRecord:
+        return self._get(sim_id)[1].record(animal_id, sim_id=sim_id)
+
+    def get_animal_in_position(self, sim_id, coordinate: SquareGridCoordinate, live_only: bool = True):
+        _, store, _ = self._get(sim_id)
+        cols = store.columns(['oid', 'coord_x', 'coord_y'], live_only=live_only)
+        here = (cols['coord_x'] == coordinate.x) & (cols['coord_y'] == coordinate.y)
+        return [store.record(int(oid), sim_id=sim_id) for oid in cols['oid'][here]]
+
+    def _frame(self, sim_id: int, animal_type: Optional[Animal] = None):
+        import pandas as pd
+        _, store, _ = self._get(sim_id)
+        cols = store.columns(ANIMAL_COLUMNS[2:] + ('oid',), animal_type=animal_type)
+        cols['sim_id'] = np.full(len(cols['oid']), sim_id, dtype=np.int64)
+        cols['animal_type'] = [_ANIMAL_BY_VALUE[v] for v in cols['animal_type'].tolist()]
+        return pd.DataFrame({k: cols[k] for k in ANIMAL_COLUMNS})
+
+    def get_animals_by_type(self, sim_id: int, animal_type: Animal):
+        return self._frame(sim_id, animal_type=animal_type)
+
+    def get_animals_df(self, sim_id: int):
+        return self._frame(sim_id)
+
+    def get_animal_arrays(self, sim_id: int, columns: Sequence[str], animal_type: Optional[Animal] = None,
+                          live_only: bool = True) -> Dict[str, np.ndarray]:
+        animal_row_type(tuple(columns))
+        _, store, _ = self._get(sim_id)
+        arrays = store.columns([c for c in columns if c != 'sim_id'], animal_type=animal_type, live_only=live_only)
+        if 'sim_id' in columns:
+            arrays['sim_id'] = np.full(len(store.slots(animal_type=animal_type, live_only=live_only)), sim_id)
+        return {c: arrays[c].astype(ARRAY_DTYPES[c]) for c in columns}
+
+    def get_animal_tuples(self, sim_id: int, columns: Sequence[str], animal_type: Optional[Animal] = None,
+                          live_only: bool = True) -> List[Tuple]:
+        row_type = animal_row_type(tuple(columns))
+        arrays = self.get_animal_arrays(sim_id, columns, animal_type=animal_type, live_only=live_only)
+        values = [arrays[c].tolist() for c in columns]
+        if 'animal_type' in columns:
+            i = columns.index('animal_type')
+            values[i] = [_ANIMAL_BY_VALUE[v] for v in values[i]]
+        return [row_type(*r) for r in zip(*values)]
+
+    def iter_animal_tuples(self, sim_id: int, columns: Sequence[str], animal_type: Optional[Animal] = None,
+                           live_only: bool = True, batch_size: int = 10000) -> Iterator[List[Tuple]]:
+        rows = self.get_animal_tuples(sim_id, columns, animal_type=animal_type, live_only=live_only)
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    def count_animals(self, sim_id: int) -> Dict[Animal, int]:
+        _, store, _ = self._get(sim_id)
+        types = store.columns(['animal_type'])['animal_type']
+        return {a: int((types == a.value).sum()) for a in Animal}
+
+    def log_turn(self, sim_id: int, turn: int, population: Dict[Animal, int]):
+        self._get(sim_id)
+        self._turns[sim_id].append((turn, population.get(Animal.Fish, 0), population.get(Animal.Shark, 0)))
+
+    def get_last_turn(self, sim_id: int) -> Optional[int]:
+        self._get(sim_id)
+        return self._turns[sim_id][-1][0] if self._turns[sim_id] else None
+
+    def get_turn_log(self, sim_id: int, until_turn: Optional[int] = None) -> List[Tuple[int, int, int]]:
+        self._get(sim_id)
+        return [t for t in self._turns[sim_id] if until_turn is None or t[0] <= until_turn]
+
+    def has_fish_in_square(self, sim_id: int, coordinates: List[SquareGridCoordinate]) -> List[SquareGridCoordinate]:
+        _, store, occupancy = self._get(sim_id)
+        has_fish = []
+        for coord in coordinates:
+            oid = occupancy.get(coord.x, coord.y)
+            if oid >= 0 and store.animal_type(oid) == Animal.Fish:
+                has_fish.append(SquareGridCoordinate(int(coord.x), int(coord.y)))
+        return has_fish
+
+    def update_animals(self, sim_id: int, update_dict: Dict):
+        _, store, _ = self._get(sim_id)
+        for oid, values in update_dict.items():
+            if oid not in store or not store.is_alive(oid):
+                continue
+            for k, v in values.items():
+                if k in UPDATABLE_COLUMNS:
+                    store.update(oid, **{k: v})
+                else:
+                    _logger.error('Cannot update {} property with this method'.format(k))
+
+    def _kill(self, store: AnimalStore, occupancy: Occupancy, oid: int):
+        x, y = store.position(oid)
+        occupancy.clear(x, y)
+        if self._release_dead:
+            store.release(oid)
+            if 8 * len(store) < store.capacity > 64:
+                # population collapsed, give the memory back
+                store.compact()
+        else:
+            store.kill(oid)
+
+    def kill_animal(self, sim_id: int, animal_ids: List[int]):
+        _, store, occupancy = self._get(sim_id)
+        for oid in animal_ids:
+            if oid in store and store.is_alive(oid):
+                self._kill(store, occupancy, oid)
+
+    def eat_animal_in_square(self, sim_id: int, coordinate: SquareGridCoordinate):
+        _, store, occupancy = self._get(sim_id)
+        oid = occupancy.get(coordinate.x, coordinate.y)
+        if oid < 0 or store.animal_type(oid) != Animal.Fish:
+            _logger.warning('No Fish to eat in {}'.format(coordinate))
+            return False
+        self._kill(store, occupancy, oid)
+        return True
+
+    def move_animal(self, sim_id: int, animal_id: int, new_position: SquareGridCoordinate):
+        simulation, store, occupancy = self._get(sim_id)
+        # Check coordinate match with the grid
+        square_grid_valid(grid_size=simulation.grid_size, coordinates=new_position)
+        if occupancy.get(new_position.x, new_position.y) >= 0:
+            raise NonEmptyCoordinate('Cannot move, coordinate {} is occupied'.format(new_position))
+        if animal_id not in store or not store.is_alive(animal_id):
+            raise ImpossibleAction('Attempting to move a dead animal: {}'.format(animal_id))
+        x, y = store.position(animal_id)
+        occupancy.clear(x, y)
+        occupancy.set(new_position.x, new_position.y, animal_id)
+        store.move(animal_id, new_position.x, new_position.y)
@@ -0,0 +1,139 @@
+"""
+Size bounded LRU cache for rendered read responses
+
+A logged turn never changes, so the rendered payload for (resource, sim_id, turn, encoding) can be kept and
+served again without touching the database, as long as it was rendered from data read together with the turn (see
+StorageBackend.get_turn_snapshot).
+"""
+import hashlib
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+from typing import Callable, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import numpy as np
+    from fish_bowl.process.tiles import DensityPyramid
+
+_logger = logging.getLogger(__name__)
+
+CacheEntry = namedtuple('CacheEntry', ['body', 'mimetype', 'etag'])
+
+
+def compute_etag(body: bytes) -> str:
+    return hashlib.sha1(body).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024):
+        """
+        :param max_entries: maximum number of cached responses
+        :param max_bytes: maximum total size of cached bodies
+        """
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def get(self, key: Tuple) -> Optional[CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, body: bytes, mimetype: str) -> CacheEntry:
+        """
+        Store a rendered body, evicting least recently used entries to stay within bounds
+        :param key: (resource, sim_id, turn, encoding)
+        :param body:
+        :param mimetype:
+        :return: the cache entry, with its etag
+        """
+        entry = CacheEntry(body=body, mimetype=mimetype, etag=compute_etag(body))
+        if len(body) > self._max_bytes:
+            # too big to be cached, but still usable by the caller
+            return entry
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous.body)
+            self._entries[key] = entry
+            self._size += len(body)
+            while len(self._entries) > self._max_entries or self._size > self._max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted.body)
+        return entry
+
+    def invalidate(self, sim_id: int, turn: int) -> int:
+        """
+        Drop all entries of a simulation turn, whatever the resource or encoding
+        :param sim_id:
+        :param turn:
+        :return: number of entries removed
+        """
+        with self._lock:
+            keys = [k for k in self._entries if k[1] == sim_id and k[2] == turn]
+            for k in keys:
+                self._size -= len(self._entries.pop(k).body)
+        if keys:
+            _logger.debug('Invalidated {} cached responses for simulation {} turn {}'.format(len(keys), sim_id, turn))
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+
+class PyramidCache:
+    """
+    Density pyramids of the last turn read of the most recently used simulations. When a simulation moved on, its
+    pyramid is updated with the squares that changed instead of being rebuilt.
+    """
+
+    def __init__(self, max_simulations: int = 8, tile_size: int = 64):
+        """
+        :param max_simulations: maximum number of pyramids kept
+        :param tile_size: number of bins on a tile side
+        """
+        self._max_simulations = max_simulations
+        self._tile_size = tile_size
+        self._pyramids = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pyramids)
+
+    def get(self, sim_id: int, turn: int, load_grid: Callable[[], Tuple[int, 'np.ndarray']]) -> 'DensityPyramid':
+        """
+        :param sim_id:
+        :param turn: turn the pyramid is expected to show
+        :param load_grid: reads the last logged turn and its grid, only called when the pyramid isn't at turn
+        :return: the pyramid, at the turn load_grid read if it was called
+        """
+        from fish_bowl.process.tiles import DensityPyramid
+        with self._lock:
+            pyramid = self._pyramids.pop(sim_id, None)
+            if pyramid is None:
+                grid_turn, grid = load_grid()
+                pyramid = DensityPyramid.from_grid(grid, turn=grid_turn, tile_size=self._tile_size)
+            elif pyramid.turn != turn:
+                pyramid.update(*load_grid())
+            self._pyramids[sim_id] = pyramid
+            while len(self._pyramids) > self._max_simulations:
+                self._pyramids.popitem(last=False)
+            return pyramid
@@ -0,0 +1,301 @@
+"""
+Background execution of simulations for the rest service
+
+Simulations are submitted as jobs and queued onto a bounded pool of workers. Progress and cancel requests are
+exchanged with the workers through shared dictionaries so that both thread and process pools can be used.
+"""
+import enum
+import itertools
+import logging
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, CancelledError
+from typing import Dict, Optional
+
+from fish_bowl.common.config_reader import read_simulation_config
+from fish_bowl.process.utils import Animal, EndOfSimulatioError
+
+_logger = logging.getLogger(__name__)
+
+SIMULATION_PARAMETERS = ('grid_size', 'init_nb_fish', 'fish_breed_maturity', 'fish_breed_probability', 'fish_speed',
+                         'init_nb_shark', 'shark_breed_maturity', 'shark_breed_probability', 'shark_speed',
+                         'shark_starving')
+CONFIG_NAME_PATTERN = re.compile(r'^[\w\-]+$')
+# engines a job can be played with, all of them play in memory and their turns are written to the database through a
+# pipeline
+ENGINES = ('python', 'jit', 'coloured')
+
+
+class AdmissionError(Exception):
+    # Scheduler is full, the job has not been accepted
+    pass
+
+
+class UnknownJobError(KeyError):
+    pass
+
+
+class JobStatus(enum.Enum):
+    Pending = 'pending'
+    Running = 'running'
+    Done = 'done'
+    Cancelled = 'cancelled'
+    Failed = 'failed'
+
+
+def validate_simulation_config(config: Dict) -> Dict:
+    """
+    Check an inline simulation configuration has exactly the expected parameters
+    :param config:
+    :return: the configuration restricted to the simulation parameters
+    """
+    if not isinstance(config, dict):
+        raise ValueError('Simulation configuration must be a mapping')
+    missing = [k for k in SIMULATION_PARAMETERS if k not in config]
+    unknown = [k for k in config if k not in SIMULATION_PARAMETERS]
+    if missing or unknown:
+        raise ValueError('Invalid simulation configuration, missing: {}, unknown: {}'.format(missing, unknown))
+    for k in SIMULATION_PARAMETERS:
+        if isinstance(config[k], bool) or not isinstance(config[k], (int, float)):
+            raise ValueError('Simulation parameter {} must be a number, not {!r}'.format(k, config[k]))
+    return {k: config[k] for k in SIMULATION_PARAMETERS}
+
+
+def load_simulation_config(config_name: str) -> Dict:
+    """
+    Read a named configuration from the configuration folder, refusing anything that looks like a path
+    :param config_name:
+    :return:
+    """
+    if not isinstance(config_name, str) or not CONFIG_NAME_PATTERN.match(config_name):
+        raise ValueError('Invalid configuration name: {!r}'.format(config_name))
+    return validate_simulation_config(read_simulation_config(config_name))
+
+
+def run_simulation_job(job_id: str, sim_config: Dict, max_turn: int, database_url: str, progress, cancel_flags,
+                       sqlite_profile: str = 'default', engine: str = 'python'):
+    """
+    Worker entry point: play a simulation until it ends, its turn budget is spent or it gets cancelled
+    :param job_id:
+    :param sim_config:
+    :param max_turn: turn budget of the job
+    :param database_url:
+    :param progress: shared mapping job_id -> progress dictionary
+    :param cancel_flags: shared mapping job_id -> True when a cancel has been requested
+    :param sqlite_profile: persistence profile of the database connection
+    :param engine: one of ENGINES
+    :return: result dictionary
+    """
+    start = time.time()
+    # imported here, workers are the only ones needing the simulation engine
+    from fish_bowl.dataio.pipeline import PipelinedSimulationClient
+    if engine == 'python':
+        from fish_bowl.process.base import SimulationGrid as engine_class
+    elif engine == 'jit':
+        from fish_bowl.process.jit import JitSimulationGrid as engine_class
+    else:
+        from fish_bowl.process.colouring import ColouredSimulationGrid as engine_class
+    # every turn is written in one transaction, the read endpoints never see a turn being played
+    client = PipelinedSimulationClient(database_url, profile=sqlite_profile)
+    grid = engine_class(persistence=client, simulation_parameters=sim_config)
+    progress[job_id] = {'sim_id': grid.sim_id, 'turn': grid.sim_turn, 'max_turn': max_turn}
+    end_reason = 'Turn budget of {} turns reached'.format(max_turn)
+    cancelled = False
+    while grid.sim_turn < max_turn:
+        if cancel_flags.get(job_id, False):
+            end_reason = 'Cancelled at turn {}'.format(grid.sim_turn)
+            cancelled = True
+            break
+        try:
+            grid.play_turn()
+        except EndOfSimulatioError as err:
+            end_reason = str(err)
+            break
+        finally:
+            progress[job_id] = {'sim_id': grid.sim_id, 'turn': grid.sim_turn, 'max_turn': max_turn}
+    try:
+        client.record_summary(grid.sim_id, end_reason=end_reason, runtime_seconds=time.time() - start)
+    except Exception:
+        # the simulation itself is complete, only its catalog row is missing (see backfill_summaries)
+        _logger.exception('Recording the summary of simulation {} failed'.format(grid.sim_id))
+    population = grid.population
+    # waits for the pending turns to be written
+    client.close()
+    return {
+        'sim_id': grid.sim_id,
+        'turn': grid.sim_turn,
+        'cancelled': cancelled,
+        'end_reason': end_reason,
+        'population': {a.name: int(population.get(a, 0)) for a in Animal}
+    }
+
+
+class SimulationJob:
+    def __init__(self, job_id: str, sim_config: Dict, max_turn: int, config_name: Optional[str] = None,
+                 engine: str = 'python'):
+        self.job_id = job_id
+        self.sim_config = sim_config
+        self.max_turn = max_turn
+        self.config_name = config_name
+        self.engine = engine
+        self.future = None
+
+    def to_dict(self) -> Dict:
+        return {'job_id': self.job_id, 'config_name': self.config_name, 'max_turn': self.max_turn,
+                'engine': self.engine}
+
+
+class SimulationScheduler:
+    """
+    Queue simulation jobs onto a bounded worker pool
+
+    - at most max_workers simulations run at the same time, the others wait in the queue
+    - at most max_jobs jobs can be pending or running, further submissions are refused (admission control)
+    - each job plays at most its own turn budget, which can't exceed max_turn_budget
+    """
+
+    def __init__(self, database_url: str, max_workers: int = 2, max_jobs: int = 16, max_turn_budget: int = 1000,
+                 use_processes: bool = True, retain_finished: int = 1000, sqlite_profile: str = 'default'):
+        if max_workers < 1 or max_jobs < max_workers:
+            raise ValueError('Need at least one worker and max_jobs >= max_workers')
+        self._database_url = database_url
+        self._max_workers = max_workers
+        self._max_jobs = max_jobs
+        self._max_turn_budget = max_turn_budget
+        self._use_processes = use_processes
+        self._retain_finished = retain_finished
+        self._sqlite_profile = sqlite_profile
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._manager = None
+        if use_processes:
+            import multiprocessing
+            # forked workers would inherit the locks of threads running in the parent (Numba parallel
+            # kernels, SQLAlchemy pools), spawn them clean instead
+            context = multiprocessing.get_context('spawn')
+            self._manager = context.Manager()
+            self._progress = self._manager.dict()
+            self._cancel_flags = self._manager.dict()
+            self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        else:
+            self._progress = dict()
+            self._cancel_flags = dict()
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='simulation')
+        self._counter = itertools.count(1)
+
+    @property
+    def max_turn_budget(self) -> int:
+        return self._max_turn_budget
+
+    def active_jobs(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if not job.future.done())
+
+    def submit(self, sim_config: Dict, max_turn: int, config_name: Optional[str] = None,
+               engine: str = 'python') -> SimulationJob:
+        """
+        Queue a simulation, raise AdmissionError if the scheduler is full
+        :param sim_config: validated simulation configuration
+        :param max_turn: turn budget of the job
+        :param config_name: name of the configuration, for reference only
+        :param engine: one of ENGINES
+        :return:
+        """
+        if engine not in ENGINES:
+            raise ValueError('Unknown engine {!r}, expected one of {}'.format(engine, ', '.join(ENGINES)))
+        if isinstance(max_turn, bool) or not isinstance(max_turn, int) or max_turn < 1:
+            raise ValueError('max_turn must be a positive integer, not {!r}'.format(max_turn))
+        if max_turn > self._max_turn_budget:
+            raise ValueError('max_turn {} exceeds the turn budget limit of {}'.format(max_turn,
+                                                                                     self._max_turn_budget))
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if not job.future.done())
+            if active >= self._max_jobs:
+                raise AdmissionError('Scheduler is full: {} jobs pending or running'.format(active))
+            job_id = '{}-{}'.format(next(self._counter), uuid.uuid4().hex[:8])
+            job = SimulationJob(job_id=job_id, sim_config=sim_config, max_turn=max_turn, config_name=config_name,
+                                engine=engine)
+            job.future = self._executor.submit(run_simulation_job, job_id, sim_config, max_turn,
+                                               self._database_url, self._progress, self._cancel_flags,
+                                               self._sqlite_profile, engine)
+            self._jobs[job_id] = job
+            self._prune()
+        _logger.info('Job {} submitted ({} turns, {} engine)'.format(job_id, max_turn, engine))
+        return job
+
+    def _prune(self):
+        """
+        Forget the oldest finished jobs once more than retain_finished are kept
+        """
+        finished = [k for k, job in self._jobs.items() if job.future.done()]
+        for job_id in finished[:max(0, len(finished) - self._retain_finished)]:
+            del self._jobs[job_id]
+            self._progress.pop(job_id, None)
+            self._cancel_flags.pop(job_id, None)
+
+    def get_job(self, job_id: str) -> SimulationJob:
+        with self._lock:
+            try:
+                return self._jobs[job_id]
+            except KeyError:
+                raise UnknownJobError(job_id)
+
+    def status(self, job_id: str) -> JobStatus:
+        job = self.get_job(job_id)
+        future = job.future
+        if future.cancelled():
+            return JobStatus.Cancelled
+        if future.done():
+            if future.exception() is not None:
+                return JobStatus.Failed
+            return JobStatus.Cancelled if future.result()['cancelled'] else JobStatus.Done
+        if future.running() or job_id in self._progress:
+            return JobStatus.Running
+        return JobStatus.Pending
+
+    def progress(self, job_id: str) -> Dict:
+        job = self.get_job(job_id)
+        progress = self._progress.get(job_id, {'sim_id': None, 'turn': 0, 'max_turn': job.max_turn})
+        progress = dict(progress)
+        progress['fraction'] = progress['turn'] / float(job.max_turn)
+        progress['status'] = self.status(job_id).value
+        return progress
+
+    def cancel(self, job_id: str) -> JobStatus:
+        """
+        Cancel a job: pending jobs are dropped from the queue, running ones stop at the end of their current turn
+        :param job_id:
+        :return: status after the cancel request
+        """
+        job = self.get_job(job_id)
+        if not job.future.cancel() and not job.future.done():
+            self._cancel_flags[job_id] = True
+        _logger.info('Cancel requested for job {}'.format(job_id))
+        return self.status(job_id)
+
+    def result(self, job_id: str) -> Optional[Dict]:
+        """
+        Return the job result, None if it has not finished yet. Errors raised by the simulation are re-raised
+        :param job_id:
+        :return:
+        """
+        job = self.get_job(job_id)
+        if not job.future.done():
+            return None
+        try:
+            return job.future.result()
+        except CancelledError:
+            return {'sim_id': None, 'turn': 0, 'cancelled': True, 'end_reason': 'Cancelled before start',
+                    'population': {}}
+
+    def shutdown(self, wait: bool = True):
+        with self._lock:
+            for job_id, job in self._jobs.items():
+                if not job.future.cancel() and not job.future.done():
+                    self._cancel_flags[job_id] = True
+        self._executor.shutdown(wait=wait)
+        if self._manager is not None:
+            self._manager.shutdown()
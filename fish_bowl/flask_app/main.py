@@ -1,10 +1,93 @@
+import csv
+import io
+import json
 import logging
-from flask import Flask, jsonify
+from typing import Optional
 
+from flask import Flask, jsonify, request, url_for, make_response
+
+from fish_bowl.flask_app.cache import ResponseCache, PyramidCache
+from fish_bowl.flask_app.jobs import SimulationScheduler, AdmissionError, UnknownJobError, JobStatus, \
+    load_simulation_config, validate_simulation_config
 
 _logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+app.config.setdefault('DATABASE_URL', None)
+app.config.setdefault('SCHEDULER_MAX_WORKERS', 2)
+app.config.setdefault('SCHEDULER_MAX_JOBS', 16)
+app.config.setdefault('SCHEDULER_MAX_TURN_BUDGET', 1000)
+app.config.setdefault('SCHEDULER_DEFAULT_TURNS', 100)
+app.config.setdefault('SCHEDULER_USE_PROCESSES', True)
+app.config.setdefault('SQLITE_PROFILE', 'production')
+app.config.setdefault('READ_POOL_SIZE', 4)
+app.config.setdefault('RESPONSE_CACHE_MAX_ENTRIES', 1024)
+app.config.setdefault('RESPONSE_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+app.config.setdefault('TILE_SIZE', 64)
+app.config.setdefault('TILE_MAX_SIMULATIONS', 8)
+app.config.setdefault('CATALOG_PAGE_SIZE', 50)
+app.config.setdefault('CATALOG_MAX_PAGE_SIZE', 500)
+
+ENCODINGS = {'json': 'application/json', 'csv': 'text/csv'}
+ANIMAL_META = {'1': 'Fish', '2': 'Shark'}
+
+
+def _database_url() -> str:
+    database_url = app.config['DATABASE_URL']
+    if database_url is None:
+        from fish_bowl.dataio.persistence import get_database_string
+        database_url = get_database_string()
+    return database_url
+
+
+def get_scheduler() -> SimulationScheduler:
+    """
+    Create the job scheduler on first use, workers are only started when simulations are submitted
+    """
+    scheduler = app.extensions.get('simulation_scheduler')
+    if scheduler is None:
+        scheduler = SimulationScheduler(database_url=_database_url(),
+                                        max_workers=app.config['SCHEDULER_MAX_WORKERS'],
+                                        max_jobs=app.config['SCHEDULER_MAX_JOBS'],
+                                        max_turn_budget=app.config['SCHEDULER_MAX_TURN_BUDGET'],
+                                        use_processes=app.config['SCHEDULER_USE_PROCESSES'],
+                                        sqlite_profile=app.config['SQLITE_PROFILE'])
+        app.extensions['simulation_scheduler'] = scheduler
+    return scheduler
+
+
+def get_client():
+    """
+    Database client used by the read endpoints, reads go through a pool of read only connections
+    """
+    client = app.extensions.get('simulation_client')
+    if client is None:
+        from fish_bowl.dataio.sharding import open_client
+        client = open_client(_database_url(), profile=app.config['SQLITE_PROFILE'],
+                             read_pool_size=app.config['READ_POOL_SIZE'])
+        app.extensions['simulation_client'] = client
+    return client
+
+
+def get_response_cache() -> ResponseCache:
+    cache = app.extensions.get('response_cache')
+    if cache is None:
+        cache = ResponseCache(max_entries=app.config['RESPONSE_CACHE_MAX_ENTRIES'],
+                              max_bytes=app.config['RESPONSE_CACHE_MAX_BYTES'])
+        app.extensions['response_cache'] = cache
+    return cache
+
+
+def get_pyramid_cache() -> PyramidCache:
+    pyramids = app.extensions.get('pyramid_cache')
+    if pyramids is None:
+        pyramids = PyramidCache(max_simulations=app.config['TILE_MAX_SIMULATIONS'], tile_size=app.config['TILE_SIZE'])
+        app.extensions['pyramid_cache'] = pyramids
+    return pyramids
+
+
+def _error(message, status_code):
+    return jsonify({'error': message}), status_code
 
 
 @app.route('/')
@@ -35,5 +118,246 @@ def test():
     return jsonify(msg)
 
 
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Submit a simulation, body is either {"config_name": name} or {"config": {...}}, with an optional "max_turn" and
+    an optional "engine" (see jobs.ENGINES)
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return _error('Expecting a json object', 400)
+    if ('config_name' in payload) == ('config' in payload):
+        return _error('Specify exactly one of config_name or config', 400)
+    try:
+        if 'config_name' in payload:
+            sim_config = load_simulation_config(payload['config_name'])
+        else:
+            sim_config = validate_simulation_config(payload['config'])
+    except FileNotFoundError:
+        return _error('Unknown configuration {}'.format(payload['config_name']), 404)
+    except ValueError as err:
+        return _error(str(err), 400)
+    scheduler = get_scheduler()
+    try:
+        default_turns = min(app.config['SCHEDULER_DEFAULT_TURNS'], scheduler.max_turn_budget)
+        job = scheduler.submit(sim_config=sim_config, max_turn=payload.get('max_turn', default_turns),
+                               config_name=payload.get('config_name'), engine=payload.get('engine', 'python'))
+    except AdmissionError as err:
+        return _error(str(err), 429)
+    except ValueError as err:
+        return _error(str(err), 400)
+    response = job.to_dict()
+    response['status'] = scheduler.status(job.job_id).value
+    return jsonify(response), 202, {'Location': url_for('job_status', job_id=job.job_id)}
+
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    scheduler = get_scheduler()
+    try:
+        response = scheduler.get_job(job_id).to_dict()
+        response['status'] = scheduler.status(job_id).value
+    except UnknownJobError:
+        return _error('Unknown job {}'.format(job_id), 404)
+    return jsonify(response)
+
+
+@app.route('/jobs/<job_id>/progress')
+def job_progress(job_id):
+    try:
+        return jsonify(get_scheduler().progress(job_id))
+    except UnknownJobError:
+        return _error('Unknown job {}'.format(job_id), 404)
+
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    try:
+        status = get_scheduler().cancel(job_id)
+    except UnknownJobError:
+        return _error('Unknown job {}'.format(job_id), 404)
+    return jsonify({'job_id': job_id, 'status': status.value}), 202
+
+
+@app.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    scheduler = get_scheduler()
+    try:
+        status = scheduler.status(job_id)
+        if status == JobStatus.Failed:
+            return _error('Job failed: {!r}'.format(scheduler.get_job(job_id).future.exception()), 500)
+        result = scheduler.result(job_id)
+    except UnknownJobError:
+        return _error('Unknown job {}'.format(job_id), 404)
+    if result is None:
+        return _error('Job {} is {}'.format(job_id, status.value), 409)
+    result['status'] = status.value
+    return jsonify(result)
+
+
+def _encode(simulation, meta, key, rows, encoding) -> bytes:
+    if encoding == 'json':
+        return json.dumps({'simulation': simulation, 'meta': meta, key: rows}).encode()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow(meta['data'])
+    writer.writerows(rows)
+    return buffer.getvalue().encode()
+
+
+def render_grid(client, sim_id: int, turn: Optional[int], last_turn: int, encoding: str):
+    """
+    Live animals as (type, x, y), only the last logged turn can be read
+    """
+    if turn is not None and turn != last_turn:
+        return None
+    from fish_bowl.process.analytics import GRID_COLUMNS
+    snapshot_turn, animals = client.get_turn_snapshot(sim_id, GRID_COLUMNS)
+    if turn is not None and turn != snapshot_turn:
+        # the simulation moved on since last_turn was read
+        return None
+    rows = list(zip(animals['animal_type'].tolist(), animals['coord_x'].tolist(), animals['coord_y'].tolist()))
+    meta = dict(ANIMAL_META, data=('type', 'x', 'y'))
+    return snapshot_turn, _encode({'sim_id': sim_id, 'sim_turn': snapshot_turn}, meta, 'grid', rows, encoding)
+
+
+def render_population(client, sim_id: int, turn: Optional[int], last_turn: int, encoding: str):
+    """
+    Population history as (turn, fish, shark) up to the requested turn
+    """
+    if turn is not None and (turn > last_turn or turn < 0):
+        return None
+    rows = client.get_turn_log(sim_id=sim_id, until_turn=turn)
+    if not rows:
+        return None
+    # read in one query, the last row is the turn of the history
+    turn = rows[-1][0]
+    meta = {'data': ('turn', 'fish', 'shark')}
+    return turn, _encode({'sim_id': sim_id, 'sim_turn': turn}, meta, 'population', rows, encoding)
+
+
+def tile_renderer(zoom: int, tx: int, ty: int):
+    """
+    Render function of a density tile, non empty bins as (bx, by, fish, shark) with bx, by the bin indices in the tile.
+    Only the last logged turn can be read
+    """
+    def render_tile(client, sim_id: int, turn: Optional[int], last_turn: int, encoding: str):
+        if turn is not None and turn != last_turn:
+            return None
+        from fish_bowl.process.analytics import FISH, SHARK, GRID_COLUMNS, grid_from_arrays
+
+        def load_grid():
+            snapshot_turn, animals = client.get_turn_snapshot(sim_id, GRID_COLUMNS)
+            return snapshot_turn, grid_from_arrays(animals, grid_size)
+        grid_size = client.get_simulation(sim_id).grid_size
+        pyramid = get_pyramid_cache().get(sim_id, last_turn, load_grid)
+        if turn is not None and turn != pyramid.turn:
+            return None
+        try:
+            counts = pyramid.tile(zoom, tx, ty)
+        except ValueError:
+            return None
+        fish, shark = counts[FISH], counts[SHARK]
+        bx, by = (fish + shark).nonzero()
+        rows = list(zip(bx.tolist(), by.tolist(), fish[bx, by].tolist(), shark[bx, by].tolist()))
+        meta = dict(zoom=zoom, tx=tx, ty=ty, max_zoom=pyramid.max_zoom, tile_size=pyramid.tile_size,
+                    bin_size=pyramid.bin_size(zoom), grid_size=grid_size, data=('bx', 'by', 'fish', 'shark'))
+        return pyramid.turn, _encode({'sim_id': sim_id, 'sim_turn': pyramid.turn}, meta, 'tile', rows, encoding)
+    return render_tile
+
+
+def _serve_turn_resource(resource: str, sim_id: int, render):
+    """
+    Serve a rendered turn resource through the response cache, with ETag and conditional GET support.
+    Responses are cached by logged turn: render reads the turn and the data it shows together, and a logged turn never
+    changes. Requests without turn get the last logged turn and must revalidate, they move on to the entries of the
+    next turn once it is logged. Requests for a given turn are immutable
+    """
+    encoding = request.args.get('encoding', 'json')
+    if encoding not in ENCODINGS:
+        return _error('Unknown encoding {}, use one of {}'.format(encoding, sorted(ENCODINGS)), 400)
+    requested_turn = request.args.get('turn')
+    if requested_turn is not None:
+        try:
+            requested_turn = int(requested_turn)
+        except ValueError:
+            return _error('turn must be an integer, not {!r}'.format(requested_turn), 400)
+    client = get_client()
+    last_turn = client.get_last_turn(sim_id=sim_id)
+    if last_turn is None:
+        return _error('Unknown simulation {}'.format(sim_id), 404)
+    turn = last_turn if requested_turn is None else requested_turn
+    cache = get_response_cache()
+    entry = cache.get((resource, sim_id, turn, encoding))
+    if entry is None:
+        rendered = render(client, sim_id, requested_turn, last_turn, encoding)
+        if rendered is None:
+            return _error('{} of simulation {} is not available for turn {}'.format(resource, sim_id, turn), 404)
+        # the turn actually rendered, a later one if the simulation logged a turn in between
+        rendered_turn, body = rendered
+        entry = cache.put((resource, sim_id, rendered_turn, encoding), body, ENCODINGS[encoding])
+    response = make_response(entry.body)
+    response.mimetype = entry.mimetype
+    response.set_etag(entry.etag)
+    if requested_turn is None:
+        response.headers['Cache-Control'] = 'no-cache'
+    else:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response.make_conditional(request)
+
+
+@app.route('/simulations')
+def list_simulations():
+    """
+    Finished simulations of the catalog, by sid, one page at a time:
+    - limit: page size, after: last sid of the previous page, order: asc (default) or desc
+    - filters: any simulation parameter, end_reason, min_turn, max_turn, min_peak_fish, min_peak_shark
+    The response links to the next page, absent on the last one
+    """
+    # imported here, catalog depends on sqlalchemy
+    from fish_bowl.dataio.catalog import SUMMARY_FILTERS
+    args = request.args.to_dict()
+    order = args.pop('order', 'asc')
+    if order not in ('asc', 'desc'):
+        return _error('Unknown order {}, use asc or desc'.format(order), 400)
+    filters = {}
+    try:
+        limit = int(args.pop('limit', app.config['CATALOG_PAGE_SIZE']))
+        after = args.pop('after', None)
+        after = None if after is None else int(after)
+        for name, value in args.items():
+            if name not in SUMMARY_FILTERS:
+                return _error('Unknown filter {}, use some of {}'.format(name, sorted(SUMMARY_FILTERS)), 400)
+            filters[name] = value if name == 'end_reason' else int(value)
+    except ValueError as err:
+        return _error('Invalid parameter: {}'.format(err), 400)
+    if not 0 < limit <= app.config['CATALOG_MAX_PAGE_SIZE']:
+        return _error('limit must be between 1 and {}'.format(app.config['CATALOG_MAX_PAGE_SIZE']), 400)
+    # one more row tells whether there is a next page
+    rows = get_client().list_simulation_summaries(filters=filters, after=after, limit=limit + 1,
+                                                  descending=order == 'desc')
+    response = {'simulations': rows[:limit], 'next': None}
+    if len(rows) > limit:
+        response['next'] = url_for('list_simulations', after=rows[limit - 1]['sid'], limit=limit, order=order,
+                                   **filters)
+    return jsonify(response)
+
+
+@app.route('/simulations/<int:sim_id>/grid')
+def simulation_grid(sim_id):
+    return _serve_turn_resource('grid', sim_id, render_grid)
+
+
+@app.route('/simulations/<int:sim_id>/population')
+def simulation_population(sim_id):
+    return _serve_turn_resource('population', sim_id, render_population)
+
+
+@app.route('/simulations/<int:sim_id>/tiles/<int:zoom>/<int:tx>/<int:ty>')
+def simulation_tile(sim_id, zoom, tx, ty):
+    return _serve_turn_resource('tile/{}/{}/{}'.format(zoom, tx, ty), sim_id, tile_renderer(zoom, tx, ty))
+
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=9999)
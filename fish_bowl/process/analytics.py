@@ -0,0 +1,318 @@
+"""
+Spatial analytics of grid snapshots
+
+Every function works on a (grid_size, grid_size) array of Animal values indexed by [x, y], 0 for empty squares, as
+returned by grid_array or the get_grid method of the engines. Neighbourhoods are the 8 squares of SQUARE_NEIGH and
+the grid does not wrap around.
+
+- label_clusters / cluster_sizes / cluster_size_distribution: 8-connected clusters of one animal type, labelled
+  with scipy.ndimage when it is installed, by vectorised label propagation otherwise
+- pair_correlation: radial pair correlation g(r) between two animal types, from FFT cross correlations of the
+  zero padded indicator fields (so edges are accounted for exactly)
+- local_density: fraction of squares holding an animal type in a window around every square, from a summed area
+  table
+- fronts: prey squares with a predator among their neighbours, from the bitboard neighbour mask of the predators
+
+SpatialAnalytics is a turn observer (see SimulationGrid observers) recording these metrics every turn. Block
+densities are updated incrementally from the squares that changed since the previous snapshot, the global metrics
+are recomputed every `every` turns.
+"""
+import logging
+from typing import List, Tuple
+
+import numpy as np
+
+from fish_bowl.process import bitboard
+from fish_bowl.process.topology import SQUARE_NEIGH
+from fish_bowl.process.utils import Animal
+
+_logger = logging.getLogger(__name__)
+
+EMPTY = 0
+FISH = Animal.Fish.value
+SHARK = Animal.Shark.value
+# animal columns a grid snapshot is built from
+GRID_COLUMNS = ('animal_type', 'coord_x', 'coord_y')
+
+
+def grid_array(persistence, sim_id: int, grid_size: int) -> np.ndarray:
+    """
+    Snapshot of the live animals of a simulation
+    :param persistence: a StorageBackend
+    :param sim_id:
+    :param grid_size:
+    :return: (grid_size, grid_size) int8 array of Animal values
+    """
+    return grid_from_arrays(persistence.get_animal_arrays(sim_id, GRID_COLUMNS), grid_size)
+
+
+def grid_from_arrays(arrays, grid_size: int) -> np.ndarray:
+    """
+    Snapshot of animals read as GRID_COLUMNS arrays (see StorageBackend.get_animal_arrays)
+    """
+    grid = np.zeros((grid_size, grid_size), dtype=np.int8)
+    grid[arrays['coord_x'], arrays['coord_y']] = arrays['animal_type']
+    return grid
+
+
+def shifted(array: np.ndarray, dx: int, dy: int, fill) -> np.ndarray:
+    """
+    out[x, y] = array[x - dx, y - dy], fill where that square is outside of the grid
+    """
+    n, m = array.shape
+    out = np.full_like(array, fill)
+    out[max(dx, 0):n + min(dx, 0), max(dy, 0):m + min(dy, 0)] = \
+        array[max(-dx, 0):n - max(dx, 0), max(-dy, 0):m - max(dy, 0)]
+    return out
+
+
+def _propagate_labels(mask: np.ndarray) -> np.ndarray:
+    """
+    Label propagation with pointer jumping: every square takes the smallest index reachable in its cluster
+    """
+    size = mask.size
+    labels = np.where(mask, np.arange(size).reshape(mask.shape), size)
+    while True:
+        smallest = labels
+        for dx, dy in SQUARE_NEIGH.values():
+            smallest = np.minimum(smallest, shifted(labels, dx, dy, size))
+        smallest = np.where(mask, smallest, size)
+        # labels are indices of squares of the same cluster, jump to the label of that square
+        flat = smallest.ravel()
+        inside = flat < size
+        while True:
+            jumped = flat.copy()
+            jumped[inside] = flat[flat[inside]]
+            if (jumped == flat).all():
+                break
+            flat = jumped
+        smallest = flat.reshape(mask.shape)
+        if (smallest == labels).all():
+            return labels
+        labels = smallest
+
+
+def label_clusters(mask: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Label the 8-connected clusters of a boolean grid
+    :param mask:
+    :return: labels (1..count, 0 outside of the mask) and count
+    """
+    mask = np.asarray(mask, dtype=bool)
+    try:
+        from scipy import ndimage
+    except ImportError:
+        ndimage = None
+    if ndimage is not None:
+        labels, count = ndimage.label(mask, structure=np.ones((3, 3), dtype=int))
+        return labels, int(count)
+    labels = np.zeros(mask.shape, dtype=np.int64)
+    if not mask.any():
+        return labels, 0
+    roots = _propagate_labels(mask)
+    _, consecutive = np.unique(roots[mask], return_inverse=True)
+    labels[mask] = consecutive + 1
+    return labels, int(consecutive.max()) + 1
+
+
+def cluster_sizes(grid: np.ndarray, animal: int = FISH) -> np.ndarray:
+    """
+    :param grid:
+    :param animal: Animal value
+    :return: number of squares of every cluster of that animal, by label
+    """
+    labels, count = label_clusters(grid == animal)
+    return np.bincount(labels.ravel(), minlength=count + 1)[1:]
+
+
+def cluster_size_distribution(grid: np.ndarray, animal: int = FISH) -> np.ndarray:
+    """
+    :param grid:
+    :param animal: Animal value
+    :return: array whose item s is the number of clusters of size s
+    """
+    return np.bincount(cluster_sizes(grid, animal), minlength=1)
+
+
+def _fast_length(n: int) -> int:
+    """
+    Smallest 5-smooth number >= n, FFT sizes the transforms handle fastest
+    """
+    best = 1
+    while best < n:
+        best *= 2
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            length = p35
+            while length < n:
+                length *= 2
+            best = min(best, length)
+            p35 *= 3
+        p5 *= 5
+    return best
+
+
+def pair_correlation(grid: np.ndarray, first: int = SHARK, second: int = FISH, max_radius: int = 10) -> np.ndarray:
+    """
+    Radial pair correlation: density of `second` animals at distance r (rounded euclidean) of a `first` animal,
+    relative to the density expected if both were placed independently. 1 means no correlation.
+    :param grid:
+    :param first: Animal value
+    :param second: Animal value
+    :param max_radius:
+    :return: g(r) for r in 0..max_radius, nan where it is undefined (no animal or no pair at that distance)
+    """
+    n, m = grid.shape
+    # padding by max_radius is enough to keep the displacements of interest from wrapping around
+    shape = (_fast_length(n + max_radius), _fast_length(m + max_radius))
+    a = (grid == first).astype(np.float64)
+    b = (grid == second).astype(np.float64)
+    g = np.full(max_radius + 1, np.nan)
+    if not a.any() or not b.any():
+        return g
+    fa = np.fft.rfft2(a, s=shape)
+    fb = fa if first == second else np.fft.rfft2(b, s=shape)
+    # pairs[d] = sum_x a[x] b[x + d]
+    pairs = np.fft.irfft2(np.conj(fa) * fb, s=shape)
+    dx = np.fft.fftfreq(shape[0], 1 / shape[0])
+    dy = np.fft.fftfreq(shape[1], 1 / shape[1])
+    # number of squares x such that x + d is still on the grid
+    squares = np.outer(np.clip(n - np.abs(dx), 0, None), np.clip(m - np.abs(dy), 0, None))
+    radius = np.rint(np.hypot(dx[:, None], dy[None, :])).astype(np.int64)
+    within = radius <= max_radius
+    observed = np.bincount(radius[within], weights=pairs[within], minlength=max_radius + 1)
+    possible = np.bincount(radius[within], weights=squares[within], minlength=max_radius + 1)
+    if first == second:
+        # an animal is not its own neighbour
+        observed[0] -= a.sum()
+    expected = possible * a.mean() * b.mean()
+    defined = expected > 0
+    g[defined] = np.rint(observed[defined]) / expected[defined]
+    return g
+
+
+def _box_sums(values: np.ndarray, radius: int) -> np.ndarray:
+    """
+    Sum of values over the (2 * radius + 1) square window around every square, clipped to the grid
+    """
+    n, m = values.shape
+    table = np.zeros((n + 1, m + 1), dtype=np.int64)
+    table[1:, 1:] = values.cumsum(axis=0).cumsum(axis=1)
+    x_lo, x_hi = np.clip(np.arange(n) - radius, 0, n), np.clip(np.arange(n) + radius + 1, 0, n)
+    y_lo, y_hi = np.clip(np.arange(m) - radius, 0, m), np.clip(np.arange(m) + radius + 1, 0, m)
+    return (table[x_hi][:, y_hi] - table[x_lo][:, y_hi] - table[x_hi][:, y_lo] + table[x_lo][:, y_lo])
+
+
+def local_density(grid: np.ndarray, animal: int = FISH, radius: int = 2) -> np.ndarray:
+    """
+    :param grid:
+    :param animal: Animal value
+    :param radius: half width of the window
+    :return: fraction of the squares of the window around every square holding that animal
+    """
+    counts = _box_sums((grid == animal).astype(np.int64), radius)
+    squares = _box_sums(np.ones(grid.shape, dtype=np.int64), radius)
+    return counts / squares
+
+
+def fronts(grid: np.ndarray, prey: int = FISH, predator: int = SHARK) -> np.ndarray:
+    """
+    :param grid:
+    :param prey: Animal value
+    :param predator: Animal value
+    :return: boolean grid of the prey squares having a predator among their neighbours
+    """
+    n = grid.shape[0]
+    near = bitboard.neighbour_mask(bitboard.pack(grid == predator), n)
+    return bitboard.unpack(near & bitboard.pack(grid == prey), n)
+
+
+class TurnObserver:
+    """
+    Fed a snapshot of the grid at the end of every turn (and after the initial spawn)
+    """
+
+    def start(self, grid_size: int):
+        """
+        Reset the observer for a new simulation
+        :param grid_size:
+        :return:
+        """
+        return
+
+    def update(self, turn: int, grid: np.ndarray):
+        raise NotImplementedError
+
+
+class SpatialAnalytics(TurnObserver):
+    """
+    Record the spatial metrics of every turn in `records`, one dictionary per turn
+    """
+
+    def __init__(self, block_size: int = 16, every: int = 1, max_radius: int = 10):
+        """
+        :param block_size: side of the blocks of the density maps
+        :param every: compute clusters, fronts and pair correlation every `every` turns only
+        :param max_radius: largest distance of the pair correlation
+        """
+        if block_size < 1 or every < 1:
+            raise ValueError('block_size and every must be positive, got {} and {}'.format(block_size, every))
+        self._block_size = block_size
+        self._every = every
+        self._max_radius = max_radius
+        self._grid_size = None
+        self._previous = None
+        self._blocks = None
+        self._counts = {}
+        self.records = []
+
+    def start(self, grid_size: int):
+        self._grid_size = grid_size
+        nb_blocks = -(-grid_size // self._block_size)
+        x, y = np.divmod(np.arange(grid_size * grid_size), grid_size)
+        self._blocks = (x // self._block_size) * nb_blocks + y // self._block_size
+        self._counts = {a: np.zeros((nb_blocks, nb_blocks), dtype=np.int64) for a in (FISH, SHARK)}
+        self._previous = np.zeros(grid_size * grid_size, dtype=np.int8)
+        self.records = []
+
+    def _update_blocks(self, flat: np.ndarray):
+        changed = np.flatnonzero(flat != self._previous)
+        blocks = self._blocks[changed]
+        for animal, counts in self._counts.items():
+            counts = counts.ravel()
+            np.subtract.at(counts, blocks[self._previous[changed] == animal], 1)
+            np.add.at(counts, blocks[flat[changed] == animal], 1)
+        self._previous = flat.copy()
+        return len(changed)
+
+    def block_density(self, animal: int = FISH) -> np.ndarray:
+        """
+        :param animal: Animal value
+        :return: fraction of the squares of every block holding that animal in the last snapshot
+        """
+        block_squares = np.bincount(self._blocks).reshape(self._counts[animal].shape)
+        return self._counts[animal] / block_squares
+
+    def update(self, turn: int, grid: np.ndarray):
+        if self._blocks is None:
+            self.start(grid.shape[0])
+        record = {'turn': turn, 'changed': self._update_blocks(grid.ravel())}
+        if turn % self._every == 0:
+            for name, animal in (('fish', FISH), ('shark', SHARK)):
+                sizes = cluster_sizes(grid, animal)
+                record['{}_clusters'.format(name)] = len(sizes)
+                record['{}_largest_cluster'.format(name)] = int(sizes.max()) if len(sizes) > 0 else 0
+                record['{}_mean_cluster'.format(name)] = float(sizes.mean()) if len(sizes) > 0 else 0.
+            record['front'] = int(fronts(grid).sum())
+            record['pair_correlation'] = pair_correlation(grid, SHARK, FISH, self._max_radius)
+        self.records.append(record)
+
+    def series(self, key: str) -> List:
+        """
+        :param key: record key
+        :return: values of that key over the turns it was computed
+        """
+        return [record[key] for record in self.records if key in record]
+
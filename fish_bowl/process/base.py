@@ -1,32 +1,93 @@
 from collections import namedtuple
+from contextlib import contextmanager
+import copy
 import random
 import logging
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple, TYPE_CHECKING
 
-import pandas as pd
-
-from fish_bowl.dataio.persistence import SimulationClient
+from fish_bowl.dataio.backends import StorageBackend
 from fish_bowl.process.utils import Animal, ImpossibleAction, EndOfSimulatioError
-from fish_bowl.process.topology import SquareGridCoordinate, square_grid_neighbours
+from fish_bowl.process.topology import SquareGridCoordinate, square_grid_neighbours, skip_neighbour_draws
+from fish_bowl.process.termination import TerminationDetector, SharkExtinction
+
+if TYPE_CHECKING:
+    # the engine itself doesn't need pandas, only backends returning DataFrames do
+    import numpy as np
+    import pandas as pd
+    from fish_bowl.process.analytics import TurnObserver
+    from fish_bowl.process.occupancy import TurnOccupancy
 
 _logger = logging.getLogger(__name__)
 
+# columns loaded by the breed and move phases
+BREED_COLUMNS = ('oid', 'coord_x', 'coord_y', 'spawn_turn', 'last_breed', 'breed_count')
+MOVE_COLUMNS = ('oid', 'coord_x', 'coord_y', 'spawn_turn')
+
 
 class SimulationGrid:
 
-    def __init__(self, persistence: SimulationClient, simulation_parameters: Dict):
+    def __init__(self, persistence: StorageBackend, simulation_parameters: Optional[Dict] = None,
+                 detectors: Optional[Sequence[TerminationDetector]] = None,
+                 observers: Optional[Sequence['TurnObserver']] = None, sim_id: Optional[int] = None,
+                 random_state: Optional[Tuple] = None, check_invariants: bool = True,
+                 occupancy_budget: Optional[int] = None):
         """
         Create a simulation and link to its persistence
         :param persistence:
-        :param simulation_parameters:
+        :param simulation_parameters: parameters of the new simulation
+        :param detectors: termination detectors checked at the end of every turn, shark extinction by default
+        :param observers: turn observers (see fish_bowl.process.analytics) fed a grid snapshot at the end of every
+        turn
+        :param sim_id: continue this existing simulation from its last logged turn instead of creating one
+        :param random_state: random.getstate() of the random stream of this simulation, swapped with the one of the
+        random module while a turn is played. The random module stream is used if None
+        :param check_invariants: check the live animals at the end of every turn (see fish_bowl.process.invariants),
+        raising InvariantError if the grid is inconsistent
+        :param occupancy_budget: bytes the occupancy of a turn can take, above it the occupancy is bit-packed
+        (see fish_bowl.process.occupancy). No limit if None
         """
-        # TODO: create a new simulation from existing parameters by providing an existing sid
+        if (simulation_parameters is None) == (sim_id is None):
+            raise ValueError('Either simulation_parameters or sim_id must be given')
         self._persistence = persistence
+        self._random_state = random_state
+        self._end_reason = None
+        # occupancy of the live animals, kept up to date by the turns played, see _occupancy
+        self._turn_occupancy = None
+        self._occupancy_budget = occupancy_budget
+        self._check_invariants = check_invariants
+        # oids moved since the last logged turn
+        self._turn_moves = []
+        if sim_id is None:
+            grid_size = simulation_parameters['grid_size']
+        else:
+            grid_size = persistence.get_simulation(sim_id).grid_size
+        self._detectors = list(detectors) if detectors is not None else [SharkExtinction()]
+        for detector in self._detectors:
+            detector.start(grid_size)
+        self._observers = list(observers) if observers is not None else []
+        for observer in self._observers:
+            observer.start(grid_size)
 
+        if sim_id is not None:
+            self._sid = sim_id
+            self._sim_turn = persistence.get_last_turn(sim_id)
+            if self._sim_turn is None:
+                raise ValueError('Simulation {} has no logged turn to continue from'.format(sim_id))
+            return
         # initialize simulation
         self._sid = self._persistence.init_simulation(**simulation_parameters)
         self._sim_turn = 0
-        self._spawn()
+        with self._random_stream():
+            self._spawn()
+        self._log_turn()
+
+    @property
+    def sim_id(self) -> int:
+        return self._sid
+
+    @property
+    def sim_turn(self) -> int:
+        return self._sim_turn
 
     def display_grid(self):
         """
@@ -40,14 +101,19 @@ class SimulationGrid:
             sim_id = self._sid
         return self._persistence.get_simulation(sim_id=sim_id)
 
-    def get_simulation_grid_data(self) -> pd.DataFrame:
+    def get_simulation_grid_data(self) -> 'pd.DataFrame':
         return self._persistence.get_animals_df(sim_id=self._sid)
 
+    def get_grid(self) -> 'np.ndarray':
+        """
+        Grid with Animal values (0 for empty squares), indexed by [x, y]
+        """
+        from fish_bowl.process.analytics import grid_array
+        return grid_array(self._persistence, self._sid, self.get_simulation_parameters().grid_size)
+
     @property
-    def population(self):
-        grid = self.get_simulation_grid_data()
-        population = grid[grid['alive']].animal_type.value_counts()
-        return population
+    def population(self) -> Dict[Animal, int]:
+        return self._persistence.count_animals(sim_id=self._sid)
 
     def persist_to_file(self, filename):
         population = self.population
@@ -57,6 +123,116 @@ class SimulationGrid:
                 fp.write('Turn, Fish, Sharks\n')
             fp.write(nb + '\n')
 
+    @contextmanager
+    def _random_stream(self):
+        """
+        Play with the random stream of this simulation, if it has its own
+        """
+        if self._random_state is None:
+            yield
+            return
+        outer = random.getstate()
+        random.setstate(self._random_state)
+        try:
+            yield
+        finally:
+            self._random_state = random.getstate()
+            random.setstate(outer)
+
+    def fork(self, seed: Optional[int] = None, **parameters) -> 'SimulationGrid':
+        """
+        Branch of the simulation: a clone of its current state with its own sid and random stream, that can then
+        be played independently of this one. Detectors and observers are copied with their state.
+        :param seed: seed of the random stream of the branch. If None the branch starts from the current state of
+        the stream of this simulation, and plays the same turns as long as parameters are unchanged
+        :param parameters: simulation parameters changed in the branch, see backends.CLONE_PARAMETERS
+        :return: engine of the branch, of the same class as this one
+        """
+        if seed is not None:
+            random_state = random.Random(seed).getstate()
+        elif self._random_state is not None:
+            random_state = self._random_state
+        else:
+            random_state = random.getstate()
+        sid = self._persistence.clone_simulation(self._sid, **parameters)
+        branch = type(self)(persistence=self._persistence, sim_id=sid, detectors=[], random_state=random_state,
+                            check_invariants=self._check_invariants, occupancy_budget=self._occupancy_budget)
+        branch._detectors = copy.deepcopy(self._detectors)
+        branch._observers = copy.deepcopy(self._observers)
+        branch._end_reason = self._end_reason
+        _logger.debug('Simulation {} forked at turn {} into {}'.format(self._sid, self._sim_turn, sid))
+        return branch
+
+    @property
+    def end_reason(self) -> Optional[str]:
+        """
+        Why the simulation ended, None while it is running
+        """
+        return self._end_reason
+
+    def _log_turn(self):
+        """
+        Record the population of the turn that just completed and feed it to the termination detectors, then the
+        grid to the observers
+        :return:
+        """
+        if self._check_invariants:
+            self._verify_turn()
+        self._turn_moves = []
+        population = self._persistence.count_animals(sim_id=self._sid)
+        self._keep_occupancy(population)
+        self._persistence.log_turn(sim_id=self._sid, turn=self._sim_turn, population=population)
+        for detector in self._detectors:
+            reason = detector.update(self._sim_turn, population.get(Animal.Fish, 0), population.get(Animal.Shark, 0))
+            if reason is not None and self._end_reason is None:
+                self._end_reason = reason
+        if len(self._observers) > 0:
+            grid = self.get_grid()
+            for observer in self._observers:
+                observer.update(self._sim_turn, grid)
+
+    def _verify_turn(self):
+        """
+        Check the invariants of the live animals, once the turn has been played
+        """
+        from fish_bowl.process.invariants import COLUMNS, InvariantError, find_violations
+        arrays = self._persistence.get_animal_arrays(sim_id=self._sid, columns=COLUMNS)
+        violations = find_violations(self.get_simulation_parameters().grid_size, arrays, moved=self._turn_moves)
+        if len(violations) > 0:
+            raise InvariantError(self._sid, self._sim_turn, violations)
+
+    def _move_animal(self, oid: int, position: SquareGridCoordinate):
+        self._persistence.move_animal(sim_id=self._sid, animal_id=oid, new_position=position)
+        self._turn_moves.append(oid)
+
+    def _occupancy(self) -> 'TurnOccupancy':
+        """
+        Occupancy kept up to date by the phases of the turns played, built from the persistence by the first turn.
+        A phase called on its own before that gets the occupancy of the current state of the persistence
+        """
+        if self._turn_occupancy is not None:
+            return self._turn_occupancy
+        from fish_bowl.process.occupancy import turn_occupancy
+        return turn_occupancy(self._persistence, self._sid, self.get_simulation_parameters().grid_size,
+                              memory_budget=self._occupancy_budget)
+
+    def _keep_occupancy(self, population: Dict[Animal, int]):
+        """
+        Keep the occupancy for the next turn if it still matches the logged population and its form still fits the
+        density of the grid, otherwise the next turn builds a new one
+        """
+        occupancy = self._turn_occupancy
+        if occupancy is None:
+            return
+        from fish_bowl.process.occupancy import occupancy_mode
+        if any(occupancy.count(a.value) != population.get(a, 0) for a in Animal):
+            _logger.warning('Occupancy of simulation {} out of step with its animals at turn {}, rebuilding '
+                            'it'.format(self._sid, self._sim_turn))
+            self._turn_occupancy = None
+        elif occupancy_mode(occupancy.grid_size, sum(population.values()), memory_budget=self._occupancy_budget,
+                            current=occupancy.mode) != occupancy.mode:
+            self._turn_occupancy = None
+
     def _spawn(self):
         """
         function to create the grid by spawning fishes and sharks initially (and only at start)
@@ -95,11 +271,15 @@ class SimulationGrid:
         """
         _debug = 'Turn: {:<3} - Deads - '.format(self._sim_turn)
         simulation_params = self.get_simulation_parameters(self._sid)
-        sharks = self._persistence.get_animals_by_type(sim_id=self._sid, animal_type=Animal.Shark)
+        occupancy = self._occupancy()
+        sharks = self._persistence.get_animal_tuples(sim_id=self._sid,
+                                                     columns=('oid', 'last_fed', 'coord_x', 'coord_y'),
+                                                     animal_type=Animal.Shark)
         sharks_starving = []
-        for idx, shark in sharks.iterrows():
+        for shark in sharks:
             if (self._sim_turn - shark.last_fed) > simulation_params.shark_starving:
                 sharks_starving.append(shark.oid)
+                occupancy.set(shark.coord_x, shark.coord_y, 0)
         if len(sharks_starving) > 0:
             _logger.info('{}Found {} shark starving'.format(_debug, len(sharks_starving)))
             self._persistence.kill_animal(sim_id=self._sid, animal_ids=sharks_starving)
@@ -112,16 +292,24 @@ class SimulationGrid:
         """
         _debug = 'Turn: {:<3} - Eat - '.format(self._sim_turn)
         simulation_params = self.get_simulation_parameters(self._sid)
-        # get a randomized df of all sharks
-        sharks = self._persistence.get_animals_by_type(sim_id=self._sid, animal_type=Animal.Shark).sample(frac=1)
+        occupancy = self._occupancy()
+        occupancy.start_phase()
+        # get a randomized list of all sharks
+        sharks = self._persistence.get_animal_tuples(sim_id=self._sid, columns=('oid', 'coord_x', 'coord_y'),
+                                                     animal_type=Animal.Shark)
+        random.shuffle(sharks)
         sharks_eating = dict()
         shark_update = dict()
-        for idx, shark in sharks.iterrows():
+        for shark in sharks:
+            if not occupancy.has_fish_neighbour(shark.coord_x, shark.coord_y):
+                # nothing to eat, only keep the random stream in step
+                skip_neighbour_draws(simulation_params.grid_size, shark.coord_x, shark.coord_y)
+                continue
             # get shark neighbour square
             shark_position = SquareGridCoordinate(shark.coord_x, shark.coord_y)
             shark_neighbour = square_grid_neighbours(simulation_params.grid_size, shark_position)
             # try to find fish
-            has_fish = self._persistence.has_fish_in_square(sim_id=self._sid, coordinates=shark_neighbour)
+            has_fish = occupancy.fish_in(shark_neighbour)
             if len(has_fish) > 0:
                 # Shark is eating
                 random.shuffle(has_fish)
@@ -132,14 +320,12 @@ class SimulationGrid:
                     # keep shark ref and position
                     sharks_eating[shark.oid] = shark_position
                     # move shark to eating position
-                    self._persistence.move_animal(sim_id=self._sid, animal_id=shark.oid,
-                                                  new_position=eating_coord)
+                    self._move_animal(shark.oid, eating_coord)
+                    occupancy.move(shark_position.x, shark_position.y, eating_coord.x, eating_coord.y)
                     # add to update dictionary
                     shark_update[shark.oid] = {'last_fed': self._sim_turn}
                 else:
                     raise ImpossibleAction('Something went wrong in Shark: {} feeding in {}'.format(shark, has_fish[0]))
-            else:
-                _logger.debug('{}turn: {}, No fish to eat for shark {}'.format(_debug, self._sim_turn, shark.oid))
         self._persistence.update_animals(sim_id=self._sid, update_dict=shark_update)
         _logger.debug('{}{} sharks have eaten'.format(_debug, len(sharks_eating)))
         return sharks_eating
@@ -155,11 +341,15 @@ class SimulationGrid:
         # perform breed for
         _debug = 'Turn: {:<3} - Breed - '.format(self._sim_turn)
         simulation_params = self.get_simulation_parameters(self._sid)
+        occupancy = self._occupancy()
+        occupancy.start_phase()
         moved = []
         to_update = {}
         # First for sharks
-        sharks = self._persistence.get_animals_by_type(sim_id=self._sid, animal_type=Animal.Shark).sample(frac=1)
-        for idx, shark in sharks.iterrows():
+        sharks = self._persistence.get_animal_tuples(sim_id=self._sid, columns=BREED_COLUMNS,
+                                                     animal_type=Animal.Shark)
+        random.shuffle(sharks)
+        for shark in sharks:
             # can shark breed?
             if (((self._sim_turn - shark.spawn_turn) >= simulation_params.shark_breed_maturity) and
                     ((self._sim_turn - shark.last_breed) >= simulation_params.shark_breed_maturity)):
@@ -170,7 +360,7 @@ class SimulationGrid:
                     if shark.oid in fed_sharks:
                         # ...if shark has eaten...
                         breed_coord = fed_sharks[shark.oid]
-                        if self._persistence.coordinate_is_occupied(self._sid, breed_coord):
+                        if occupancy.is_occupied(breed_coord.x, breed_coord.y):
                             # someone took that space before breeding
                             _logger.debug('{}This shark {} breeding has fed and moved,' +
                                           ' cannot breed in {} because position is taken'.format(_debug, shark.oid,
@@ -181,16 +371,20 @@ class SimulationGrid:
                                                                                                           breed_coord))
                         # shark has already moved to eating position
                         moved.append(shark.oid)
+                    elif not occupancy.has_free_neighbour(shark.coord_x, shark.coord_y):
+                        # ... boxed in, can't breed
+                        skip_neighbour_draws(simulation_params.grid_size, shark.coord_x, shark.coord_y)
                     else:
                         # ... or if free space is available
                         neighbors = square_grid_neighbours(simulation_params.grid_size,
                                                            SquareGridCoordinate(shark.coord_x,
                                                                                 shark.coord_y))
                         for neigh in neighbors:
-                            if not self._persistence.coordinate_is_occupied(self._sid, neigh):
+                            if not occupancy.is_occupied(neigh.x, neigh.y):
                                 breed_coord = SquareGridCoordinate(int(shark.coord_x), int(shark.coord_y))
                                 # move shark to this slot
-                                self._persistence.move_animal(sim_id=self._sid, animal_id=shark.oid, new_position=neigh)
+                                self._move_animal(shark.oid, neigh)
+                                occupancy.move(breed_coord.x, breed_coord.y, neigh.x, neigh.y)
                                 moved.append(shark.oid)
                                 _logger.debug('{}Shark {} not fed breeding in {}, moving to {}'.format(_debug,
                                                                                                        shark.oid,
@@ -204,15 +398,22 @@ class SimulationGrid:
                         new_oid = self._persistence.init_animal(sim_id=self._sid, current_turn=self._sim_turn,
                                                                 animal_type=Animal.Shark, coordinate=breed_coord,
                                                                 last_fed=self._sim_turn)
+                        occupancy.set(breed_coord.x, breed_coord.y, Animal.Shark.value)
                         _logger.debug('{}Spawning new shark {} {}'.format(_debug, new_oid, breed_coord))
         # Last Fishes, randomize
-        fishes = self._persistence.get_animals_by_type(sim_id=self._sid, animal_type=Animal.Fish).sample(frac=1)
-        for idx, fish in fishes.iterrows():
+        fishes = self._persistence.get_animal_tuples(sim_id=self._sid, columns=BREED_COLUMNS,
+                                                     animal_type=Animal.Fish)
+        random.shuffle(fishes)
+        for fish in fishes:
             # can fish breed?
             if (((self._sim_turn - fish.spawn_turn) >= simulation_params.fish_breed_maturity) and
                     ((self._sim_turn - fish.last_breed) >= simulation_params.fish_breed_maturity)):
                 # fish can breed
                 if random.randint(0, 100) <= simulation_params.fish_breed_probability:
+                    if not occupancy.has_free_neighbour(fish.coord_x, fish.coord_y):
+                        # boxed in, can't breed
+                        skip_neighbour_draws(simulation_params.grid_size, fish.coord_x, fish.coord_y)
+                        continue
                     # fish is possibly breeding if free space is available
                     breed_coord = SquareGridCoordinate(int(fish.coord_x), int(fish.coord_y))
                     _logger.debug('{}Fish breeding in {} if space is available'.format(_debug, breed_coord))
@@ -220,18 +421,19 @@ class SimulationGrid:
                                                        SquareGridCoordinate(fish.coord_x,
                                                                             fish.coord_y))
                     for neigh in neighbors:
-                        if not self._persistence.coordinate_is_occupied(self._sid, neigh):
+                        if not occupancy.is_occupied(neigh.x, neigh.y):
                             _logger.debug('{}Space found in {}, fish breed and move'.format(_debug, neigh))
                             to_update[fish.oid] = {'last_breed': self._sim_turn,
                                                    'breed_count': fish.breed_count + 1}
                             # move fish to this slot
-                            self._persistence.move_animal(sim_id=self._sid, animal_id=fish.oid,
-                                                          new_position=neigh)
+                            self._move_animal(fish.oid, neigh)
                             moved.append(fish.oid)
                             # spawn new fish in breed_coord
                             self._persistence.init_animal(sim_id=self._sid, current_turn=self._sim_turn,
                                                           animal_type=Animal.Fish, coordinate=breed_coord,
                                                           last_fed=self._sim_turn)
+                            occupancy.move(breed_coord.x, breed_coord.y, neigh.x, neigh.y)
+                            occupancy.set(breed_coord.x, breed_coord.y, Animal.Fish.value)
                             # break out of loop
                             break
         # now, update all animals
@@ -270,8 +472,13 @@ class SimulationGrid:
         """
         _debug = 'Turn: {:<3} - Move - '.format(self._sim_turn)
         simulation_params = self.get_simulation_parameters(self._sid)
-        animals = self._persistence.get_animals_by_type(sim_id=self._sid, animal_type=animal_type).sample(frac=1)
-        for _, animal in animals.iterrows():
+        occupancy = self._occupancy()
+        occupancy.start_phase()
+        already_moved = set(already_moved)
+        animals = self._persistence.get_animal_tuples(sim_id=self._sid, columns=MOVE_COLUMNS,
+                                                      animal_type=animal_type)
+        random.shuffle(animals)
+        for animal in animals:
             if animal.oid in already_moved:
                 # this one has already moved so not moving
                 _logger.debug('{}{} already moved'.format(_debug, animal.oid))
@@ -280,25 +487,30 @@ class SimulationGrid:
                 # fish was just spawn, not moving
                 _logger.debug('{}{} just spawned'.format(_debug, animal.oid))
                 continue
+            elif not occupancy.has_free_neighbour(animal.coord_x, animal.coord_y):
+                # boxed in, only keep the random stream in step
+                skip_neighbour_draws(simulation_params.grid_size, animal.coord_x, animal.coord_y)
             else:
-                neighbors = square_grid_neighbours(simulation_params.grid_size, SquareGridCoordinate(animal.coord_x,
-                                                                                                     animal.coord_y))
+                position = SquareGridCoordinate(animal.coord_x, animal.coord_y)
+                neighbors = square_grid_neighbours(simulation_params.grid_size, position)
                 for neigh in neighbors:
-                    if not self._persistence.coordinate_is_occupied(self._sid, neigh):
+                    if not occupancy.is_occupied(neigh.x, neigh.y):
                         # move animal to this slot
                         _logger.debug('{}{} moved to {}'.format(_debug, animal_type.name, neigh))
-                        self._persistence.move_animal(sim_id=self._sid, animal_id=animal.oid, new_position=neigh)
+                        self._move_animal(animal.oid, neigh)
+                        occupancy.move(position.x, position.y, neigh.x, neigh.y)
+                        position = neigh
                     else:
                         _logger.debug('{}{}: {} had no space to move to'.format(_debug, animal_type.name, animal.oid))
         return
 
     def check_simulation_ends(self):
         """
-        Simulation ends if Sharks have disappeared
+        Simulation ends as soon as one of the termination detectors fired (by default when Sharks have disappeared)
         :return:
         """
-        if len(self._persistence.get_animals_by_type(sim_id=self._sid, animal_type=Animal.Shark)) == 0:
-            raise EndOfSimulatioError('Simulation ends because no more Sharks')
+        if self._end_reason is not None:
+            raise EndOfSimulatioError(self._end_reason)
 
     def play_turn(self):
         """
@@ -313,11 +525,19 @@ class SimulationGrid:
         :return:
         """
         _logger.debug('********************TURN: {:<3}********************'.format(self._sim_turn))
-        self._check_deads()
-        fed_sharks = self._eat()
-        moved_animals = self._breed_and_move(fed_sharks=fed_sharks)
-        self._move(already_moved=moved_animals)
-        self._sim_turn += 1
+        self._turn_occupancy = self._occupancy()
+        try:
+            with self._random_stream():
+                self._check_deads()
+                fed_sharks = self._eat()
+                moved_animals = self._breed_and_move(fed_sharks=fed_sharks)
+                self._move(already_moved=moved_animals)
+            self._sim_turn += 1
+            self._log_turn()
+        except Exception:
+            # the occupancy may hold part of the turn
+            self._turn_occupancy = None
+            raise
         _logger.debug('********************END***************************'.format(self._sim_turn))
         self.check_simulation_ends()
         return
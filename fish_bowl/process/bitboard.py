@@ -0,0 +1,301 @@
+"""
+Bit-packed boards of the grid
+
+A board is one bit per square: a (grid_size, words) uint64 array, bit b of word w of row x being square
+(x, 64 * w + b). The bits past grid_size in the last word of every row are always 0.
+
+Neighbourhood masks of the whole grid are computed with shifts and ORs, 64 squares per operation:
+neighbour_mask(board) has the bits of the squares with at least one of their 8 neighbours set in board (the grid
+does not wrap around). A row is first spread along y (b | b << 1 | b >> 1, with the carries between words), then
+the spread rows above and below are ORed in.
+
+BitboardOccupancy is the occupancy of SimulationGrid (see occupancy.TurnOccupancy) stored as a fish board and a shark
+board: 2 bits per square instead of the lists of kinds and neighbour counts, so that the occupancy of a large grid
+fits in cache. Neighbour counts are read from the 3 x 3 block of bits around a square. The engine only needs to know
+whether an animal has a free neighbour or a fish neighbour: every phase computes both masks with neighbour_mask and
+tests one bit per animal (see BitboardOccupancy.start_phase).
+"""
+import array
+from typing import List
+
+import numpy as np
+
+from fish_bowl.process.topology import SquareGridCoordinate
+from fish_bowl.process.utils import Animal
+
+EMPTY = 0
+FISH = Animal.Fish.value
+SHARK = Animal.Shark.value
+
+WORD_BITS = 64
+_ONE = np.uint64(1)
+_TOP = np.uint64(WORD_BITS - 1)
+_WORD = (1 << WORD_BITS) - 1
+# number of bits set in a 3 bits value
+_POPCOUNT3 = (0, 1, 1, 2, 1, 2, 2, 3)
+
+
+def words_per_row(grid_size: int) -> int:
+    return (grid_size + WORD_BITS - 1) // WORD_BITS
+
+
+def pack(mask: np.ndarray) -> np.ndarray:
+    """
+    Board of a (grid_size, grid_size) boolean mask
+    """
+    n = mask.shape[0]
+    padded = np.zeros((n, words_per_row(n) * WORD_BITS), dtype=bool)
+    padded[:, :mask.shape[1]] = mask
+    return np.packbits(padded, axis=1, bitorder='little').view(np.dtype('<u8'))
+
+
+def unpack(board: np.ndarray, grid_size: int) -> np.ndarray:
+    """
+    (grid_size, grid_size) boolean mask of a board
+    """
+    bits = np.unpackbits(board.astype(np.dtype('<u8')).view(np.uint8), axis=1, bitorder='little')
+    return bits[:, :grid_size].astype(bool)
+
+
+def valid_mask(grid_size: int) -> np.ndarray:
+    """
+    Board with the bits of every square of the grid set
+    """
+    return pack(np.ones((grid_size, grid_size), dtype=bool))
+
+
+def shift_up(board: np.ndarray) -> np.ndarray:
+    """
+    out[x, y] = board[x, y - 1]
+    """
+    out = board << _ONE
+    out[:, 1:] |= board[:, :-1] >> _TOP
+    return out
+
+
+def shift_down(board: np.ndarray) -> np.ndarray:
+    """
+    out[x, y] = board[x, y + 1]
+    """
+    out = board >> _ONE
+    out[:, :-1] |= board[:, 1:] << _TOP
+    return out
+
+
+def neighbour_mask(board: np.ndarray, grid_size: int) -> np.ndarray:
+    """
+    Board of the squares having at least one neighbour set in board
+    """
+    sides = shift_up(board) | shift_down(board)
+    spread = sides | board
+    out = sides
+    out[1:] |= spread[:-1]
+    out[:-1] |= spread[1:]
+    # shift_up carries bits past grid_size
+    return out & valid_mask(grid_size)
+
+
+def free_neighbour_mask(fish: np.ndarray, shark: np.ndarray, grid_size: int) -> np.ndarray:
+    """
+    Board of the squares having at least one free neighbour
+    """
+    return neighbour_mask(valid_mask(grid_size) & ~(fish | shark), grid_size)
+
+
+class BitboardOccupancy:
+    """
+    Occupancy of the grid as two boards, see occupancy.TurnOccupancy for the interface. The words are kept in
+    array.array buffers, read and written as python ints by the engine, and seen as numpy boards without copy by the
+    whole grid masks
+    """
+    mode = 'bitboard'
+
+    def __init__(self, grid: np.ndarray):
+        """
+        :param grid: (grid_size, grid_size) Animal values indexed by [x, y], 0 for empty squares
+        """
+        n = grid.shape[0]
+        self._size = n
+        self._words = words_per_row(n)
+        self._fish = array.array('Q', pack(grid == FISH).tobytes())
+        self._shark = array.array('Q', pack(grid == SHARK).tobytes())
+        self._counts = {FISH: int((grid == FISH).sum()), SHARK: int((grid == SHARK).sum())}
+        # masks of the phase being played, see start_phase
+        self._free_mask = None
+        self._fish_mask = None
+
+    @classmethod
+    def from_arrays(cls, arrays, grid_size: int) -> 'BitboardOccupancy':
+        """
+        Occupancy of animals read as analytics.GRID_COLUMNS arrays
+        """
+        from fish_bowl.process.analytics import grid_from_arrays
+        return cls(grid_from_arrays(arrays, grid_size))
+
+    @property
+    def grid_size(self) -> int:
+        return self._size
+
+    def count(self, kind: int) -> int:
+        """
+        Number of squares holding an animal type
+        """
+        return self._counts[kind]
+
+    @property
+    def nbytes(self) -> int:
+        return (len(self._fish) + len(self._shark)) * self._fish.itemsize
+
+    def _board(self, words: array.array) -> np.ndarray:
+        return np.frombuffer(words, dtype=np.dtype('<u8')).reshape(self._size, self._words)
+
+    def fish_board(self) -> np.ndarray:
+        return self._board(self._fish).copy()
+
+    def shark_board(self) -> np.ndarray:
+        return self._board(self._shark).copy()
+
+    def free_neighbour_mask(self) -> np.ndarray:
+        """
+        Board of the squares having at least one free neighbour
+        """
+        return free_neighbour_mask(self._board(self._fish), self._board(self._shark), self._size)
+
+    def fish_neighbour_mask(self) -> np.ndarray:
+        """
+        Board of the squares having at least one fish neighbour
+        """
+        return neighbour_mask(self._board(self._fish), self._size)
+
+    def start_phase(self):
+        """
+        Compute the free neighbour and fish neighbour masks of the whole grid, word-parallel, for has_free_neighbour
+        and has_fish_neighbour. Until the next phase, set only adds bits to the free mask, those of the neighbours of
+        a square that becomes free, and drops the fish mask when a fish arrives. A square whose neighbours fill up
+        keeps its bit: the engine then looks for a free square or a fish and finds none, which plays the same as
+        skipping the animal
+        """
+        self._free_mask = array.array('Q', self.free_neighbour_mask().tobytes())
+        self._fish_mask = array.array('Q', self.fish_neighbour_mask().tobytes())
+
+    def has_free_neighbour(self, x: int, y: int) -> bool:
+        if self._free_mask is None:
+            return self.free_neighbours(x, y) > 0
+        w, b = divmod(y, WORD_BITS)
+        return bool(self._free_mask[x * self._words + w] >> b & 1)
+
+    def has_fish_neighbour(self, x: int, y: int) -> bool:
+        if self._fish_mask is None:
+            return self.fish_neighbours(x, y) > 0
+        w, b = divmod(y, WORD_BITS)
+        return bool(self._fish_mask[x * self._words + w] >> b & 1)
+
+    def _mark_neighbours(self, mask: array.array, x: int, y: int):
+        """
+        Set the bits of the neighbours of (x, y) in a mask
+        """
+        w, b = divmod(y, WORD_BITS)
+        # bits y - 1, y, y + 1 of the rows above and below, y - 1 and y + 1 of the row of (x, y)
+        for nx, bits in ((x - 1, 7), (x, 5), (x + 1, 7)):
+            if 0 <= nx < self._size:
+                i = nx * self._words + w
+                if b > 0:
+                    mask[i] |= (bits << (b - 1)) & _WORD
+                    if b == WORD_BITS - 1 and w + 1 < self._words:
+                        mask[i + 1] |= bits >> 2
+                else:
+                    mask[i] |= bits >> 1
+                    if w > 0:
+                        mask[i - 1] |= (bits & 1) << (WORD_BITS - 1)
+
+    def kind(self, x: int, y: int) -> int:
+        """
+        Animal value in the square, 0 if empty
+        """
+        w, b = divmod(y, WORD_BITS)
+        i = x * self._words + w
+        if self._fish[i] >> b & 1:
+            return FISH
+        if self._shark[i] >> b & 1:
+            return SHARK
+        return EMPTY
+
+    def is_occupied(self, x: int, y: int) -> bool:
+        w, b = divmod(y, WORD_BITS)
+        i = x * self._words + w
+        return bool((self._fish[i] | self._shark[i]) >> b & 1)
+
+    def _row_bits(self, words: array.array, other: array.array, i: int, w: int, b: int) -> int:
+        """
+        Bits y - 1, y, y + 1 of the row starting at word index i - w, y = 64 * w + b, from words | other
+        """
+        if 0 < b < WORD_BITS - 1:
+            return ((words[i] | other[i]) >> (b - 1)) & 7
+        if b == 0:
+            bits = ((words[i] | other[i]) & 3) << 1
+            if w > 0:
+                bits |= (words[i - 1] | other[i - 1]) >> (WORD_BITS - 1)
+            return bits
+        bits = (words[i] | other[i]) >> (b - 1)
+        if w + 1 < self._words:
+            bits |= ((words[i + 1] | other[i + 1]) & 1) << 2
+        return bits
+
+    def _count(self, x: int, y: int, words: array.array, other: array.array) -> int:
+        """
+        Number of the 8 neighbours of (x, y) set in words | other
+        """
+        w, b = divmod(y, WORD_BITS)
+        i = x * self._words + w
+        count = _POPCOUNT3[self._row_bits(words, other, i, w, b) & 5]
+        if x > 0:
+            count += _POPCOUNT3[self._row_bits(words, other, i - self._words, w, b)]
+        if x + 1 < self._size:
+            count += _POPCOUNT3[self._row_bits(words, other, i + self._words, w, b)]
+        return count
+
+    def free_neighbours(self, x: int, y: int) -> int:
+        n = self._size
+        squares = (1 + (x > 0) + (x + 1 < n)) * (1 + (y > 0) + (y + 1 < n)) - 1
+        return squares - self._count(x, y, self._fish, self._shark)
+
+    def fish_neighbours(self, x: int, y: int) -> int:
+        # fish | fish: the fish neighbours alone
+        return self._count(x, y, self._fish, self._fish)
+
+    def fish_in(self, coordinates: List[SquareGridCoordinate]) -> List[SquareGridCoordinate]:
+        """
+        Coordinates holding a fish, in the order they were given
+        """
+        fish, words = self._fish, self._words
+        return [c for c in coordinates if fish[c.x * words + c.y // WORD_BITS] >> (c.y % WORD_BITS) & 1]
+
+    def set(self, x: int, y: int, kind: int):
+        """
+        Change the content of a square
+        :param x:
+        :param y:
+        :param kind: Animal value, 0 to empty the square
+        """
+        old = self.kind(x, y)
+        if old == kind:
+            return
+        if old != EMPTY:
+            self._counts[old] -= 1
+        if kind != EMPTY:
+            self._counts[kind] += 1
+        w, b = divmod(y, WORD_BITS)
+        i = x * self._words + w
+        bit = 1 << b
+        self._fish[i] = self._fish[i] | bit if kind == FISH else self._fish[i] & ~bit
+        self._shark[i] = self._shark[i] | bit if kind == SHARK else self._shark[i] & ~bit
+        if kind == EMPTY and self._free_mask is not None:
+            self._mark_neighbours(self._free_mask, x, y)
+        elif kind == FISH:
+            # fish only arrive after the eat phase, the only one reading the fish mask: fall back to the counts
+            self._fish_mask = None
+
+    def move(self, x: int, y: int, new_x: int, new_y: int):
+        kind = self.kind(x, y)
+        self.set(x, y, EMPTY)
+        self.set(new_x, new_y, kind)
@@ -0,0 +1,451 @@
+"""
+Parallel engine based on a colouring of the grid
+
+An animal only reads and writes the squares of its neighbourhood (SQUARE_NEIGH, reach 1 around it), so two animals
+at least 2 * reach + 1 squares apart in x or y can't compete for a square. Colouring the squares by
+(x mod 3, y mod 3) gives 9 classes whose animals can act at the same time. Each phase of the turn sweeps the
+classes one after the other, in an order drawn for the turn, and the animals of a class act in parallel threads.
+
+Rules are the ones of SimulationGrid, but the order in which animals act differs (class by class instead of a
+shuffle of all animals), so trajectories are not the ones of the sequential engines. Random draws come from a
+counter based generator keyed by (seed, turn, phase, square), so a run only depends on its seed, not on the number
+of threads.
+
+Requires numba for the parallel sweep, otherwise runs sequentially as plain Python.
+"""
+import logging
+import random
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.ensemble import neighbour_table
+from fish_bowl.process.termination import TerminationDetector, SharkExtinction
+from fish_bowl.process.topology import SQUARE_NEIGH
+from fish_bowl.process.utils import Animal, EndOfSimulatioError
+
+try:
+    import numba
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+_logger = logging.getLogger(__name__)
+
+EMPTY = 0
+FISH = Animal.Fish.value
+SHARK = Animal.Shark.value
+# animal attributes exchanged with the backends
+ANIMAL_COLUMNS = ('oid', 'animal_type', 'coord_x', 'coord_y', 'spawn_turn', 'last_breed', 'last_fed', 'breed_count')
+# phases of a turn, also part of the random keys
+EAT, BREED_SHARK, BREED_FISH, MOVE_FISH, MOVE_SHARK = range(5)
+
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def neighbourhood_reach() -> int:
+    return max(max(abs(dx), abs(dy)) for dx, dy in SQUARE_NEIGH.values())
+
+
+def colour_classes(grid_size: int) -> List[np.ndarray]:
+    """
+    Flat indices (x * grid_size + y) of the squares of each colour, squares of a colour are far enough apart for
+    their neighbourhoods not to overlap
+    :param grid_size:
+    :return: one array per colour
+    """
+    stride = 2 * neighbourhood_reach() + 1
+    x, y = np.divmod(np.arange(grid_size * grid_size), grid_size)
+    colour = (x % stride) * stride + (y % stride)
+    return [np.flatnonzero(colour == c) for c in range(stride * stride)]
+
+
+@njit(cache=True)
+def _mix(z):
+    z = (z ^ (z >> np.uint64(30))) * _MIX_1
+    z = (z ^ (z >> np.uint64(27))) * _MIX_2
+    return z ^ (z >> np.uint64(31))
+
+
+@njit(cache=True)
+def _key(seed, turn, phase, square):
+    return _mix(np.uint64(seed) ^ _mix(np.uint64(turn) * np.uint64(16) + np.uint64(phase)) ^
+                (np.uint64(square) * _GOLDEN_GAMMA))
+
+
+@njit(cache=True)
+def _uniform(key, draw):
+    z = _mix(key + np.uint64(draw + 1) * _GOLDEN_GAMMA)
+    return float(z >> np.uint64(11)) * (1.0 / 9007199254740992.0)
+
+
+@njit(cache=True)
+def _pick(neigh, cells, square, content, u):
+    """
+    Uniform choice of a neighbour square with the given content, -1 if there is none
+    """
+    count = 0
+    for i in range(neigh.shape[1]):
+        n = neigh[square, i]
+        if n >= 0 and cells[n] == content:
+            count += 1
+    if count == 0:
+        return -1
+    chosen = int(u * count)
+    for i in range(neigh.shape[1]):
+        n = neigh[square, i]
+        if n >= 0 and cells[n] == content:
+            if chosen == 0:
+                return n
+            chosen -= 1
+    return -1
+
+
+@njit(cache=True)
+def _clear(square, cells, oid, acted, fed_from, done):
+    cells[square] = EMPTY
+    oid[square] = -1
+    acted[square] = False
+    fed_from[square] = -1
+    done[square] = False
+
+
+@njit(cache=True)
+def _move(src, dst, cells, oid, spawn_turn, last_breed, last_fed, breed_count, acted, fed_from, done):
+    """
+    Move an animal and its attributes, whatever was in dst is overwritten
+    """
+    cells[dst] = cells[src]
+    oid[dst] = oid[src]
+    spawn_turn[dst] = spawn_turn[src]
+    last_breed[dst] = last_breed[src]
+    last_fed[dst] = last_fed[src]
+    breed_count[dst] = breed_count[src]
+    acted[dst] = acted[src]
+    fed_from[dst] = fed_from[src]
+    done[dst] = done[src]
+    _clear(src, cells, oid, acted, fed_from, done)
+
+
+@njit(cache=True, parallel=True)
+def _sweep(phase, squares, turn, seed, maturity, probability, neigh, cells, oid, spawn_turn, last_breed, last_fed,
+           breed_count, acted, fed_from, done):
+    """
+    One phase on the squares of one colour, each square in its own iteration
+    """
+    kind = FISH if phase == BREED_FISH or phase == MOVE_FISH else SHARK
+    for i in prange(squares.shape[0]):
+        square = squares[i]
+        if cells[square] != kind or done[square]:
+            continue
+        key = _key(seed, turn, phase, square)
+        if phase == EAT:
+            target = _pick(neigh, cells, square, FISH, _uniform(key, 0))
+            if target >= 0:
+                # the fish is eaten, the shark takes its square
+                _move(square, target, cells, oid, spawn_turn, last_breed, last_fed, breed_count, acted, fed_from, done)
+                last_fed[target] = turn
+                acted[target] = True
+                fed_from[target] = square
+                done[target] = True
+        elif phase == BREED_SHARK or phase == BREED_FISH:
+            done[square] = True
+            if turn - spawn_turn[square] < maturity or turn - last_breed[square] < maturity:
+                continue
+            if int(_uniform(key, 1) * 101) > probability:
+                continue
+            parent = -1
+            birth = -1
+            if fed_from[square] >= 0:
+                if cells[fed_from[square]] == EMPTY:
+                    parent = square
+                    birth = fed_from[square]
+            else:
+                target = _pick(neigh, cells, square, EMPTY, _uniform(key, 2))
+                if target >= 0:
+                    _move(square, target, cells, oid, spawn_turn, last_breed, last_fed, breed_count, acted,
+                          fed_from, done)
+                    parent = target
+                    birth = square
+            if parent >= 0:
+                last_breed[parent] = turn
+                breed_count[parent] += 1
+                acted[parent] = True
+                cells[birth] = kind
+                # numbered once the turn is played, in square order
+                oid[birth] = -1
+                spawn_turn[birth] = turn
+                last_fed[birth] = turn
+                last_breed[birth] = 0
+                breed_count[birth] = 0
+                acted[birth] = False
+                fed_from[birth] = -1
+                done[birth] = True
+        else:
+            done[square] = True
+            if acted[square] or spawn_turn[square] == turn:
+                continue
+            target = _pick(neigh, cells, square, EMPTY, _uniform(key, 3))
+            if target >= 0:
+                _move(square, target, cells, oid, spawn_turn, last_breed, last_fed, breed_count, acted, fed_from, done)
+
+
+class ColouredGrid:
+    """
+    Single simulation played colour class by colour class, animals of a class acting in parallel
+    """
+
+    def __init__(self, simulation_parameters: Dict, seed: Optional[int] = None, threads: Optional[int] = None,
+                 detectors: Optional[Sequence[TerminationDetector]] = None, spawn: bool = True):
+        """
+        :param simulation_parameters: same parameters as SimulationGrid
+        :param seed: seed of the random draws
+        :param threads: number of threads of the sweeps, numba default (all cores) if None
+        :param detectors: termination detectors, shark extinction by default
+        :param spawn: if False, the grid starts empty and animals are added with add_animal or load_animals
+        """
+        params = simulation_parameters
+        if params['grid_size'] ** 2 < (params['init_nb_fish'] + params['init_nb_shark']):
+            raise ValueError('initial number of animals bigger than grid size....')
+        self._params = dict(params)
+        self._grid_size = params['grid_size']
+        self._seed = np.random.SeedSequence(seed).generate_state(1, dtype=np.uint64)[0]
+        self._threads = threads
+        self._neigh = neighbour_table(self._grid_size)
+        self._colours = colour_classes(self._grid_size)
+        nb_cells = self._grid_size ** 2
+        self._cells = np.zeros(nb_cells, dtype=np.uint8)
+        self._oid = np.full(nb_cells, -1, dtype=np.int64)
+        self._spawn_turn = np.zeros(nb_cells, dtype=np.int32)
+        self._last_breed = np.zeros(nb_cells, dtype=np.int32)
+        self._last_fed = np.zeros(nb_cells, dtype=np.int32)
+        self._breed_count = np.zeros(nb_cells, dtype=np.int32)
+        self._acted = np.zeros(nb_cells, dtype=bool)
+        self._fed_from = np.full(nb_cells, -1, dtype=np.int64)
+        self._done = np.zeros(nb_cells, dtype=bool)
+        self._next_oid = 1
+        self._sim_turn = 0
+        self._end_reason = None
+        self._detectors = list(detectors) if detectors is not None else [SharkExtinction()]
+        for detector in self._detectors:
+            detector.start(self._grid_size)
+        if spawn:
+            self._spawn()
+        # detectors are fed from the first turn on, animals can still be added to the initial grid
+        self._history = [self.population]
+
+    @property
+    def sim_turn(self) -> int:
+        return self._sim_turn
+
+    @property
+    def end_reason(self) -> Optional[str]:
+        return self._end_reason
+
+    @property
+    def next_oid(self) -> int:
+        return self._next_oid
+
+    @property
+    def population(self) -> Dict[Animal, int]:
+        return {Animal.Fish: int((self._cells == FISH).sum()), Animal.Shark: int((self._cells == SHARK).sum())}
+
+    @property
+    def population_history(self) -> List[Dict[Animal, int]]:
+        return list(self._history)
+
+    def get_grid(self) -> np.ndarray:
+        """
+        Grid with Animal values (0 for empty squares), indexed by [x, y]
+        """
+        return self._cells.reshape(self._grid_size, self._grid_size).copy()
+
+    def add_animal(self, animal_type: Animal, x: int, y: int, spawn_turn: int = 0, last_breed: int = 0,
+                   last_fed: int = 0) -> int:
+        if not (0 <= x < self._grid_size and 0 <= y < self._grid_size):
+            raise ValueError('Coordinate ({}, {}) is outside of the grid'.format(x, y))
+        square = x * self._grid_size + y
+        if self._cells[square] != EMPTY:
+            raise ValueError('Coordinate ({}, {}) is occupied'.format(x, y))
+        self._cells[square] = animal_type.value
+        self._oid[square] = self._next_oid
+        self._next_oid += 1
+        self._spawn_turn[square] = spawn_turn
+        self._last_breed[square] = last_breed
+        self._last_fed[square] = last_fed
+        self._breed_count[square] = 0
+        return int(self._oid[square])
+
+    def load_animals(self, columns: Dict[str, np.ndarray], next_oid: int):
+        """
+        Replace the animals of the grid
+        :param columns: ANIMAL_COLUMNS of the live animals
+        :param next_oid: oid the next newborn gets
+        :return:
+        """
+        squares = columns['coord_x'] * self._grid_size + columns['coord_y']
+        if len(np.unique(squares)) != len(squares):
+            raise ValueError('Several animals share a square')
+        self._cells[:] = EMPTY
+        self._oid[:] = -1
+        self._cells[squares] = columns['animal_type']
+        self._oid[squares] = columns['oid']
+        for name in ('spawn_turn', 'last_breed', 'last_fed', 'breed_count'):
+            getattr(self, '_' + name)[squares] = columns[name]
+        self._next_oid = next_oid
+
+    def animal_columns(self) -> Dict[str, np.ndarray]:
+        """
+        ANIMAL_COLUMNS of the live animals, ordered by oid
+        """
+        squares = np.flatnonzero(self._cells != EMPTY)
+        squares = squares[np.argsort(self._oid[squares], kind='stable')]
+        x, y = np.divmod(squares, self._grid_size)
+        return {'oid': self._oid[squares], 'animal_type': self._cells[squares].astype(np.int64), 'coord_x': x,
+                'coord_y': y, 'spawn_turn': self._spawn_turn[squares], 'last_breed': self._last_breed[squares],
+                'last_fed': self._last_fed[squares], 'breed_count': self._breed_count[squares]}
+
+    def _spawn(self):
+        rng = np.random.default_rng(int(self._seed))
+        order = rng.permutation(self._grid_size ** 2)
+        nb_fish, nb_shark = self._params['init_nb_fish'], self._params['init_nb_shark']
+        for animal, squares, maturity in ((FISH, order[:nb_fish], self._params['fish_breed_maturity']),
+                                          (SHARK, order[nb_fish:nb_fish + nb_shark],
+                                           self._params['shark_breed_maturity'])):
+            # since animal at start can be able to breed, last breed can be negative
+            spawn_turn = -rng.integers(0, maturity + 1, size=len(squares))
+            self._cells[squares] = animal
+            self._oid[squares] = np.arange(self._next_oid, self._next_oid + len(squares))
+            self._next_oid += len(squares)
+            self._spawn_turn[squares] = spawn_turn
+            self._last_breed[squares] = spawn_turn
+
+    def colour_order(self, turn: int) -> np.ndarray:
+        """
+        Order in which the colour classes are swept during a turn, a function of the seed and the turn only
+        """
+        rng = np.random.default_rng([int(self._seed), turn])
+        return rng.permutation(len(self._colours))
+
+    def _update_detectors(self):
+        population = self.population
+        for detector in self._detectors:
+            reason = detector.update(self._sim_turn, population[Animal.Fish], population[Animal.Shark])
+            if reason is not None and self._end_reason is None:
+                self._end_reason = reason
+
+    def play_phases(self, turn: int):
+        """
+        Phases of SimulationGrid.play_turn for a turn, each one swept colour by colour. Newborns are numbered
+        after the sweeps, in square order, so oids don't depend on the number of threads either
+        :param turn:
+        :return:
+        """
+        if self._threads is not None and NUMBA_AVAILABLE:
+            numba.set_num_threads(self._threads)
+        params = self._params
+        starving = (self._cells == SHARK) & ((turn - self._last_fed) > params['shark_starving'])
+        self._cells[starving] = EMPTY
+        self._oid[starving] = -1
+        self._fed_from[starving] = -1
+        order = self.colour_order(turn)
+        for phase, maturity, probability in (
+                (EAT, 0, 0),
+                (BREED_SHARK, params['shark_breed_maturity'], params['shark_breed_probability']),
+                (BREED_FISH, params['fish_breed_maturity'], params['fish_breed_probability']),
+                (MOVE_FISH, 0, 0),
+                (MOVE_SHARK, 0, 0)):
+            self._done[:] = False
+            for colour in order:
+                _sweep(phase, self._colours[colour], turn, self._seed, maturity, probability, self._neigh,
+                       self._cells, self._oid, self._spawn_turn, self._last_breed, self._last_fed,
+                       self._breed_count, self._acted, self._fed_from, self._done)
+        newborns = np.flatnonzero((self._cells != EMPTY) & (self._oid < 0))
+        self._oid[newborns] = np.arange(self._next_oid, self._next_oid + len(newborns))
+        self._next_oid += len(newborns)
+        self._acted[:] = False
+        self._fed_from[:] = -1
+
+    def play_turn(self):
+        """
+        Same phases as SimulationGrid.play_turn, each one swept colour by colour
+        :return:
+        """
+        self.play_phases(self._sim_turn)
+        self._sim_turn += 1
+        self._history.append(self.population)
+        self._update_detectors()
+        if self._end_reason is not None:
+            raise EndOfSimulatioError(self._end_reason)
+        return
+
+
+class ColouredSimulationGrid(SimulationGrid):
+    """
+    SimulationGrid whose turns are played colour class by colour class (see ColouredGrid). Works on the in-memory
+    backends (StoreSimulationClient and subclasses: memory, parquet, pipelined), whose animals are exchanged with the
+    cell arrays at every turn. Trajectories differ from the sequential engines, see the module documentation
+    """
+
+    def __init__(self, persistence: StoreSimulationClient, simulation_parameters: Optional[Dict] = None,
+                 detectors: Optional[Sequence[TerminationDetector]] = None, seed: Optional[int] = None,
+                 threads: Optional[int] = None, **kwargs):
+        """
+        See SimulationGrid, kwargs are its other arguments
+        :param seed: seed of the random draws of the sweeps, drawn from the random stream of the simulation if None
+        :param threads: number of threads of the sweeps, numba default (all cores) if None
+        """
+        if not isinstance(persistence, StoreSimulationClient):
+            raise TypeError('ColouredSimulationGrid needs an in-memory backend, not {}'.format(
+                type(persistence).__name__))
+        if not NUMBA_AVAILABLE:
+            _logger.warning('numba is not installed, the colouring engine runs sequentially as plain Python')
+        super().__init__(persistence=persistence, simulation_parameters=simulation_parameters, detectors=detectors,
+                         **kwargs)
+        if seed is None:
+            with self._random_stream():
+                seed = random.getrandbits(64)
+        parameters = dict(self.get_simulation_parameters()._asdict(), init_nb_fish=0, init_nb_shark=0)
+        self._board = ColouredGrid(parameters, seed=seed, threads=threads, detectors=[], spawn=False)
+
+    def play_turn(self):
+        """
+        Same turn as SimulationGrid.play_turn, played by colour class
+        :return:
+        """
+        store = self._persistence.get_store(self._sid)
+        columns = store.columns(ANIMAL_COLUMNS + ('alive',), live_only=False)
+        alive = columns['alive']
+        self._board.load_animals({c: columns[c][alive] for c in ANIMAL_COLUMNS}, next_oid=store.next_oid)
+        self._board.play_phases(self._sim_turn)
+        played = self._board.animal_columns()
+        # rows of the animals alive after the turn among the ones of the store, newborns are appended
+        known = played['oid'] < store.next_oid
+        rows = np.searchsorted(columns['oid'], played['oid'][known])
+        if self._check_invariants:
+            moved = (columns['coord_x'][rows] != played['coord_x'][known]) | \
+                (columns['coord_y'][rows] != played['coord_y'][known])
+            self._turn_moves = played['oid'][known][moved].tolist()
+        result = {'alive': np.zeros(len(alive), dtype=bool)}
+        result['alive'][rows] = True
+        for c in ANIMAL_COLUMNS:
+            merged = columns[c].copy()
+            merged[rows] = played[c][known]
+            result[c] = np.concatenate([merged, played[c][~known].astype(merged.dtype)])
+        result['alive'] = np.concatenate([result['alive'], np.ones(int((~known).sum()), dtype=bool)])
+        self._persistence.replace_animals(self._sid, result, next_oid=self._board.next_oid)
+        self._sim_turn += 1
+        self._log_turn()
+        self.check_simulation_ends()
+        return
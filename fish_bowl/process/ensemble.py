@@ -0,0 +1,328 @@
+"""
+Ensemble engine: play R replicates of the same simulation configuration together
+
+The state of every replicate lives in (R x grid_size**2) arrays, one animal per cell so that animal attributes are
+stored on the cell they occupy. Rules are the ones of SimulationGrid: within a replicate animals still act one after
+the other in a random order, but the k-th animal of every replicate is processed in the same array operation. The
+python overhead of a turn is therefore paid once per ensemble instead of once per replicate.
+
+Each replicate draws its random numbers from its own counter based stream, a replicate trajectory only depends on
+the seed and its index, not on the other replicates of the ensemble.
+"""
+import logging
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from fish_bowl.process.topology import SQUARE_NEIGH
+from fish_bowl.process.utils import Animal, EndOfSimulatioError
+
+_logger = logging.getLogger(__name__)
+
+EMPTY = 0
+FISH = Animal.Fish.value
+SHARK = Animal.Shark.value
+
+_GOLDEN_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+
+
+def neighbour_table(grid_size: int) -> np.ndarray:
+    """
+    Flat index of the 8 neighbours of every cell (cell = x * grid_size + y), -1 outside of the grid
+    :param grid_size:
+    :return: (grid_size**2, 8) array
+    """
+    x, y = np.divmod(np.arange(grid_size * grid_size), grid_size)
+    table = np.full((grid_size * grid_size, len(SQUARE_NEIGH)), -1, dtype=np.int64)
+    for i, (dx, dy) in enumerate(SQUARE_NEIGH.values()):
+        nx, ny = x + dx, y + dy
+        valid = (nx >= 0) & (nx < grid_size) & (ny >= 0) & (ny < grid_size)
+        table[valid, i] = nx[valid] * grid_size + ny[valid]
+    return table
+
+
+class ReplicateStreams:
+    """
+    Independent random streams, one per replicate, drawn in a vectorized way.
+    Draw i of replicate r is splitmix64(key_r + i * gamma), keys come from numpy SeedSequence children.
+    """
+
+    def __init__(self, seed: Optional[int], replicates: int):
+        children = np.random.SeedSequence(seed).spawn(replicates)
+        self._keys = np.array([c.generate_state(1, dtype=np.uint64)[0] for c in children], dtype=np.uint64)
+        self._counters = np.zeros(replicates, dtype=np.uint64)
+
+    def random(self, rows: np.ndarray, size: int) -> np.ndarray:
+        """
+        Uniform floats in [0, 1) for a set of replicates
+        :param rows: replicate indices
+        :param size: number of draws per replicate
+        :return: (len(rows), size) array
+        """
+        counters = self._counters[rows][:, None] + np.arange(size, dtype=np.uint64)
+        z = self._keys[rows][:, None] + counters * _GOLDEN_GAMMA
+        z = (z ^ (z >> np.uint64(30))) * _MIX_1
+        z = (z ^ (z >> np.uint64(27))) * _MIX_2
+        z = z ^ (z >> np.uint64(31))
+        self._counters[rows] += np.uint64(size)
+        return (z >> np.uint64(11)).astype(np.float64) * (1.0 / (1 << 53))
+
+    def randint(self, rows: np.ndarray, low: int, high: int) -> np.ndarray:
+        """
+        One integer per replicate in [low, high], both included (as random.randint)
+        """
+        return low + np.floor(self.random(rows, 1)[:, 0] * (high - low + 1)).astype(np.int64)
+
+
+class EnsembleGrid:
+
+    def __init__(self, simulation_parameters: Dict, replicates: int, seed: Optional[int] = None,
+                 spawn: bool = True):
+        """
+        Create an ensemble of replicates of the same simulation
+        :param simulation_parameters: same parameters as SimulationGrid
+        :param replicates: number of replicates
+        :param seed: seed of the random streams
+        :param spawn: if False, the grids start empty and animals are added with add_animal
+        """
+        params = simulation_parameters
+        if params['grid_size'] ** 2 < (params['init_nb_fish'] + params['init_nb_shark']):
+            raise ValueError('initial number of animals bigger than grid size....')
+        if replicates < 1:
+            raise ValueError('Ensemble needs at least one replicate')
+        self._params = dict(params)
+        self._grid_size = params['grid_size']
+        self._replicates = replicates
+        nb_cells = self._grid_size ** 2
+        self._neigh = neighbour_table(self._grid_size)
+        self._streams = ReplicateStreams(seed, replicates)
+        shape = (replicates, nb_cells)
+        self._cells = np.zeros(shape, dtype=np.uint8)
+        self._spawn_turn = np.zeros(shape, dtype=np.int32)
+        self._last_breed = np.zeros(shape, dtype=np.int32)
+        self._last_fed = np.zeros(shape, dtype=np.int32)
+        self._breed_count = np.zeros(shape, dtype=np.int32)
+        # animal already moved this turn
+        self._acted = np.zeros(shape, dtype=bool)
+        # for sharks that have eaten this turn, cell they came from
+        self._fed_from = np.full(shape, -1, dtype=np.int64)
+        self._attributes = (self._cells, self._spawn_turn, self._last_breed, self._last_fed, self._breed_count,
+                            self._acted, self._fed_from)
+        self._sim_turn = 0
+        self._running = np.ones(replicates, dtype=bool)
+        self._end_turn = np.full(replicates, -1, dtype=np.int64)
+        if spawn:
+            self._spawn()
+        self._history = [self.population]
+
+    @property
+    def replicates(self) -> int:
+        return self._replicates
+
+    @property
+    def sim_turn(self) -> int:
+        return self._sim_turn
+
+    @property
+    def running(self) -> np.ndarray:
+        """
+        Mask of replicates still playing
+        """
+        return self._running.copy()
+
+    @property
+    def end_turn(self) -> np.ndarray:
+        """
+        Turn at which each replicate ended, -1 if still running
+        """
+        return self._end_turn.copy()
+
+    @property
+    def population(self) -> np.ndarray:
+        """
+        (replicates, 2) array with the number of fish and sharks of each replicate
+        """
+        return np.stack([(self._cells == FISH).sum(axis=1), (self._cells == SHARK).sum(axis=1)], axis=1)
+
+    @property
+    def population_history(self) -> np.ndarray:
+        """
+        (turns + 1, replicates, 2) array of populations, first row is the initial spawn
+        """
+        return np.stack(self._history)
+
+    def get_grid(self, replicate: int) -> np.ndarray:
+        """
+        Grid of a replicate, with Animal values (0 for empty cells), indexed by [x, y]
+        """
+        return self._cells[replicate].reshape(self._grid_size, self._grid_size).copy()
+
+    def add_animal(self, replicate: int, animal_type: Animal, x: int, y: int, spawn_turn: int = 0,
+                   last_breed: int = 0, last_fed: int = 0):
+        """
+        Place an animal on a free cell of a replicate
+        """
+        if not (0 <= x < self._grid_size and 0 <= y < self._grid_size):
+            raise ValueError('Coordinate ({}, {}) is outside of the grid'.format(x, y))
+        cell = x * self._grid_size + y
+        if self._cells[replicate, cell] != EMPTY:
+            raise ValueError('Coordinate ({}, {}) is occupied'.format(x, y))
+        self._cells[replicate, cell] = animal_type.value
+        self._spawn_turn[replicate, cell] = spawn_turn
+        self._last_breed[replicate, cell] = last_breed
+        self._last_fed[replicate, cell] = last_fed
+        self._breed_count[replicate, cell] = 0
+
+    def _spawn(self):
+        """
+        Spawn initial fish then sharks on random cells of every replicate
+        """
+        rows = np.arange(self._replicates)
+        nb_fish, nb_shark = self._params['init_nb_fish'], self._params['init_nb_shark']
+        order = np.argsort(self._streams.random(rows, self._grid_size ** 2), axis=1)
+        for animal, start, count, maturity in ((FISH, 0, nb_fish, self._params['fish_breed_maturity']),
+                                               (SHARK, nb_fish, nb_shark, self._params['shark_breed_maturity'])):
+            if count == 0:
+                continue
+            cells = order[:, start:start + count]
+            # since animal at start can be able to breed, last breed can be negative
+            spawn_turn = -np.floor(self._streams.random(rows, count) * (maturity + 1)).astype(np.int32)
+            self._cells[rows[:, None], cells] = animal
+            self._spawn_turn[rows[:, None], cells] = spawn_turn
+            self._last_breed[rows[:, None], cells] = spawn_turn
+
+    def _clear(self, rows: np.ndarray, cells: np.ndarray):
+        for attribute in self._attributes:
+            attribute[rows, cells] = 0
+        self._fed_from[rows, cells] = -1
+
+    def _move(self, rows: np.ndarray, src: np.ndarray, dst: np.ndarray):
+        """
+        Move animals (and their attributes) from src to dst cells, whatever was in dst is overwritten
+        """
+        for attribute in self._attributes:
+            attribute[rows, dst] = attribute[rows, src]
+        self._clear(rows, src)
+
+    def _new_born(self, rows: np.ndarray, cells: np.ndarray, animal: int):
+        self._cells[rows, cells] = animal
+        self._spawn_turn[rows, cells] = self._sim_turn
+        self._last_fed[rows, cells] = self._sim_turn
+        self._last_breed[rows, cells] = 0
+        self._breed_count[rows, cells] = 0
+        self._acted[rows, cells] = False
+        self._fed_from[rows, cells] = -1
+
+    def _shuffled(self, animal: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Random order of the cells holding an animal type, for each running replicate
+        :return: rows, (len(rows), max count) cells array, count per row
+        """
+        rows = np.flatnonzero(self._running)
+        is_animal = self._cells[rows] == animal
+        keys = self._streams.random(rows, self._grid_size ** 2)
+        keys[~is_animal] = 2.
+        counts = is_animal.sum(axis=1)
+        order = np.argsort(keys, axis=1)[:, :counts.max() if len(rows) else 0]
+        return rows, order, counts
+
+    def _steps(self, animal: int):
+        """
+        Iterate over the k-th animal of each replicate
+        """
+        rows, order, counts = self._shuffled(animal)
+        for k in range(order.shape[1]):
+            has_k = counts > k
+            yield rows[has_k], order[has_k, k]
+
+    def _pick_neighbour(self, rows: np.ndarray, cells: np.ndarray, content: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Pick uniformly a neighbour cell with the given content
+        :return: picked cell, mask of animals that found one
+        """
+        neigh = self._neigh[cells]
+        valid = neigh >= 0
+        candidates = valid & (self._cells[rows[:, None], np.where(valid, neigh, 0)] == content)
+        keys = self._streams.random(rows, neigh.shape[1])
+        keys[~candidates] = -1.
+        choice = keys.argmax(axis=1)
+        return neigh[np.arange(len(cells)), choice], candidates.any(axis=1)
+
+    def _can_breed(self, rows: np.ndarray, cells: np.ndarray, maturity: int, probability: int) -> np.ndarray:
+        turn = self._sim_turn
+        mature = (((turn - self._spawn_turn[rows, cells]) >= maturity) &
+                  ((turn - self._last_breed[rows, cells]) >= maturity))
+        return mature & (self._streams.randint(rows, 0, 100) <= probability)
+
+    def _check_deads(self):
+        starving = ((self._cells == SHARK) & self._running[:, None] &
+                    ((self._sim_turn - self._last_fed) > self._params['shark_starving']))
+        rows, cells = np.nonzero(starving)
+        self._clear(rows, cells)
+
+    def _eat(self):
+        for rows, cells in self._steps(SHARK):
+            target, found = self._pick_neighbour(rows, cells, FISH)
+            rows, src, dst = rows[found], cells[found], target[found]
+            self._move(rows, src, dst)
+            self._last_fed[rows, dst] = self._sim_turn
+            self._acted[rows, dst] = True
+            self._fed_from[rows, dst] = src
+
+    def _breed(self, animal: int, maturity: int, probability: int):
+        for rows, cells in self._steps(animal):
+            breeding = self._can_breed(rows, cells, maturity, probability)
+            fed_from = self._fed_from[rows, cells]
+            fed = fed_from >= 0
+            target, found = self._pick_neighbour(rows, cells, EMPTY)
+            # sharks that have eaten breed in the cell they came from, if nobody took it
+            fed_breed = breeding & fed
+            fed_breed[fed_breed] = self._cells[rows[fed_breed], fed_from[fed_breed]] == EMPTY
+            # others breed in place and move to a free neighbour
+            move_breed = breeding & ~fed & found
+            self._move(rows[move_breed], cells[move_breed], target[move_breed])
+            parent = np.where(fed, cells, target)
+            birth = np.where(fed, fed_from, cells)
+            bred = fed_breed | move_breed
+            rows, parent, birth = rows[bred], parent[bred], birth[bred]
+            self._last_breed[rows, parent] = self._sim_turn
+            self._breed_count[rows, parent] += 1
+            self._acted[rows, parent] = True
+            self._new_born(rows, birth, animal)
+
+    def _move_animal_type(self, animal: int):
+        for rows, cells in self._steps(animal):
+            target, found = self._pick_neighbour(rows, cells, EMPTY)
+            moving = found & ~self._acted[rows, cells] & (self._spawn_turn[rows, cells] != self._sim_turn)
+            self._move(rows[moving], cells[moving], target[moving])
+
+    def play_turn(self):
+        """
+        Play a turn on every running replicate, same phases as SimulationGrid.play_turn
+        Raise EndOfSimulatioError once no replicate has sharks left
+        :return:
+        """
+        if not self._running.any():
+            raise EndOfSimulatioError('All replicates have ended')
+        params = self._params
+        self._check_deads()
+        self._eat()
+        self._breed(SHARK, params['shark_breed_maturity'], params['shark_breed_probability'])
+        self._breed(FISH, params['fish_breed_maturity'], params['fish_breed_probability'])
+        self._move_animal_type(FISH)
+        self._move_animal_type(SHARK)
+        self._acted[:] = False
+        self._fed_from[:] = -1
+        self._sim_turn += 1
+        population = self.population
+        self._history.append(population)
+        ended = self._running & (population[:, 1] == 0)
+        self._end_turn[ended] = self._sim_turn
+        self._running &= ~ended
+        if ended.any():
+            _logger.debug('Turn: {:<3} - {} replicates ended'.format(self._sim_turn, ended.sum()))
+        if not self._running.any():
+            raise EndOfSimulatioError('Simulation ends because no more Sharks in any replicate')
+        return
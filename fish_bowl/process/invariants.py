@@ -0,0 +1,80 @@
+"""
+End of turn invariants of the animals of a simulation
+
+The storage backends do not validate every spawn and move against the rest of the grid (the SQL client would need a
+query on the square and one on the simulation row for each of them). SimulationGrid checks the whole grid once per
+turn instead, from the arrays of the live animals:
+
+- every live animal is inside the grid
+- no square holds more than one live animal
+- no dead animal moved: deaths (starving sharks, eaten fish) come before the moves in a turn, so every animal moved
+  during the turn is still alive at its end
+
+Each check is a few numpy operations over the live animals. Broken invariants raise InvariantError, listing the
+first offending squares and animals.
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from fish_bowl.process.utils import Animal
+
+# columns of the live animals read by the checks
+COLUMNS = ('oid', 'animal_type', 'coord_x', 'coord_y')
+# offending squares or animals listed by each diagnostic
+MAX_REPORTED = 10
+
+
+class InvariantError(Exception):
+
+    def __init__(self, sim_id: int, turn: int, violations: List[str]):
+        super().__init__('Turn {} of simulation {} breaks {} invariant(s): {}'.format(
+            turn, sim_id, len(violations), '; '.join(violations)))
+        self.sim_id = sim_id
+        self.turn = turn
+        self.violations = violations
+
+
+def _describe(arrays: Dict[str, np.ndarray], rows: np.ndarray) -> str:
+    return ', '.join('{} {} at ({}, {})'.format(Animal(int(arrays['animal_type'][i])).name, arrays['oid'][i],
+                                                arrays['coord_x'][i], arrays['coord_y'][i]) for i in rows)
+
+
+def find_violations(grid_size: int, arrays: Dict[str, np.ndarray], moved: Optional[Sequence[int]] = None,
+                    max_reported: int = MAX_REPORTED) -> List[str]:
+    """
+    Check the invariants of the live animals at the end of a turn
+    :param grid_size:
+    :param arrays: COLUMNS of the live animals, as returned by get_animal_arrays
+    :param moved: oids of the animals moved during the turn, the dead animal check is skipped if None
+    :param max_reported: offending squares or animals described by each violation
+    :return: one description per broken invariant, empty if the grid is valid
+    """
+    violations = []
+    x = np.asarray(arrays['coord_x'], dtype=np.int64)
+    y = np.asarray(arrays['coord_y'], dtype=np.int64)
+    inside = (x >= 0) & (x < grid_size) & (y >= 0) & (y < grid_size)
+    if not inside.all():
+        outside = np.flatnonzero(~inside)
+        violations.append('{} live animal(s) outside of the {}x{} grid: {}'.format(
+            len(outside), grid_size, grid_size, _describe(arrays, outside[:max_reported])))
+    rows = np.flatnonzero(inside)
+    squares = x[rows] * grid_size + y[rows]
+    order = np.argsort(squares, kind='stable')
+    squares = squares[order]
+    repeated = squares[1:] == squares[:-1]
+    if repeated.any():
+        shared = np.unique(squares[1:][repeated])
+        described = []
+        for square in shared[:max_reported]:
+            animals = rows[order[np.searchsorted(squares, square, 'left'):np.searchsorted(squares, square, 'right')]]
+            described.append('({}, {}) holds {}'.format(square // grid_size, square % grid_size,
+                                                        _describe(arrays, animals)))
+        violations.append('{} square(s) with several live animals: {}'.format(len(shared), ', '.join(described)))
+    if moved is not None and len(moved) > 0:
+        moved = np.unique(np.asarray(moved, dtype=np.int64))
+        dead = moved[~np.isin(moved, arrays['oid'])]
+        if len(dead) > 0:
+            violations.append('{} animal(s) moved during the turn are not alive at its end: oids {}'.format(
+                len(dead), ', '.join(str(oid) for oid in dead[:max_reported])))
+    return violations
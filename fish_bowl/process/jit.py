@@ -0,0 +1,363 @@
+"""
+Compiled sequential engine
+
+JitSimulationGrid plays exactly the turn of SimulationGrid (same phases, same animal order, same random draws)
+as a Numba compiled loop over flat arrays. Random draws come from a Mersenne Twister implementation reproducing
+CPython's random.shuffle and random.randint; it starts from the state of the random module and hands its state
+back after each turn, so the simulation stays bit-for-bit equal to SimulationGrid for a given random.seed, and
+both engines can be interleaved.
+
+Animals live in the arrays in oid order: the arrays are loaded from the memory backend at the start of the turn,
+newborns are appended with increasing oids and dead animals are only flagged, so walking the slots in order is
+walking the animals by oid, as the reference engine does through the backend queries.
+
+Without numba the same kernel runs as plain Python, slowly.
+"""
+import logging
+import random
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.termination import TerminationDetector
+from fish_bowl.process.topology import SQUARE_NEIGH
+from fish_bowl.process.utils import Animal
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda f: f
+
+_logger = logging.getLogger(__name__)
+
+FISH = Animal.Fish.value
+SHARK = Animal.Shark.value
+FREE = -1
+# neighbour offsets, in the order square_grid_neighbours lists them before shuffling
+NEIGHBOUR_OFFSETS = np.array(list(SQUARE_NEIGH.values()), dtype=np.int64)
+KERNEL_COLUMNS = ('oid', 'animal_type', 'coord_x', 'coord_y', 'spawn_turn', 'last_breed', 'last_fed', 'breed_count',
+                  'alive')
+
+# Mersenne Twister constants, as in CPython's _randommodule.c
+MT_N = 624
+MT_M = 397
+MATRIX_A = 0x9908b0df
+UPPER_MASK = 0x80000000
+LOWER_MASK = 0x7fffffff
+
+
+# ---------------------------------------------------------------------------- random draws
+@njit(cache=True)
+def _mt_twist(mt):
+    for kk in range(MT_N):
+        y = (mt[kk] & UPPER_MASK) | (mt[(kk + 1) % MT_N] & LOWER_MASK)
+        value = mt[(kk + MT_M) % MT_N] ^ (y >> 1)
+        if y & 1:
+            value ^= MATRIX_A
+        mt[kk] = value
+
+
+@njit(cache=True)
+def _mt_uint32(mt):
+    """
+    Next 32 bits word, mt[MT_N] holds the position in the state
+    """
+    if mt[MT_N] >= MT_N:
+        _mt_twist(mt)
+        mt[MT_N] = 0
+    y = mt[mt[MT_N]]
+    mt[MT_N] += 1
+    y ^= y >> 11
+    y ^= (y << 7) & 0x9d2c5680
+    y ^= (y << 15) & 0xefc60000
+    y ^= y >> 18
+    return y & 0xffffffff
+
+
+@njit(cache=True)
+def _randbelow(mt, n):
+    """
+    random.Random._randbelow_with_getrandbits
+    """
+    k = 0
+    while (n >> k) > 0:
+        k += 1
+    r = _mt_uint32(mt) >> (32 - k)
+    while r >= n:
+        r = _mt_uint32(mt) >> (32 - k)
+    return r
+
+
+@njit(cache=True)
+def _shuffle_pairs(mt, xs, ys, n):
+    """
+    random.shuffle of the n first (xs, ys) pairs
+    """
+    for i in range(n - 1, 0, -1):
+        j = _randbelow(mt, i + 1)
+        xs[i], xs[j] = xs[j], xs[i]
+        ys[i], ys[j] = ys[j], ys[i]
+
+
+@njit(cache=True)
+def _shuffle(mt, values, n):
+    for i in range(n - 1, 0, -1):
+        j = _randbelow(mt, i + 1)
+        values[i], values[j] = values[j], values[i]
+
+
+# ---------------------------------------------------------------------------- turn phases
+@njit(cache=True)
+def _select(alive, animal_type, kind, n, order):
+    """
+    Slots of the live animals of a type, in oid order
+    """
+    m = 0
+    for s in range(n):
+        if alive[s] and animal_type[s] == kind:
+            order[m] = s
+            m += 1
+    return m
+
+
+@njit(cache=True)
+def _neighbours(mt, grid_size, x, y, offsets, nx, ny):
+    """
+    square_grid_neighbours: valid neighbours in SQUARE_NEIGH order, shuffled
+    """
+    k = 0
+    for i in range(offsets.shape[0]):
+        cx = x + offsets[i, 0]
+        cy = y + offsets[i, 1]
+        if 0 <= cx < grid_size and 0 <= cy < grid_size:
+            nx[k] = cx
+            ny[k] = cy
+            k += 1
+    _shuffle_pairs(mt, nx, ny, k)
+    return k
+
+
+@njit(cache=True)
+def _move_to(s, cx, cy, coord_x, coord_y, occupancy):
+    occupancy[coord_x[s], coord_y[s]] = FREE
+    coord_x[s] = cx
+    coord_y[s] = cy
+    occupancy[cx, cy] = s
+
+
+@njit(cache=True)
+def _spawn(n, oid, next_oid, kind, cx, cy, turn, animal_type, coord_x, coord_y, spawn_turn, last_breed, last_fed,
+           breed_count, alive, occupancy):
+    oid[n] = next_oid
+    animal_type[n] = kind
+    coord_x[n] = cx
+    coord_y[n] = cy
+    spawn_turn[n] = turn
+    last_breed[n] = 0
+    last_fed[n] = turn
+    breed_count[n] = 0
+    alive[n] = True
+    occupancy[cx, cy] = n
+
+
+@njit(cache=True)
+def play_turn_kernel(turn, grid_size, fish_breed_maturity, fish_breed_probability, shark_breed_maturity,
+                     shark_breed_probability, shark_starving, n, next_oid, oid, animal_type, coord_x, coord_y,
+                     spawn_turn, last_breed, last_fed, breed_count, alive, occupancy, offsets, mt):
+    """
+    One turn of SimulationGrid on flat arrays
+    :return: (number of used slots, next oid)
+    """
+    capacity = oid.shape[0]
+    order = np.empty(capacity, dtype=np.int64)
+    fed = np.zeros(capacity, dtype=np.bool_)
+    fed_x = np.zeros(capacity, dtype=np.int64)
+    fed_y = np.zeros(capacity, dtype=np.int64)
+    moved = np.zeros(capacity, dtype=np.bool_)
+    nx = np.empty(8, dtype=np.int64)
+    ny = np.empty(8, dtype=np.int64)
+    fx = np.empty(8, dtype=np.int64)
+    fy = np.empty(8, dtype=np.int64)
+
+    # starving sharks die
+    for s in range(n):
+        if alive[s] and animal_type[s] == SHARK and turn - last_fed[s] > shark_starving:
+            alive[s] = False
+            occupancy[coord_x[s], coord_y[s]] = FREE
+
+    # sharks eat an adjacent fish and move in its square
+    m = _select(alive, animal_type, SHARK, n, order)
+    _shuffle(mt, order, m)
+    for i in range(m):
+        s = order[i]
+        k = _neighbours(mt, grid_size, coord_x[s], coord_y[s], offsets, nx, ny)
+        f = 0
+        for j in range(k):
+            o = occupancy[nx[j], ny[j]]
+            if o != FREE and animal_type[o] == FISH:
+                fx[f] = nx[j]
+                fy[f] = ny[j]
+                f += 1
+        if f > 0:
+            _shuffle_pairs(mt, fx, fy, f)
+            eaten = occupancy[fx[0], fy[0]]
+            alive[eaten] = False
+            occupancy[fx[0], fy[0]] = FREE
+            fed[s] = True
+            fed_x[s] = coord_x[s]
+            fed_y[s] = coord_y[s]
+            _move_to(s, fx[0], fy[0], coord_x, coord_y, occupancy)
+            last_fed[s] = turn
+
+    # sharks breed: in their previous square if they ate, otherwise moving to a free neighbour
+    m = _select(alive, animal_type, SHARK, n, order)
+    _shuffle(mt, order, m)
+    for i in range(m):
+        s = order[i]
+        if turn - spawn_turn[s] >= shark_breed_maturity and turn - last_breed[s] >= shark_breed_maturity:
+            if _randbelow(mt, 101) <= shark_breed_probability:
+                breeding = False
+                bx = coord_x[s]
+                by = coord_y[s]
+                if fed[s]:
+                    bx = fed_x[s]
+                    by = fed_y[s]
+                    breeding = occupancy[bx, by] == FREE
+                    moved[s] = True
+                else:
+                    k = _neighbours(mt, grid_size, coord_x[s], coord_y[s], offsets, nx, ny)
+                    for j in range(k):
+                        if occupancy[nx[j], ny[j]] == FREE:
+                            _move_to(s, nx[j], ny[j], coord_x, coord_y, occupancy)
+                            moved[s] = True
+                            breeding = True
+                            break
+                if breeding:
+                    last_breed[s] = turn
+                    breed_count[s] += 1
+                    _spawn(n, oid, next_oid, SHARK, bx, by, turn, animal_type, coord_x, coord_y, spawn_turn,
+                           last_breed, last_fed, breed_count, alive, occupancy)
+                    n += 1
+                    next_oid += 1
+
+    # fish breed if they can move to a free neighbour
+    m = _select(alive, animal_type, FISH, n, order)
+    _shuffle(mt, order, m)
+    for i in range(m):
+        s = order[i]
+        if turn - spawn_turn[s] >= fish_breed_maturity and turn - last_breed[s] >= fish_breed_maturity:
+            if _randbelow(mt, 101) <= fish_breed_probability:
+                bx = coord_x[s]
+                by = coord_y[s]
+                k = _neighbours(mt, grid_size, bx, by, offsets, nx, ny)
+                for j in range(k):
+                    if occupancy[nx[j], ny[j]] == FREE:
+                        last_breed[s] = turn
+                        breed_count[s] += 1
+                        _move_to(s, nx[j], ny[j], coord_x, coord_y, occupancy)
+                        moved[s] = True
+                        _spawn(n, oid, next_oid, FISH, bx, by, turn, animal_type, coord_x, coord_y, spawn_turn,
+                               last_breed, last_fed, breed_count, alive, occupancy)
+                        n += 1
+                        next_oid += 1
+                        break
+    for s in range(n):
+        if fed[s]:
+            moved[s] = True
+
+    # the others move, fish first then sharks, through every free neighbour in turn
+    for kind in (FISH, SHARK):
+        m = _select(alive, animal_type, kind, n, order)
+        _shuffle(mt, order, m)
+        for i in range(m):
+            s = order[i]
+            if moved[s] or spawn_turn[s] == turn:
+                continue
+            k = _neighbours(mt, grid_size, coord_x[s], coord_y[s], offsets, nx, ny)
+            for j in range(k):
+                if occupancy[nx[j], ny[j]] == FREE:
+                    _move_to(s, nx[j], ny[j], coord_x, coord_y, occupancy)
+    return n, next_oid
+
+
+# ---------------------------------------------------------------------------- engine
+def get_mt_state() -> np.ndarray:
+    """
+    State of the random module as MT_N words followed by the position
+    """
+    return np.array(random.getstate()[1], dtype=np.int64)
+
+
+def set_mt_state(mt: np.ndarray):
+    version, _, gauss_next = random.getstate()
+    random.setstate((version, tuple(int(v) for v in mt), gauss_next))
+
+
+class JitSimulationGrid(SimulationGrid):
+    """
+    SimulationGrid whose turns are played by the compiled kernel. Works on the in-memory backends
+    (StoreSimulationClient and subclasses), whose animals are exchanged with the kernel as whole arrays.
+    """
+
+    def __init__(self, persistence: StoreSimulationClient, simulation_parameters: Optional[Dict] = None,
+                 detectors: Optional[Sequence[TerminationDetector]] = None, **kwargs):
+        """
+        See SimulationGrid, kwargs are its other arguments
+        """
+        if not isinstance(persistence, StoreSimulationClient):
+            raise TypeError('JitSimulationGrid needs an in-memory backend, not {}'.format(type(persistence).__name__))
+        if not NUMBA_AVAILABLE:
+            _logger.warning('numba is not installed, the compiled engine runs as plain Python')
+        super().__init__(persistence=persistence, simulation_parameters=simulation_parameters, detectors=detectors,
+                         **kwargs)
+        self._parameters = self.get_simulation_parameters(self._sid)
+
+    def _load(self):
+        store = self._persistence.get_store(self._sid)
+        columns = store.columns(KERNEL_COLUMNS, live_only=False)
+        n = len(columns['oid'])
+        # every animal breeds at most once per turn
+        capacity = 2 * n + 1
+        arrays = {}
+        for name in KERNEL_COLUMNS:
+            dtype = np.bool_ if name == 'alive' else np.int64
+            arrays[name] = np.zeros(capacity, dtype=dtype)
+            arrays[name][:n] = columns[name]
+        occupancy = np.full((self._parameters.grid_size, self._parameters.grid_size), FREE, dtype=np.int64)
+        live = np.flatnonzero(arrays['alive'][:n])
+        occupancy[arrays['coord_x'][live], arrays['coord_y'][live]] = live
+        return n, store.next_oid, arrays, occupancy
+
+    def play_turn(self):
+        """
+        Same turn as SimulationGrid.play_turn, played by the compiled kernel
+        :return:
+        """
+        params = self._parameters
+        n, next_oid, arrays, occupancy = self._load()
+        if self._check_invariants:
+            before_x, before_y = arrays['coord_x'][:n].copy(), arrays['coord_y'][:n].copy()
+        with self._random_stream():
+            mt = get_mt_state()
+            n, next_oid = play_turn_kernel(self._sim_turn, params.grid_size, params.fish_breed_maturity,
+                                           params.fish_breed_probability, params.shark_breed_maturity,
+                                           params.shark_breed_probability, params.shark_starving, n, next_oid,
+                                           *[arrays[c] for c in KERNEL_COLUMNS], occupancy, NEIGHBOUR_OFFSETS, mt)
+            set_mt_state(mt)
+        if self._check_invariants:
+            # the kernel moves animals in place, spawns are appended after the first n rows
+            moved = (arrays['coord_x'][:len(before_x)] != before_x) | (arrays['coord_y'][:len(before_y)] != before_y)
+            self._turn_moves = arrays['oid'][np.flatnonzero(moved)].tolist()
+        self._persistence.replace_animals(self._sid, {c: arrays[c][:n] for c in KERNEL_COLUMNS}, next_oid=next_oid)
+        self._sim_turn += 1
+        self._log_turn()
+        self.check_simulation_ends()
+        return
@@ -0,0 +1,290 @@
+"""
+Occupancy of the grid, used by SimulationGrid to only work on the animals that can act
+
+A turn occupancy keeps the Animal value of every occupied square, and for every square the number of free neighbours
+and of fish neighbours. The counts are updated incrementally when animals move, spawn or die, so the engine knows in
+constant time that an animal is boxed in (no move, no breed) or that a shark has no fish next to it (no meal) and
+skips the persistence lookups of that animal. The engine builds it once from the live animals and keeps it up to
+date from one turn to the next.
+
+Skipping must not change the simulation: square_grid_neighbours shuffles the neighbours with the global random
+generator, so a skipped animal still consumes the draws of that shuffle (topology.skip_neighbour_draws). A seed
+plays the same simulation as the engine visiting every animal.
+
+Three forms answer the same queries, picked by occupancy_mode from the density of the grid:
+- sparse: SparseTurnOccupancy, dictionaries holding the occupied squares and their neighbours only, memory and
+  build time in the number of animals
+- lists: TurnOccupancy, flat lists of about LIST_BYTES_PER_SQUARE bytes per square, the fastest on dense grids
+- bitboard: bitboard.BitboardOccupancy, 2 bits per square, for dense grids whose lists would exceed the memory
+  budget given to turn_occupancy (SimulationGrid occupancy_budget). There is no budget by default. Its neighbour
+  counts are about 20 times slower than the lists, the phases test the bits of masks computed once per phase
+  instead (start_phase, has_free_neighbour, has_fish_neighbour)
+Grids switch to the dense forms above DENSE_ABOVE of the squares occupied and back to the sparse one below
+SPARSE_BELOW, the gap keeps a population hovering around a threshold from converting every turn.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from fish_bowl.process.analytics import EMPTY, FISH, SHARK, GRID_COLUMNS, grid_from_arrays, shifted
+from fish_bowl.process.bitboard import BitboardOccupancy
+from fish_bowl.process.topology import SQUARE_NEIGH, SquareGridCoordinate, neighbour_count
+
+OFFSETS = tuple(SQUARE_NEIGH.values())
+# three lists of pointers to small cached ints
+LIST_BYTES_PER_SQUARE = 24
+# the sparse form takes up to 9 dictionary entries per animal (its square and its neighbours), some 700 bytes
+DENSE_ABOVE = 0.02
+SPARSE_BELOW = 0.005
+# fish neighbour counts are stored above the occupied neighbour counts (at most 8) in the sparse form
+_FISH_UNIT = 16
+
+
+class TurnOccupancy:
+    mode = 'lists'
+
+    def __init__(self, grid: np.ndarray):
+        """
+        :param grid: (grid_size, grid_size) Animal values indexed by [x, y], 0 for empty squares
+        """
+        n = grid.shape[0]
+        self._counts = {FISH: int((grid == FISH).sum()), SHARK: int((grid == SHARK).sum())}
+        empty = grid == EMPTY
+        fish = grid == FISH
+        free = np.zeros(grid.shape, dtype=np.int64)
+        fish_around = np.zeros(grid.shape, dtype=np.int64)
+        for dx, dy in OFFSETS:
+            # squares outside of the grid are neither free nor fish
+            free += shifted(empty, dx, dy, False)
+            fish_around += shifted(fish, dx, dy, False)
+        self._size = n
+        # flat lists: scalar reads and writes are much cheaper than on numpy arrays
+        self._kind = grid.astype(np.int64).ravel().tolist()
+        self._free = free.ravel().tolist()
+        self._fish = fish_around.ravel().tolist()
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], grid_size: int) -> 'TurnOccupancy':
+        """
+        Occupancy of animals read as GRID_COLUMNS arrays
+        """
+        return cls(grid_from_arrays(arrays, grid_size))
+
+    @property
+    def grid_size(self) -> int:
+        return self._size
+
+    def count(self, kind: int) -> int:
+        """
+        Number of squares holding an animal type
+        """
+        return self._counts[kind]
+
+    def kind(self, x: int, y: int) -> int:
+        """
+        Animal value in the square, 0 if empty
+        """
+        return self._kind[x * self._size + y]
+
+    def is_occupied(self, x: int, y: int) -> bool:
+        return self._kind[x * self._size + y] != EMPTY
+
+    def free_neighbours(self, x: int, y: int) -> int:
+        return self._free[x * self._size + y]
+
+    def fish_neighbours(self, x: int, y: int) -> int:
+        return self._fish[x * self._size + y]
+
+    def start_phase(self):
+        """
+        Nothing to prepare, the neighbour counts are always up to date (see BitboardOccupancy.start_phase)
+        """
+        return
+
+    def has_free_neighbour(self, x: int, y: int) -> bool:
+        return self.free_neighbours(x, y) > 0
+
+    def has_fish_neighbour(self, x: int, y: int) -> bool:
+        return self.fish_neighbours(x, y) > 0
+
+    def fish_in(self, coordinates: List[SquareGridCoordinate]) -> List[SquareGridCoordinate]:
+        """
+        Coordinates holding a fish, in the order they were given
+        """
+        return [c for c in coordinates if self._kind[c.x * self._size + c.y] == FISH]
+
+    def set(self, x: int, y: int, kind: int):
+        """
+        Change the content of a square and update the counts of its neighbours
+        :param x:
+        :param y:
+        :param kind: Animal value, 0 to empty the square
+        """
+        n = self._size
+        i = x * n + y
+        old = self._kind[i]
+        if old == kind:
+            return
+        self._kind[i] = kind
+        if old != EMPTY:
+            self._counts[old] -= 1
+        if kind != EMPTY:
+            self._counts[kind] += 1
+        free_delta = (old != EMPTY) - (kind != EMPTY)
+        fish_delta = (kind == FISH) - (old == FISH)
+        for dx, dy in OFFSETS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < n and 0 <= ny < n:
+                j = nx * n + ny
+                self._free[j] += free_delta
+                self._fish[j] += fish_delta
+
+    def move(self, x: int, y: int, new_x: int, new_y: int):
+        kind = self._kind[x * self._size + y]
+        self.set(x, y, EMPTY)
+        self.set(new_x, new_y, kind)
+
+
+class SparseTurnOccupancy:
+    """
+    TurnOccupancy of a sparse grid: the kind of the occupied squares, and the neighbour counts of the squares next to
+    an animal, in dictionaries keyed by x * grid_size + y
+    """
+    mode = 'sparse'
+
+    def __init__(self, grid_size: int):
+        self._size = grid_size
+        self._kind = {}
+        # occupied neighbours + _FISH_UNIT * fish neighbours, squares without neighbour have no entry
+        self._around = {}
+        self._counts = {FISH: 0, SHARK: 0}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], grid_size: int) -> 'SparseTurnOccupancy':
+        """
+        Occupancy of animals read as GRID_COLUMNS arrays
+        """
+        occupancy = cls(grid_size)
+        for x, y, kind in zip(arrays['coord_x'].tolist(), arrays['coord_y'].tolist(),
+                              arrays['animal_type'].tolist()):
+            occupancy.set(x, y, kind)
+        return occupancy
+
+    @property
+    def grid_size(self) -> int:
+        return self._size
+
+    def count(self, kind: int) -> int:
+        return self._counts[kind]
+
+    def kind(self, x: int, y: int) -> int:
+        return self._kind.get(x * self._size + y, EMPTY)
+
+    def is_occupied(self, x: int, y: int) -> bool:
+        return x * self._size + y in self._kind
+
+    def free_neighbours(self, x: int, y: int) -> int:
+        return neighbour_count(self._size, x, y) - (self._around.get(x * self._size + y, 0) % _FISH_UNIT)
+
+    def fish_neighbours(self, x: int, y: int) -> int:
+        return self._around.get(x * self._size + y, 0) // _FISH_UNIT
+
+    def start_phase(self):
+        """
+        Nothing to prepare, the neighbour counts are always up to date (see BitboardOccupancy.start_phase)
+        """
+        return
+
+    def has_free_neighbour(self, x: int, y: int) -> bool:
+        return self.free_neighbours(x, y) > 0
+
+    def has_fish_neighbour(self, x: int, y: int) -> bool:
+        return self.fish_neighbours(x, y) > 0
+
+    def fish_in(self, coordinates: List[SquareGridCoordinate]) -> List[SquareGridCoordinate]:
+        """
+        Coordinates holding a fish, in the order they were given
+        """
+        kinds, n = self._kind, self._size
+        return [c for c in coordinates if kinds.get(c.x * n + c.y) == FISH]
+
+    def set(self, x: int, y: int, kind: int):
+        """
+        Change the content of a square and update the counts of its neighbours
+        :param x:
+        :param y:
+        :param kind: Animal value, 0 to empty the square
+        """
+        n = self._size
+        i = x * n + y
+        old = self._kind.get(i, EMPTY)
+        if old == kind:
+            return
+        if old != EMPTY:
+            self._counts[old] -= 1
+        if kind == EMPTY:
+            del self._kind[i]
+        else:
+            self._kind[i] = kind
+            self._counts[kind] += 1
+        delta = (kind != EMPTY) - (old != EMPTY) + _FISH_UNIT * ((kind == FISH) - (old == FISH))
+        around = self._around
+        for dx, dy in OFFSETS:
+            nx, ny = x + dx, y + dy
+            if 0 <= nx < n and 0 <= ny < n:
+                j = nx * n + ny
+                value = around.get(j, 0) + delta
+                if value:
+                    around[j] = value
+                else:
+                    del around[j]
+
+    def move(self, x: int, y: int, new_x: int, new_y: int):
+        kind = self.kind(x, y)
+        self.set(x, y, EMPTY)
+        self.set(new_x, new_y, kind)
+
+
+TURN_OCCUPANCY_TYPES = {
+    'sparse': SparseTurnOccupancy,
+    'lists': TurnOccupancy,
+    'bitboard': BitboardOccupancy,
+}
+
+
+def occupancy_mode(grid_size: int, nb_animals: int, memory_budget: Optional[int] = None,
+                   current: Optional[str] = None) -> str:
+    """
+    Form of the occupancy of a grid
+    :param grid_size:
+    :param nb_animals: live animals on the grid
+    :param memory_budget: bytes the dense occupancy can take, no limit if None
+    :param current: form of the occupancy kept so far, if any
+    :return: one of TURN_OCCUPANCY_TYPES
+    """
+    cells = grid_size * grid_size
+    if current == 'sparse' or current is None:
+        sparse = nb_animals <= DENSE_ABOVE * cells
+    else:
+        sparse = nb_animals < SPARSE_BELOW * cells
+    if sparse:
+        return 'sparse'
+    if memory_budget is not None and cells * LIST_BYTES_PER_SQUARE > memory_budget:
+        return 'bitboard'
+    return 'lists'
+
+
+def turn_occupancy(persistence, sim_id: int, grid_size: int, memory_budget: Optional[int] = None,
+                   current: Optional[str] = None):
+    """
+    Occupancy of the live animals of a simulation, in the form occupancy_mode picks
+    :param persistence:
+    :param sim_id:
+    :param grid_size:
+    :param memory_budget: bytes the dense occupancy can take, no limit if None
+    :param current: form of the occupancy this one replaces, if any
+    :return: SparseTurnOccupancy, TurnOccupancy or BitboardOccupancy
+    """
+    arrays = persistence.get_animal_arrays(sim_id, GRID_COLUMNS)
+    mode = occupancy_mode(grid_size, len(arrays['coord_x']), memory_budget=memory_budget, current=current)
+    return TURN_OCCUPANCY_TYPES[mode].from_arrays(arrays, grid_size)
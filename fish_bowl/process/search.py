@@ -0,0 +1,225 @@
+"""
+Successive halving search of the parameters where fish and sharks coexist
+
+A sweep over a parameter grid plays every configuration for the full number of turns, although most of them end
+within a few turns with the fish or the sharks extinct. SuccessiveHalving plays all the configurations for a short
+budget of turns, drops the ones where both species no longer coexist, keeps the best 1/eta of the others and
+extends them to eta times the budget, until max_turns:
+
+- budgets: min_turns, min_turns * eta, min_turns * eta ** 2, ... max_turns
+- survivors are continued, not replayed: each replicate is a SimulationGrid kept between the rungs
+- score of a configuration: mean over its replicates of the number of turns both species coexisted, then the
+  number of replicates still coexisting. Configurations tied with the last kept one are kept too: while every
+  configuration still coexists nothing tells them apart
+- replicates of a configuration whose fish or sharks went extinct are no longer played
+
+Each replicate has its own random stream (random_state of SimulationGrid), derived from the seed of the search, so
+the result doesn't depend on the order the replicates are played in.
+"""
+import itertools
+import logging
+import math
+import random
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from fish_bowl.dataio.backends import create_backend
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.termination import FishExtinction, SharkExtinction
+from fish_bowl.process.utils import EndOfSimulatioError
+
+_logger = logging.getLogger(__name__)
+
+
+def parameter_grid(base_parameters: Dict, space: Dict[str, Sequence]) -> List[Dict]:
+    """
+    Simulation parameters of every combination of the values of space
+    :param base_parameters: complete simulation parameters
+    :param space: parameter name -> values to try
+    :return:
+    """
+    unknown = sorted(set(space) - set(base_parameters))
+    if unknown:
+        raise ValueError('Unknown simulation parameters {}'.format(', '.join(unknown)))
+    names = sorted(space)
+    return [dict(base_parameters, **dict(zip(names, values)))
+            for values in itertools.product(*(space[name] for name in names))]
+
+
+class Trial:
+    """
+    Replicates of one configuration
+    """
+
+    def __init__(self, parameters: Dict, grids: List[SimulationGrid]):
+        self.parameters = parameters
+        self.grids = grids
+        # turns both species coexisted, by replicate
+        self.alive = [grid.end_reason is None for grid in grids]
+        self.coexistence = [int(alive) for alive in self.alive]
+        # budget of the last rung the trial was played in
+        self.budget = 0
+        self.dropped_at = None
+
+    @property
+    def score(self) -> float:
+        return sum(self.coexistence) / len(self.coexistence)
+
+    def rank_key(self):
+        return -self.score, -self.coexisting
+
+    @property
+    def coexisting(self) -> int:
+        """
+        Number of replicates where both species are still alive
+        """
+        return sum(self.alive)
+
+    def play(self, budget: int) -> int:
+        """
+        Play the coexisting replicates until turn budget
+        :param budget:
+        :return: number of turns played
+        """
+        played = 0
+        for r, grid in enumerate(self.grids):
+            while self.alive[r] and grid.sim_turn < budget:
+                try:
+                    grid.play_turn()
+                except EndOfSimulatioError:
+                    self.alive[r] = False
+                played += 1
+            # turns 0 to sim_turn - 1 had both species, and sim_turn too if they are still there
+            self.coexistence[r] = grid.sim_turn + 1 if self.alive[r] else grid.sim_turn
+        self.budget = budget
+        return played
+
+    def to_dict(self) -> Dict:
+        return {'parameters': self.parameters, 'score': self.score, 'coexisting': self.coexisting,
+                'replicates': len(self.grids), 'budget': self.budget, 'dropped_at': self.dropped_at}
+
+
+class SearchResult:
+
+    def __init__(self, trials: List[Trial], rungs: List[Dict], varied: Sequence[str], turns_played: int,
+                 full_sweep_turns: int, seconds: float):
+        self.trials = trials
+        self.rungs = rungs
+        self.varied = list(varied)
+        self.turns_played = turns_played
+        self.full_sweep_turns = full_sweep_turns
+        self.seconds = seconds
+
+    @property
+    def survivors(self) -> List[Trial]:
+        """
+        Configurations still coexisting in at least one replicate at the end of the last rung, best first
+        """
+        return sorted([t for t in self.trials if t.dropped_at is None], key=Trial.rank_key)
+
+    @property
+    def compute_fraction(self) -> float:
+        """
+        Turns played over the turns of a full sweep playing every replicate of every configuration to max_turns
+        """
+        return self.turns_played / self.full_sweep_turns if self.full_sweep_turns > 0 else 0.
+
+    def region(self) -> Dict[str, List]:
+        """
+        Values of the varied parameters taken by the survivors
+        """
+        return {name: sorted({t.parameters[name] for t in self.survivors}) for name in self.varied}
+
+    def summary(self) -> Dict:
+        return {'region': self.region(),
+                'survivors': [{name: t.parameters[name] for name in self.varied} for t in self.survivors],
+                'rungs': self.rungs,
+                'turns_played': self.turns_played,
+                'full_sweep_turns': self.full_sweep_turns,
+                'compute_fraction': self.compute_fraction,
+                'seconds': self.seconds}
+
+
+class SuccessiveHalving:
+
+    def __init__(self, base_parameters: Dict, space: Dict[str, Sequence], max_turns: int, min_turns: int = 10,
+                 eta: int = 3, keep_fraction: Optional[float] = None, replicates: int = 1, seed: Optional[int] = None,
+                 backend: str = 'memory',
+                 engine: Callable[..., SimulationGrid] = SimulationGrid):
+        """
+        :param base_parameters: simulation parameters shared by every configuration
+        :param space: parameter name -> values to try, every combination is a configuration
+        :param max_turns: budget of the last rung
+        :param min_turns: budget of the first rung
+        :param eta: budget growth between two rungs
+        :param keep_fraction: fraction of the configurations of a rung extended to the next one, the best coexisting
+        ones. 1/eta (successive halving) if None, 1 to extend every coexisting configuration
+        :param replicates: simulations played for each configuration
+        :param seed: seed of the random streams of the replicates
+        :param backend: storage backend of the simulations, see backends.BACKENDS
+        :param engine: SimulationGrid or JitSimulationGrid
+        """
+        if eta < 2:
+            raise ValueError('eta must be at least 2, got {}'.format(eta))
+        if not 0 < min_turns <= max_turns:
+            raise ValueError('Expected 0 < min_turns <= max_turns, got {} and {}'.format(min_turns, max_turns))
+        if keep_fraction is not None and not 0 < keep_fraction <= 1:
+            raise ValueError('keep_fraction must be in (0, 1], got {}'.format(keep_fraction))
+        if replicates < 1:
+            raise ValueError('replicates must be positive, got {}'.format(replicates))
+        self._configurations = parameter_grid(base_parameters, space)
+        self._varied = sorted(space)
+        self._max_turns = max_turns
+        self._min_turns = min_turns
+        self._eta = eta
+        self._keep_fraction = 1 / eta if keep_fraction is None else keep_fraction
+        self._replicates = replicates
+        self._seed = seed
+        self._backend = backend
+        self._engine = engine
+
+    def budgets(self) -> List[int]:
+        """
+        Number of turns played at the end of each rung
+        """
+        budgets = [self._min_turns]
+        while budgets[-1] < self._max_turns:
+            budgets.append(min(budgets[-1] * self._eta, self._max_turns))
+        return budgets
+
+    def run(self) -> SearchResult:
+        start = time.time()
+        rng = random.Random(self._seed)
+        persistence = create_backend(self._backend)
+        trials = []
+        for parameters in self._configurations:
+            grids = [self._engine(persistence=persistence, simulation_parameters=parameters,
+                                  detectors=[SharkExtinction(), FishExtinction()],
+                                  random_state=random.Random(rng.getrandbits(64)).getstate())
+                     for _ in range(self._replicates)]
+            trials.append(Trial(parameters, grids))
+        active = list(trials)
+        rungs = []
+        turns_played = 0
+        budgets = self.budgets()
+        for rung, budget in enumerate(budgets):
+            for trial in active:
+                turns_played += trial.play(budget)
+            coexisting = sorted([t for t in active if t.coexisting > 0], key=Trial.rank_key)
+            kept = coexisting
+            if rung < len(budgets) - 1 and len(coexisting) > 0:
+                keep = max(1, math.ceil(len(active) * self._keep_fraction))
+                kept = [t for t in coexisting if t.rank_key() <= coexisting[min(keep, len(coexisting)) - 1].rank_key()]
+            kept_ids = {id(t) for t in kept}
+            for trial in active:
+                if id(trial) not in kept_ids:
+                    trial.dropped_at = budget
+            _logger.info('Rung {}: {} configurations played {} turns, {} coexisting, {} kept'.format(
+                rung, len(active), budget, len(coexisting), len(kept)))
+            rungs.append({'budget': budget, 'played': len(active), 'coexisting': len(coexisting), 'kept': len(kept)})
+            active = kept
+            if len(active) == 0:
+                break
+        persistence.close()
+        full_sweep_turns = len(trials) * self._replicates * self._max_turns
+        return SearchResult(trials, rungs, self._varied, turns_played, full_sweep_turns, time.time() - start)
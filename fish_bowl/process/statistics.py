@@ -0,0 +1,341 @@
+"""
+Streaming statistics of the populations of many replicates
+
+PopulationStatistics aggregates the (turn, nb_fish, nb_shark) series of replicates of a configuration as they are
+reported, without keeping them:
+
+- mean and variance of both populations at every turn, updated with Welford's algorithm and combined with Chan's
+  formula, so batches and other aggregators merge exactly
+- quantiles of both populations at every turn, from a logarithmic bucket sketch (as DDSketch): a quantile is
+  returned within relative_accuracy of a population that was reported at that turn
+- extinction turns: histogram of the first turn each population hit 0, and the replicates still alive when they
+  stopped reporting (censored)
+
+Memory is proportional to the number of turns (and log of the largest population), not to the number of replicates.
+Aggregators are plain numpy arrays: they pickle to worker processes and back, and merge() adds the aggregator of
+another worker.
+
+Replicates report through a recorder (a termination detector that never ends the simulation, to pass to
+SimulationGrid), a whole turn log (add_turn_log), or the population history of an EnsembleGrid (add_histories).
+"""
+import logging
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from fish_bowl.process.termination import TerminationDetector
+from fish_bowl.process.utils import Animal
+
+_logger = logging.getLogger(__name__)
+
+# index of the populations in the arrays
+SPECIES = (Animal.Fish, Animal.Shark)
+
+
+def _species_index(animal: Animal) -> int:
+    return SPECIES.index(animal)
+
+
+class PopulationStatistics:
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        """
+        :param relative_accuracy: relative error of the quantiles
+        """
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy must be between 0 and 1, got {}'.format(relative_accuracy))
+        self._accuracy = relative_accuracy
+        self._log_gamma = math.log((1 + relative_accuracy) / (1 - relative_accuracy))
+        # (turns, species) moments
+        self._count = np.zeros((0, len(SPECIES)), dtype=np.int64)
+        self._mean = np.zeros((0, len(SPECIES)))
+        self._m2 = np.zeros((0, len(SPECIES)))
+        # (turns, species, buckets) sketch, bucket 0 holds the zeros, bucket k + 1 the values in (gamma**(k-1),
+        # gamma**k]
+        self._buckets = np.zeros((0, len(SPECIES), 1), dtype=np.int64)
+        # (turns, species) number of replicates whose population first hit 0 at that turn
+        self._extinct = np.zeros((0, len(SPECIES)), dtype=np.int64)
+        # (turns, species) number of replicates that stopped reporting at that turn with that population alive
+        self._censored = np.zeros((0, len(SPECIES)), dtype=np.int64)
+
+    @property
+    def relative_accuracy(self) -> float:
+        return self._accuracy
+
+    @property
+    def turns(self) -> int:
+        """
+        Number of turns with at least one report, turn 0 included
+        """
+        return len(self._count)
+
+    @property
+    def replicates(self) -> int:
+        """
+        Number of replicates that reported turn 0
+        """
+        return int(self._count[0, 0]) if self.turns > 0 else 0
+
+    @property
+    def nbytes(self) -> int:
+        return sum(a.nbytes for a in (self._count, self._mean, self._m2, self._buckets, self._extinct,
+                                      self._censored))
+
+    def _grow(self, turns: int, buckets: int = 0):
+        """
+        Make room for turns turns and buckets buckets
+        """
+        extra_turns = max(0, turns - self.turns)
+        extra_buckets = max(0, buckets - self._buckets.shape[2])
+        if extra_turns == 0 and extra_buckets == 0:
+            return
+        for name in ('_count', '_mean', '_m2', '_extinct', '_censored'):
+            array = getattr(self, name)
+            setattr(self, name, np.concatenate([array, np.zeros((extra_turns, len(SPECIES)), dtype=array.dtype)]))
+        self._buckets = np.pad(self._buckets, ((0, extra_turns), (0, 0), (0, extra_buckets)))
+
+    def _bucket(self, values: np.ndarray) -> np.ndarray:
+        """
+        Sketch bucket of non negative values
+        """
+        values = np.asarray(values, dtype=np.float64)
+        positive = values > 0
+        buckets = np.zeros(values.shape, dtype=np.int64)
+        # values are >= 1, their bucket is >= 1
+        buckets[positive] = np.ceil(np.log(values[positive]) / self._log_gamma - 1e-9).astype(np.int64) + 1
+        return buckets
+
+    def _add_moments(self, turns: np.ndarray, count: np.ndarray, mean: np.ndarray, m2: np.ndarray):
+        """
+        Chan's combination of (turns, species) moments of a batch into the aggregated ones
+        """
+        n_a = self._count[turns]
+        n = n_a + count
+        delta = mean - self._mean[turns]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(n > 0, count / np.maximum(n, 1), 0.)
+        self._mean[turns] += delta * weight
+        self._m2[turns] += m2 + delta ** 2 * n_a * weight
+        self._count[turns] = n
+
+    def _add_values(self, turns: np.ndarray, values: np.ndarray, reported: np.ndarray):
+        """
+        Add a batch of reports
+        :param turns: (T,) distinct turns
+        :param values: (T, R, species) populations of R replicates at these turns
+        :param reported: (T, R) mask of the replicates that reported each turn
+        """
+        self._grow(int(turns.max()) + 1)
+        weights = reported[:, :, None].astype(np.float64)
+        count = np.repeat(reported.sum(axis=1)[:, None], len(SPECIES), axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, (values * weights).sum(axis=1) / np.maximum(count, 1), 0.)
+        m2 = (((values - mean[:, None, :]) ** 2) * weights).sum(axis=1)
+        self._add_moments(turns, count, mean, m2)
+        t, r = np.nonzero(reported)
+        buckets = self._bucket(values[t, r])
+        self._grow(0, int(buckets.max()) + 1 if buckets.size else 0)
+        for s in range(len(SPECIES)):
+            np.add.at(self._buckets, (turns[t], s, buckets[:, s]), 1)
+
+    def _add_series(self, values: np.ndarray, reported: np.ndarray):
+        """
+        Add the series of R replicates reporting from turn 0
+        :param values: (T, R, species) populations by turn
+        :param reported: (T, R) mask, a replicate reports turns 0 to its last turn
+        """
+        turns = np.arange(values.shape[0])
+        self._add_values(turns, values, reported)
+        last = reported.sum(axis=0) - 1
+        replicates = np.flatnonzero(last >= 0)
+        for s in range(len(SPECIES)):
+            zero = (values[:, :, s] == 0) & reported
+            extinct = zero.any(axis=0)
+            first = np.argmax(zero, axis=0)
+            np.add.at(self._extinct[:, s], first[extinct], 1)
+            alive = replicates[~extinct[replicates]]
+            np.add.at(self._censored[:, s], last[alive], 1)
+
+    def add_turn_log(self, turn_log: Sequence[Tuple[int, int, int]]):
+        """
+        Add a complete replicate
+        :param turn_log: (turn, nb_fish, nb_shark) of turns 0 to the last one, as returned by get_turn_log
+        """
+        if len(turn_log) == 0:
+            return
+        log = np.asarray(turn_log, dtype=np.int64)
+        if (log[:, 0] != np.arange(len(log))).any():
+            raise ValueError('A turn log must hold turns 0 to {} in order'.format(len(log) - 1))
+        self._add_series(log[:, None, 1:].astype(np.float64), np.ones((len(log), 1), dtype=bool))
+
+    def add_histories(self, history: np.ndarray, end_turn: Optional[np.ndarray] = None):
+        """
+        Add replicates played together, as EnsembleGrid.population_history
+        :param history: (turns + 1, R, 2) fish and shark populations, row 0 being the spawn
+        :param end_turn: (R,) turn each replicate ended at, -1 if it reported every row (EnsembleGrid.end_turn)
+        """
+        history = np.asarray(history, dtype=np.float64)
+        reported = np.ones(history.shape[:2], dtype=bool)
+        if end_turn is not None:
+            end_turn = np.asarray(end_turn)
+            last = np.where(end_turn < 0, history.shape[0] - 1, end_turn)
+            reported = np.arange(history.shape[0])[:, None] <= last[None, :]
+        self._add_series(history, reported)
+
+    def recorder(self) -> 'ReplicateRecorder':
+        """
+        Recorder of one replicate, to pass to SimulationGrid among its detectors
+        """
+        return ReplicateRecorder(self)
+
+    def merge(self, other: 'PopulationStatistics'):
+        """
+        Add the reports aggregated by another PopulationStatistics, with the same relative_accuracy
+        :param other:
+        :return: self
+        """
+        if other.relative_accuracy != self._accuracy:
+            raise ValueError('Cannot merge sketches of relative accuracy {} and {}'.format(other.relative_accuracy,
+                                                                                          self._accuracy))
+        self._grow(other.turns, other._buckets.shape[2])
+        turns = np.arange(other.turns)
+        self._add_moments(turns, other._count, other._mean, other._m2)
+        self._buckets[:other.turns, :, :other._buckets.shape[2]] += other._buckets
+        self._extinct[:other.turns] += other._extinct
+        self._censored[:other.turns] += other._censored
+        return self
+
+    # ---------------------------------------------------------------- results
+    def count(self, animal: Animal = Animal.Shark) -> np.ndarray:
+        """
+        Number of replicates that reported each turn
+        """
+        return self._count[:, _species_index(animal)].copy()
+
+    def mean(self, animal: Animal) -> np.ndarray:
+        """
+        Mean population by turn
+        """
+        return self._mean[:, _species_index(animal)].copy()
+
+    def variance(self, animal: Animal, ddof: int = 1) -> np.ndarray:
+        """
+        Variance of the population by turn, nan where less than ddof + 1 replicates reported
+        """
+        s = _species_index(animal)
+        n = self._count[:, s]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(n > ddof, self._m2[:, s] / (n - ddof), np.nan)
+
+    def std(self, animal: Animal, ddof: int = 1) -> np.ndarray:
+        return np.sqrt(self.variance(animal, ddof=ddof))
+
+    def quantile(self, animal: Animal, q: float) -> np.ndarray:
+        """
+        q-quantile of the population by turn, within relative_accuracy, nan for turns without report
+        :param animal:
+        :param q: between 0 and 1
+        :return:
+        """
+        if not 0 <= q <= 1:
+            raise ValueError('q must be between 0 and 1, got {}'.format(q))
+        s = _species_index(animal)
+        buckets = self._buckets[:, s, :]
+        n = buckets.sum(axis=1)
+        cumulated = np.cumsum(buckets, axis=1)
+        rank = np.floor(q * (n - 1))
+        bucket = np.argmax(cumulated > rank[:, None], axis=1)
+        gamma = math.exp(self._log_gamma)
+        # middle of the bucket (in relative terms), 0 for the zero bucket
+        values = np.where(bucket > 0, 2 * gamma ** (bucket - 1.) / (gamma + 1), 0.)
+        return np.where(n > 0, values, np.nan)
+
+    def extinctions(self, animal: Animal) -> np.ndarray:
+        """
+        Number of replicates whose population first hit 0 at each turn
+        """
+        return self._extinct[:, _species_index(animal)].copy()
+
+    def censored(self, animal: Animal) -> np.ndarray:
+        """
+        Number of replicates that stopped reporting at each turn with that population still alive
+        """
+        return self._censored[:, _species_index(animal)].copy()
+
+    def extinction_probability(self, animal: Animal) -> np.ndarray:
+        """
+        Kaplan-Meier estimate of the probability that the population is extinct at each turn, replicates that
+        stopped early only count while they reported
+        """
+        s = _species_index(animal)
+        extinct = self._extinct[:, s]
+        # at risk at turn t: neither extinct nor censored before t
+        at_risk = self.replicates - np.concatenate([[0], np.cumsum(extinct + self._censored[:, s])[:-1]])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            hazard = np.where(at_risk > 0, extinct / np.maximum(at_risk, 1), 0.)
+        return 1 - np.cumprod(1 - hazard)
+
+    def summary(self, quantiles: Sequence[float] = (0.05, 0.5, 0.95)) -> Dict[str, Dict[str, List]]:
+        """
+        Json friendly statistics by population
+        """
+        result = {'replicates': self.replicates, 'turns': self.turns}
+        for animal in SPECIES:
+            result[animal.name.lower()] = {
+                'count': self.count(animal).tolist(),
+                'mean': self.mean(animal).tolist(),
+                'std': [None if math.isnan(v) else v for v in self.std(animal).tolist()],
+                'quantiles': {str(q): self.quantile(animal, q).tolist() for q in quantiles},
+                'extinctions': self.extinctions(animal).tolist(),
+                'extinction_probability': self.extinction_probability(animal).tolist(),
+            }
+        return result
+
+
+class ReplicateRecorder(TerminationDetector):
+    """
+    Reports the populations of one replicate to a PopulationStatistics, turn by turn. Never ends the simulation
+    """
+    name = 'statistics_recorder'
+
+    def __init__(self, statistics: PopulationStatistics):
+        self._statistics = statistics
+        self._turn = None
+        self._extinct = [False] * len(SPECIES)
+        self._finished = False
+
+    def __deepcopy__(self, memo):
+        # the recorder of a forked simulation reports the branch to the same statistics
+        branch = ReplicateRecorder(self._statistics)
+        branch._turn = self._turn
+        branch._extinct = list(self._extinct)
+        return branch
+
+    def start(self, grid_size: int):
+        return
+
+    def update(self, turn: int, nb_fish: int, nb_shark: int) -> Optional[str]:
+        expected = 0 if self._turn is None else self._turn + 1
+        if turn != expected or self._finished:
+            raise ValueError('Turn {} reported, expected turn {}'.format(turn, expected))
+        self._turn = turn
+        stats = self._statistics
+        values = np.array([[[nb_fish, nb_shark]]], dtype=np.float64)
+        stats._add_values(np.array([turn]), values, np.ones((1, 1), dtype=bool))
+        for s, value in enumerate((nb_fish, nb_shark)):
+            if value == 0 and not self._extinct[s]:
+                self._extinct[s] = True
+                stats._extinct[turn, s] += 1
+        return None
+
+    def finish(self):
+        """
+        The replicate stops reporting: populations still alive are censored at the last reported turn
+        """
+        if self._finished or self._turn is None:
+            return
+        self._finished = True
+        for s, extinct in enumerate(self._extinct):
+            if not extinct:
+                self._statistics._censored[self._turn, s] += 1
@@ -0,0 +1,182 @@
+"""
+Termination detectors
+
+A detector is fed the population of every logged turn and keeps its own running statistics, so checking for the end
+of a simulation costs O(1) (or O(max_period)) per turn instead of re-reading the grid. update returns the reason the
+simulation should stop, or None to keep playing.
+
+- SharkExtinction: no sharks left (the original rule of the game)
+- FishExtinction: no fish left, the sharks are bound to starve
+- FullGrid: every square is occupied
+- StableCycle: both populations repeat with a period of at most max_period turns, within a tolerance
+- LowVariance: the variance of both populations over a sliding window fell below a threshold
+"""
+import math
+from collections import deque
+from typing import Dict, List, Optional, Sequence
+
+# name -> detector class, filled below
+DETECTORS = {}
+
+
+class TerminationDetector:
+    name = None
+
+    def start(self, grid_size: int):
+        """
+        Reset the statistics for a new simulation
+        :param grid_size:
+        :return:
+        """
+        return
+
+    def update(self, turn: int, nb_fish: int, nb_shark: int) -> Optional[str]:
+        raise NotImplementedError
+
+
+class SharkExtinction(TerminationDetector):
+    name = 'shark_extinction'
+
+    def update(self, turn: int, nb_fish: int, nb_shark: int) -> Optional[str]:
+        if nb_shark == 0:
+            return 'Simulation ends because no more Sharks'
+        return None
+
+
+class FishExtinction(TerminationDetector):
+    name = 'fish_extinction'
+
+    def update(self, turn: int, nb_fish: int, nb_shark: int) -> Optional[str]:
+        if nb_fish == 0:
+            return 'Simulation ends because no more Fish'
+        return None
+
+
+class FullGrid(TerminationDetector):
+    name = 'full_grid'
+
+    def __init__(self):
+        self._cells = None
+
+    def start(self, grid_size: int):
+        self._cells = grid_size ** 2
+
+    def update(self, turn: int, nb_fish: int, nb_shark: int) -> Optional[str]:
+        if self._cells is not None and nb_fish + nb_shark >= self._cells:
+            return 'Simulation ends because the grid is full'
+        return None
+
+
+class StableCycle(TerminationDetector):
+    """
+    For each candidate period p, count the consecutive turns where both populations match their value p turns
+    earlier. The populations are cycling once a streak covers `repeats` full periods.
+    """
+    name = 'stable_cycle'
+
+    def __init__(self, max_period: int = 20, repeats: int = 3, atol: float = 0, rtol: float = 0.):
+        """
+        :param max_period: longest cycle looked for, in turns
+        :param repeats: number of periods the cycle must be observed for
+        :param atol: absolute tolerance on population counts
+        :param rtol: tolerance relative to the population count
+        """
+        if max_period < 1 or repeats < 1:
+            raise ValueError('max_period and repeats must be positive')
+        self._max_period = max_period
+        self._repeats = repeats
+        self._atol = atol
+        self._rtol = rtol
+        self.start(0)
+
+    def start(self, grid_size: int):
+        self._history = deque(maxlen=self._max_period)
+        self._streaks = [0] * (self._max_period + 1)
+
+    def _close(self, a: int, b: int) -> bool:
+        return abs(a - b) <= self._atol + self._rtol * max(abs(a), abs(b))
+
+    def update(self, turn: int, nb_fish: int, nb_shark: int) -> Optional[str]:
+        found = None
+        # history[-p] is the population p turns ago
+        for p in range(1, len(self._history) + 1):
+            fish, shark = self._history[-p]
+            if self._close(nb_fish, fish) and self._close(nb_shark, shark):
+                self._streaks[p] += 1
+                if found is None and self._streaks[p] >= p * self._repeats:
+                    found = p
+            else:
+                self._streaks[p] = 0
+        self._history.append((nb_fish, nb_shark))
+        if found is not None:
+            return 'Simulation ends because populations cycle with a period of {} turns'.format(found)
+        return None
+
+
+class LowVariance(TerminationDetector):
+    """
+    Running sums of both populations and of their squares over a sliding window
+    """
+    name = 'low_variance'
+
+    def __init__(self, window: int = 50, threshold: float = 1., relative: bool = False):
+        """
+        :param window: number of turns
+        :param threshold: maximum variance of each population over the window
+        :param relative: if True, compare the variance divided by the squared mean (squared coefficient of
+        variation) to the threshold, so that it doesn't depend on the grid size
+        """
+        if window < 2:
+            raise ValueError('window must be at least 2 turns')
+        self._window = window
+        self._threshold = threshold
+        self._relative = relative
+        self.start(0)
+
+    def start(self, grid_size: int):
+        self._values = deque()
+        # integer sums, exact whatever the number of turns
+        self._sums = [0, 0]
+        self._squares = [0, 0]
+
+    def _variance(self, i: int) -> float:
+        n = len(self._values)
+        variance = (n * self._squares[i] - self._sums[i] ** 2) / n ** 2
+        if self._relative:
+            return variance * n ** 2 / self._sums[i] ** 2 if self._sums[i] > 0 else math.inf
+        return variance
+
+    def update(self, turn: int, nb_fish: int, nb_shark: int) -> Optional[str]:
+        values = (nb_fish, nb_shark)
+        self._values.append(values)
+        for i, v in enumerate(values):
+            self._sums[i] += v
+            self._squares[i] += v * v
+        if len(self._values) > self._window:
+            for i, v in enumerate(self._values.popleft()):
+                self._sums[i] -= v
+                self._squares[i] -= v * v
+        if len(self._values) == self._window and all(self._variance(i) < self._threshold for i in range(2)):
+            return 'Simulation ends because populations variance stayed below {} for {} turns'.format(
+                self._threshold, self._window)
+        return None
+
+
+for _detector in (SharkExtinction, FishExtinction, FullGrid, StableCycle, LowVariance):
+    DETECTORS[_detector.name] = _detector
+
+
+def build_detectors(names: Sequence[str], options: Optional[Dict[str, Dict]] = None) -> List[TerminationDetector]:
+    """
+    Instantiate detectors by name
+    :param names: names from DETECTORS
+    :param options: name -> constructor arguments
+    :return:
+    """
+    options = options or {}
+    detectors = []
+    for name in names:
+        if name not in DETECTORS:
+            raise ValueError('Unknown termination detector {!r}, expected one of {}'.format(name, sorted(DETECTORS)))
+        detectors.append(DETECTORS[name](**options.get(name, {})))
+    return detectors
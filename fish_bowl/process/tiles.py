@@ -0,0 +1,152 @@
+"""
+Multi-resolution density tiles of a grid
+
+DensityPyramid aggregates the fish and shark counts of a grid into square bins at several zoom levels, and cuts
+every level into tiles of tile_size x tile_size bins:
+
+- zoom 0 is a single tile covering the whole grid
+- zoom z has 2**z x 2**z tiles, each bin covering 2**(max_zoom - z) x 2**(max_zoom - z) squares
+- max_zoom is the first level where a bin is a single square
+
+The grid is padded to tile_size * 2**max_zoom squares, the padding squares are always empty. A client viewing a
+huge grid only requests the tiles in view, each of them costs tile_size**2 bins whatever the size of the grid.
+
+The pyramid is a turn observer: every update applies the squares that changed since the previous snapshot to all
+levels, and only rebuilds the levels by 2x2 block sums when most of the grid changed.
+"""
+import logging
+from typing import Dict
+
+import numpy as np
+
+from fish_bowl.process.analytics import FISH, SHARK, TurnObserver
+
+_logger = logging.getLogger(__name__)
+
+ANIMALS = (FISH, SHARK)
+
+
+class DensityPyramid(TurnObserver):
+
+    def __init__(self, tile_size: int = 64, rebuild_above: float = 0.1):
+        """
+        :param tile_size: number of bins on a tile side, a power of 2
+        :param rebuild_above: fraction of changed squares above which levels are rebuilt instead of updated
+        """
+        if tile_size < 1 or tile_size & (tile_size - 1):
+            raise ValueError('tile_size must be a power of 2, got {}'.format(tile_size))
+        self._tile_size = tile_size
+        self._rebuild_above = rebuild_above
+        self._grid_size = None
+        self._max_zoom = None
+        self._grid = None
+        self._levels = []
+        self.turn = None
+
+    @classmethod
+    def from_grid(cls, grid: np.ndarray, turn: int = 0, tile_size: int = 64) -> 'DensityPyramid':
+        """
+        :param grid: Animal values indexed by [x, y]
+        :param turn:
+        :param tile_size:
+        :return: pyramid of that grid
+        """
+        pyramid = cls(tile_size=tile_size)
+        pyramid.start(grid.shape[0])
+        pyramid.update(turn, grid)
+        return pyramid
+
+    @property
+    def tile_size(self) -> int:
+        return self._tile_size
+
+    @property
+    def grid_size(self) -> int:
+        return self._grid_size
+
+    @property
+    def max_zoom(self) -> int:
+        return self._max_zoom
+
+    @property
+    def nbytes(self) -> int:
+        return self._grid.nbytes + sum(c.nbytes for level in self._levels for c in level.values())
+
+    def bin_size(self, zoom: int) -> int:
+        """
+        Number of squares on the side of a bin at that zoom
+        """
+        return 1 << (self._max_zoom - zoom)
+
+    def start(self, grid_size: int):
+        self._grid_size = grid_size
+        self._max_zoom = 0
+        while self._tile_size << self._max_zoom < grid_size:
+            self._max_zoom += 1
+        # the finest level is the padded grid itself, counts are kept for the coarser ones
+        side = self._tile_size << self._max_zoom
+        self._grid = np.zeros((side, side), dtype=np.int8)
+        self._levels = [{a: np.zeros((self._tile_size << z, self._tile_size << z), dtype=np.uint32) for a in ANIMALS}
+                        for z in range(self._max_zoom)]
+        self.turn = None
+
+    def _rebuild(self):
+        finer = {a: (self._grid == a).astype(np.uint32) for a in ANIMALS}
+        for z in reversed(range(self._max_zoom)):
+            side = self._tile_size << z
+            for a in ANIMALS:
+                self._levels[z][a] = finer[a].reshape(side, 2, side, 2).sum(axis=(1, 3), dtype=np.uint32)
+            finer = self._levels[z]
+
+    def update(self, turn: int, grid: np.ndarray):
+        if self._grid is None:
+            self.start(grid.shape[0])
+        n = self._grid_size
+        current = self._grid[:n, :n]
+        xs, ys = np.nonzero(current != grid)
+        if len(xs) > self._rebuild_above * n * n:
+            current[:] = grid
+            self._rebuild()
+        elif len(xs) > 0:
+            old = current[xs, ys]
+            new = grid[xs, ys]
+            for z, level in enumerate(self._levels):
+                shift = self._max_zoom - z
+                bx, by = xs >> shift, ys >> shift
+                for a, counts in level.items():
+                    np.subtract.at(counts, (bx[old == a], by[old == a]), 1)
+                    np.add.at(counts, (bx[new == a], by[new == a]), 1)
+            current[xs, ys] = new
+        self.turn = turn
+
+    def _check_tile(self, zoom: int, tx: int, ty: int):
+        if not 0 <= zoom <= self._max_zoom:
+            raise ValueError('zoom must be between 0 and {}, got {}'.format(self._max_zoom, zoom))
+        if not (0 <= tx < 1 << zoom and 0 <= ty < 1 << zoom):
+            raise ValueError('Tile ({}, {}) is outside of the {} x {} tiles of zoom {}'.format(tx, ty, 1 << zoom,
+                                                                                            1 << zoom, zoom))
+
+    def tile(self, zoom: int, tx: int, ty: int) -> Dict[int, np.ndarray]:
+        """
+        :param zoom:
+        :param tx: tile index along x
+        :param ty: tile index along y
+        :return: Animal value -> (tile_size, tile_size) counts of the bins of the tile, indexed by [x, y]
+        """
+        self._check_tile(zoom, tx, ty)
+        t = self._tile_size
+        window = (slice(tx * t, (tx + 1) * t), slice(ty * t, (ty + 1) * t))
+        if zoom == self._max_zoom:
+            return {a: (self._grid[window] == a).astype(np.uint32) for a in ANIMALS}
+        return {a: self._levels[zoom][a][window].copy() for a in ANIMALS}
+
+    def tile_squares(self, zoom: int, tx: int, ty: int) -> np.ndarray:
+        """
+        :return: (tile_size, tile_size) number of grid squares (not padding) in the bins of the tile
+        """
+        self._check_tile(zoom, tx, ty)
+        size = self.bin_size(zoom)
+        first = np.arange(self._tile_size) * size
+        xs = np.clip(self._grid_size - (tx * self._tile_size * size + first), 0, size)
+        ys = np.clip(self._grid_size - (ty * self._tile_size * size + first), 0, size)
+        return np.outer(xs, ys)
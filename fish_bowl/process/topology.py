@@ -20,6 +20,9 @@ SQUARE_NEIGH = {
     'se': (1, 1)
 }
 
+# shuffling a list draws the same random numbers whatever its content, one placeholder per neighbour count
+_PLACEHOLDERS = [list(range(k)) for k in range(len(SQUARE_NEIGH) + 1)]
+
 
 class NonEmptyCoordinate(Exception):
     pass
@@ -86,3 +89,28 @@ def square_grid_neighbours(grid_size: int, coordinate: SquareGridCoordinate,
     if shuffle:
         random.shuffle(neigh)
     return neigh
+
+
+def neighbour_count(grid_size: int, x: int, y: int) -> int:
+    """
+    Number of squares of the grid around (x, y), the length of square_grid_neighbours
+    :param grid_size:
+    :param x:
+    :param y:
+    :return:
+    """
+    nx = 3 - (x == 0) - (x == grid_size - 1)
+    ny = 3 - (y == 0) - (y == grid_size - 1)
+    return nx * ny - 1
+
+
+def skip_neighbour_draws(grid_size: int, x: int, y: int):
+    """
+    Consume the random draws of square_grid_neighbours for (x, y) without building the neighbours, so that an animal
+    that can't act keeps the random stream in step
+    :param grid_size:
+    :param x:
+    :param y:
+    :return:
+    """
+    random.shuffle(_PLACEHOLDERS[neighbour_count(grid_size, x, y)])
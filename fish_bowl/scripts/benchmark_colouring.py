@@ -0,0 +1,69 @@
+"""
+Turn duration of the colouring engine by number of threads, on a large grid
+
+Needs numba (pip install .[jit]), without it the engine runs sequentially and there is nothing to measure.
+Speedups are only meaningful up to the number of cores of the machine. --record appends the measurement, with the
+core count and the numba threading layer, as a json line to a file so that runs on different machines can be
+compared.
+"""
+import logging
+import argparse
+import json
+import os
+import sys
+import time
+
+from fish_bowl.process.colouring import NUMBA_AVAILABLE, ColouredGrid
+
+_logger = logging.getLogger(__name__)
+
+
+def turn_duration(sim_config: dict, threads: int, turns: int) -> float:
+    grid = ColouredGrid(sim_config, seed=0, threads=threads)
+    # first turn compiles the sweep
+    grid.play_turn()
+    timer = time.time()
+    for _ in range(turns):
+        grid.play_turn()
+    return (time.time() - timer) / turns
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d:%(message)s")
+    cmd_parser = argparse.ArgumentParser()
+    cmd_parser.add_argument('--grid_size', default=2000, type=int, help='Side of the grid')
+    cmd_parser.add_argument('--turns', default=5, type=int, help='Number of measured turns')
+    cmd_parser.add_argument('--max_threads', default=None, type=int,
+                            help='Largest number of threads measured, numba default (all cores) if None')
+    cmd_parser.add_argument('--record', default=None, type=str,
+                            help='File the measurement is appended to, as a json line')
+    args = cmd_parser.parse_args()
+    if not NUMBA_AVAILABLE:
+        sys.exit('The colouring benchmark requires numba, install it with: pip install numba')
+    import numba
+    max_threads = args.max_threads or numba.config.NUMBA_NUM_THREADS
+    if max_threads > numba.config.NUMBA_NUM_THREADS:
+        sys.exit('numba starts {} threads at most, set NUMBA_NUM_THREADS to measure more'.format(
+            numba.config.NUMBA_NUM_THREADS))
+    if max_threads > os.cpu_count():
+        _logger.warning('Measuring up to {} threads on {} core(s), threads above the core count share them'.format(
+            max_threads, os.cpu_count()))
+    config = {'grid_size': args.grid_size, 'init_nb_fish': args.grid_size ** 2 // 3,
+              'init_nb_shark': args.grid_size ** 2 // 30, 'fish_breed_maturity': 3, 'fish_breed_probability': 80,
+              'fish_speed': 2, 'shark_breed_maturity': 5, 'shark_breed_probability': 90, 'shark_speed': 4,
+              'shark_starving': 4}
+    threads, reference = 1, None
+    durations = {}
+    while threads <= max_threads:
+        duration = turn_duration(config, threads, args.turns)
+        reference = reference or duration
+        durations[threads] = duration
+        print('{:>3} threads: {:>7.3f} s/turn, speedup {:.2f}'.format(threads, duration, reference / duration))
+        threads *= 2
+    if args.record is not None:
+        record = {'cpu_count': os.cpu_count(), 'numba_threads': numba.config.NUMBA_NUM_THREADS,
+                  'threading_layer': numba.threading_layer(), 'grid_size': args.grid_size, 'turns': args.turns,
+                  'seconds_per_turn': {str(k): round(v, 4) for k, v in durations.items()}}
+        with open(args.record, 'a') as fp:
+            fp.write(json.dumps(record) + '\n')
+        _logger.info('Measurement appended to {}'.format(args.record))
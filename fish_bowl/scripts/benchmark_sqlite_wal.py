@@ -0,0 +1,79 @@
+"""
+Writer throughput with concurrent readers, for each sqlite persistence profile
+
+A simulation is played in the main process while reader processes keep loading the grid of the same database.
+"""
+import logging
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from sqlalchemy.exc import OperationalError
+
+from fish_bowl.dataio.persistence import SimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.utils import EndOfSimulatioError
+from fish_bowl.common.config_reader import read_simulation_config
+
+_logger = logging.getLogger(__name__)
+
+
+def reader(database_url, profile, sim_id, stop, counters, index):
+    client = SimulationClient(database_url, profile=profile, read_pool_size=1)
+    reads, errors = 0, 0
+    while not stop.is_set():
+        try:
+            client.get_last_turn(sim_id)
+            client.get_animal_arrays(sim_id, ('animal_type', 'coord_x', 'coord_y'))
+            reads += 1
+        except OperationalError:
+            errors += 1
+    counters[index] = (reads, errors)
+
+
+def run(profile: str, sim_config: dict, turns: int, nb_readers: int):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url = 'sqlite:///{}'.format(os.path.join(tmp_dir, 'bench.db'))
+        client = SimulationClient(database_url, profile=profile)
+        grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+        stop = multiprocessing.Event()
+        counters = multiprocessing.Manager().dict()
+        readers = [multiprocessing.Process(target=reader, args=(database_url, profile, grid.sim_id, stop, counters, i))
+                   for i in range(nb_readers)]
+        for p in readers:
+            p.start()
+        timer = time.time()
+        played, write_errors = 0, 0
+        while played < turns:
+            try:
+                grid.play_turn()
+            except EndOfSimulatioError:
+                break
+            except OperationalError:
+                write_errors += 1
+                break
+            played += 1
+        duration = time.time() - timer
+        stop.set()
+        for p in readers:
+            p.join()
+        reads = sum(c[0] for c in counters.values())
+        read_errors = sum(c[1] for c in counters.values())
+        print('{:<10} readers={} writer: {:>6.2f} turns/s ({} errors) readers: {:>7.1f} reads/s ({} errors)'
+              .format(profile, nb_readers, played / duration, write_errors, reads / duration, read_errors))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d:%(message)s")
+    cmd_parser = argparse.ArgumentParser()
+    cmd_parser.add_argument('--config_name', default='simulation_config_1',
+                            help='Simulation configuration file name')
+    cmd_parser.add_argument('--turns', default=5, type=int, help='Number of turns played by the writer')
+    cmd_parser.add_argument('--readers', default=4, type=int, help='Number of concurrent reader processes')
+    args = cmd_parser.parse_args()
+    config = read_simulation_config(args.config_name)
+    for profile_name in ('default', 'production'):
+        for n in (0, args.readers):
+            run(profile_name, config, args.turns, n)
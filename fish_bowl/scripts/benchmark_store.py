@@ -0,0 +1,45 @@
+import logging
+import argparse
+import tracemalloc
+
+from fish_bowl.dataio.persistence import SimulationClient, Animals
+from fish_bowl.dataio.store import AnimalStore
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.common.config_reader import read_simulation_config
+
+_logger = logging.getLogger(__name__)
+
+
+def orm_bytes_per_animal(client: SimulationClient, sim_id: int) -> float:
+    """
+    Memory allocated to hold the live animals as Animals ORM rows, as update_animals and kill_animal do
+    """
+    with client.session_scope() as s:
+        tracemalloc.start()
+        rows = s.query(Animals).filter(Animals.sim_id == sim_id, Animals.alive).all()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return size / len(rows)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d:%(message)s")
+    cmd_parser = argparse.ArgumentParser()
+    cmd_parser.add_argument('--config_name', default='simulation_config_1',
+                            help='Simulation configuration file name')
+    cmd_parser.add_argument('--turns', default=2, type=int, help='Number of turns played before measuring')
+    args = cmd_parser.parse_args()
+    sim_config = read_simulation_config(args.config_name)
+    client = SimulationClient('sqlite://')
+    grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+    for _ in range(args.turns):
+        grid.play_turn()
+    df = client.get_animals_df(grid.sim_id)
+    store = AnimalStore.load(client, grid.sim_id, live_only=True)
+    store_bytes = store.bytes_per_animal
+    df_bytes = df.memory_usage(deep=True).sum() / len(df)
+    orm_bytes = orm_bytes_per_animal(client, grid.sim_id)
+    print('{} live animals'.format(len(df)))
+    print('AnimalStore : {:>7.1f} bytes/animal'.format(store_bytes))
+    print('DataFrame   : {:>7.1f} bytes/animal ({:.1f}x)'.format(df_bytes, df_bytes / store_bytes))
+    print('ORM rows    : {:>7.1f} bytes/animal ({:.1f}x)'.format(orm_bytes, orm_bytes / store_bytes))
@@ -0,0 +1,54 @@
+import json
+import logging
+import argparse
+import sys
+
+from fish_bowl.common.config_reader import read_simulation_config
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.search import SuccessiveHalving
+
+_logger = logging.getLogger(__name__)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d:%(message)s")
+    cmd_parser = argparse.ArgumentParser()
+    cmd_parser.add_argument('--config_name', default='simulation_config_1',
+                            help='Configuration file of the parameters that are not searched')
+    cmd_parser.add_argument('--config_path', default=None, type=str,
+                            help='Configuration folder holding config_name, or path of the configuration file itself')
+    cmd_parser.add_argument('--fish_breed_probability', default=[20, 40, 60, 80, 100], type=int, nargs='+')
+    cmd_parser.add_argument('--shark_breed_maturity', default=[2, 4, 6, 8, 12], type=int, nargs='+')
+    cmd_parser.add_argument('--shark_starving', default=[2, 3, 4, 6, 8], type=int, nargs='+')
+    cmd_parser.add_argument('--max_turns', default=500, type=int, help='Turns both species must coexist')
+    cmd_parser.add_argument('--min_turns', default=10, type=int, help='Turns played by every configuration')
+    cmd_parser.add_argument('--eta', default=3, type=int, help='Budget growth between two rungs')
+    cmd_parser.add_argument('--keep_fraction', default=None, type=float,
+                            help='Fraction of the configurations extended to the next rung, 1/eta by default')
+    cmd_parser.add_argument('--replicates', default=3, type=int, help='Simulations played by configuration')
+    cmd_parser.add_argument('--seed', default=None, type=int)
+    cmd_parser.add_argument('--engine', default='python', choices=['python', 'jit'])
+    cmd_parser.add_argument('--summary', default='-', type=str,
+                            help='Write the json summary of the search to this file, - for stdout')
+    args = cmd_parser.parse_args()
+    sim_config = read_simulation_config(args.config_name, config_path=args.config_path)
+    if args.engine == 'jit':
+        from fish_bowl.process.jit import JitSimulationGrid as engine
+    else:
+        engine = SimulationGrid
+    space = {'fish_breed_probability': args.fish_breed_probability,
+             'shark_breed_maturity': args.shark_breed_maturity,
+             'shark_starving': args.shark_starving}
+    search = SuccessiveHalving(sim_config, space, max_turns=args.max_turns, min_turns=args.min_turns, eta=args.eta,
+                               keep_fraction=args.keep_fraction, replicates=args.replicates, seed=args.seed,
+                               engine=engine)
+    result = search.run()
+    _logger.info('{} configurations coexist for {} turns, found with {:.0%} of the turns of a full sweep'.format(
+        len(result.survivors), args.max_turns, result.compute_fraction))
+    summary = result.summary()
+    if args.summary == '-':
+        json.dump(summary, sys.stdout)
+        print()
+    else:
+        with open(args.summary, 'w') as fp:
+            json.dump(summary, fp)
@@ -0,0 +1,28 @@
+import logging
+import argparse
+
+from fish_bowl.dataio.export import ParquetExporter
+from fish_bowl.dataio.persistence import get_database_string
+from fish_bowl.dataio.sharding import open_client
+
+_logger = logging.getLogger(__name__)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d:%(message)s")
+    cmd_parser = argparse.ArgumentParser()
+    cmd_parser.add_argument('directory', help='Export folder, an interrupted export in it is resumed')
+    cmd_parser.add_argument('--database', default=None, type=str,
+                            help='Database url, sharded:///<folder> for sharded databases. Default simulation database '
+                                 'if not provided')
+    cmd_parser.add_argument('--sim_id', default=None, type=int, nargs='+',
+                            help='Simulations to export, all of them if not provided')
+    cmd_parser.add_argument('--turns_per_partition', default=1000, type=int, help='Number of turns per file')
+    cmd_parser.add_argument('--batch_size', default=1 << 16, type=int, help='Rows read at once and row group size')
+    cmd_parser.add_argument('--compression', default='zstd', type=str, help='Parquet compression codec')
+    args = cmd_parser.parse_args()
+    client = open_client(args.database or get_database_string())
+    exporter = ParquetExporter(client, args.directory, turns_per_partition=args.turns_per_partition,
+                               batch_size=args.batch_size, compression=args.compression)
+    exporter.export(args.sim_id)
+    client.close()
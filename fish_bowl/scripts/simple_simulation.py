@@ -1,15 +1,100 @@
+import json
 import logging
 import argparse
+import os
+import sys
 import time
+from typing import Dict, Optional
 
-from fish_bowl.dataio.persistence import SimulationClient, get_database_string
+from fish_bowl.dataio.backends import BACKENDS, create_backend
 from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.termination import DETECTORS, build_detectors
+from fish_bowl.process.utils import Animal, EndOfSimulatioError
 from fish_bowl.common.config_reader import read_simulation_config
-from fish_bowl.process.simple_display import display_simple_grid
 
 _logger = logging.getLogger(__name__)
 
 
+def save_snapshot(grid: SimulationGrid, snapshot_dir: str) -> str:
+    """
+    Save the grid of the current turn as a .npy file
+    :param grid:
+    :param snapshot_dir:
+    :return: file path
+    """
+    import numpy as np
+    path = os.path.join(snapshot_dir, 'sim_{}_turn_{:06d}.npy'.format(grid.sim_id, grid.sim_turn))
+    np.save(path, grid.get_grid())
+    return path
+
+
+def run_simulation(grid: SimulationGrid, max_turn: int, headless: bool = False, snapshot_every: int = 1,
+                   snapshot_dir: Optional[str] = None, progress_every: float = 10.) -> Dict:
+    """
+    Play a simulation until max_turn or until it ends
+    :param grid:
+    :param max_turn:
+    :param headless: don't print the grid nor the turn durations
+    :param snapshot_every: print (or save to snapshot_dir) the grid every snapshot_every turns, never if 0
+    :param snapshot_dir: folder of the saved snapshots, the grid is printed if None
+    :param progress_every: seconds between two progress logs, never if 0
+    :return: summary of the run
+    """
+    def snapshot():
+        if snapshot_dir is not None:
+            save_snapshot(grid, snapshot_dir)
+        elif not headless:
+            print(grid.get_grid())
+
+    grid_size = grid.get_simulation_parameters().grid_size
+    if snapshot_dir is not None:
+        os.makedirs(snapshot_dir, exist_ok=True)
+    if snapshot_every > 0:
+        snapshot()
+    start = time.time()
+    last_progress = start
+    first_turn = grid.sim_turn
+    for _ in range(max_turn):
+        timer = time.time()
+        try:
+            grid.play_turn()
+        except EndOfSimulatioError as err:
+            if not headless:
+                print(err)
+            break
+        now = time.time()
+        if snapshot_every > 0 and grid.sim_turn % snapshot_every == 0:
+            if not headless and snapshot_dir is None:
+                print(''.join(['*'] * grid_size * 2))
+                print('Turn: {turn: ^{size}}'.format(turn=grid.sim_turn, size=grid_size))
+                print()
+            snapshot()
+        if not headless:
+            print('Turn duration: {:.3f}s'.format(now - timer))
+            print()
+        if progress_every > 0 and now - last_progress >= progress_every:
+            last_progress = now
+            played = grid.sim_turn - first_turn
+            rate = played / (now - start)
+            population = grid.population
+            _logger.info('Turn {}/{}: {} fish, {} sharks, {:.2f} turns/s, ETA {:.0f}s'.format(
+                played, max_turn, population[Animal.Fish], population[Animal.Shark], rate,
+                (max_turn - played) / rate))
+    elapsed = time.time() - start
+    played = grid.sim_turn - first_turn
+    population = grid.population
+    return {
+        'sim_id': grid.sim_id,
+        'turns': played,
+        'last_turn': grid.sim_turn,
+        'end_reason': grid.end_reason,
+        'nb_fish': population[Animal.Fish],
+        'nb_shark': population[Animal.Shark],
+        'elapsed': elapsed,
+        'turns_per_second': played / elapsed if elapsed > 0 else None,
+    }
+
+
 if __name__ == '__main__':
     logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(filename)s:%(lineno)d:%(message)s")
     cmd_parser = argparse.ArgumentParser()
@@ -18,26 +103,74 @@ if __name__ == '__main__':
     cmd_parser.add_argument('--max_turn', default=100, type=int, help='Maximum number of turns for the simulation')
     cmd_parser.add_argument('--config_path', default=None, type=str,
                             help="""
-                            Configuration file path. If specified, configuration file will be loaded from this path
+                            Configuration folder holding config_name, or path of the configuration file itself
                             """)
+    cmd_parser.add_argument('--backend', default='sql', choices=sorted(BACKENDS),
+                            help='Storage backend of the simulation')
+    cmd_parser.add_argument('--history_dir', default='simulation_history',
+                            help='Folder of the parquet history, for the parquet backend')
+    cmd_parser.add_argument('--shard_dir', default='simulation_shards',
+                            help='Folder of the catalog and simulation databases, for the sharded backend')
+    cmd_parser.add_argument('--engine', default='python', choices=['python', 'jit', 'coloured'],
+                            help='jit plays the same turns with the compiled kernel, coloured plays them colour class '
+                                 'by colour class on several cores (other trajectories), both on the memory, parquet '
+                                 'and pipelined backends only')
+    cmd_parser.add_argument('--threads', default=None, type=int,
+                            help='Threads of the coloured engine, all cores by default')
+    cmd_parser.add_argument('--occupancy_budget', default=None, type=float,
+                            help='Megabytes the occupancy of a turn can take before it is bit-packed, no limit by '
+                                 'default')
+    cmd_parser.add_argument('--stop_when', default=['shark_extinction'], nargs='+', choices=sorted(DETECTORS),
+                            help='Termination detectors stopping the simulation before max_turn')
+    cmd_parser.add_argument('--headless', action='store_true',
+                            help='Play at full engine speed: no grid display, only progress logs and the summary')
+    cmd_parser.add_argument('--snapshot_every', default=None, type=int,
+                            help='Grid snapshot every n turns, 0 for none. Default 1, or 0 when headless')
+    cmd_parser.add_argument('--snapshot_dir', default=None, type=str,
+                            help='Save the snapshots to this folder as .npy files instead of printing them')
+    cmd_parser.add_argument('--progress_every', default=10., type=float,
+                            help='Seconds between two progress logs, 0 for none')
+    cmd_parser.add_argument('--summary', default=None, type=str,
+                            help='Write a json summary of the run to this file, - for stdout')
     args = cmd_parser.parse_args()
-    if args.config_path is not None:
-        raise NotImplementedError('Code for directing to an alternative configuration'
-                                  ' repository has not been implemented yet')
     # Load simulation configuration
-    sim_config = read_simulation_config(args.config_name)
+    sim_config = read_simulation_config(args.config_name, config_path=args.config_path)
     # Instantiate client
-    client = SimulationClient(get_database_string())
-    # display initial grid
-    grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
-    print(display_simple_grid(client.get_animals_df(grid._sid), grid_size=sim_config['grid_size']))
-    for turn in range(args.max_turn):
-        timer = time.time()
-        grid.play_turn()
-        print(''.join(['*'] * sim_config['grid_size'] * 2))
-        print('Turn: {turn: ^{size}}'.format(turn=grid._sim_turn, size=sim_config['grid_size']))
-        print()
-        print(display_simple_grid(grid.get_simulation_grid_data(), sim_config['grid_size']))
-        print()
-        print('Turn duration: {:<3}s'.format(int(time.time()-timer)))
+    if args.backend in ('sql', 'pipelined'):
+        from fish_bowl.dataio.persistence import get_database_string
+        client = create_backend(args.backend, database_url=get_database_string())
+    elif args.backend == 'parquet':
+        client = create_backend('parquet', directory=args.history_dir)
+    elif args.backend == 'sharded':
+        client = create_backend('sharded', directory=args.shard_dir)
+    else:
+        client = create_backend(args.backend)
+    engine_kwargs = {}
+    if args.occupancy_budget is not None:
+        engine_kwargs['occupancy_budget'] = int(args.occupancy_budget * 1024 * 1024)
+    if args.engine == 'jit':
+        from fish_bowl.process.jit import JitSimulationGrid as engine
+    elif args.engine == 'coloured':
+        from fish_bowl.process.colouring import ColouredSimulationGrid as engine
+        engine_kwargs['threads'] = args.threads
+    else:
+        engine = SimulationGrid
+    grid = engine(persistence=client, simulation_parameters=sim_config, detectors=build_detectors(args.stop_when),
+                  **engine_kwargs)
+    snapshot_every = args.snapshot_every
+    if snapshot_every is None:
+        snapshot_every = 0 if args.headless else 1
+    summary = run_simulation(grid, args.max_turn, headless=args.headless, snapshot_every=snapshot_every,
+                             snapshot_dir=args.snapshot_dir, progress_every=args.progress_every)
+    client.record_summary(grid.sim_id, end_reason=summary['end_reason'] or 'Turn budget of {} turns reached'.format(
+        args.max_turn), runtime_seconds=summary['elapsed'])
+    client.close()
+    summary.update(config=sim_config, backend=args.backend, engine=args.engine)
+    _logger.info('Simulation {} played {} turns in {:.1f}s, end reason: {}'.format(
+        summary['sim_id'], summary['turns'], summary['elapsed'], summary['end_reason']))
+    if args.summary == '-':
+        json.dump(summary, sys.stdout)
         print()
+    elif args.summary is not None:
+        with open(args.summary, 'w') as fp:
+            json.dump(summary, fp)
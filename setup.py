@@ -9,5 +9,6 @@ setup(
     license='',
     author='Pierre Carotti',
     author_email='pierre.carotti@gmail.com',
-    description='Predator-Prey simulation'
+    description='Predator-Prey simulation',
+    extras_require={'parquet': ['pyarrow'], 'jit': ['numba'], 'analytics': ['scipy']}
 )
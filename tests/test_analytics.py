@@ -0,0 +1,99 @@
+import random
+
+import numpy as np
+
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process import analytics
+from fish_bowl.process.analytics import SpatialAnalytics, cluster_size_distribution, cluster_sizes, fronts, \
+    label_clusters, local_density, pair_correlation
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.utils import EndOfSimulatioError
+
+sim_config = {
+    'grid_size': 20,
+    'init_nb_fish': 150,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 20,
+    'shark_breed_maturity': 4,
+    'shark_breed_probability': 90,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+
+def random_grid(grid_size: int, seed: int) -> np.ndarray:
+    rng = np.random.RandomState(seed)
+    return rng.choice([0, 1, 2], size=(grid_size, grid_size), p=[0.5, 0.35, 0.15]).astype(np.int8)
+
+
+class TestAnalytics:
+
+    def test_clusters(self):
+        grid = np.zeros((6, 6), dtype=np.int8)
+        grid[0, 0] = grid[1, 1] = grid[2, 2] = 1  # diagonal squares are neighbours
+        grid[0, 4] = grid[0, 5] = 1
+        grid[5, 0] = 1
+        assert sorted(cluster_sizes(grid).tolist()) == [1, 2, 3]
+        assert cluster_size_distribution(grid).tolist() == [0, 1, 1, 1]
+        assert len(cluster_sizes(grid, analytics.SHARK)) == 0
+        # the fallback labelling finds the same clusters as scipy
+        for seed in range(5):
+            mask = random_grid(30, seed) == 1
+            labels, count = label_clusters(mask)
+            roots = analytics._propagate_labels(mask)
+            assert len(np.unique(roots[mask])) == count
+            assert len(set(zip(labels[mask].tolist(), roots[mask].tolist()))) == count
+
+    def test_pair_correlation(self):
+        grid = random_grid(12, 0)
+        max_radius = 4
+        sharks = np.argwhere(grid == analytics.SHARK)
+        fishes = np.argwhere(grid == analytics.FISH)
+        squares = np.argwhere(np.ones(grid.shape))
+
+        def distances(origins, points):
+            counts = np.zeros(max_radius + 1)
+            for x, y in origins:
+                r = np.rint(np.hypot(*(points - [x, y]).T)).astype(int)
+                counts += np.bincount(r[r <= max_radius], minlength=max_radius + 1)
+            return counts
+
+        observed = distances(sharks, fishes)
+        possible = distances(squares, squares)
+        expected = possible * len(sharks) / grid.size * len(fishes) / grid.size
+        assert np.allclose(pair_correlation(grid, max_radius=max_radius), observed / expected)
+        assert np.isnan(pair_correlation(np.zeros((5, 5), dtype=np.int8))).all()
+
+    def test_density_and_fronts(self):
+        grid = random_grid(15, 1)
+        density = local_density(grid, analytics.FISH, radius=2)
+        for x, y in [(0, 0), (7, 7), (14, 3)]:
+            window = grid[max(x - 2, 0):x + 3, max(y - 2, 0):y + 3]
+            assert density[x, y] == (window == analytics.FISH).mean()
+        front = fronts(grid)
+        for x, y in np.argwhere(grid == analytics.FISH):
+            window = grid[max(x - 1, 0):x + 2, max(y - 1, 0):y + 2]
+            assert front[x, y] == (window == analytics.SHARK).any()
+        assert not front[grid != analytics.FISH].any()
+
+    def test_observer(self):
+        random.seed(5)
+        observer = SpatialAnalytics(block_size=6, every=2)
+        grid = SimulationGrid(persistence=StoreSimulationClient(), simulation_parameters=sim_config,
+                              observers=[observer])
+        try:
+            for _ in range(6):
+                grid.play_turn()
+        except EndOfSimulatioError:
+            pass
+        assert [r['turn'] for r in observer.records] == list(range(grid.sim_turn + 1))
+        assert len(observer.series('front')) == grid.sim_turn // 2 + 1
+        # incremental block densities match the last snapshot
+        snapshot = grid.get_grid()
+        assert (snapshot == analytics.FISH).sum() == grid.population[analytics.Animal.Fish]
+        fish = np.zeros((4, 4))
+        for x, y in np.argwhere(snapshot == analytics.FISH):
+            fish[x // 6, y // 6] += 1
+        sizes = np.array([6, 6, 6, 2])
+        assert np.allclose(observer.block_density(analytics.FISH), fish / np.outer(sizes, sizes))
@@ -0,0 +1,91 @@
+import random
+
+import pyarrow.parquet as pq
+import pytest
+
+from fish_bowl.dataio.backends import StorageBackend, create_backend, get_backend_class
+from fish_bowl.dataio.parquet import ParquetSimulationClient, HISTORY_COLUMNS
+from fish_bowl.dataio.persistence import SimulationClient, get_database_string
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.utils import Animal
+
+sim_config = {
+    'grid_size': 10,
+    'init_nb_fish': 50,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 5,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+
+def play(client: StorageBackend, turns: int, seed: int = 7) -> SimulationGrid:
+    random.seed(seed)
+    grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+    for _ in range(turns):
+        grid.play_turn()
+    return grid
+
+
+class TestBackends:
+
+    def test_registry(self):
+        assert get_backend_class('memory') is StoreSimulationClient
+        assert get_backend_class('sql') is SimulationClient
+        assert get_backend_class('parquet') is ParquetSimulationClient
+        assert isinstance(create_backend('memory'), StorageBackend)
+        with pytest.raises(ValueError):
+            create_backend('redis')
+
+    def test_interface_is_enforced(self):
+        class Incomplete(StorageBackend):
+            def count_animals(self, sim_id):
+                return {}
+        with pytest.raises(TypeError):
+            Incomplete()
+
+    def test_same_simulation_on_all_backends(self, tmp_path):
+        clients = [create_backend('memory'),
+                   create_backend('sql', database_url=get_database_string(memory=True)),
+                   create_backend('parquet', directory=str(tmp_path))]
+        logs = []
+        for client in clients:
+            grid = play(client, turns=4)
+            logs.append(client.get_turn_log(grid.sim_id))
+            client.close()
+        assert logs[0] == logs[1] == logs[2]
+        assert len(logs[0]) == 5
+
+    def test_parquet_history(self, tmp_path):
+        client = ParquetSimulationClient(directory=str(tmp_path), row_group_rows=100)
+        grid = play(client, turns=3)
+        history = client.read_history(grid.sim_id)
+        assert history.column_names == ['turn'] + list(HISTORY_COLUMNS)
+        # one snapshot per logged turn, matching the population log
+        turns = history.column('turn').to_pylist()
+        for turn, nb_fish, nb_shark in client.get_turn_log(grid.sim_id):
+            assert turns.count(turn) == nb_fish + nb_shark
+        last = client.read_history(grid.sim_id, turns=[3], columns=['oid', 'animal_type'])
+        assert last.num_rows == sum(grid.population.values())
+        assert last.column('animal_type').to_pylist().count(Animal.Shark.value) == grid.population[Animal.Shark]
+        client.close()
+        assert (tmp_path / 'simulation_{}'.format(grid.sim_id) / 'turns.parquet').exists()
+
+    def test_parquet_directory_reuse(self, tmp_path):
+        first = ParquetSimulationClient(directory=str(tmp_path), row_group_rows=50)
+        first_grid = play(first, turns=8)
+        expected = first.read_history(first_grid.sim_id)
+        first.close()
+        # a later run on the same directory, as from another process
+        second = ParquetSimulationClient(directory=str(tmp_path), row_group_rows=50)
+        grid = play(second, turns=1)
+        assert grid.sim_id == first_grid.sim_id + 1
+        history = second.read_history(grid.sim_id)
+        assert sorted(set(history.column('turn').to_pylist())) == [0, 1]
+        assert history.num_rows == sum(nb_fish + nb_shark for _, nb_fish, nb_shark in second.get_turn_log(grid.sim_id))
+        # the history of the first run is untouched
+        assert pq.read_table(str(tmp_path / 'simulation_{}'.format(first_grid.sim_id) / 'animals')).equals(expected)
@@ -0,0 +1,61 @@
+import numpy as np
+
+from fish_bowl.process.analytics import shifted
+from fish_bowl.process.bitboard import BitboardOccupancy, neighbour_mask, pack, unpack
+from fish_bowl.process.occupancy import TurnOccupancy
+from fish_bowl.process.topology import SQUARE_NEIGH, SquareGridCoordinate
+
+
+class TestBitboard:
+
+    def test_neighbour_mask(self):
+        rng = np.random.RandomState(0)
+        # rows of less than, exactly and more than one word
+        for n in (1, 63, 64, 65):
+            mask = rng.rand(n, n) < 0.1
+            assert np.array_equal(unpack(pack(mask), n), mask)
+            expected = np.zeros((n, n), dtype=bool)
+            for dx, dy in SQUARE_NEIGH.values():
+                expected |= shifted(mask, dx, dy, False)
+            assert np.array_equal(unpack(neighbour_mask(pack(mask), n), n), expected)
+
+    def test_same_counts_as_occupancy(self):
+        rng = np.random.RandomState(1)
+        for n in (5, 64, 65):
+            grid = rng.randint(0, 3, size=(n, n)).astype(np.int8)
+            lists, bits = TurnOccupancy(grid), BitboardOccupancy(grid)
+            for _ in range(300):
+                x, y, kind = rng.randint(n), rng.randint(n), rng.randint(3)
+                lists.set(x, y, kind)
+                bits.set(x, y, kind)
+            for x in range(n):
+                for y in range(n):
+                    assert bits.kind(x, y) == lists.kind(x, y)
+                    assert bits.free_neighbours(x, y) == lists.free_neighbours(x, y)
+                    assert bits.fish_neighbours(x, y) == lists.fish_neighbours(x, y)
+            coordinates = [SquareGridCoordinate(x, n - 1) for x in range(n)]
+            assert bits.fish_in(coordinates) == lists.fish_in(coordinates)
+            assert np.array_equal(unpack(bits.fish_neighbour_mask(), n),
+                                  np.array([[lists.fish_neighbours(x, y) > 0 for y in range(n)] for x in range(n)]))
+            assert np.array_equal(unpack(bits.free_neighbour_mask(), n),
+                                  np.array([[lists.free_neighbours(x, y) > 0 for y in range(n)] for x in range(n)]))
+
+    def test_phase_masks(self):
+        rng = np.random.RandomState(2)
+        for n in (7, 65):
+            grid = rng.randint(0, 3, size=(n, n)).astype(np.int8)
+            lists, bits = TurnOccupancy(grid), BitboardOccupancy(grid)
+            bits.start_phase()
+            for x in range(n):
+                for y in range(n):
+                    assert bits.has_free_neighbour(x, y) == (lists.free_neighbours(x, y) > 0)
+                    assert bits.has_fish_neighbour(x, y) == (lists.fish_neighbours(x, y) > 0)
+            for _ in range(200):
+                x, y, kind = rng.randint(n), rng.randint(n), rng.randint(3)
+                lists.set(x, y, kind)
+                bits.set(x, y, kind)
+            # the masks may keep bits the counts lost, never miss one
+            for x in range(n):
+                for y in range(n):
+                    assert bits.has_free_neighbour(x, y) >= (lists.free_neighbours(x, y) > 0)
+                    assert bits.has_fish_neighbour(x, y) >= (lists.fish_neighbours(x, y) > 0)
@@ -0,0 +1,85 @@
+import random
+
+import pytest
+
+from fish_bowl.dataio.persistence import SimulationClient, get_database_string
+from fish_bowl.dataio.pipeline import PipelinedSimulationClient
+from fish_bowl.dataio.sharding import ShardedSimulationClient
+from fish_bowl.process.base import SimulationGrid
+
+sim_config = {
+    'grid_size': 8,
+    'init_nb_fish': 20,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 3,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 3}
+
+
+def play(client, turns: int, **parameters) -> SimulationGrid:
+    grid = SimulationGrid(persistence=client, simulation_parameters=dict(sim_config, **parameters))
+    for _ in range(turns):
+        grid.play_turn()
+    return grid
+
+
+class TestSimulationCatalog:
+
+    @pytest.mark.parametrize('backend', ['sql', 'sharded', 'pipelined'])
+    def test_summaries(self, backend, tmp_path):
+        if backend == 'sql':
+            client = SimulationClient(get_database_string(memory=True))
+        elif backend == 'sharded':
+            client = ShardedSimulationClient(str(tmp_path))
+        else:
+            client = PipelinedSimulationClient('sqlite:///{}'.format(tmp_path / 'simul.db'))
+        random.seed(2)
+        grid = play(client, 3)
+        client.record_summary(grid.sim_id, end_reason='Turn budget of 3 turns reached', runtime_seconds=0.5)
+        log = client.get_turn_log(grid.sim_id)
+        catalog = client if backend != 'pipelined' else client.sink
+        row, = catalog.list_simulation_summaries()
+        assert row['sid'] == grid.sim_id and row['shark_starving'] == sim_config['shark_starving']
+        assert row['final_turn'] == 3
+        assert (row['final_nb_fish'], row['final_nb_shark']) == log[-1][1:]
+        assert row['peak_nb_fish'] == max(t[1] for t in log) and row['peak_nb_shark'] == max(t[2] for t in log)
+        assert row['end_reason'] == 'Turn budget of 3 turns reached' and row['runtime_seconds'] == 0.5
+        # recording again replaces the row
+        client.record_summary(grid.sim_id, end_reason='Cancelled at turn 3')
+        assert [r['end_reason'] for r in catalog.list_simulation_summaries()] == ['Cancelled at turn 3']
+        client.close()
+
+    def test_keyset_pages_and_filters(self):
+        client = SimulationClient(get_database_string(memory=True))
+        random.seed(5)
+        grids = [play(client, turns=i % 3, shark_starving=2 + i % 2) for i in range(7)]
+        for grid in grids[:6]:
+            client.record_summary(grid.sim_id, end_reason='budget')
+        # the last one was played before the catalog existed
+        assert client.backfill_summaries() == 1
+        assert client.backfill_summaries() == 0
+        pages, after = [], None
+        while True:
+            page = client.list_simulation_summaries(after=after, limit=3)
+            if not page:
+                break
+            pages.append([r['sid'] for r in page])
+            after = page[-1]['sid']
+        assert pages == [[1, 2, 3], [4, 5, 6], [7]]
+        assert [r['sid'] for r in client.list_simulation_summaries(after=6, descending=True)] == [5, 4, 3, 2, 1]
+        starving = client.list_simulation_summaries(filters={'shark_starving': 3, 'min_turn': 1})
+        assert [r['sid'] for r in starving] == [g.sim_id for g in grids if g.sim_turn >= 1 and
+                                                g.get_simulation_parameters().shark_starving == 3]
+        assert [r['sid'] for r in client.list_simulation_summaries(filters={'end_reason': 'budget'}, after=4)] == \
+            [5, 6]
+        # backfilled rows have no end reason
+        assert [r['sid'] for r in client.list_simulation_summaries(filters={'end_reason': None})] == [7]
+        with pytest.raises(ValueError):
+            client.list_simulation_summaries(filters={'shark_hunger': 3})
+        with pytest.raises(ValueError):
+            client.list_simulation_summaries(limit=0)
+        client.close()
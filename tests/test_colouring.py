@@ -0,0 +1,109 @@
+import random
+
+import numpy as np
+import pytest
+
+from fish_bowl.dataio.persistence import SimulationClient
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.colouring import ANIMAL_COLUMNS, ColouredGrid, ColouredSimulationGrid, colour_classes
+from fish_bowl.process.ensemble import neighbour_table
+from fish_bowl.process.utils import Animal, EndOfSimulatioError
+
+sim_config = {
+    'grid_size': 20,
+    'init_nb_fish': 150,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 20,
+    'shark_breed_maturity': 4,
+    'shark_breed_probability': 90,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+
+def play(grid: ColouredGrid, turns: int) -> ColouredGrid:
+    try:
+        for _ in range(turns):
+            grid.play_turn()
+    except EndOfSimulatioError:
+        pass
+    return grid
+
+
+class TestColouring:
+
+    def test_classes_are_independent(self):
+        grid_size = 10
+        classes = colour_classes(grid_size)
+        assert len(classes) == 9
+        assert sorted(np.concatenate(classes).tolist()) == list(range(grid_size ** 2))
+        neigh = neighbour_table(grid_size)
+        for squares in classes:
+            # closed neighbourhoods of the squares of a class don't overlap
+            reach = np.concatenate([squares, neigh[squares][neigh[squares] >= 0]])
+            assert len(np.unique(reach)) == len(reach)
+
+    def test_deterministic(self):
+        first = play(ColouredGrid(sim_config, seed=3), turns=10)
+        second = play(ColouredGrid(sim_config, seed=3), turns=10)
+        assert first.population_history == second.population_history
+        assert (first.get_grid() == second.get_grid()).all()
+        other = play(ColouredGrid(sim_config, seed=4), turns=10)
+        assert other.population_history != first.population_history
+        assert list(first.colour_order(2)) == list(second.colour_order(2))
+
+    def test_rules(self):
+        grid = ColouredGrid(dict(sim_config, init_nb_fish=0, init_nb_shark=0), seed=0)
+        # a shark surrounded by fish eats one and breeds where it was
+        grid.add_animal(Animal.Shark, 5, 5, spawn_turn=-10, last_breed=-10)
+        for x, y in [(4, 4), (4, 5), (4, 6)]:
+            grid.add_animal(Animal.Fish, x, y, spawn_turn=0, last_breed=0)
+        grid.play_turn()
+        population = grid.population
+        assert population[Animal.Shark] == 2
+        assert population[Animal.Fish] == 2
+        assert grid.get_grid()[5, 5] == Animal.Shark.value
+
+    def test_starvation(self):
+        grid = ColouredGrid(dict(sim_config, init_nb_fish=0, init_nb_shark=0, shark_breed_maturity=100), seed=0)
+        grid.add_animal(Animal.Shark, 1, 1)
+        with pytest.raises(EndOfSimulatioError):
+            for _ in range(sim_config['shark_starving'] + 2):
+                grid.play_turn()
+        assert grid.sim_turn == sim_config['shark_starving'] + 2
+        assert grid.end_reason == 'Simulation ends because no more Sharks'
+
+    def test_engine_on_backend(self):
+        random.seed(5)
+        client = StoreSimulationClient(release_dead=False)
+        grid = ColouredSimulationGrid(persistence=client, simulation_parameters=sim_config, detectors=[], seed=7)
+        # same turns as a ColouredGrid starting from the animals of the backend
+        board = ColouredGrid(dict(sim_config, init_nb_fish=0, init_nb_shark=0), seed=7, detectors=[], spawn=False)
+        store = client.get_store(grid.sim_id)
+        board.load_animals(store.columns(ANIMAL_COLUMNS), next_oid=store.next_oid)
+        for _ in range(8):
+            grid.play_turn()
+            board.play_turn()
+            assert (grid.get_grid() == board.get_grid()).all()
+            assert grid.population == board.population
+        assert client.get_last_turn(grid.sim_id) == 8
+        columns = client.get_store(grid.sim_id).columns(ANIMAL_COLUMNS)
+        played = board.animal_columns()
+        for c in ANIMAL_COLUMNS:
+            assert np.array_equal(columns[c], played[c])
+        # dead animals are kept
+        assert len(client.get_store(grid.sim_id).columns(['oid'], live_only=False)['oid']) > len(columns['oid'])
+
+    def test_engine_fork(self):
+        random.seed(1)
+        grid = ColouredSimulationGrid(persistence=StoreSimulationClient(), simulation_parameters=sim_config,
+                                      detectors=[])
+        grid.play_turn()
+        branch = grid.fork(seed=3)
+        branch.play_turn()
+        assert branch.sim_turn == 2 and grid.sim_turn == 1
+
+    def test_memory_backend_only(self):
+        with pytest.raises(TypeError):
+            ColouredSimulationGrid(persistence=SimulationClient('sqlite://'), simulation_parameters=sim_config)
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+from fish_bowl.process.ensemble import EnsembleGrid, neighbour_table
+from fish_bowl.process.utils import Animal, EndOfSimulatioError
+
+sim_config = {
+    'grid_size': 10,
+    'init_nb_fish': 50,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 5,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+sim_config_empty = dict(sim_config, init_nb_fish=0, init_nb_shark=0, fish_breed_probability=100,
+                        shark_breed_maturity=3)
+
+
+def play(ensemble, turns):
+    for _ in range(turns):
+        try:
+            ensemble.play_turn()
+        except EndOfSimulatioError:
+            break
+
+
+class TestEnsemble:
+
+    def test_neighbour_table(self):
+        table = neighbour_table(10)
+        assert (table[0] >= 0).sum() == 3
+        assert (table[5] >= 0).sum() == 5
+        assert (table[11] >= 0).sum() == 8
+
+    def test_spawn(self):
+        ensemble = EnsembleGrid(sim_config, replicates=4, seed=1)
+        population = ensemble.population
+        assert population.shape == (4, 2)
+        assert (population[:, 0] == 50).all() and (population[:, 1] == 5).all()
+        # replicates have their own random streams
+        assert not (ensemble.get_grid(0) == ensemble.get_grid(1)).all()
+
+    def test_replicates_are_independent(self):
+        small = EnsembleGrid(sim_config, replicates=2, seed=7)
+        large = EnsembleGrid(sim_config, replicates=5, seed=7)
+        play(small, 10)
+        play(large, 10)
+        history = large.population_history
+        assert np.array_equal(small.population_history, history[:len(small.population_history), :2])
+        for r in range(2):
+            assert np.array_equal(small.get_grid(r), large.get_grid(r))
+
+    def test_eat_and_breed(self):
+        ensemble = EnsembleGrid(sim_config_empty, replicates=3, seed=3, spawn=False)
+        a_list = [
+            (Animal.Fish, 1, 1),
+            (Animal.Fish, 2, 1),
+            (Animal.Fish, 3, 1),
+            (Animal.Fish, 1, 3),
+            (Animal.Fish, 3, 2),
+            (Animal.Shark, 2, 2)
+        ]
+        for r in range(3):
+            for t, x, y in a_list:
+                ensemble.add_animal(r, t, x, y)
+        ensemble._sim_turn = 4
+        ensemble.play_turn()
+        # shark ate a fish and bred, 4 remaining fishes bred
+        assert (ensemble.population == [[8, 2]] * 3).all()
+
+    def test_starving_ends_replicates(self):
+        ensemble = EnsembleGrid(dict(sim_config, init_nb_fish=0, shark_breed_maturity=100), replicates=2, seed=0)
+        with pytest.raises(EndOfSimulatioError):
+            for _ in range(sim_config['shark_starving'] + 2):
+                ensemble.play_turn()
+        assert (ensemble.end_turn == sim_config['shark_starving'] + 2).all()
+        assert not ensemble.running.any()
@@ -0,0 +1,97 @@
+import os
+import random
+
+import pyarrow.parquet as pq
+import pytest
+
+from fish_bowl.dataio.export import ParquetExporter, EXPORT_ANIMAL_COLUMNS
+from fish_bowl.dataio.persistence import SimulationClient, get_database_string
+from fish_bowl.process.base import SimulationGrid
+
+sim_config = {
+    'grid_size': 10,
+    'init_nb_fish': 50,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 5,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+
+@pytest.fixture(scope='module')
+def client():
+    random.seed(11)
+    client = SimulationClient(get_database_string(memory=True))
+    for turns in (7, 2):
+        grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+        for _ in range(turns):
+            grid.play_turn()
+    yield client
+    client.close()
+
+
+def exported_animals(directory: str, sim_id: int):
+    table = pq.read_table(os.path.join(directory, 'sim_id={}'.format(sim_id), 'animals'))
+    rows = zip(*[table.column(c).to_pylist() for c in EXPORT_ANIMAL_COLUMNS])
+    return sorted(rows)
+
+
+def database_animals(client: SimulationClient, sim_id: int):
+    rows = client.get_animal_tuples(sim_id, EXPORT_ANIMAL_COLUMNS, live_only=False)
+    return sorted(tuple(r.animal_type.value if c == 'animal_type' else r[i] for i, c in enumerate(r._fields))
+                  for r in rows)
+
+
+class TestParquetExport:
+
+    def test_export(self, client, tmp_path):
+        directory = str(tmp_path / 'export')
+        manifest = ParquetExporter(client, directory, turns_per_partition=3, batch_size=7).export()
+        assert sorted(manifest['simulations']) == ['1', '2']
+        for sim_id in (1, 2):
+            turns = pq.read_table(os.path.join(directory, 'sim_id={}'.format(sim_id), 'turns'))
+            assert list(zip(*[turns.column(c).to_pylist() for c in ('turn', 'nb_fish', 'nb_shark')])) == \
+                client.get_turn_log(sim_id)
+            assert exported_animals(directory, sim_id) == database_animals(client, sim_id)
+        # turns 0..7: partitions 0 and 1 are complete, turns 6 and 7 of partition 2 are not recorded yet
+        assert manifest['simulations']['1']['turns'] == {'0': 3, '1': 3}
+        assert manifest['simulations']['2']['turns'] == {'0': 3}
+        assert sorted(os.listdir(os.path.join(directory, 'sim_id=1', 'turns'))) == \
+            ['turns_0_2.parquet', 'turns_3_5.parquet', 'turns_6_8.parquet']
+        with pytest.raises(ValueError):
+            ParquetExporter(client, directory, turns_per_partition=5)
+
+    def test_resume(self, client, tmp_path, monkeypatch):
+        directory = str(tmp_path / 'export')
+        exporter = ParquetExporter(client, directory, turns_per_partition=2, batch_size=5)
+        stream = client.iter_animals_by_spawn_turn
+
+        def interrupted(*args, **kwargs):
+            for i, batch in enumerate(stream(*args, **kwargs)):
+                if i == 6:
+                    raise KeyboardInterrupt()
+                yield batch
+
+        monkeypatch.setattr(client, 'iter_animals_by_spawn_turn', interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            exporter.export([1])
+        done = dict(exporter.manifest['simulations']['1']['animals'])
+        assert len(done) > 0
+        written = {p: os.path.getmtime(os.path.join(directory, 'sim_id=1', 'animals', p))
+                   for p in os.listdir(os.path.join(directory, 'sim_id=1', 'animals')) if p.endswith('.parquet')}
+
+        resumed = []
+
+        def recording(*args, **kwargs):
+            resumed.append(kwargs['from_spawn_turn'])
+            return stream(*args, **kwargs)
+
+        monkeypatch.setattr(client, 'iter_animals_by_spawn_turn', recording)
+        ParquetExporter(client, directory, turns_per_partition=2, batch_size=5).export([1])
+        assert resumed == [(max(int(p) for p in done) + 1) * 2]
+        assert exported_animals(directory, 1) == database_animals(client, 1)
+        for part, mtime in written.items():
+            assert os.path.getmtime(os.path.join(directory, 'sim_id=1', 'animals', part)) == mtime
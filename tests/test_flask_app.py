@@ -0,0 +1,278 @@
+import time
+
+import pytest
+
+from fish_bowl.dataio.persistence import SimulationClient
+from fish_bowl.flask_app.cache import ResponseCache
+from fish_bowl.flask_app.main import app
+from fish_bowl.flask_app.jobs import SimulationScheduler, AdmissionError, JobStatus
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.utils import Animal
+
+sim_config = {
+    'grid_size': 6,
+    'init_nb_fish': 10,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 2,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+
+def wait_for(scheduler, job_id, timeout=30):
+    start = time.time()
+    while scheduler.status(job_id) in (JobStatus.Pending, JobStatus.Running):
+        assert time.time() - start < timeout, 'Job did not finish in time'
+        time.sleep(0.05)
+    return scheduler.status(job_id)
+
+
+@pytest.fixture
+def client():
+    app.config['TESTING'] = True
+    app.config['DATABASE_URL'] = 'sqlite://'
+    app.config['SCHEDULER_USE_PROCESSES'] = False
+    app.config['SCHEDULER_MAX_WORKERS'] = 1
+    app.config['SCHEDULER_MAX_JOBS'] = 2
+    app.config['SCHEDULER_MAX_TURN_BUDGET'] = 20
+    with app.test_client() as c:
+        yield c
+    scheduler = app.extensions.pop('simulation_scheduler', None)
+    if scheduler is not None:
+        scheduler.shutdown()
+    app.extensions.pop('simulation_client', None)
+    app.extensions.pop('response_cache', None)
+
+
+class TestJobScheduler:
+
+    def test_scheduler_runs_jobs(self):
+        scheduler = SimulationScheduler(database_url='sqlite://', max_workers=2, max_jobs=2, max_turn_budget=10,
+                                        use_processes=True)
+        try:
+            jobs = [scheduler.submit(sim_config=sim_config, max_turn=3) for _ in range(2)]
+            # queue is full
+            with pytest.raises(AdmissionError):
+                scheduler.submit(sim_config=sim_config, max_turn=3)
+            for job in jobs:
+                assert wait_for(scheduler, job.job_id) == JobStatus.Done
+                result = scheduler.result(job.job_id)
+                assert result['turn'] <= 3
+                assert scheduler.progress(job.job_id)['turn'] == result['turn']
+            # budget above the limit is refused
+            with pytest.raises(ValueError):
+                scheduler.submit(sim_config=sim_config, max_turn=11)
+        finally:
+            scheduler.shutdown()
+
+    def test_coloured_engine(self, tmp_path):
+        database_url = 'sqlite:///{}'.format(tmp_path / 'simul.db')
+        # spawned workers, the parallel engine starts threads a forked worker could inherit locked
+        scheduler = SimulationScheduler(database_url=database_url, max_workers=1, max_jobs=1, max_turn_budget=10,
+                                        use_processes=True)
+        try:
+            with pytest.raises(ValueError):
+                scheduler.submit(sim_config=sim_config, max_turn=3, engine='gpu')
+            job = scheduler.submit(sim_config=sim_config, max_turn=3, engine='coloured')
+            assert job.to_dict()['engine'] == 'coloured'
+            assert wait_for(scheduler, job.job_id, timeout=120) == JobStatus.Done
+            result = scheduler.result(job.job_id)
+        finally:
+            scheduler.shutdown()
+        persistence = SimulationClient(database_url)
+        assert persistence.get_last_turn(result['sim_id']) == result['turn']
+        population = persistence.count_animals(sim_id=result['sim_id'])
+        assert {a.name: population.get(a, 0) for a in Animal} == result['population']
+        assert persistence.get_simulation_summary(result['sim_id']) is not None
+
+    def test_cancel(self):
+        scheduler = SimulationScheduler(database_url='sqlite://', max_workers=1, max_jobs=2, max_turn_budget=1000,
+                                        use_processes=False)
+        try:
+            running = scheduler.submit(sim_config=sim_config, max_turn=1000)
+            pending = scheduler.submit(sim_config=sim_config, max_turn=1000)
+            assert scheduler.cancel(pending.job_id) == JobStatus.Cancelled
+            scheduler.cancel(running.job_id)
+            assert wait_for(scheduler, running.job_id) in (JobStatus.Cancelled, JobStatus.Done)
+            assert scheduler.result(pending.job_id)['cancelled']
+        finally:
+            scheduler.shutdown()
+
+
+class TestJobEndpoints:
+
+    def test_submit_and_result(self, client):
+        response = client.post('/jobs', json={'config': sim_config, 'max_turn': 2})
+        assert response.status_code == 202
+        job_id = response.get_json()['job_id']
+        assert wait_for(app.extensions['simulation_scheduler'], job_id) == JobStatus.Done
+        assert client.get('/jobs/{}'.format(job_id)).get_json()['status'] == 'done'
+        progress = client.get('/jobs/{}/progress'.format(job_id)).get_json()
+        assert progress['max_turn'] == 2
+        result = client.get('/jobs/{}/result'.format(job_id)).get_json()
+        assert set(result['population'].keys()) == {'Fish', 'Shark'}
+
+    def test_invalid_submissions(self, client):
+        assert client.post('/jobs', json={'config_name': '../secret'}).status_code == 400
+        assert client.post('/jobs', json={'config_name': 'does_not_exist'}).status_code == 404
+        assert client.post('/jobs', json={'config': {'grid_size': 10}}).status_code == 400
+        assert client.post('/jobs', json={'config': sim_config, 'max_turn': 21}).status_code == 400
+        assert client.post('/jobs', json={'config': sim_config, 'engine': 'gpu'}).status_code == 400
+        assert client.get('/jobs/unknown/result').status_code == 404
+
+    def test_admission_and_cancel(self, client):
+        job_ids = [client.post('/jobs', json={'config_name': 'simulation_config_1', 'max_turn': 20}).get_json()
+                   ['job_id'] for _ in range(2)]
+        assert client.post('/jobs', json={'config': sim_config}).status_code == 429
+        for job_id in job_ids:
+            assert client.post('/jobs/{}/cancel'.format(job_id)).status_code == 202
+        scheduler = app.extensions['simulation_scheduler']
+        for job_id in job_ids:
+            wait_for(scheduler, job_id)
+        assert client.get('/jobs/{}/result'.format(job_ids[1])).get_json()['status'] == 'cancelled'
+
+
+class TestResponseCache:
+
+    def test_lru_bounds(self):
+        cache = ResponseCache(max_entries=2, max_bytes=10)
+        cache.put(('grid', 1, 0, 'json'), b'1234', 'application/json')
+        cache.put(('grid', 1, 1, 'json'), b'1234', 'application/json')
+        assert cache.get(('grid', 1, 0, 'json')) is not None
+        # entry count bound evicts the least recently used
+        cache.put(('grid', 1, 2, 'json'), b'1234', 'application/json')
+        assert cache.get(('grid', 1, 1, 'json')) is None
+        assert len(cache) == 2
+        # byte bound
+        cache.put(('grid', 2, 0, 'json'), b'12345678', 'application/json')
+        assert len(cache) == 1 and cache.size == 8
+        assert cache.invalidate(2, 0) == 1
+        assert len(cache) == 0
+
+
+class TestReadEndpoints:
+
+    def test_grid_and_population(self, client, tmp_path):
+        database_url = 'sqlite:///{}'.format(tmp_path / 'simul.db')
+        app.config['DATABASE_URL'] = database_url
+        persistence = SimulationClient(database_url)
+        grid = SimulationGrid(persistence=persistence, simulation_parameters=sim_config)
+        grid.play_turn()
+        persistence.record_summary(grid.sim_id, end_reason='test')
+        url = '/simulations/{}/grid'.format(grid.sim_id)
+        response = client.get(url)
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['simulation']['sim_turn'] == 1
+        assert len(data['grid']) == sum(grid._persistence.count_animals(grid.sim_id).values())
+        etag = response.headers['ETag']
+        # conditional get
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+        cache = app.extensions['response_cache']
+        hits = cache.hits
+        assert client.get(url + '?turn=1').status_code == 200
+        assert cache.hits == hits + 1
+        # csv encoding and history
+        csv_body = client.get(url + '?encoding=csv').data.decode()
+        assert csv_body.splitlines()[0] == 'type,x,y'
+        assert client.get(url + '?turn=0').status_code == 404
+        assert client.get(url + '?encoding=xml').status_code == 400
+        assert client.get(url + '?turn=abc').status_code == 400
+        population = client.get('/simulations/{}/population'.format(grid.sim_id)).get_json()['population']
+        assert [p[0] for p in population] == [0, 1]
+        assert population[0][1:] == [sim_config['init_nb_fish'], sim_config['init_nb_shark']]
+        assert client.get('/simulations/999/grid').status_code == 404
+
+    def test_running_simulation_cached_by_turn(self, client, tmp_path):
+        database_url = 'sqlite:///{}'.format(tmp_path / 'simul.db')
+        app.config['DATABASE_URL'] = database_url
+        # played by another process, which has not ended the run
+        persistence = SimulationClient(database_url)
+        grid = SimulationGrid(persistence=persistence, simulation_parameters=sim_config)
+        url = '/simulations/{}/grid'.format(grid.sim_id)
+        cache = app.extensions.setdefault('response_cache', ResponseCache())
+        grid.play_turn()
+        response = client.get(url)
+        assert response.get_json()['simulation']['sim_turn'] == 1
+        assert response.headers['Cache-Control'] == 'no-cache'
+        assert len(cache) == 1
+        hits = cache.hits
+        response = client.get(url + '?turn=1')
+        assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        assert cache.hits == hits + 1
+        # the latest grid moves on with the logged turns, the grid of turn 1 is still served
+        grid.play_turn()
+        assert client.get(url).get_json()['simulation']['sim_turn'] == 2
+        assert client.get(url + '?turn=1').status_code == 200
+        assert len(cache) == 2
+
+    def test_turn_snapshot(self, tmp_path):
+        persistence = SimulationClient('sqlite:///{}'.format(tmp_path / 'simul.db'), read_pool_size=1)
+        grid = SimulationGrid(persistence=persistence, simulation_parameters=sim_config)
+        grid.play_turn()
+        turn, animals = persistence.get_turn_snapshot(grid.sim_id, ('animal_type', 'coord_x'))
+        assert turn == 1
+        assert len(animals['coord_x']) == sum(persistence.count_animals(grid.sim_id).values())
+
+    def test_tiles(self, client, tmp_path):
+        database_url = 'sqlite:///{}'.format(tmp_path / 'simul.db')
+        app.config['DATABASE_URL'] = database_url
+        app.config['TILE_SIZE'] = 2
+        persistence = SimulationClient(database_url)
+        grid = SimulationGrid(persistence=persistence, simulation_parameters=sim_config)
+        url = '/simulations/{}/tiles/{{}}'.format(grid.sim_id)
+        data = client.get(url.format('0/0/0')).get_json()
+        assert data['meta']['max_zoom'] == 2 and data['meta']['bin_size'] == 4
+        assert sum(r[2] + r[3] for r in data['tile']) == sim_config['init_nb_fish'] + sim_config['init_nb_shark']
+        # the pyramid follows the simulation
+        grid.play_turn()
+        population = persistence.count_animals(grid.sim_id)
+        fish = 0
+        for tx in range(4):
+            for ty in range(4):
+                tile = client.get(url.format('2/{}/{}'.format(tx, ty))).get_json()
+                assert tile['simulation']['sim_turn'] == 1
+                fish += sum(r[2] for r in tile['tile'])
+        assert fish == population[Animal.Fish]
+        assert len(app.extensions['pyramid_cache']) == 1
+        assert client.get(url.format('1/2/0')).status_code == 404
+        # turn 0 is still served from the response cache, but other tiles are only rendered for the last turn
+        assert client.get(url.format('0/0/0') + '?turn=0').status_code == 200
+        assert client.get(url.format('1/0/0') + '?turn=0').status_code == 404
+        app.config['TILE_SIZE'] = 64
+        app.extensions.pop('pyramid_cache', None)
+
+    def test_simulation_catalog(self, client, tmp_path):
+        database_url = 'sqlite:///{}'.format(tmp_path / 'simul.db')
+        app.config['DATABASE_URL'] = database_url
+        # jobs add their simulation to the catalog when they end
+        scheduler = SimulationScheduler(database_url=database_url, max_workers=1, max_jobs=1, use_processes=False)
+        job = scheduler.submit(sim_config=sim_config, max_turn=2)
+        assert wait_for(scheduler, job.job_id) == JobStatus.Done
+        scheduler.shutdown()
+        persistence = SimulationClient(database_url)
+        for starving in (2, 3, 4, 5):
+            grid = SimulationGrid(persistence=persistence, simulation_parameters=dict(sim_config,
+                                                                                        shark_starving=starving))
+            persistence.record_summary(grid.sim_id, end_reason='test')
+        data = client.get('/simulations?limit=2').get_json()
+        first = data['simulations'][0]
+        assert first['sid'] == 1 and first['end_reason'] == scheduler.result(job.job_id)['end_reason']
+        assert first['runtime_seconds'] > 0
+        sids = [r['sid'] for r in data['simulations']]
+        while data['next'] is not None:
+            data = client.get(data['next']).get_json()
+            sids += [r['sid'] for r in data['simulations']]
+        assert sids == [1, 2, 3, 4, 5]
+        data = client.get('/simulations?order=desc&end_reason=test&min_turn=0&limit=3').get_json()
+        assert [r['sid'] for r in data['simulations']] == [5, 4, 3]
+        assert [r['sid'] for r in client.get(data['next']).get_json()['simulations']] == [2]
+        assert [r['sid'] for r in client.get('/simulations?shark_starving=4').get_json()['simulations']] == [1, 4]
+        assert client.get('/simulations?shark_hunger=1').status_code == 400
+        assert client.get('/simulations?limit=abc').status_code == 400
+        assert client.get('/simulations?limit=100000').status_code == 400
+        assert client.get('/simulations?order=random').status_code == 400
+        persistence.close()
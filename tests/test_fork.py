@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from fish_bowl.dataio.parquet import ParquetSimulationClient
+from fish_bowl.dataio.persistence import SimulationClient, get_database_string
+from fish_bowl.dataio.pipeline import PipelinedSimulationClient
+from fish_bowl.dataio.sharding import ShardedSimulationClient, sharded_url
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.jit import JitSimulationGrid
+from fish_bowl.process.termination import StableCycle
+
+sim_config = {
+    'grid_size': 12,
+    'init_nb_fish': 60,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 8,
+    'shark_breed_maturity': 4,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+COLUMNS = ('oid', 'animal_type', 'coord_x', 'coord_y', 'spawn_turn', 'breed_count', 'last_breed', 'last_fed')
+
+
+def play(grid: SimulationGrid, turns: int):
+    for _ in range(turns):
+        grid.play_turn()
+    return grid._persistence.get_turn_log(grid.sim_id), \
+        grid._persistence.get_animal_tuples(grid.sim_id, COLUMNS)
+
+
+class TestFork:
+
+    def test_branch_replays_parent(self):
+        random.seed(3)
+        client = StoreSimulationClient()
+        grid = SimulationGrid(persistence=client, simulation_parameters=sim_config,
+                              detectors=[StableCycle()])
+        play(grid, 3)
+        branch = grid.fork()
+        assert branch.sim_id != grid.sim_id and branch.sim_turn == grid.sim_turn == 3
+        assert client.get_turn_log(branch.sim_id) == client.get_turn_log(grid.sim_id)
+        # the branch has its own stream: playing it doesn't move the parent's one
+        branched = play(branch, 4)
+        assert play(grid, 4) == branched
+        assert branch._detectors[0] is not grid._detectors[0]
+
+    def test_seeds_and_parameters(self):
+        random.seed(3)
+        client = StoreSimulationClient()
+        grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+        play(grid, 2)
+        first, same, other = grid.fork(seed=1), grid.fork(seed=1), grid.fork(seed=2)
+        assert play(first, 4) == play(same, 4) != play(other, 4)
+        starving = grid.fork(seed=1, shark_starving=2)
+        assert starving.get_simulation_parameters().shark_starving == 2
+        assert grid.get_simulation_parameters().shark_starving == sim_config['shark_starving']
+        with pytest.raises(ValueError):
+            grid.fork(grid_size=20)
+        with pytest.raises(ValueError):
+            grid.fork(shark_breed_probability=120)
+
+    @pytest.mark.parametrize('backend', ['sql', 'parquet', 'pipelined', 'sharded', 'pipelined_sharded', 'jit'])
+    def test_backends(self, backend, tmp_path):
+        engine = SimulationGrid
+        if backend == 'sql':
+            client = SimulationClient(get_database_string(memory=True))
+        elif backend == 'parquet':
+            client = ParquetSimulationClient(directory=str(tmp_path))
+        elif backend == 'pipelined':
+            client = PipelinedSimulationClient('sqlite:///{}'.format(tmp_path / 'simul.db'))
+        elif backend == 'sharded':
+            client = ShardedSimulationClient(str(tmp_path))
+        elif backend == 'pipelined_sharded':
+            client = PipelinedSimulationClient(sharded_url(str(tmp_path)))
+        else:
+            client = StoreSimulationClient()
+            engine = JitSimulationGrid
+        random.seed(5)
+        grid = engine(persistence=client, simulation_parameters=sim_config)
+        play(grid, 2)
+        branch = grid.fork(seed=9, fish_breed_probability=50)
+        assert type(branch) is engine
+        log, animals = play(branch, 3)
+        # reference: the same branch in memory
+        random.seed(5)
+        reference = SimulationGrid(persistence=StoreSimulationClient(), simulation_parameters=sim_config)
+        play(reference, 2)
+        expected_log, expected_animals = play(reference.fork(seed=9, fish_breed_probability=50), 3)
+        assert log == expected_log
+        assert [a[1:] for a in animals] == [a[1:] for a in expected_animals]
+        if backend == 'sharded':
+            # the parent shard is untouched
+            assert client.get_turn_log(grid.sim_id) == reference._persistence.get_turn_log(reference.sim_id)
+            assert client.get_simulation_ids() == [grid.sim_id, branch.sim_id]
+            client.close()
+        elif backend.startswith('pipelined'):
+            client.close()
+            if backend == 'pipelined':
+                written = SimulationClient('sqlite:///{}'.format(tmp_path / 'simul.db'))
+            else:
+                written = ShardedSimulationClient(str(tmp_path))
+            assert written.get_turn_log(branch.sim_id) == expected_log
+            assert [a[1:] for a in written.get_animal_tuples(branch.sim_id, COLUMNS)] == \
+                [a[1:] for a in expected_animals]
+            written.close()
+        else:
+            client.close()
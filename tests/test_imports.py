@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+import pytest
+
+HEAVY_MODULES = ('pandas', 'numpy', 'sqlalchemy')
+# cumulative import time budget, importing pandas alone takes several hundred milliseconds
+IMPORT_BUDGET_US = 250000
+
+
+def import_profile(module: str):
+    """
+    Import a module in a fresh interpreter
+    :param module:
+    :return: (heavy modules loaded, cumulative import time of the module in microseconds)
+    """
+    code = 'import sys, {}; print(",".join(m for m in {!r} if m in sys.modules))'.format(module, HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    cumulative = None
+    for line in result.stderr.splitlines():
+        fields = [f.strip() for f in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            cumulative = int(fields[1])
+    loaded = [m for m in result.stdout.strip().split(',') if m]
+    return loaded, cumulative
+
+
+class TestImports:
+
+    @pytest.mark.parametrize('module', ['fish_bowl.process.base', 'fish_bowl.process.simple_display',
+                                        'fish_bowl.dataio.backends', 'fish_bowl.flask_app.jobs'])
+    def test_no_heavy_import(self, module):
+        loaded, cumulative = import_profile(module)
+        assert loaded == []
+        assert cumulative < IMPORT_BUDGET_US
+
+    def test_db_path_still_loads(self):
+        loaded, _ = import_profile('fish_bowl.dataio.persistence')
+        assert 'sqlalchemy' in loaded
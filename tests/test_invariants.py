@@ -0,0 +1,62 @@
+import random
+
+import numpy as np
+import pytest
+
+from fish_bowl.dataio.persistence import SimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.invariants import InvariantError, find_violations
+from fish_bowl.process.topology import SquareGridCoordinate
+from fish_bowl.process.utils import Animal
+
+sim_config = {
+    'grid_size': 6,
+    'init_nb_fish': 12,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 3,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+
+def animals(*rows):
+    oid, animal_type, x, y = zip(*rows)
+    return {'oid': np.array(oid), 'animal_type': np.array(animal_type), 'coord_x': np.array(x),
+            'coord_y': np.array(y)}
+
+
+class TestInvariants:
+
+    def test_find_violations(self):
+        fish, shark = Animal.Fish.value, Animal.Shark.value
+        valid = animals((1, fish, 0, 0), (2, shark, 3, 3), (4, fish, 3, 2))
+        assert find_violations(4, valid, moved=[2, 4]) == []
+        broken = animals((1, fish, 0, 0), (2, shark, 3, 3), (4, fish, 3, 3), (5, fish, 0, 4), (6, shark, 3, 3),
+                         (7, fish, 1, 1), (8, fish, 1, 1))
+        assert find_violations(4, broken, moved=[3, 4, 9]) == [
+            '1 live animal(s) outside of the 4x4 grid: Fish 5 at (0, 4)',
+            '2 square(s) with several live animals: (1, 1) holds Fish 7 at (1, 1), Fish 8 at (1, 1), '
+            '(3, 3) holds Shark 2 at (3, 3), Fish 4 at (3, 3), Shark 6 at (3, 3)',
+            '2 animal(s) moved during the turn are not alive at its end: oids 3, 9']
+        assert find_violations(4, broken, max_reported=1)[1] == \
+            '2 square(s) with several live animals: (1, 1) holds Fish 7 at (1, 1), Fish 8 at (1, 1)'
+
+    def test_engine_checks_turns(self):
+        random.seed(2)
+        client = SimulationClient('sqlite://')
+        # a full grid, no animal moves
+        grid = SimulationGrid(persistence=client, detectors=[],
+                              simulation_parameters=dict(sim_config, init_nb_fish=36, init_nb_shark=0))
+        grid.play_turn()
+        # a second fish in a square, written behind the back of the engine
+        client.init_animal(sim_id=grid.sim_id, current_turn=grid.sim_turn, animal_type=Animal.Fish,
+                           coordinate=SquareGridCoordinate(2, 3))
+        with pytest.raises(InvariantError) as err:
+            grid.play_turn()
+        assert err.value.sim_id == grid.sim_id and err.value.turn == 2
+        assert err.value.violations[0].startswith('1 square(s) with several live animals: (2, 3) holds Fish')
+        # the turn is not logged
+        assert client.get_last_turn(grid.sim_id) == 1
@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+import pytest
+
+from fish_bowl.dataio.persistence import SimulationClient, get_database_string
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.jit import JitSimulationGrid, get_mt_state, set_mt_state, _randbelow, _shuffle
+from fish_bowl.process.utils import EndOfSimulatioError
+
+sim_config = {
+    'grid_size': 20,
+    'init_nb_fish': 150,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 20,
+    'shark_breed_maturity': 4,
+    'shark_breed_probability': 90,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+STATE_COLUMNS = ('oid', 'animal_type', 'coord_x', 'coord_y', 'spawn_turn', 'last_breed', 'breed_count', 'last_fed')
+
+
+def play(engines, seed: int, turns: int):
+    """
+    Play a simulation switching engine every turn, return the turn log, the final animals and the next draw
+    """
+    random.seed(seed)
+    client = StoreSimulationClient()
+    grid = engines[0](persistence=client, simulation_parameters=sim_config)
+    for turn in range(turns):
+        try:
+            engines[turn % len(engines)].play_turn(grid)
+        except EndOfSimulatioError:
+            break
+    return (client.get_turn_log(grid.sim_id), client.get_animal_tuples(grid.sim_id, STATE_COLUMNS),
+            random.random())
+
+
+class TestJitEngine:
+
+    def test_random_draws(self):
+        random.seed(42)
+        mt = get_mt_state()
+        values = list(range(30))
+        random.shuffle(values)
+        expected = values + [random.randint(0, 100) for _ in range(50)] + [random.randrange(7) for _ in range(50)]
+        array = np.arange(30, dtype=np.int64)
+        _shuffle(mt, array, 30)
+        draws = array.tolist() + [_randbelow(mt, 101) for _ in range(50)] + [_randbelow(mt, 7) for _ in range(50)]
+        assert draws == expected
+        # the state handed back continues the same stream
+        set_mt_state(mt)
+        after = random.random()
+        random.seed(42)
+        random.shuffle(list(range(30)))
+        for n in [101] * 50 + [7] * 50:
+            random.randrange(n)
+        assert random.random() == after
+
+    @pytest.mark.parametrize('seed', [1, 2, 3])
+    def test_same_simulation(self, seed):
+        reference = play([SimulationGrid], seed=seed, turns=12)
+        assert play([JitSimulationGrid], seed=seed, turns=12) == reference
+        # engines can be interleaved
+        assert play([JitSimulationGrid, SimulationGrid], seed=seed, turns=12) == reference
+
+    def test_kept_dead_animals(self):
+        random.seed(4)
+        client = StoreSimulationClient(release_dead=False)
+        grid = JitSimulationGrid(persistence=client, simulation_parameters=sim_config)
+        for _ in range(3):
+            grid.play_turn()
+        assert len(client.get_animal_tuples(grid.sim_id, ('oid',), live_only=False)) > \
+            sum(grid.population.values())
+
+    def test_memory_backend_only(self):
+        with pytest.raises(TypeError):
+            JitSimulationGrid(persistence=SimulationClient(get_database_string(memory=True)),
+                              simulation_parameters=sim_config)
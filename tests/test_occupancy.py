@@ -0,0 +1,123 @@
+import random
+
+import numpy as np
+
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.jit import JitSimulationGrid
+from fish_bowl.process.bitboard import BitboardOccupancy
+from fish_bowl.process.occupancy import (LIST_BYTES_PER_SQUARE, SparseTurnOccupancy, TurnOccupancy, occupancy_mode,
+                                         turn_occupancy)
+from fish_bowl.process.topology import (SquareGridCoordinate, neighbour_count, skip_neighbour_draws,
+                                        square_grid_neighbours)
+
+# most animals are boxed in
+dense_config = {
+    'grid_size': 15,
+    'init_nb_fish': 180,
+    'fish_breed_maturity': 2,
+    'fish_breed_probability': 90,
+    'fish_speed': 2,
+    'init_nb_shark': 30,
+    'shark_breed_maturity': 3,
+    'shark_breed_probability': 90,
+    'shark_speed': 4,
+    'shark_starving': 3}
+
+# a few animals on a large grid
+sparse_config = dict(dense_config, grid_size=200, init_nb_fish=60, init_nb_shark=8, shark_starving=6)
+
+
+def play(engine, seed: int, turns: int, config=dense_config, **kwargs):
+    random.seed(seed)
+    client = StoreSimulationClient()
+    grid = engine(persistence=client, simulation_parameters=config, **kwargs)
+    for _ in range(turns):
+        grid.play_turn()
+    return client.get_turn_log(grid.sim_id), client.get_animal_tuples(grid.sim_id, ('oid', 'coord_x', 'coord_y')), \
+        random.random()
+
+
+class TestOccupancy:
+
+    def test_incremental_counts(self):
+        rng = np.random.RandomState(0)
+        grid = rng.randint(0, 3, size=(9, 9)).astype(np.int8)
+        occupancy = TurnOccupancy(grid)
+        for _ in range(200):
+            x, y, kind = rng.randint(9), rng.randint(9), rng.randint(3)
+            occupancy.set(x, y, kind)
+            grid[x, y] = kind
+        rebuilt = TurnOccupancy(grid)
+        for x in range(9):
+            for y in range(9):
+                assert occupancy.kind(x, y) == grid[x, y]
+                assert occupancy.free_neighbours(x, y) == rebuilt.free_neighbours(x, y)
+                assert occupancy.fish_neighbours(x, y) == rebuilt.fish_neighbours(x, y)
+        assert rebuilt.free_neighbours(0, 0) == sum(grid[c.x, c.y] == 0 for c in square_grid_neighbours(
+            9, SquareGridCoordinate(0, 0)))
+
+    def test_skipped_draws(self):
+        for x, y in [(0, 0), (0, 4), (3, 4), (8, 8)]:
+            assert neighbour_count(9, x, y) == len(square_grid_neighbours(9, SquareGridCoordinate(x, y)))
+            random.seed(x + y)
+            square_grid_neighbours(9, SquareGridCoordinate(x, y))
+            expected = random.random()
+            random.seed(x + y)
+            skip_neighbour_draws(9, x, y)
+            assert random.random() == expected
+
+    def test_dense_grid_same_simulation(self):
+        # the compiled kernel visits every animal
+        for seed in (1, 2):
+            assert play(SimulationGrid, seed, turns=6) == play(JitSimulationGrid, seed, turns=6)
+
+    def test_bitboard_same_simulation(self):
+        client = StoreSimulationClient()
+        grid = SimulationGrid(persistence=client, simulation_parameters=dense_config)
+        assert isinstance(turn_occupancy(client, grid.sim_id, 15), TurnOccupancy)
+        budget = 15 * 15 * LIST_BYTES_PER_SQUARE - 1
+        assert isinstance(turn_occupancy(client, grid.sim_id, 15, memory_budget=budget), BitboardOccupancy)
+        # the lists don't fit in the budget
+        assert play(SimulationGrid, 3, turns=6, occupancy_budget=budget) == play(SimulationGrid, 3, turns=6)
+
+    def test_sparse_counts(self):
+        rng = np.random.RandomState(2)
+        grid = np.zeros((12, 12), dtype=np.int8)
+        sparse = SparseTurnOccupancy(12)
+        for _ in range(300):
+            x, y, kind = rng.randint(12), rng.randint(12), rng.randint(3)
+            sparse.set(x, y, kind)
+            grid[x, y] = kind
+        lists = TurnOccupancy(grid)
+        for x in range(12):
+            for y in range(12):
+                assert sparse.kind(x, y) == lists.kind(x, y)
+                assert sparse.free_neighbours(x, y) == lists.free_neighbours(x, y)
+                assert sparse.fish_neighbours(x, y) == lists.fish_neighbours(x, y)
+        assert sparse.count(1) == lists.count(1) == (grid == 1).sum()
+        # only the squares next to an animal have counts
+        for x in range(12):
+            for y in range(12):
+                sparse.set(x, y, 0)
+        assert len(sparse._kind) == len(sparse._around) == 0
+
+    def test_occupancy_mode(self):
+        assert occupancy_mode(100, 100) == 'sparse'
+        assert occupancy_mode(100, 300) == 'lists'
+        assert occupancy_mode(100, 300, memory_budget=1000) == 'bitboard'
+        # hysteresis
+        assert occupancy_mode(100, 100, current='lists') == 'lists'
+        assert occupancy_mode(100, 40, current='lists') == 'sparse'
+
+    def test_sparse_grid_same_simulation(self):
+        client = StoreSimulationClient()
+        grid = SimulationGrid(persistence=client, simulation_parameters=sparse_config)
+        grid.play_turn()
+        occupancy = grid._turn_occupancy
+        assert isinstance(occupancy, SparseTurnOccupancy)
+        # kept from one turn to the next
+        grid.play_turn()
+        assert grid._turn_occupancy is occupancy
+        assert play(SimulationGrid, 4, turns=6, config=sparse_config) == \
+            play(JitSimulationGrid, 4, turns=6, config=sparse_config)
@@ -1,9 +1,11 @@
 import pandas as pd
 import pytest
+from sqlalchemy.exc import IntegrityError
 
 from fish_bowl.dataio.persistence import SimulationClient, Simulation
+from fish_bowl.process.invariants import COLUMNS, find_violations
 from fish_bowl.process.utils import ImpossibleAction, Animal
-from fish_bowl.process.topology import SquareGridCoordinate, NonEmptyCoordinate, TopologyError, square_grid_neighbours
+from fish_bowl.process.topology import SquareGridCoordinate, square_grid_neighbours
 
 sim_config = {
     'grid_size': 10,
@@ -38,8 +40,8 @@ class TestPersistence:
         assert len(client.get_all_simulations()) == 1, 'Should be only one simulation'
         assert isinstance(client.get_simulation(sid), Simulation)
 
-        # check exception raised in init when adding animal on non-existent sim
-        with pytest.raises(ValueError):
+        # adding an animal to a non-existent sim breaks the foreign key
+        with pytest.raises(IntegrityError):
             client.init_animal(sim_id=10, current_turn=0, animal_type=Animal.Fish,
                                coordinate=SquareGridCoordinate(x=0, y=1))
         # init some animals
@@ -47,19 +49,21 @@ class TestPersistence:
                            coordinate=SquareGridCoordinate(x=0, y=1))
         assert client.coordinate_is_occupied(sim_id=sid, coordinate=SquareGridCoordinate(x=0, y=1))
 
-        # check exception for adding animal to an already occupied square
-        with pytest.raises(NonEmptyCoordinate):
-            client.init_animal(sim_id=sid, current_turn=0, animal_type=Animal.Fish,
-                               coordinate=SquareGridCoordinate(x=0, y=1))
+        # adding an animal to an already occupied square is found by the end of turn checks
+        client.init_animal(sim_id=sid, current_turn=0, animal_type=Animal.Fish,
+                           coordinate=SquareGridCoordinate(x=0, y=1))
+        violations = find_violations(10, client.get_animal_arrays(sid, COLUMNS))
+        assert violations == ['1 square(s) with several live animals: (0, 1) holds Fish 1 at (0, 1), Fish 2 at (0, 1)']
         # but should be fine in a new simulation
         sid_2 = client.init_simulation(**sim_config)
         client.init_animal(sim_id=sid_2, current_turn=0, animal_type=Animal.Fish,
                            coordinate=SquareGridCoordinate(x=0, y=1))
 
         # spawn outside the grid
-        with pytest.raises(TopologyError):
-            client.init_animal(sim_id=sid_2, current_turn=0, animal_type=Animal.Fish,
-                               coordinate=SquareGridCoordinate(x=10, y=1))
+        client.init_animal(sim_id=sid_2, current_turn=0, animal_type=Animal.Fish,
+                           coordinate=SquareGridCoordinate(x=10, y=1))
+        assert find_violations(10, client.get_animal_arrays(sid_2, COLUMNS)) == [
+            '1 live animal(s) outside of the 10x10 grid: Fish 4 at (10, 1)']
 
     def test_animal_functions(self):
         client = SimulationClient('sqlite:///:memory:')
@@ -128,9 +132,10 @@ class TestPersistence:
         client.kill_animal(sim_id=sid, animal_ids=[3])
         with pytest.raises(ImpossibleAction):
             client.move_animal(sim_id=sid, animal_id=3, new_position=SquareGridCoordinate(3, 3))
-        # trying to move to an already occupied square
-        with pytest.raises(NonEmptyCoordinate):
-            client.move_animal(sim_id=sid, animal_id=5, new_position=SquareGridCoordinate(5, 3))
+        # moving to an already occupied square is found by the end of turn checks
+        client.move_animal(sim_id=sid, animal_id=5, new_position=SquareGridCoordinate(5, 3))
+        assert len(find_violations(10, client.get_animal_arrays(sid, COLUMNS), moved=[4, 5])) == 1
+        client.move_animal(sim_id=sid, animal_id=5, new_position=SquareGridCoordinate(5, 4))
         # but moving to a square occupied by a dead animal is possible
         assert not client.coordinate_is_occupied(sim_id=sid, coordinate=SquareGridCoordinate(3, 2))
         client.move_animal(sim_id=sid, animal_id=1, new_position=SquareGridCoordinate(3, 2))
@@ -167,3 +172,21 @@ class TestPersistence:
         client.init_animal(sim_id=sid, current_turn=0, animal_type=Animal.Shark, coordinate=SquareGridCoordinate(5, 5))
         eaten = client.eat_animal_in_square(sim_id=sid, coordinate=SquareGridCoordinate(5, 5))
         assert not eaten, 'Should not be able to eat a Shark'
+
+    def test_projection_queries(self):
+        client = SimulationClient('sqlite:///:memory:')
+        sid = client.init_simulation(**sim_config)
+        for t, c in animal_list:
+            client.init_animal(sim_id=sid, current_turn=0, animal_type=t, coordinate=c)
+        client.kill_animal(sim_id=sid, animal_ids=[1])
+        sharks = client.get_animal_tuples(sim_id=sid, columns=('oid', 'coord_x', 'coord_y'), animal_type=Animal.Shark)
+        assert sharks == [(6, 6, 5), (7, 6, 6)]
+        assert sharks[0].coord_y == 5
+        arrays = client.get_animal_arrays(sim_id=sid, columns=('oid', 'animal_type', 'alive'), live_only=False)
+        assert arrays['oid'].tolist() == list(range(1, 9))
+        assert arrays['animal_type'].tolist() == [t.value for t, _ in animal_list]
+        assert arrays['alive'].sum() == 7
+        batches = list(client.iter_animal_tuples(sim_id=sid, columns=('oid',), batch_size=3))
+        assert [len(b) for b in batches] == [3, 3, 1]
+        with pytest.raises(ValueError):
+            client.get_animal_tuples(sim_id=sid, columns=('oid', 'password'))
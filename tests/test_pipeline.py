@@ -0,0 +1,101 @@
+import random
+import threading
+
+import pytest
+
+from fish_bowl.dataio.backends import create_backend
+from fish_bowl.dataio.persistence import SimulationClient
+from fish_bowl.dataio.pipeline import PipelinedSimulationClient, PersistenceError
+from fish_bowl.process.base import SimulationGrid
+
+sim_config = {
+    'grid_size': 10,
+    'init_nb_fish': 50,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 5,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+COLUMNS = ('oid', 'animal_type', 'coord_x', 'coord_y', 'spawn_turn', 'breed_count', 'last_breed', 'last_fed',
+           'alive')
+
+
+def play(client, turns: int, seed: int = 7) -> SimulationGrid:
+    random.seed(seed)
+    grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+    for _ in range(turns):
+        grid.play_turn()
+    return grid
+
+
+class TestPipelinedPersistence:
+
+    def test_same_database_as_sql_backend(self, tmp_path):
+        urls = ['sqlite:///{}'.format(tmp_path / name) for name in ('direct.db', 'pipelined.db')]
+        direct = SimulationClient(urls[0])
+        play(direct, turns=6)
+        pipelined = create_backend('pipelined', database_url=urls[1], max_pending_turns=2)
+        grid = play(pipelined, turns=6)
+        pipelined.flush()
+        assert pipelined.stats['turns_written'] == 7
+        pipelined.close()
+        written = SimulationClient(urls[1])
+        assert written.get_turn_log(grid.sim_id) == direct.get_turn_log(1)
+        assert written.get_animal_tuples(grid.sim_id, COLUMNS, live_only=False) == \
+            direct.get_animal_tuples(1, COLUMNS, live_only=False)
+        # the database gives the sid, and its own oids when it is shared
+        second = PipelinedSimulationClient(urls[1])
+        grid = play(second, turns=2)
+        second.close()
+        assert grid.sim_id == 2
+        assert written.count_animals(2) == second.count_animals(2)
+        assert min(written.get_animal_arrays(2, ('oid',))['oid']) > max(written.get_animal_arrays(1, ('oid',))['oid'])
+        written.close()
+        direct.close()
+
+    def test_failure_propagation(self, tmp_path):
+        client = PipelinedSimulationClient('sqlite:///{}'.format(tmp_path / 'simul.db'), max_pending_turns=1)
+        grid = play(client, turns=1)
+        apply = client.sink.apply_turn_changes
+
+        def failing(sim_id, turn, *args, **kwargs):
+            if turn >= 3:
+                raise IOError('disk full')
+            return apply(sim_id, turn, *args, **kwargs)
+
+        client.sink.apply_turn_changes = failing
+        with pytest.raises(PersistenceError):
+            for _ in range(10):
+                grid.play_turn()
+        assert grid.sim_turn < 10
+        with pytest.raises(PersistenceError):
+            client.close()
+        assert SimulationClient('sqlite:///{}'.format(tmp_path / 'simul.db')).get_last_turn(grid.sim_id) == 2
+
+    def test_backpressure(self, tmp_path):
+        client = PipelinedSimulationClient('sqlite:///{}'.format(tmp_path / 'simul.db'), max_pending_turns=1)
+        grid = play(client, turns=0)
+        client.flush()
+        release = threading.Event()
+        apply = client.sink.apply_turn_changes
+
+        def slow(*args, **kwargs):
+            release.wait()
+            return apply(*args, **kwargs)
+
+        client.sink.apply_turn_changes = slow
+        player = threading.Thread(target=lambda: [grid.play_turn() for _ in range(4)])
+        player.start()
+        player.join(timeout=1)
+        # one turn being written, one waiting in the queue, the third one can't be logged
+        assert player.is_alive()
+        assert grid.sim_turn == 3
+        release.set()
+        player.join(timeout=30)
+        assert not player.is_alive()
+        client.close()
+        assert client.stats['turns_written'] == 5
@@ -0,0 +1,55 @@
+import pytest
+
+from fish_bowl.process.search import SuccessiveHalving, parameter_grid
+
+sim_config = {
+    'grid_size': 12,
+    'init_nb_fish': 40,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 4,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 3}
+
+space = {'fish_breed_probability': [30, 90], 'shark_breed_maturity': [2, 8, 12], 'shark_starving': [2, 5]}
+
+
+def survivors(result):
+    return sorted(tuple(sorted(t.parameters.items())) for t in result.survivors)
+
+
+class TestSuccessiveHalving:
+
+    def test_budgets_and_validation(self):
+        configurations = parameter_grid(sim_config, space)
+        assert len(configurations) == 12
+        assert all(c['grid_size'] == 12 for c in configurations)
+        with pytest.raises(ValueError):
+            parameter_grid(sim_config, {'shark_hunger': [1, 2]})
+        assert SuccessiveHalving(sim_config, space, max_turns=100, min_turns=10, eta=3).budgets() == [10, 30, 90, 100]
+        assert SuccessiveHalving(sim_config, space, max_turns=40, min_turns=40).budgets() == [40]
+        with pytest.raises(ValueError):
+            SuccessiveHalving(sim_config, space, max_turns=10, min_turns=20)
+        with pytest.raises(ValueError):
+            SuccessiveHalving(sim_config, space, max_turns=10, eta=1)
+
+    def test_matches_full_sweep(self):
+        # replicates have their own random streams: the rungs play the same turns as a single long rung
+        sweep = SuccessiveHalving(sim_config, space, max_turns=60, min_turns=60, replicates=2, seed=3).run()
+        extended = SuccessiveHalving(sim_config, space, max_turns=60, min_turns=5, eta=2, keep_fraction=1,
+                                     replicates=2, seed=3).run()
+        assert survivors(extended) == survivors(sweep)
+        assert extended.turns_played == sweep.turns_played
+        assert [t.score for t in extended.trials] == [t.score for t in sweep.trials]
+        halving = SuccessiveHalving(sim_config, space, max_turns=60, min_turns=5, eta=2, replicates=2, seed=3).run()
+        assert set(survivors(halving)) <= set(survivors(sweep))
+        assert halving.turns_played <= sweep.turns_played < sweep.full_sweep_turns
+        summary = halving.summary()
+        assert summary['rungs'][0] == {'budget': 5, 'played': 12, 'coexisting': summary['rungs'][0]['coexisting'],
+                                       'kept': summary['rungs'][0]['kept']}
+        assert sorted(summary['region']) == sorted(space)
+        for trial in halving.trials:
+            assert (trial.dropped_at is None) == (trial in halving.survivors)
@@ -0,0 +1,110 @@
+import os
+import random
+
+import pytest
+
+from fish_bowl.dataio.backends import create_backend, get_backend_class
+from fish_bowl.dataio.export import ParquetExporter
+from fish_bowl.dataio.persistence import SimulationClient, get_database_string
+from fish_bowl.dataio.sharding import ShardedSimulationClient, open_client, sharded_url
+from fish_bowl.flask_app.main import app
+from fish_bowl.process.base import SimulationGrid
+
+sim_config = {
+    'grid_size': 10,
+    'init_nb_fish': 50,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 5,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+
+def play(client, turns: int, seed: int = 7) -> SimulationGrid:
+    random.seed(seed)
+    grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+    for _ in range(turns):
+        grid.play_turn()
+    return grid
+
+
+class TestSharding:
+
+    def test_one_database_per_simulation(self, tmp_path):
+        directory = str(tmp_path / 'shards')
+        assert get_backend_class('sharded') is ShardedSimulationClient
+        client = create_backend('sharded', directory=directory, max_open_shards=1)
+        grids = [play(client, turns=3, seed=seed) for seed in (1, 2)]
+        assert [g.sim_id for g in grids] == [1, 2] == client.get_simulation_ids()
+        assert sorted(os.listdir(directory)) == ['catalog.db', 'simulation_1.db', 'simulation_2.db']
+        # each shard only holds its own simulation
+        for grid in grids:
+            shard = SimulationClient('sqlite:///{}'.format(os.path.join(directory, 'simulation_{}.db'.format(
+                grid.sim_id))))
+            assert shard.get_simulation_ids() == [grid.sim_id]
+            assert shard.get_turn_log(grid.sim_id) == client.get_turn_log(grid.sim_id)
+            shard.close()
+        assert len(client.get_all_simulations()) == 2
+        assert client.get_last_turn(3) is None
+        with pytest.raises(KeyError):
+            client.count_animals(3)
+        client.close()
+        # the catalog keeps allocating unique sids after a restart
+        reopened = open_client(sharded_url(directory))
+        assert isinstance(reopened, ShardedSimulationClient)
+        assert play(reopened, turns=1).sim_id == 3
+        assert reopened.get_last_turn(1) == grids[0].sim_turn
+        reopened.close()
+
+    def test_held_shards_and_released_sids(self, tmp_path):
+        client = ShardedSimulationClient(str(tmp_path), max_open_shards=1)
+        grids = [play(client, turns=1, seed=seed) for seed in (1, 2)]
+        with client.shard(grids[0].sim_id) as held:
+            # opening the other shard doesn't close the held one
+            assert client.get_last_turn(grids[1].sim_id) == 1
+            assert held.get_last_turn(grids[0].sim_id) == 1
+            turns = client.iter_turn_log(grids[1].sim_id, batch_size=1)
+            next(turns)
+            assert client.count_animals(grids[0].sim_id) == held.count_animals(grids[0].sim_id)
+            assert list(turns)
+        # back to the bound once released
+        client.count_animals(grids[1].sim_id)
+        assert list(client._shards) == [grids[1].sim_id]
+        # the sid of a failed creation is not handed out again
+        with pytest.raises(TypeError):
+            client.init_simulation(grid_size=10)
+        assert play(client, turns=0).sim_id == 4
+        client.close()
+
+    def test_same_simulation_as_single_database(self, tmp_path):
+        single = SimulationClient(get_database_string(memory=True))
+        sharded = ShardedSimulationClient(str(tmp_path))
+        logs = [client.get_turn_log(play(client, turns=4).sim_id) for client in (single, sharded)]
+        assert logs[0] == logs[1]
+        columns = ('oid', 'animal_type', 'coord_x', 'coord_y', 'alive')
+        assert single.get_animal_tuples(1, columns, live_only=False) == \
+            sharded.get_animal_tuples(1, columns, live_only=False)
+        single.close()
+        sharded.close()
+
+    def test_readers(self, tmp_path):
+        directory = str(tmp_path / 'shards')
+        client = ShardedSimulationClient(directory)
+        grid = play(client, turns=2)
+        manifest = ParquetExporter(client, str(tmp_path / 'export'), turns_per_partition=2).export()
+        assert list(manifest['simulations']) == [str(grid.sim_id)]
+        client.close()
+        app.config['TESTING'] = True
+        app.config['DATABASE_URL'] = sharded_url(directory)
+        try:
+            with app.test_client() as c:
+                response = c.get('/simulations/{}/population'.format(grid.sim_id))
+                assert response.status_code == 200
+                assert len(response.get_json()['population']) == 3
+                assert c.get('/simulations/999/grid').status_code == 404
+        finally:
+            app.extensions.pop('simulation_client').close()
+            app.extensions.pop('response_cache', None)
@@ -0,0 +1,36 @@
+import json
+import os
+import random
+
+import numpy as np
+
+from fish_bowl.common.config_reader import read_simulation_config, CONFIG_DIR
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.scripts.simple_simulation import run_simulation
+
+
+class TestSimpleSimulation:
+
+    def test_config_path(self, tmp_path):
+        config = read_simulation_config('simulation_config_1')
+        assert read_simulation_config('simulation_config_1', config_path=CONFIG_DIR) == config
+        path = tmp_path / 'other.json'
+        path.write_text(json.dumps(dict(config, grid_size=12)))
+        assert read_simulation_config('other', config_path=str(tmp_path))['grid_size'] == 12
+        assert read_simulation_config('ignored', config_path=str(path))['grid_size'] == 12
+
+    def test_headless_run(self, tmp_path, capsys):
+        random.seed(3)
+        config = dict(read_simulation_config('simulation_config_1'), grid_size=15, init_nb_fish=60)
+        grid = SimulationGrid(persistence=StoreSimulationClient(), simulation_parameters=config)
+        summary = run_simulation(grid, max_turn=5, headless=True, snapshot_every=2, snapshot_dir=str(tmp_path),
+                                 progress_every=0)
+        assert capsys.readouterr().out == ''
+        assert summary['turns'] == grid.sim_turn
+        assert summary['nb_fish'] + summary['nb_shark'] == sum(grid.population.values())
+        json.dumps(summary)
+        turns = [t for t in (0, 2, 4) if t <= grid.sim_turn]
+        assert sorted(os.listdir(str(tmp_path))) == ['sim_1_turn_{:06d}.npy'.format(t) for t in turns]
+        assert (np.load(str(tmp_path / 'sim_1_turn_000000.npy')) != 0).sum() == config['init_nb_fish'] + \
+            config['init_nb_shark']
@@ -0,0 +1,124 @@
+import pickle
+import random
+
+import numpy as np
+import pytest
+
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.ensemble import EnsembleGrid
+from fish_bowl.process.statistics import PopulationStatistics
+from fish_bowl.process.termination import SharkExtinction
+from fish_bowl.process.utils import Animal, EndOfSimulatioError
+
+sim_config = {
+    'grid_size': 8,
+    'init_nb_fish': 20,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 4,
+    'shark_breed_maturity': 4,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 2}
+
+
+def random_logs(nb_logs: int, seed: int = 0):
+    rng = np.random.RandomState(seed)
+    logs = []
+    for _ in range(nb_logs):
+        turns = rng.randint(1, 30)
+        fish = rng.randint(0, 5000, size=turns)
+        shark = np.maximum(rng.randint(-20, 300, size=turns), 0)
+        logs.append([(t, int(f), int(s)) for t, (f, s) in enumerate(zip(fish, shark))])
+    return logs
+
+
+def assert_same_statistics(first: PopulationStatistics, second: PopulationStatistics):
+    assert first.turns == second.turns and first.replicates == second.replicates
+    for animal in Animal:
+        for method in ('count', 'extinctions', 'censored'):
+            assert np.array_equal(getattr(first, method)(animal), getattr(second, method)(animal))
+        assert np.allclose(first.mean(animal), second.mean(animal))
+        assert np.allclose(first.variance(animal), second.variance(animal), equal_nan=True)
+        for q in (0.1, 0.5, 0.9):
+            assert np.array_equal(first.quantile(animal, q), second.quantile(animal, q), equal_nan=True)
+
+
+class TestPopulationStatistics:
+
+    def test_moments_and_quantiles(self):
+        logs = random_logs(200)
+        stats = PopulationStatistics(relative_accuracy=0.01)
+        for log in logs:
+            stats.add_turn_log(log)
+        for turn in (0, 10, 25):
+            reported = np.array([log[turn][1:] for log in logs if len(log) > turn], dtype=float)
+            assert stats.count()[turn] == len(reported)
+            for s, animal in enumerate((Animal.Fish, Animal.Shark)):
+                assert stats.mean(animal)[turn] == pytest.approx(reported[:, s].mean())
+                assert stats.variance(animal)[turn] == pytest.approx(reported[:, s].var(ddof=1))
+                for q in (0., 0.1, 0.5, 0.9, 1.):
+                    expected = np.sort(reported[:, s])[int(np.floor(q * (len(reported) - 1)))]
+                    assert stats.quantile(animal, q)[turn] == pytest.approx(expected, rel=0.01, abs=1e-9)
+        # extinctions: every replicate is either extinct once or censored at its last turn
+        for s, animal in enumerate((Animal.Fish, Animal.Shark)):
+            first = [next((t for t, *p in log if p[s] == 0), None) for log in logs]
+            assert stats.extinctions(animal).sum() == sum(t is not None for t in first)
+            assert stats.extinctions(animal).sum() + stats.censored(animal).sum() == len(logs)
+        probability = stats.extinction_probability(Animal.Shark)
+        assert (np.diff(probability) >= 0).all() and 0 <= probability[-1] <= 1
+
+    def test_merge_and_pickle(self):
+        logs = random_logs(60, seed=1)
+        single = PopulationStatistics()
+        for log in logs:
+            single.add_turn_log(log)
+        workers = [PopulationStatistics() for _ in range(3)]
+        for i, log in enumerate(logs):
+            workers[i % 3].add_turn_log(log)
+        merged = pickle.loads(pickle.dumps(workers[0]))
+        for worker in workers[1:]:
+            merged.merge(pickle.loads(pickle.dumps(worker)))
+        assert_same_statistics(merged, single)
+        with pytest.raises(ValueError):
+            merged.merge(PopulationStatistics(relative_accuracy=0.05))
+        # memory doesn't depend on the number of replicates
+        assert merged.nbytes == single.nbytes
+
+    def test_recorders_and_ensembles(self):
+        stats = PopulationStatistics()
+        logs = []
+        random.seed(4)
+        for _ in range(3):
+            client = StoreSimulationClient()
+            recorder = stats.recorder()
+            grid = SimulationGrid(persistence=client, simulation_parameters=sim_config,
+                                  detectors=[recorder, SharkExtinction()])
+            try:
+                for _ in range(12):
+                    grid.play_turn()
+            except EndOfSimulatioError:
+                pass
+            recorder.finish()
+            logs.append(client.get_turn_log(grid.sim_id))
+        reference = PopulationStatistics()
+        for log in logs:
+            reference.add_turn_log(log)
+        assert_same_statistics(stats, reference)
+
+        ensemble = EnsembleGrid(sim_config, replicates=16, seed=2)
+        try:
+            for _ in range(15):
+                ensemble.play_turn()
+        except EndOfSimulatioError:
+            pass
+        history, end_turn = ensemble.population_history, ensemble.end_turn
+        batch = PopulationStatistics()
+        batch.add_histories(history, end_turn=end_turn)
+        one_by_one = PopulationStatistics()
+        for r in range(ensemble.replicates):
+            last = end_turn[r] if end_turn[r] >= 0 else len(history) - 1
+            one_by_one.add_turn_log([(t, int(f), int(s)) for t, (f, s) in enumerate(history[:last + 1, r])])
+        assert_same_statistics(batch, one_by_one)
@@ -0,0 +1,200 @@
+import random
+
+import pandas as pd
+import pytest
+
+from fish_bowl.dataio.occupancy import AdaptiveOccupancy, DenseOccupancy, SparseOccupancy
+from fish_bowl.dataio.persistence import SimulationClient
+from fish_bowl.dataio.store import AnimalStore, StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.topology import SquareGridCoordinate, NonEmptyCoordinate, TopologyError
+from fish_bowl.process.utils import Animal, ImpossibleAction
+
+sim_config = {
+    'grid_size': 10,
+    'init_nb_fish': 50,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 80,
+    'fish_speed': 2,
+    'init_nb_shark': 5,
+    'shark_breed_maturity': 5,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 4}
+
+sim_config_empty = dict(sim_config, init_nb_fish=0, init_nb_shark=0, fish_breed_probability=100,
+                        shark_breed_maturity=3)
+
+
+class TestAnimalStore:
+
+    def test_slots_and_oids(self):
+        store = AnimalStore(grid_size=10, capacity=2)
+        oids = [store.add(Animal.Fish, x=i, y=0, spawn_turn=0) for i in range(5)]
+        assert oids == [1, 2, 3, 4, 5]
+        assert len(store) == 5
+        slot = store.slot(3)
+        store.release(3)
+        assert 3 not in store and len(store) == 4
+        # released slot is reused
+        new_oid = store.add(Animal.Shark, x=9, y=9, spawn_turn=1)
+        assert new_oid == 6 and store.slot(new_oid) == slot
+        assert store.animal_type(new_oid) == Animal.Shark
+        store.kill(1)
+        assert len(store) == 4 and 1 in store
+        assert store.columns(['oid'])['oid'].tolist() == [2, 4, 5, 6]
+        assert store.columns(['oid'], live_only=False)['oid'].tolist() == [1, 2, 4, 5, 6]
+        with pytest.raises(ValueError):
+            store.update(2, alive=False)
+        store.update(2, breed_count=3)
+        assert store.record(2).breed_count == 3
+
+    def test_memory(self):
+        client = SimulationClient('sqlite:///:memory:')
+        grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+        grid.play_turn()
+        store = AnimalStore.load(client, grid.sim_id, live_only=True)
+        assert store.bytes_per_animal < 40
+        df = client.get_animals_df(grid.sim_id)
+        assert df.memory_usage(deep=True).sum() / len(df) > 3 * store.bytes_per_animal
+
+    def test_oid_index_follows_population(self):
+        store = AnimalStore(grid_size=1000)
+        # a long lived animal and a hundred ones renewed over 100k oids
+        elder = store.add(Animal.Fish, x=0, y=0, spawn_turn=0)
+        live = [store.add(Animal.Fish, x=1, y=i, spawn_turn=0) for i in range(100)]
+        for turn in range(1000):
+            for oid in live[:100]:
+                store.release(oid)
+            live = [store.add(Animal.Shark, x=2, y=i, spawn_turn=turn) for i in range(100)]
+        assert store.next_oid == 100102
+        assert len(store._slot_of) < 1000
+        assert store.position(elder) == (0, 0) and all(oid in store for oid in live)
+        assert store.columns(['oid'])['oid'].tolist() == [elder] + live
+        assert store.bytes_per_animal < 64
+        store.compact()
+        assert store.capacity <= 202 and store.position(elder) == (0, 0)
+
+    def test_round_trip(self):
+        client = SimulationClient('sqlite:///:memory:')
+        grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+        grid.play_turn()
+        store = AnimalStore.load(client, grid.sim_id)
+        assert len(store) == sum(client.count_animals(grid.sim_id).values())
+        other = SimulationClient('sqlite:///:memory:')
+        sid = other.init_simulation(**sim_config)
+        store.save(other, sid)
+        before = client.get_animals_df(grid.sim_id).drop(columns='sim_id')
+        after = other.get_animals_df(sid).drop(columns='sim_id')
+        pd.testing.assert_frame_equal(before, after)
+
+
+class TestStoreSimulationClient:
+
+    def test_client_checks(self):
+        client = StoreSimulationClient(release_dead=False)
+        sid = client.init_simulation(**sim_config)
+        with pytest.raises(ValueError):
+            client.init_animal(sim_id=10, current_turn=0, animal_type=Animal.Fish,
+                               coordinate=SquareGridCoordinate(x=0, y=1))
+        oid = client.init_animal(sim_id=sid, current_turn=0, animal_type=Animal.Fish,
+                                 coordinate=SquareGridCoordinate(x=0, y=1))
+        with pytest.raises(NonEmptyCoordinate):
+            client.init_animal(sim_id=sid, current_turn=0, animal_type=Animal.Fish,
+                               coordinate=SquareGridCoordinate(x=0, y=1))
+        with pytest.raises(TopologyError):
+            client.init_animal(sim_id=sid, current_turn=0, animal_type=Animal.Fish,
+                               coordinate=SquareGridCoordinate(x=10, y=1))
+        client.move_animal(sim_id=sid, animal_id=oid, new_position=SquareGridCoordinate(1, 1))
+        assert not client.coordinate_is_occupied(sim_id=sid, coordinate=SquareGridCoordinate(0, 1))
+        assert client.eat_animal_in_square(sim_id=sid, coordinate=SquareGridCoordinate(1, 1))
+        with pytest.raises(ImpossibleAction):
+            client.move_animal(sim_id=sid, animal_id=oid, new_position=SquareGridCoordinate(2, 2))
+        assert len(client.get_animal_in_position(sim_id=sid, coordinate=SquareGridCoordinate(1, 1),
+                                                 live_only=False)) == 1
+
+    def test_simulation_runs_in_memory(self):
+        client = StoreSimulationClient()
+        grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+        for _ in range(3):
+            grid.play_turn()
+        df = grid.get_simulation_grid_data()
+        assert len(df) == sum(client.count_animals(grid.sim_id).values())
+        # one animal per cell
+        assert not df.duplicated(['coord_x', 'coord_y']).any()
+        assert client.get_last_turn(grid.sim_id) == 3
+
+    def test_breed(self):
+        client = StoreSimulationClient()
+        grid = SimulationGrid(persistence=client, simulation_parameters=sim_config_empty)
+        for x, y in [(1, 1), (2, 1), (3, 1), (1, 3), (3, 2)]:
+            client.init_animal(sim_id=grid.sim_id, current_turn=0, animal_type=Animal.Fish,
+                               coordinate=SquareGridCoordinate(x, y))
+        client.init_animal(sim_id=grid.sim_id, current_turn=0, animal_type=Animal.Shark,
+                           coordinate=SquareGridCoordinate(2, 2))
+        grid._sim_turn = 4
+        shark_update = grid._eat()
+        assert len(shark_update) == 1
+        assert len(grid._breed_and_move(fed_sharks=shark_update)) == 5
+        assert client.count_animals(grid.sim_id) == {Animal.Fish: 8, Animal.Shark: 2}
+
+
+class TestOccupancy:
+
+    def test_representations_agree(self):
+        dense, sparse = DenseOccupancy(grid_size=6), SparseOccupancy(grid_size=6)
+        for occupancy in (dense, sparse):
+            occupancy.set(1, 2, 7)
+            occupancy.set(5, 5, 8)
+            occupancy.set(1, 2, 9)
+            occupancy.clear(5, 5)
+            occupancy.clear(0, 0)
+        assert len(dense) == len(sparse) == 1
+        assert dense.get(1, 2) == sparse.get(1, 2) == 9 and dense.get(5, 5) == sparse.get(5, 5) == -1
+        assert (dense.to_array() == sparse.to_array()).all()
+        assert list(dense.items()) == list(sparse.items()) == [((1, 2), 9)]
+
+    def test_adaptive_hysteresis(self):
+        occupancy = AdaptiveOccupancy(grid_size=10, dense_above=0.2, sparse_below=0.05)
+        for i in range(20):
+            occupancy.set(i % 10, i // 10, i)
+        assert occupancy.mode == 'sparse'
+        occupancy.set(0, 5, 20)
+        assert occupancy.mode == 'dense' and occupancy.switches == 1
+        # hovering between both thresholds doesn't convert back and forth
+        for _ in range(5):
+            occupancy.clear(0, 5)
+            occupancy.set(0, 5, 20)
+        assert occupancy.switches == 1
+        for i in range(17):
+            occupancy.clear(i % 10, i // 10)
+        assert occupancy.mode == 'sparse' and occupancy.switches == 2
+        assert occupancy.get(9, 1) == 19 and occupancy.get(0, 0) == -1
+        with pytest.raises(ValueError):
+            AdaptiveOccupancy(grid_size=10, dense_above=0.05, sparse_below=0.2)
+
+    def test_memory_tracks_population(self):
+        client = StoreSimulationClient()
+        sid = client.init_simulation(**dict(sim_config_empty, grid_size=1000))
+        oids = [client.init_animal(sim_id=sid, current_turn=0, animal_type=Animal.Fish,
+                                   coordinate=SquareGridCoordinate(i % 1000, i // 1000)) for i in range(200000)]
+        occupancy, store = client.get_occupancy(sid), client.get_store(sid)
+        assert occupancy.mode == 'dense'
+        client.kill_animal(sim_id=sid, animal_ids=oids[:-10])
+        assert occupancy.mode == 'sparse' and len(store) == 10
+        # a few kB for 10 animals on a million squares instead of the 4 MB dense array
+        assert occupancy.nbytes < 10000 and store.capacity <= 64
+        assert client.coordinate_is_occupied(sid, SquareGridCoordinate(999, 199))
+        assert client.get_animal(sid, oids[-1]).coord_x == 999
+
+    @pytest.mark.parametrize('occupancy', ['dense', 'sparse'])
+    def test_same_simulation(self, occupancy):
+        logs = []
+        for client in (StoreSimulationClient(occupancy='adaptive', dense_above=0.5, sparse_below=0.4),
+                       StoreSimulationClient(occupancy=occupancy)):
+            random.seed(3)
+            grid = SimulationGrid(persistence=client, simulation_parameters=sim_config)
+            for _ in range(5):
+                grid.play_turn()
+            logs.append(client.get_turn_log(grid.sim_id))
+        assert logs[0] == logs[1]
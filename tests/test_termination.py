@@ -0,0 +1,87 @@
+import pytest
+
+from fish_bowl.dataio.store import StoreSimulationClient
+from fish_bowl.process.base import SimulationGrid
+from fish_bowl.process.termination import FishExtinction, FullGrid, LowVariance, SharkExtinction, StableCycle, \
+    build_detectors
+from fish_bowl.process.topology import SquareGridCoordinate
+from fish_bowl.process.utils import Animal, EndOfSimulatioError
+
+sim_config = {
+    'grid_size': 5,
+    'init_nb_fish': 0,
+    'fish_breed_maturity': 3,
+    'fish_breed_probability': 100,
+    'fish_speed': 2,
+    'init_nb_shark': 0,
+    'shark_breed_maturity': 100,
+    'shark_breed_probability': 100,
+    'shark_speed': 4,
+    'shark_starving': 100}
+
+
+def feed(detector, populations, grid_size=10):
+    detector.start(grid_size)
+    for turn, (fish, shark) in enumerate(populations):
+        reason = detector.update(turn, fish, shark)
+        if reason is not None:
+            return turn, reason
+    return None
+
+
+class TestDetectors:
+
+    def test_extinctions(self):
+        assert feed(SharkExtinction(), [(10, 2), (10, 1), (12, 0)])[0] == 2
+        assert feed(FishExtinction(), [(1, 2), (0, 3)])[0] == 1
+        assert feed(FullGrid(), [(50, 10), (90, 10)], grid_size=10)[0] == 1
+        assert feed(FullGrid(), [(90, 9)], grid_size=10) is None
+
+    def test_stable_cycle(self):
+        cycle = [(10, 3), (14, 4), (9, 6)]
+        # period 3, seen for 2 full periods after the first one
+        turn, reason = feed(StableCycle(max_period=5, repeats=2), [(50, 1), (40, 2)] + cycle * 4)
+        assert turn == 2 + 3 + 6 - 1
+        assert 'period of 3' in reason
+        # noisy cycle only detected with a tolerance
+        noisy = [(10, 3), (14, 4), (9, 6), (11, 3), (14, 4), (9, 5)] * 3
+        assert feed(StableCycle(max_period=5, repeats=2), noisy) is None
+        assert feed(StableCycle(max_period=5, repeats=2, atol=1), noisy) is not None
+        # a constant population is a cycle of period 1
+        assert feed(StableCycle(repeats=3), [(5, 5)] * 4)[0] == 3
+
+    def test_low_variance(self):
+        populations = [(100 + 20 * (t % 2), 10) for t in range(10)] + [(100 + t % 2, 10) for t in range(10)]
+        turn, _ = feed(LowVariance(window=5, threshold=1.), populations)
+        assert turn == 14
+        assert feed(LowVariance(window=5, threshold=0.001, relative=True), populations)[0] == 14
+        with pytest.raises(ValueError):
+            LowVariance(window=1)
+
+    def test_build(self):
+        detectors = build_detectors(['fish_extinction', 'low_variance'], {'low_variance': {'window': 3}})
+        assert isinstance(detectors[1], LowVariance) and detectors[1]._window == 3
+        with pytest.raises(ValueError):
+            build_detectors(['never'])
+
+
+class TestSimulationEnds:
+
+    def test_default_stops_without_sharks(self):
+        grid = SimulationGrid(persistence=StoreSimulationClient(), simulation_parameters=sim_config)
+        grid._persistence.init_animal(sim_id=grid.sim_id, current_turn=0, animal_type=Animal.Fish,
+                                      coordinate=SquareGridCoordinate(0, 0))
+        with pytest.raises(EndOfSimulatioError, match='no more Sharks'):
+            grid.play_turn()
+        assert grid.end_reason == 'Simulation ends because no more Sharks'
+
+    def test_fish_extinction_stops(self):
+        client = StoreSimulationClient()
+        grid = SimulationGrid(persistence=client, simulation_parameters=sim_config,
+                              detectors=[FishExtinction()])
+        client.init_animal(sim_id=grid.sim_id, current_turn=0, animal_type=Animal.Shark,
+                           coordinate=SquareGridCoordinate(0, 0), last_fed=0)
+        # no fish, but the initial turn has been logged before any animal was added: ends after the first turn
+        with pytest.raises(EndOfSimulatioError, match='no more Fish'):
+            grid.play_turn()
+        assert grid.sim_turn == 1
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from fish_bowl.process.analytics import FISH, SHARK
+from fish_bowl.process.tiles import DensityPyramid
+
+
+def random_grid(grid_size: int, seed: int) -> np.ndarray:
+    rng = np.random.RandomState(seed)
+    return rng.choice([0, FISH, SHARK], size=(grid_size, grid_size), p=[0.6, 0.3, 0.1]).astype(np.int8)
+
+
+def brute_tile(grid: np.ndarray, pyramid: DensityPyramid, zoom: int, tx: int, ty: int, animal: int) -> np.ndarray:
+    size = pyramid.bin_size(zoom)
+    t = pyramid.tile_size
+    counts = np.zeros((t, t), dtype=np.int64)
+    for x, y in np.argwhere(grid == animal):
+        bx, by = x // size - tx * t, y // size - ty * t
+        if 0 <= bx < t and 0 <= by < t:
+            counts[bx, by] += 1
+    return counts
+
+
+class TestDensityPyramid:
+
+    def test_tiles(self):
+        grid = random_grid(100, 0)
+        pyramid = DensityPyramid.from_grid(grid, tile_size=8)
+        assert pyramid.max_zoom == 4
+        for zoom in range(pyramid.max_zoom + 1):
+            squares = 0
+            for tx in range(1 << zoom):
+                for ty in range(1 << zoom):
+                    counts = pyramid.tile(zoom, tx, ty)
+                    for animal in (FISH, SHARK):
+                        assert (counts[animal] == brute_tile(grid, pyramid, zoom, tx, ty, animal)).all()
+                    squares += pyramid.tile_squares(zoom, tx, ty).sum()
+            assert squares == 100 * 100
+        with pytest.raises(ValueError):
+            pyramid.tile(1, 2, 0)
+        with pytest.raises(ValueError):
+            pyramid.tile(5, 0, 0)
+        with pytest.raises(ValueError):
+            DensityPyramid(tile_size=6)
+
+    def test_incremental_updates(self):
+        grid = random_grid(50, 1)
+        pyramid = DensityPyramid.from_grid(grid, tile_size=4)
+        rng = np.random.RandomState(2)
+        for turn in range(1, 6):
+            # a few animals move, and the whole grid changes on the last turn
+            grid = grid.copy()
+            if turn < 5:
+                squares = rng.randint(0, 50, size=(20, 2))
+                grid[squares[:, 0], squares[:, 1]] = rng.choice([0, FISH, SHARK], size=20)
+            else:
+                grid = random_grid(50, 3)
+            pyramid.update(turn, grid)
+            reference = DensityPyramid.from_grid(grid, turn=turn, tile_size=4)
+            for zoom in range(pyramid.max_zoom + 1):
+                tile = (zoom, 0, (1 << zoom) - 1)
+                for animal in (FISH, SHARK):
+                    assert (pyramid.tile(*tile)[animal] == reference.tile(*tile)[animal]).all()
+        assert pyramid.turn == 5